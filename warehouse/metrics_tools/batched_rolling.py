@@ -0,0 +1,176 @@
+"""Rewrites rolling metrics queries into a single query over many days.
+
+A rolling metrics query is normally rendered and executed once per day. For
+the common shape of
+
+    SELECT @metrics_sample_date(...) AS metrics_sample_date, ..., AGG(...)
+    FROM source
+    WHERE ... AND source.time BETWEEN @metrics_start(...) AND @metrics_end(...)
+    GROUP BY 1, ...
+
+the per day results can be computed at once by range joining the source with
+a spine of days. Each row of the spine holds the rendered values of
+`@metrics_start`, `@metrics_end` and `@metrics_sample_date` for one day so the
+semantics of the macros are unchanged. This requires the sample date to only
+depend on the day, which isn't the case for time aggregations. Queries of any
+other shape must still be executed per day.
+"""
+
+import typing as t
+
+from sqlglot import exp
+from sqlmesh.core.dialect import MacroFunc, MacroVar
+
+SPINE_TABLE = "__metrics_spine"
+
+# The sqlmesh macro variables that are derived from the rendered interval
+DATE_MACRO_VAR_PREFIXES = ("start_", "end_", "execution_", "latest_")
+
+
+def is_macro_call(expression: exp.Expression, name: str) -> bool:
+    return isinstance(expression, MacroFunc) and expression.this.name.lower() == name
+
+
+def _find_macro_calls(expression: exp.Expression, name: str):
+    return [
+        node for node in expression.find_all(MacroFunc) if is_macro_call(node, name)
+    ]
+
+
+def _spine_column(name: str) -> exp.Column:
+    return exp.column(name, table=SPINE_TABLE)
+
+
+class BatchedRollingQuery(t.NamedTuple):
+    # The rewritten query. It reads from `SPINE_TABLE` which must be provided
+    # as a CTE.
+    query: exp.Select
+    # A select of the date macros of the query. Rendering this for each day
+    # creates the rows of the spine.
+    spine_select: exp.Select
+
+
+def create_batched_rolling_query(
+    query: exp.Expression,
+) -> t.Optional[BatchedRollingQuery]:
+    """Creates a batched version of a rolling query. Returns None if the shape
+    of the query isn't supported."""
+    if not isinstance(query, exp.Select):
+        return None
+    for arg in ["with", "order", "limit", "offset", "distinct"]:
+        if query.args.get(arg):
+            return None
+    # Window functions and subqueries would be evaluated across days
+    if query.find(exp.Window):
+        return None
+    if any(select is not query for select in query.find_all(exp.Select)):
+        return None
+    for macro_var in query.find_all(MacroVar):
+        if macro_var.name.startswith(DATE_MACRO_VAR_PREFIXES):
+            return None
+
+    query = query.copy()
+
+    where = query.args.get("where")
+    if not where:
+        return None
+    conditions = (
+        list(where.this.flatten()) if isinstance(where.this, exp.And) else [where.this]
+    )
+    range_conditions = [
+        condition
+        for condition in conditions
+        if isinstance(condition, exp.Between)
+        and is_macro_call(condition.args["low"], "metrics_start")
+        and is_macro_call(condition.args["high"], "metrics_end")
+    ]
+    if len(range_conditions) != 1:
+        return None
+    range_condition = range_conditions[0]
+    other_conditions = [
+        condition for condition in conditions if condition is not range_condition
+    ]
+
+    sample_date_projections = [
+        (index, projection)
+        for index, projection in enumerate(query.expressions)
+        if _find_macro_calls(projection, "metrics_sample_date")
+    ]
+    if len(sample_date_projections) != 1:
+        return None
+    sample_date_index, sample_date_projection = sample_date_projections[0]
+    if not is_macro_call(sample_date_projection.unalias(), "metrics_sample_date"):
+        return None
+    sample_date_alias = sample_date_projection.alias_or_name or "metrics_sample_date"
+
+    # Any other use of the date macros can't be rewritten
+    date_macros = (
+        _find_macro_calls(query, "metrics_start")
+        + _find_macro_calls(query, "metrics_end")
+        + _find_macro_calls(query, "metrics_sample_date")
+    )
+    group = query.args.get("group")
+    allowed_macros = [
+        range_condition.args["low"],
+        range_condition.args["high"],
+        sample_date_projection.unalias(),
+    ]
+    if group:
+        allowed_macros.extend(_find_macro_calls(group, "metrics_sample_date"))
+    if any(
+        not any(macro is allowed for allowed in allowed_macros) for macro in date_macros
+    ):
+        return None
+
+    spine_select = exp.select(
+        range_condition.args["low"].copy().as_("metrics_start"),
+        range_condition.args["high"].copy().as_("metrics_end"),
+        sample_date_projection.unalias().copy().as_("metrics_sample_date"),
+    )
+
+    # Aggregations must be grouped by the sample date so that they are
+    # computed per day
+    if query.find(exp.AggFunc):
+        if not group:
+            return None
+        grouped_by_sample_date = False
+        for grouping in group.expressions:
+            if is_macro_call(grouping, "metrics_sample_date"):
+                grouped_by_sample_date = True
+            elif (
+                isinstance(grouping, exp.Literal)
+                and not grouping.is_string
+                and grouping.this == str(sample_date_index + 1)
+            ):
+                grouped_by_sample_date = True
+            elif isinstance(grouping, exp.Column) and grouping.name == (
+                sample_date_alias
+            ):
+                grouped_by_sample_date = True
+        if not grouped_by_sample_date:
+            return None
+    if group:
+        for macro in _find_macro_calls(group, "metrics_sample_date"):
+            macro.replace(_spine_column("metrics_sample_date"))
+
+    query.expressions[sample_date_index] = _spine_column("metrics_sample_date").as_(
+        sample_date_alias
+    )
+    query.set("expressions", query.expressions)
+
+    if other_conditions:
+        query.set("where", exp.Where(this=exp.and_(*other_conditions, copy=False)))
+    else:
+        query.set("where", None)
+
+    query = query.join(
+        exp.to_table(SPINE_TABLE),
+        on=exp.Between(
+            this=range_condition.this.copy(),
+            low=_spine_column("metrics_start"),
+            high=_spine_column("metrics_end"),
+        ),
+        join_type="inner",
+        copy=False,
+    )
+    return BatchedRollingQuery(query=query, spine_select=spine_select)
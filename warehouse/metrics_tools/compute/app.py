@@ -23,23 +23,30 @@ from metrics_tools.compute.result import (
     TrinoImportAdapter,
 )
 
+from .autoscale import AutoscalePolicy
+from .broadcast import JobStatusSubscription
 from .cache import setup_fake_cache_export_manager, setup_trino_cache_export_manager
+from .cache_index import CacheEvictionPolicy, DuckDBExportCacheIndex
 from .cluster import (
     ClusterManager,
     KubeClusterFactory,
     LocalClusterFactory,
     make_new_cluster_with_defaults,
 )
+from .placement import LocalityTaskPlacer, SpreadTaskPlacer
 from .service import MetricsCalculationService
 from .types import (
     AppConfig,
     AppLifespanFactory,
+    CacheExportStatsResponse,
     ClusterStartRequest,
     EmptyResponse,
     ExportedTableLoadRequest,
-    JobStatusResponse,
+    JobStatusErrorResponse,
+    JobStatusSubscribeRequest,
     JobSubmitRequest,
-    QueryJobStatus,
+    ResultCompactionOptions,
+    TaskPlacementMode,
 )
 
 load_dotenv()
@@ -71,6 +78,20 @@ def default_lifecycle(config: AppConfig):
                 config.gcs_bucket,
                 config.hive_catalog,
                 config.hive_schema,
+                index=(
+                    DuckDBExportCacheIndex(config.cache_index_path)
+                    if config.cache_index_path
+                    else None
+                ),
+                eviction_policy=CacheEvictionPolicy(
+                    ttl_seconds=config.cache_ttl_seconds,
+                    max_entries=config.cache_max_entries,
+                ),
+                use_table_fingerprints=config.cache_use_table_fingerprints,
+                max_concurrent_exports=config.cache_max_concurrent_exports,
+                export_retries=config.cache_export_retries,
+                retry_backoff_seconds=config.cache_export_retry_backoff_seconds,
+                size_estimate_wait_seconds=config.cache_export_size_estimate_wait_seconds,
             )
             import_adapter = TrinoImportAdapter(
                 db=trino_connection,
@@ -103,6 +124,12 @@ def default_lifecycle(config: AppConfig):
                 config.gcs_secret,
                 config.worker_duckdb_path,
                 cluster_factory,
+                cache_mode=config.worker_cache_mode,
+                cache_max_bytes=config.worker_cache_max_bytes,
+                cache_local_dir=config.worker_cache_local_dir,
+                result_row_group_size=config.worker_result_row_group_size,
+                result_compression=config.worker_result_compression,
+                result_upload_block_size=config.worker_result_upload_block_size,
             )
         else:
             logger.warning("Loading fake cluster manager")
@@ -120,6 +147,37 @@ def default_lifecycle(config: AppConfig):
             import_adapter=import_adapter,
             cluster_scale_down_timeout=config.cluster_scale_down_timeout,
             cluster_shutdown_timeout=config.cluster_shutdown_timeout,
+            task_placer=(
+                LocalityTaskPlacer()
+                if config.task_placement_mode == TaskPlacementMode.LOCALITY
+                else SpreadTaskPlacer()
+            ),
+            target_task_seconds=config.job_target_task_seconds,
+            task_queue_depth=config.job_task_queue_depth,
+            autoscale_policy=(
+                AutoscalePolicy(
+                    worker_slots=config.worker_resources.get("slots", 1),
+                    warm_pool_size=config.cluster_warm_pool_size,
+                    warm_pool_horizon_seconds=config.cluster_warm_pool_horizon_seconds,
+                )
+                if config.cluster_autoscale_enabled
+                else None
+            ),
+            warm_pool_dependencies=config.cluster_warm_pool_dependencies,
+            keep_job_update_log=config.job_update_log,
+            job_status_updates_per_second=config.job_status_updates_per_second,
+            result_compaction=(
+                ResultCompactionOptions(
+                    target_file_bytes=config.result_compaction_target_file_bytes,
+                    sort_by=config.result_compaction_sort_by,
+                    partition_by=config.result_compaction_partition_by or None,
+                    row_group_size=config.worker_result_row_group_size,
+                    compression=config.worker_result_compression,
+                )
+                if config.result_compaction_enabled
+                else None
+            ),
+            prune_dependency_columns=config.cache_export_prune_columns,
         )
         try:
             yield {
@@ -216,15 +274,12 @@ def setup_app(lifespan: t.Callable[[FastAPI], t.Any]):
     ):
         """Websocket endpoint for job status updates"""
         service = get_mcs(websocket)
-        update_queue: asyncio.Queue[JobStatusResponse] = asyncio.Queue()
 
         await websocket.accept()
 
-        async def listener(job_status_response: JobStatusResponse):
-            logger.debug(f"Received job status update: {job_status_response}")
-            await update_queue.put(job_status_response)
-
-        stop_listening = await service.listen_for_job_updates(job_id, listener)
+        # Updates are coalesced by the subscription so a slow connection only
+        # skips intermediate states
+        subscription = await service.subscribe_to_job_status(job_id)
 
         count = 0
 
@@ -236,22 +291,78 @@ def setup_app(lifespan: t.Callable[[FastAPI], t.Any]):
                 if websocket.client_state == WebSocketState.DISCONNECTED:
                     logger.debug("Websocket disconnected while waiting for job updates")
                     break
-                try:
-                    update = await asyncio.wait_for(update_queue.get(), timeout=1)
-                except asyncio.TimeoutError:
+                update = await subscription.get(timeout=1)
+                if update is None:
                     continue
-                await websocket.send_text(update.model_dump_json())
-                if update.status in (QueryJobStatus.COMPLETED, QueryJobStatus.FAILED):
+                await websocket.send_text(update.encoded)
+                if update.is_final:
                     logger.debug("Job completed, stopping listening")
                     break
         except WebSocketDisconnect:
             logger.debug("Websocket disconnected")
-            stop_listening()
+            subscription.close()
             await websocket.close()
         else:
-            stop_listening()
+            subscription.close()
             await websocket.close()
 
+    @app.websocket("/job/status/ws")
+    async def jobs_status_ws(websocket: WebSocket):
+        """Websocket endpoint for the status updates of many jobs. Jobs are
+        added by sending a JobStatusSubscribeRequest. The connection stays
+        open after the jobs complete so that it can be reused."""
+        service = get_mcs(websocket)
+        send_lock = asyncio.Lock()
+        forwarders: t.Dict[str, asyncio.Task] = {}
+
+        await websocket.accept()
+
+        async def send(data: str):
+            async with send_lock:
+                await websocket.send_text(data)
+
+        async def forward(subscription: JobStatusSubscription):
+            try:
+                while True:
+                    update = await subscription.get()
+                    if update is None:
+                        continue
+                    await send(update.encoded)
+                    if update.is_final:
+                        break
+            finally:
+                subscription.close()
+
+        try:
+            while True:
+                request = JobStatusSubscribeRequest.model_validate_json(
+                    await websocket.receive_text()
+                )
+                for job_id in request.job_ids:
+                    if job_id in forwarders:
+                        continue
+                    try:
+                        subscription = await service.subscribe_to_job_status(job_id)
+                    except ValueError as e:
+                        await send(
+                            JobStatusErrorResponse(
+                                job_id=job_id, error=str(e)
+                            ).model_dump_json()
+                        )
+                        continue
+                    task = asyncio.create_task(forward(subscription))
+                    task.add_done_callback(
+                        lambda _, job_id=job_id: forwarders.pop(job_id, None)
+                    )
+                    forwarders[job_id] = task
+        except WebSocketDisconnect:
+            logger.debug("Websocket disconnected")
+        finally:
+            tasks = list(forwarders.values())
+            for task in tasks:
+                task.cancel()
+            await asyncio.gather(*tasks, return_exceptions=True)
+
     @app.post("/cache/manual")
     async def add_existing_exported_table_references(
         request: Request, input: ExportedTableLoadRequest
@@ -261,6 +372,12 @@ def setup_app(lifespan: t.Callable[[FastAPI], t.Any]):
         await service.add_existing_exported_table_references(input.map)
         return EmptyResponse()
 
+    @app.get("/cache/stats")
+    async def get_cache_stats(request: Request):
+        """Get the export queue depth, wait times and export durations"""
+        service = get_mcs(request)
+        return CacheExportStatsResponse(stats=service.get_cache_export_stats())
+
     # @app.websocket("/ws")
     # async def websocket_endpoint(websocket: WebSocket):
     #     await websocket.accept()
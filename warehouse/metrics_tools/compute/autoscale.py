@@ -0,0 +1,135 @@
+"""Predictive autoscaling of the metrics cluster.
+
+The cluster used to be scaled to 0 once no client had been listening for a
+while, and the next job then paid for the full startup of the cluster's pods.
+The autoscale policy instead determines the minimum number of workers from
+the queued work of running jobs. While the service is idle it keeps a warm pool
+of workers if the history of job arrivals suggests that a job will arrive
+soon. Jobs submitted by scheduled sqlmesh runs arrive at about the same time
+every day, so a job is expected if jobs arrived around the same time of day on
+enough of the previous days or if jobs have recently been arriving
+frequently.
+"""
+
+import math
+import typing as t
+from collections import deque
+from datetime import datetime, timedelta
+
+from pydantic import BaseModel
+
+
+class JobArrivalHistory:
+    def __init__(self, lookback_days: int = 7, max_arrivals: int = 10_000):
+        self.lookback_days = lookback_days
+        self._arrivals: t.Deque[datetime] = deque(maxlen=max_arrivals)
+
+    def __len__(self):
+        return len(self._arrivals)
+
+    def record(self, arrived_at: datetime):
+        self._arrivals.append(arrived_at)
+        oldest = arrived_at - timedelta(days=self.lookback_days)
+        while self._arrivals and self._arrivals[0] < oldest:
+            self._arrivals.popleft()
+
+    def has_history(self, now: datetime) -> bool:
+        """Whether the history covers at least a day"""
+        return bool(self._arrivals) and now - self._arrivals[0] >= timedelta(days=1)
+
+    def daily_arrival_ratio(self, now: datetime, horizon: timedelta) -> float:
+        """The fraction of the previous days on which a job arrived within
+        `horizon` of this time of day"""
+        days_with_arrivals = 0
+        days = 0
+        for days_ago in range(1, self.lookback_days + 1):
+            window_start = now - timedelta(days=days_ago)
+            if self._arrivals and window_start + horizon < self._arrivals[0]:
+                break
+            days += 1
+            window_end = window_start + horizon
+            if any(window_start <= arrival <= window_end for arrival in self._arrivals):
+                days_with_arrivals += 1
+        if days == 0:
+            return 0.0
+        return days_with_arrivals / days
+
+    def median_interval(self) -> t.Optional[timedelta]:
+        if len(self._arrivals) < 2:
+            return None
+        arrivals = list(self._arrivals)
+        intervals = sorted(
+            later - earlier for earlier, later in zip(arrivals, arrivals[1:])
+        )
+        return intervals[len(intervals) // 2]
+
+    def expects_job(
+        self, now: datetime, horizon: timedelta, min_daily_ratio: float = 0.5
+    ) -> bool:
+        if self.daily_arrival_ratio(now, horizon) >= min_daily_ratio:
+            return True
+        if not self._arrivals:
+            return False
+        # Jobs that arrive in quick succession are likely to continue
+        median_interval = self.median_interval()
+        return (
+            median_interval is not None
+            and median_interval <= horizon
+            and now - self._arrivals[-1] <= horizon
+        )
+
+
+class AutoscaleDecision(BaseModel):
+    min_size: int
+    # Whether the cluster may be shut down entirely
+    allow_shutdown: bool
+
+
+class AutoscalePolicy:
+    def __init__(
+        self,
+        worker_slots: int,
+        warm_pool_size: int = 0,
+        warm_pool_horizon_seconds: int = 3600,
+        history: t.Optional[JobArrivalHistory] = None,
+    ):
+        self.worker_slots = max(worker_slots, 1)
+        self.warm_pool_size = warm_pool_size
+        self.warm_pool_horizon = timedelta(seconds=warm_pool_horizon_seconds)
+        self.history = history or JobArrivalHistory()
+
+    def record_job_arrival(self, arrived_at: datetime):
+        self.history.record(arrived_at)
+
+    def keep_warm(self, now: datetime) -> bool:
+        """Whether a warm pool should be kept while the service is idle.
+        Without a day of history the warm pool is kept."""
+        if self.warm_pool_size <= 0:
+            return False
+        if not self.history.has_history(now):
+            return True
+        return self.history.expects_job(now, self.warm_pool_horizon)
+
+    def decide(
+        self,
+        now: datetime,
+        queued_slots: int,
+        requested_min_size: int,
+        requested_max_size: int,
+        idle: bool,
+    ) -> AutoscaleDecision:
+        """Determines the minimum size of the cluster from the slots required
+        by the queued tasks of all jobs"""
+        demand = math.ceil(queued_slots / self.worker_slots)
+        keep_warm = self.keep_warm(now)
+        if idle:
+            baseline = self.warm_pool_size if keep_warm else 0
+        else:
+            baseline = max(requested_min_size, self.warm_pool_size)
+        min_size = max(baseline, demand)
+        if requested_max_size > 0:
+            min_size = min(min_size, requested_max_size)
+        return AutoscaleDecision(
+            min_size=min_size,
+            allow_shutdown=not keep_warm and queued_slots == 0,
+        )
@@ -0,0 +1,208 @@
+"""Adaptive batching of the days of a metrics job.
+
+A fixed number of days per task skews the work of a job badly. The early
+days of most metrics have almost no events while recent days have millions
+of rows. Batches are therefore sized by the estimated work of each day. That
+estimate is the number of dependency rows the day's query reads.
+
+Batches are taken from the plan while the job runs (guided self scheduling).
+Each batch gets at most an equal share of the remaining work per available
+task slot. It also gets at most the work that the cluster is estimated to
+process in the target task duration. The batches therefore shrink towards the
+end of a job, so that the last batches finish at about the same time instead
+of a few large stragglers holding the job open.
+"""
+
+import asyncio
+import bisect
+import math
+import typing as t
+from datetime import date, datetime
+
+import arrow
+from pydantic import BaseModel
+
+# Each query has some overhead regardless of the amount of rows it reads
+MIN_DAY_WEIGHT = 1.0
+
+
+def query_day_weights(
+    days: t.List[datetime],
+    row_counts: t.Dict[date, int],
+    window: t.Optional[int] = None,
+    unit: t.Optional[str] = None,
+) -> t.List[float]:
+    """Estimates the work of each query day as the number of rows the query
+    of that day reads. For rolling metrics these are the rows of the whole
+    window ending on the day. Without any row counts every day is weighted
+    equally."""
+    if not row_counts:
+        return [MIN_DAY_WEIGHT] * len(days)
+
+    sorted_days = sorted(row_counts.keys())
+    cumulative: t.List[int] = []
+    total = 0
+    for day in sorted_days:
+        total += row_counts[day]
+        cumulative.append(total)
+
+    def rows_until(day: date) -> int:
+        # The rows up to and including the given day
+        index = bisect.bisect_right(sorted_days, day)
+        return cumulative[index - 1] if index > 0 else 0
+
+    weights: t.List[float] = []
+    for query_day in days:
+        end = query_day.date()
+        if window and unit:
+            start = arrow.get(end).shift(**{f"{unit}s": -(window - 1)}).date()
+        else:
+            start = end
+        rows = rows_until(end) - rows_until(start) + row_counts.get(start, 0)
+        weights.append(max(float(rows), MIN_DAY_WEIGHT))
+    return weights
+
+
+class DayBatch(BaseModel):
+    days: t.List[datetime]
+    weight: float
+
+
+class ThroughputEstimator:
+    """An exponentially weighted estimate of the work done per second by a
+    single task"""
+
+    def __init__(self, initial: float = 0.0, smoothing: float = 0.3):
+        self.smoothing = smoothing
+        self._weight_per_second = initial
+
+    @property
+    def weight_per_second(self) -> float:
+        return self._weight_per_second
+
+    def record(self, weight: float, seconds: float):
+        if seconds <= 0:
+            return
+        observed = weight / seconds
+        if self._weight_per_second <= 0:
+            self._weight_per_second = observed
+        else:
+            self._weight_per_second = (
+                self.smoothing * observed
+                + (1 - self.smoothing) * self._weight_per_second
+            )
+
+    def target_batch_weight(self, target_seconds: float) -> float:
+        """The work a task can do within the target duration. Unbounded if
+        no target is set or nothing has been measured yet."""
+        if target_seconds <= 0 or self._weight_per_second <= 0:
+            return math.inf
+        return self._weight_per_second * target_seconds
+
+
+class AdaptiveBatchPlan:
+    def __init__(
+        self,
+        days: t.List[datetime],
+        weights: t.List[float],
+        max_batch_days: int,
+    ):
+        assert len(days) == len(weights), "every day requires a weight"
+        self.days = days
+        self.weights = weights
+        self.max_batch_days = max(max_batch_days, 1)
+        self._next = 0
+        self._remaining_weight = sum(weights)
+
+    @property
+    def remaining_days(self) -> int:
+        return len(self.days) - self._next
+
+    @property
+    def remaining_weight(self) -> float:
+        return self._remaining_weight
+
+    def _batch_end(self, start: int, limit: float) -> int:
+        end = start
+        weight = 0.0
+        while end < len(self.days) and end - start < self.max_batch_days:
+            # A batch always contains at least one day
+            if end > start and weight + self.weights[end] > limit:
+                break
+            weight += self.weights[end]
+            end += 1
+        return end
+
+    def _limit(self, remaining_weight: float, parallelism: int, target_weight: float):
+        return min(target_weight, remaining_weight / max(parallelism, 1))
+
+    def next_batch(
+        self, parallelism: int, target_weight: float = math.inf
+    ) -> t.Optional[DayBatch]:
+        """Takes the next batch for a cluster that can run `parallelism` tasks
+        of this job at the same time"""
+        if self.remaining_days == 0:
+            return None
+        limit = self._limit(self._remaining_weight, parallelism, target_weight)
+        end = self._batch_end(self._next, limit)
+        batch = DayBatch(
+            days=self.days[self._next : end],
+            weight=sum(self.weights[self._next : end]),
+        )
+        self._next = end
+        self._remaining_weight = max(self._remaining_weight - batch.weight, 0.0)
+        return batch
+
+    def estimate_remaining_batches(
+        self, parallelism: int, target_weight: float = math.inf
+    ) -> int:
+        """The number of batches left if the parallelism and the target
+        weight don't change"""
+        count = 0
+        position = self._next
+        remaining_weight = self._remaining_weight
+        while position < len(self.days):
+            limit = self._limit(remaining_weight, parallelism, target_weight)
+            end = self._batch_end(position, limit)
+            remaining_weight -= sum(self.weights[position:end])
+            position = end
+            count += 1
+        return count
+
+
+class TaskSlots:
+    """Limits the number of submitted tasks of a job to the capacity of the
+    cluster plus `queue_depth` queued tasks. The queued tasks let the cluster
+    see the pending work so that it scales up, and let workers that join
+    start right away. The capacity is checked again every `recheck_seconds`
+    while waiting as the cluster may be resized while the job runs."""
+
+    def __init__(self, queue_depth: int = 0, recheck_seconds: float = 1.0):
+        self.queue_depth = max(queue_depth, 0)
+        self.recheck_seconds = recheck_seconds
+        self._running = 0
+        self._condition = asyncio.Condition()
+
+    @property
+    def running(self) -> int:
+        return self._running
+
+    def limit(self, capacity: int) -> int:
+        """The number of tasks that may be submitted for the given capacity"""
+        return max(capacity, 1) + self.queue_depth
+
+    async def acquire(self, capacity: t.Callable[[], int]):
+        async with self._condition:
+            while self._running >= self.limit(capacity()):
+                try:
+                    await asyncio.wait_for(
+                        self._condition.wait(), timeout=self.recheck_seconds
+                    )
+                except asyncio.TimeoutError:
+                    pass
+            self._running += 1
+
+    async def release(self):
+        async with self._condition:
+            self._running -= 1
+            self._condition.notify_all()
@@ -0,0 +1,177 @@
+"""Coalesced broadcasting of job status to websocket connections"""
+
+import asyncio
+import logging
+import time
+import typing as t
+from dataclasses import dataclass, field
+
+from .types import JobStatusResponse, QueryJobState, QueryJobStatus
+
+logger = logging.getLogger(__name__)
+
+TERMINAL_STATUSES = (QueryJobStatus.COMPLETED, QueryJobStatus.FAILED)
+
+
+@dataclass
+class JobStatusUpdate:
+    response: JobStatusResponse
+    # The response encoded as json. It's shared by all the subscribers.
+    encoded: str
+
+    @property
+    def is_final(self):
+        return self.response.status in TERMINAL_STATUSES
+
+
+class JobStatusSubscription:
+    """The pending status update of a single connection.
+
+    Only the latest update is kept. If the connection is slower than the
+    updates, the intermediate states are dropped instead of queued. An update
+    that is identical to the previous one (e.g. the first update after the
+    initial snapshot of a subscription) is skipped.
+    """
+
+    def __init__(
+        self,
+        job_id: str,
+        on_close: t.Optional[t.Callable[["JobStatusSubscription"], None]] = None,
+    ):
+        self.job_id = job_id
+        self.dropped = 0
+        self._on_close = on_close
+        self._latest: t.Optional[JobStatusUpdate] = None
+        self._last_encoded: t.Optional[str] = None
+        self._ready = asyncio.Event()
+        self._closed = False
+
+    def offer(self, update: JobStatusUpdate):
+        if update.encoded == self._last_encoded:
+            return
+        self._last_encoded = update.encoded
+        if self._latest is not None:
+            self.dropped += 1
+        self._latest = update
+        self._ready.set()
+
+    async def get(self, timeout: t.Optional[float] = None):
+        """Waits for the next update. Returns None on timeout"""
+        if not self._ready.is_set():
+            try:
+                await asyncio.wait_for(self._ready.wait(), timeout=timeout)
+            except asyncio.TimeoutError:
+                return None
+        self._ready.clear()
+        update, self._latest = self._latest, None
+        return update
+
+    def close(self):
+        if self._closed:
+            return
+        self._closed = True
+        if self._on_close:
+            self._on_close(self)
+
+
+@dataclass
+class _JobBroadcast:
+    subscriptions: t.Set[JobStatusSubscription] = field(default_factory=set)
+    state: t.Optional[QueryJobState] = None
+    last_flush: float = 0.0
+    timer: t.Optional[asyncio.TimerHandle] = None
+
+
+class JobStatusBroadcaster:
+    """Sends the status of jobs to their subscribers at most
+    `max_updates_per_second` times per job. Each status is encoded once for
+    all subscribers. The final status of a job is always sent immediately."""
+
+    def __init__(
+        self,
+        max_updates_per_second: float = 2.0,
+        log_override: t.Optional[logging.Logger] = None,
+    ):
+        self.min_interval = (
+            1.0 / max_updates_per_second if max_updates_per_second > 0 else 0.0
+        )
+        self.logger = log_override or logger
+        self._jobs: t.Dict[str, _JobBroadcast] = {}
+
+    def subscribe(
+        self,
+        state: QueryJobState,
+        on_close: t.Optional[t.Callable[[JobStatusSubscription], None]] = None,
+    ) -> JobStatusSubscription:
+        """Subscribes to the status of the job of the given state. A snapshot
+        of the current status is sent immediately so that subscribers don't
+        have to wait for the next change of the job."""
+
+        def close(subscription: JobStatusSubscription):
+            self._unsubscribe(subscription)
+            if on_close:
+                on_close(subscription)
+
+        subscription = JobStatusSubscription(state.job_id, on_close=close)
+        self._jobs.setdefault(state.job_id, _JobBroadcast()).subscriptions.add(
+            subscription
+        )
+        subscription.offer(self.encode(state))
+        return subscription
+
+    def publish(self, state: QueryJobState):
+        """Schedules the given state to be sent to the job's subscribers. The
+        state is read when it's sent so it may be mutated in the meantime."""
+        job = self._jobs.get(state.job_id)
+        if job is None:
+            return
+        job.state = state
+        if state.status in TERMINAL_STATUSES:
+            self._flush(state.job_id)
+            return
+        if job.timer is not None:
+            return
+        delay = job.last_flush + self.min_interval - time.monotonic()
+        if delay <= 0:
+            self._flush(state.job_id)
+        else:
+            job.timer = asyncio.get_running_loop().call_later(
+                delay, self._flush, state.job_id
+            )
+
+    def encode(self, state: QueryJobState) -> JobStatusUpdate:
+        response = state.as_response()
+        return JobStatusUpdate(response=response, encoded=response.model_dump_json())
+
+    def subscribers_count(self, job_id: str) -> int:
+        job = self._jobs.get(job_id)
+        return len(job.subscriptions) if job else 0
+
+    def _flush(self, job_id: str):
+        job = self._jobs.get(job_id)
+        if job is None:
+            return
+        if job.timer is not None:
+            job.timer.cancel()
+            job.timer = None
+        state, job.state = job.state, None
+        if state is None:
+            return
+        job.last_flush = time.monotonic()
+        update = self.encode(state)
+        for subscription in job.subscriptions:
+            subscription.offer(update)
+
+    def _unsubscribe(self, subscription: JobStatusSubscription):
+        job = self._jobs.get(subscription.job_id)
+        if job is None:
+            return
+        job.subscriptions.discard(subscription)
+        if subscription.dropped > 0:
+            self.logger.debug(
+                f"job[{subscription.job_id}] subscriber skipped {subscription.dropped} intermediate updates"
+            )
+        if not job.subscriptions:
+            if job.timer is not None:
+                job.timer.cancel()
+            del self._jobs[subscription.job_id]
@@ -1,22 +1,39 @@
 import abc
 import asyncio
-import copy
 import logging
+import math
 import queue
 import typing as t
 import uuid
-from datetime import datetime
+from datetime import date, datetime, timedelta
 
+import gcsfs
 from aiotrino.dbapi import Connection
 from pydantic import BaseModel
 from pyee.asyncio import AsyncIOEventEmitter
 from sqlglot import exp
 from sqlmesh.core.dialect import parse_one
 
-from .types import ColumnsDefinition, ExportReference, ExportType, TableReference
+from .cache_index import (
+    CacheEvictionPolicy,
+    CacheIndexEntry,
+    ExportCacheIndex,
+    InMemoryExportCacheIndex,
+)
+from .types import (
+    CacheExportStats,
+    ColumnsDefinition,
+    ExportReference,
+    ExportTimeRange,
+    ExportType,
+    TableReference,
+)
 
 logger = logging.getLogger(__name__)
 
+# Partial exports are partitioned by day on this column
+EXPORT_PARTITION_COLUMN = "_export_day"
+
 
 class ExportCacheCompletedQueueItem(BaseModel):
     table: str
@@ -26,6 +43,75 @@ class ExportCacheCompletedQueueItem(BaseModel):
 class ExportCacheQueueItem(BaseModel):
     execution_time: datetime
     table: str
+    cache_key: str
+    time_range: t.Optional[ExportTimeRange] = None
+    columns: t.Optional[t.List[str]] = None
+
+
+def merge_columns(
+    columns: t.Optional[t.List[str]], other: t.Optional[t.List[str]]
+) -> t.Optional[t.List[str]]:
+    """The columns needed by both column lists. None stands for all columns"""
+    if columns is None or other is None:
+        return None
+    seen = {column.lower() for column in columns}
+    merged = list(columns)
+    for column in other:
+        if column.lower() not in seen:
+            seen.add(column.lower())
+            merged.append(column)
+    return merged
+
+
+class PendingExport(BaseModel):
+    table: str
+    execution_time: datetime
+    cache_key: str
+    enqueued_at: datetime
+    next_attempt_at: datetime
+    waiters: int = 1
+    attempts: int = 0
+    estimated_size: t.Optional[float] = None
+    time_range: t.Optional[ExportTimeRange] = None
+    # Only these columns are exported if set
+    columns: t.Optional[t.List[str]] = None
+
+    def covers(
+        self,
+        time_range: t.Optional[ExportTimeRange],
+        columns: t.Optional[t.List[str]] = None,
+    ) -> bool:
+        if self.columns is not None and (
+            columns is None or merge_columns(self.columns, columns) != self.columns
+        ):
+            return False
+        if self.time_range is None:
+            return True
+        if time_range is None:
+            return False
+        return self.time_range.covers(time_range)
+
+    def merge(self, other: "PendingExport"):
+        """Merges a request for the same cache key into this export"""
+        self.waiters += other.waiters
+        self.enqueued_at = min(self.enqueued_at, other.enqueued_at)
+        self.merge_time_range(other.time_range)
+        self.merge_columns(other.columns)
+
+    def merge_time_range(self, time_range: t.Optional[ExportTimeRange]):
+        if self.time_range is not None and time_range is not None:
+            self.time_range = self.time_range.union(time_range)
+
+    def merge_columns(self, columns: t.Optional[t.List[str]]):
+        self.columns = merge_columns(self.columns, columns)
+
+    def priority(self):
+        """Sort key for pending exports. Tables that more requests are
+        waiting on go first, then smaller tables, then older requests"""
+        estimated_size = (
+            self.estimated_size if self.estimated_size is not None else math.inf
+        )
+        return (-self.waiters, estimated_size, self.enqueued_at)
 
 
 class ExportError(Exception):
@@ -36,11 +122,56 @@ class ExportError(Exception):
 
 class DBExportAdapter(abc.ABC):
     async def export_table(
-        self, table: str, execution_time: datetime
+        self,
+        table: str,
+        execution_time: datetime,
+        columns: t.Optional[t.List[str]] = None,
+    ) -> ExportReference:
+        """Exports the table. If `columns` is given, only those columns are
+        needed. Adapters that export all the columns anyway leave
+        `selected_columns` of the export reference unset."""
+        raise NotImplementedError()
+
+    async def export_table_slice(
+        self,
+        table: str,
+        execution_time: datetime,
+        time_range: ExportTimeRange,
+        columns: t.Optional[t.List[str]] = None,
     ) -> ExportReference:
+        """Exports only the rows of the table within the given time range.
+        Adapters that cannot export part of a table export the entire table
+        which satisfies any time range."""
+        return await self.export_table(table, execution_time, columns)
+
+    async def extend_export_table_slice(
+        self, export_reference: ExportReference, time_range: ExportTimeRange
+    ) -> ExportReference:
+        """Adds any rows of the time range that are missing from a partial
+        export. The returned export reference must cover both the previously
+        exported range and the given time range."""
         raise NotImplementedError()
 
-    async def clean_export_table(self, table: str):
+    async def fingerprint_table(self, table: str) -> t.Optional[str]:
+        """Returns a fingerprint of the current contents of the table. If the
+        contents of the table change, so must the fingerprint. Adapters that
+        cannot fingerprint a table return None."""
+        return None
+
+    async def estimate_table_size(self, table: str) -> t.Optional[float]:
+        """Returns an estimate of the size of the table. This is only used to
+        order exports so it does not need to be exact. Adapters that cannot
+        estimate the size return None."""
+        return None
+
+    async def row_counts_by_day(
+        self, export_reference: ExportReference
+    ) -> t.Dict[date, int]:
+        """Returns the number of exported rows for each day of a partial
+        export. Adapters that cannot count the rows return an empty dict."""
+        return {}
+
+    async def clean_export_table(self, export_reference: ExportReference):
         raise NotImplementedError()
 
 
@@ -49,7 +180,10 @@ class FakeExportAdapter(DBExportAdapter):
         self.logger = log_override or logger
 
     async def export_table(
-        self, table: str, execution_time: datetime
+        self,
+        table: str,
+        execution_time: datetime,
+        columns: t.Optional[t.List[str]] = None,
     ) -> ExportReference:
         self.logger.info(f"fake exporting table: {table}")
         return ExportReference(
@@ -57,9 +191,33 @@ class FakeExportAdapter(DBExportAdapter):
             type=ExportType.GCS,
             payload={"gcs_path": "fake_path:{table}"},
             columns=ColumnsDefinition(columns=[]),
+            selected_columns=columns,
+        )
+
+    async def export_table_slice(
+        self,
+        table: str,
+        execution_time: datetime,
+        time_range: ExportTimeRange,
+        columns: t.Optional[t.List[str]] = None,
+    ) -> ExportReference:
+        self.logger.info(f"fake exporting table: {table} for {time_range}")
+        export_reference = await self.export_table(table, execution_time, columns)
+        export_reference.time_range = time_range
+        return export_reference
+
+    async def extend_export_table_slice(
+        self, export_reference: ExportReference, time_range: ExportTimeRange
+    ) -> ExportReference:
+        assert export_reference.time_range is not None
+        self.logger.info(
+            f"fake extending export of {export_reference.table_fqn()} with {time_range}"
+        )
+        return export_reference.model_copy(
+            update={"time_range": export_reference.time_range.union(time_range)}
         )
 
-    async def clean_export_table(self, table: str):
+    async def clean_export_table(self, export_reference: ExportReference):
         pass
 
 
@@ -70,16 +228,143 @@ class TrinoExportAdapter(DBExportAdapter):
         gcs_bucket: str,
         hive_catalog: str,
         hive_schema: str,
+        fs: t.Optional[gcsfs.GCSFileSystem] = None,
         log_override: t.Optional[logging.Logger] = None,
     ):
         self.db = db
         self.gcs_bucket = gcs_bucket
         self.hive_catalog = hive_catalog
         self.hive_schema = hive_schema
+        self._fs = fs
         self.logger = log_override or logger
 
+    @property
+    def fs(self):
+        if self._fs is None:
+            self._fs = gcsfs.GCSFileSystem()
+        return self._fs
+
+    async def fingerprint_table(self, table: str) -> t.Optional[str]:
+        """Uses the latest iceberg snapshot id of the table as the fingerprint.
+        Tables that don't expose a `$snapshots` metadata table (e.g. non
+        iceberg tables) cannot be fingerprinted."""
+        table_exp = exp.to_table(table)
+        snapshots_table = exp.table_(
+            f"{table_exp.name}$snapshots",
+            db=table_exp.db or None,
+            catalog=table_exp.catalog or None,
+            quoted=True,
+        )
+        try:
+            result = await self.run_query(
+                f"""
+                SELECT snapshot_id FROM {snapshots_table.sql(dialect="trino")}
+                ORDER BY committed_at DESC
+                LIMIT 1
+                """
+            )
+        except Exception as e:
+            self.logger.debug(f"could not fingerprint table {table}: {e}")
+            return None
+        if not result:
+            return None
+        return str(result[0][0])
+
+    async def estimate_table_size(self, table: str) -> t.Optional[float]:
+        """Estimates the size of the table from trino's table statistics. The
+        sum of the data size of all columns is used if available, otherwise
+        the row count is used."""
+        try:
+            result = await self.run_query(f"SHOW STATS FOR {exp.to_table(table)}")
+        except Exception as e:
+            self.logger.debug(f"could not retrieve stats for table {table}: {e}")
+            return None
+
+        data_size = 0.0
+        row_count: t.Optional[float] = None
+        for row in result:
+            # The columns are: column_name, data_size, distinct_values_count,
+            # nulls_fraction, row_count, low_value, high_value. The summary row
+            # has no column_name and contains the row count.
+            if row[0] is None:
+                row_count = row[4]
+            elif row[1] is not None:
+                data_size += row[1]
+        if data_size > 0:
+            return data_size
+        return row_count
+
+    async def row_counts_by_day(
+        self, export_reference: ExportReference
+    ) -> t.Dict[date, int]:
+        """Counts the rows of each day partition of a partial export"""
+        if export_reference.time_range is None:
+            return {}
+        export_table_name = export_reference.source_metadata["export_table_name"]
+        hive_catalog = export_reference.source_metadata.get(
+            "hive_catalog", self.hive_catalog
+        )
+        hive_schema = export_reference.source_metadata.get(
+            "hive_schema", self.hive_schema
+        )
+        result = await self.run_query(
+            f"""
+            SELECT {EXPORT_PARTITION_COLUMN}, COUNT(*)
+            FROM "{hive_catalog}"."{hive_schema}"."{export_table_name}"
+            GROUP BY 1
+            """
+        )
+        return {row[0]: row[1] for row in result}
+
     async def export_table(
-        self, table: str, execution_time: datetime
+        self,
+        table: str,
+        execution_time: datetime,
+        columns: t.Optional[t.List[str]] = None,
+    ) -> ExportReference:
+        return await self._export_table(table, execution_time, selected_columns=columns)
+
+    async def export_table_slice(
+        self,
+        table: str,
+        execution_time: datetime,
+        time_range: ExportTimeRange,
+        columns: t.Optional[t.List[str]] = None,
+    ) -> ExportReference:
+        return await self._export_table(table, execution_time, time_range, columns)
+
+    async def extend_export_table_slice(
+        self, export_reference: ExportReference, time_range: ExportTimeRange
+    ) -> ExportReference:
+        """Inserts the missing days into the existing export table. As the
+        export table is partitioned by day this only adds new partitions to the
+        exported files and readers of the previous range are unaffected."""
+        assert export_reference.time_range is not None, "export is not partial"
+        export_table_name = export_reference.source_metadata["export_table_name"]
+        hive_catalog = export_reference.source_metadata.get(
+            "hive_catalog", self.hive_catalog
+        )
+        hive_schema = export_reference.source_metadata.get(
+            "hive_schema", self.hive_schema
+        )
+        processed_columns = self.process_column_list(export_reference.columns.columns)
+        for missing_range in export_reference.time_range.missing_ranges(time_range):
+            await self._insert_into_export_table(
+                export_reference.table_fqn(),
+                f'"{hive_catalog}"."{hive_schema}"."{export_table_name}"',
+                processed_columns,
+                missing_range,
+            )
+        return export_reference.model_copy(
+            update={"time_range": export_reference.time_range.union(time_range)}
+        )
+
+    async def _export_table(
+        self,
+        table: str,
+        execution_time: datetime,
+        time_range: t.Optional[ExportTimeRange] = None,
+        selected_columns: t.Optional[t.List[str]] = None,
     ) -> ExportReference:
         columns: t.List[t.Tuple[str, str]] = []
 
@@ -90,6 +375,8 @@ class TrinoExportAdapter(DBExportAdapter):
             column_type = row[1]
             columns.append((column_name, column_type))
 
+        columns, selected_columns = self.select_columns(columns, selected_columns)
+
         table_exp = exp.to_table(table)
         self.logger.debug(f"retrieved columns for {table} export: {columns}")
         export_table_name = f"export_{table_exp.this.this}_{uuid.uuid4().hex}"
@@ -98,6 +385,12 @@ class TrinoExportAdapter(DBExportAdapter):
         # of the export tables
         gcs_path = f"gs://{self.gcs_bucket}/trino-export/{execution_time.strftime('%Y/%m/%d/%H')}/{export_table_name}/"
 
+        # Partial exports are partitioned by day so that they can be extended
+        # later by only adding the missing partitions
+        partitioning = ""
+        if time_range:
+            partitioning = f", partitioned_by = ARRAY['{EXPORT_PARTITION_COLUMN}']"
+
         # We use a little bit of a hybrid templating+sqlglot magic to generate
         # the create and insert queries. This saves us having to figure out the
         # exact sqlglot objects
@@ -106,39 +399,112 @@ class TrinoExportAdapter(DBExportAdapter):
                 placeholder VARCHAR,
             ) WITH (
                 format = 'PARQUET',
-                external_location = '{gcs_path}'
+                external_location = '{gcs_path}'{partitioning}
             )
         """
 
         # Trino's hive connector has some issues with certain column types so we
         # will forcibly cast those columns to values that will work
-        processed_columns: t.List[
-            t.Tuple[exp.Identifier, exp.ColumnDef, exp.Expression]
-        ] = [
-            self.process_columns(column_name, parse_one(column_type, into=exp.DataType))
-            for column_name, column_type in columns
-        ]
+        processed_columns = self.process_column_list(columns)
 
         # Parse the create query
         create_query = parse_one(base_create_query)
         # Rewrite the column definitions we need to rewrite.
-
-        create_query.this.set("expressions", [row[1] for row in processed_columns])
+        column_defs = [row[1] for row in processed_columns]
+        if time_range:
+            # Hive requires the partition columns to be the last columns
+            column_defs.append(
+                exp.ColumnDef(
+                    this=exp.to_identifier(EXPORT_PARTITION_COLUMN),
+                    kind=exp.DataType.build("DATE"),
+                )
+            )
+        create_query.this.set("expressions", column_defs)
 
         # Execute the create query which will create the export table
         await self.run_query(create_query.sql(dialect="trino"))
 
+        await self._insert_into_export_table(
+            table,
+            f'"{self.hive_catalog}"."{self.hive_schema}"."{export_table_name}"',
+            processed_columns,
+            time_range,
+        )
+
+        return ExportReference(
+            table=TableReference(table_name=table),
+            type=ExportType.GCS,
+            payload={"gcs_path": gcs_path},
+            columns=ColumnsDefinition(columns=columns, dialect="trino"),
+            source_metadata={
+                "hive_catalog": self.hive_catalog,
+                "hive_schema": self.hive_schema,
+                "export_table_name": export_table_name,
+            },
+            time_range=time_range,
+            selected_columns=selected_columns,
+        )
+
+    def select_columns(
+        self,
+        columns: t.List[t.Tuple[str, str]],
+        selected_columns: t.Optional[t.List[str]],
+    ) -> t.Tuple[t.List[t.Tuple[str, str]], t.Optional[t.List[str]]]:
+        """Returns the columns of the table to export and the names of the
+        selected columns. The requested columns may include names that the
+        table doesn't have. If the table has none of them all of its columns
+        are exported. If no columns are requested at all (e.g. the rows are
+        only counted), only the first column is exported."""
+        if selected_columns is None:
+            return columns, None
+        requested = {column.lower() for column in selected_columns}
+        if requested:
+            selected = [column for column in columns if column[0].lower() in requested]
+        else:
+            selected = columns[:1]
+        if not selected or len(selected) == len(columns):
+            return columns, None
+        self.logger.debug(
+            f"exporting {len(selected)} of {len(columns)} columns: {selected}"
+        )
+        return selected, [column_name for column_name, _ in selected]
+
+    async def _insert_into_export_table(
+        self,
+        table: str,
+        export_table: str,
+        processed_columns: t.List[
+            t.Tuple[exp.Identifier, exp.ColumnDef, exp.Expression]
+        ],
+        time_range: t.Optional[ExportTimeRange] = None,
+    ):
         # Again using a hybrid templating+sqlglot magic to generate the insert
         # for the export table
         base_insert_query = f"""
-            INSERT INTO "{self.hive_catalog}"."{self.hive_schema}"."{export_table_name}" (placeholder)
+            INSERT INTO {export_table} (placeholder)
             SELECT placeholder
-            FROM {table_exp}
+            FROM {exp.to_table(table)}
         """
 
         column_identifiers = [row[0] for row in processed_columns]
         column_selects = [row[2] for row in processed_columns]
 
+        if time_range:
+            # Derive the partition from the exported value of the time column
+            # so that timezones are handled the same way as in the export
+            time_column_select = next(
+                (
+                    column_select
+                    for column_identifier, _, column_select in processed_columns
+                    if column_identifier.name == time_range.column
+                ),
+                exp.to_identifier(time_range.column),
+            )
+            column_identifiers.append(exp.to_identifier(EXPORT_PARTITION_COLUMN))
+            column_selects.append(
+                exp.cast(time_column_select.copy(), exp.DataType.build("DATE"))
+            )
+
         # Rewrite the column identifiers in the insert into statement
         insert_query = parse_one(base_insert_query)
         insert_query.this.set(
@@ -150,22 +516,45 @@ class TrinoExportAdapter(DBExportAdapter):
         select = t.cast(exp.Select, insert_query.expression)
         select.set("expressions", column_selects)
 
+        if time_range:
+            # The range is inclusive of the end day. Comparing against
+            # timestamps keeps this correct for date and timestamp columns
+            end = time_range.end + timedelta(days=1)
+            select.where(
+                exp.and_(
+                    exp.GTE(
+                        this=exp.column(time_range.column),
+                        expression=exp.cast(
+                            exp.Literal.string(time_range.start.isoformat(" ")),
+                            exp.DataType.build("TIMESTAMP"),
+                        ),
+                    ),
+                    exp.LT(
+                        this=exp.column(time_range.column),
+                        expression=exp.cast(
+                            exp.Literal.string(end.isoformat(" ")),
+                            exp.DataType.build("TIMESTAMP"),
+                        ),
+                    ),
+                ),
+                copy=False,
+            )
+
         # Execute the insert query which will populate the export table
         await self.run_query(insert_query.sql(dialect="trino"))
 
-        return ExportReference(
-            table=TableReference(table_name=table),
-            type=ExportType.GCS,
-            payload={"gcs_path": gcs_path},
-            columns=ColumnsDefinition(columns=columns, dialect="trino"),
-        )
-
     async def run_query(self, query: str):
         cursor = await self.db.cursor()
         self.logger.info(f"Executing SQL: {query}")
         await cursor.execute(query)
         return await cursor.fetchall()
 
+    def process_column_list(self, columns: t.List[t.Tuple[str, str]]):
+        return [
+            self.process_columns(column_name, parse_one(column_type, into=exp.DataType))
+            for column_name, column_type in columns
+        ]
+
     def process_columns(
         self, column_name: str, column_type: exp.Expression
     ) -> t.Tuple[exp.Identifier, exp.ColumnDef, exp.Expression]:
@@ -205,8 +594,30 @@ class TrinoExportAdapter(DBExportAdapter):
             column_select,
         )
 
-    async def clean_export_table(self, table: str):
-        pass
+    async def clean_export_table(self, export_reference: ExportReference):
+        """Drops the hive table for the export and deletes the exported
+        parquet files. Dropping an external hive table does not delete the
+        data so both steps are necessary."""
+        export_table_name = export_reference.source_metadata.get("export_table_name")
+        if export_table_name:
+            hive_catalog = export_reference.source_metadata.get(
+                "hive_catalog", self.hive_catalog
+            )
+            hive_schema = export_reference.source_metadata.get(
+                "hive_schema", self.hive_schema
+            )
+            await self.run_query(
+                f'DROP TABLE IF EXISTS "{hive_catalog}"."{hive_schema}"."{export_table_name}"'
+            )
+
+        gcs_path = export_reference.payload.get("gcs_path")
+        if not gcs_path:
+            return
+        self.logger.info(f"deleting exported files at {gcs_path}")
+        try:
+            await asyncio.to_thread(self.fs.rm, gcs_path, recursive=True)
+        except FileNotFoundError:
+            self.logger.warning(f"exported files at {gcs_path} already deleted")
 
 
 def setup_trino_cache_export_manager(
@@ -215,6 +626,13 @@ def setup_trino_cache_export_manager(
     hive_catalog: str,
     hive_schema: str,
     preloaded_exported_map: t.Optional[t.Dict[str, ExportReference]] = None,
+    index: t.Optional[ExportCacheIndex] = None,
+    eviction_policy: t.Optional[CacheEvictionPolicy] = None,
+    use_table_fingerprints: bool = False,
+    max_concurrent_exports: int = 4,
+    export_retries: int = 2,
+    retry_backoff_seconds: float = 1.0,
+    size_estimate_wait_seconds: float = 0.5,
     log_override: t.Optional[logging.Logger] = None,
 ):
     adapter = TrinoExportAdapter(
@@ -223,6 +641,13 @@ def setup_trino_cache_export_manager(
     return CacheExportManager.setup(
         export_adapter=adapter,
         preloaded_exported_map=preloaded_exported_map,
+        index=index,
+        eviction_policy=eviction_policy,
+        use_table_fingerprints=use_table_fingerprints,
+        max_concurrent_exports=max_concurrent_exports,
+        export_retries=export_retries,
+        retry_backoff_seconds=retry_backoff_seconds,
+        size_estimate_wait_seconds=size_estimate_wait_seconds,
         log_override=log_override,
     )
 
@@ -250,6 +675,29 @@ class CacheExportManager:
     trigger the database export. Once the export is completed any consumers of
     this export manager can listen for the `exported_table` event to know when
     the export is complete.
+
+    Completed exports are stored in an `ExportCacheIndex`. If
+    `use_table_fingerprints` is enabled, exports are keyed by the adapter's
+    fingerprint of the table instead of the execution time so that exports of
+    unchanged tables are reused. Paired with a durable index this allows
+    exports to be reused across restarts. Entries selected by the eviction
+    policy are removed from the index and the exported data is cleaned through
+    the adapter.
+
+    Tables can also be requested for a time range. These are exported
+    partially and stored under a separate cache key. Requests for a range that
+    isn't covered by an existing partial export extend that export with the
+    missing days instead of exporting the table again.
+
+    Similarly, tables can be requested with only the columns that are read.
+    These are stored under a separate cache key as well. Requests for columns
+    that such an export doesn't have export the table again with the columns
+    of both so that the export is still shared. The replaced export is kept
+    in the index until it's evicted as running jobs may still read it.
+
+    Exports that running jobs read should be pinned with
+    `pin_export_references`. Pinned exports are never evicted, even if the
+    eviction policy selects them, until they have been unpinned.
     """
 
     export_queue_task: asyncio.Task
@@ -261,23 +709,52 @@ class CacheExportManager:
         cls,
         export_adapter: DBExportAdapter,
         preloaded_exported_map: t.Optional[t.Dict[str, ExportReference]] = None,
+        index: t.Optional[ExportCacheIndex] = None,
+        eviction_policy: t.Optional[CacheEvictionPolicy] = None,
+        use_table_fingerprints: bool = False,
+        max_concurrent_exports: int = 4,
+        export_retries: int = 2,
+        retry_backoff_seconds: float = 1.0,
+        size_estimate_wait_seconds: float = 0.5,
         log_override: t.Optional[logging.Logger] = None,
     ):
         cache = cls(
             export_adapter,
-            preloaded_exported_map=preloaded_exported_map,
+            index=index,
+            eviction_policy=eviction_policy,
+            use_table_fingerprints=use_table_fingerprints,
+            max_concurrent_exports=max_concurrent_exports,
+            export_retries=export_retries,
+            retry_backoff_seconds=retry_backoff_seconds,
+            size_estimate_wait_seconds=size_estimate_wait_seconds,
             log_override=log_override,
         )
+        if preloaded_exported_map:
+            await cache.add_export_table_references(preloaded_exported_map)
         await cache.start()
         return cache
 
     def __init__(
         self,
         export_adapter: DBExportAdapter,
-        preloaded_exported_map: t.Optional[t.Dict[str, ExportReference]] = None,
+        index: t.Optional[ExportCacheIndex] = None,
+        eviction_policy: t.Optional[CacheEvictionPolicy] = None,
+        use_table_fingerprints: bool = False,
+        eviction_interval_seconds: int = 300,
+        max_concurrent_exports: int = 4,
+        export_retries: int = 2,
+        retry_backoff_seconds: float = 1.0,
+        size_estimate_wait_seconds: float = 0.5,
         log_override: t.Optional[logging.Logger] = None,
     ):
-        self.exported_map: t.Dict[str, ExportReference] = preloaded_exported_map or {}
+        self.index = index or InMemoryExportCacheIndex()
+        self.max_concurrent_exports = max_concurrent_exports
+        self.export_retries = export_retries
+        self.retry_backoff_seconds = retry_backoff_seconds
+        self.size_estimate_wait_seconds = size_estimate_wait_seconds
+        self.eviction_policy = eviction_policy or CacheEvictionPolicy()
+        self.eviction_interval_seconds = eviction_interval_seconds
+        self.use_table_fingerprints = use_table_fingerprints
         self.export_adapter = export_adapter
         self.exported_map_lock = asyncio.Lock()
         self.export_queue: asyncio.Queue[ExportCacheQueueItem] = asyncio.Queue()
@@ -288,86 +765,293 @@ class CacheExportManager:
         self.logger = log_override or logger
         self.event_emitter = AsyncIOEventEmitter()
 
+        self._scheduler_wakeup = asyncio.Event()
+        self._pending_exports: t.Dict[str, PendingExport] = {}
+        self._in_flight_exports: t.Dict[str, PendingExport] = {}
+        self._estimate_tasks: t.Set[asyncio.Task] = set()
+        # Number of running jobs that read each export, keyed by the identity
+        # of the export (see `export_pin_key`)
+        self._pinned_exports: t.Dict[str, int] = {}
+        self._completed_exports_count = 0
+        self._failed_exports_count = 0
+        self._retried_exports_count = 0
+        self._waited_exports_count = 0
+        self._total_wait_seconds = 0.0
+        self._max_wait_seconds = 0.0
+        self._timed_exports_count = 0
+        self._total_export_seconds = 0.0
+        self._max_export_seconds = 0.0
+
     async def start(self):
         self.export_queue_task = asyncio.create_task(self.export_queue_loop())
 
     async def stop(self):
         self.stop_signal.set()
+        self._scheduler_wakeup.set()
         await self.export_queue_task
+        await self.index.close()
 
     async def export_queue_loop(self):
-        in_progress: t.Set[str] = set()
-        errors: t.Dict[str, t.List[Exception]] = {}
+        """Schedules queued exports.
+
+        Queued tables are collected into a set of pending exports keyed by the
+        cache key. At most `max_concurrent_exports` exports run at the same
+        time. Pending exports are ordered by the number of requests waiting on
+        the table and then by the estimated size of the table so that small
+        tables don't get stuck behind large ones. The size is estimated in the
+        background, so new exports are held back for up to
+        `size_estimate_wait_seconds` until their estimate arrives. Failed
+        exports are retried
+        with an exponential backoff before the error is reported to any
+        listeners.
+        """
+        tasks: t.Dict[str, asyncio.Task] = {}
 
-        async def export_table(id: str, table: str, execution_time: datetime):
-            export_table_key = self.export_table_key(table, execution_time)
+        async def export_table(id: str, pending: PendingExport):
+            export_table_key = pending.cache_key
+            pending.attempts += 1
             try:
-                export_reference = await self._export_table_for_cache(
-                    table, execution_time
+                # The export may have been completed by an earlier request
+                # that was queued before this one.
+                export_reference = await self._get_export_reference_by_key(
+                    export_table_key
                 )
+                if export_reference is None or not export_reference.covers(
+                    pending.time_range, pending.columns
+                ):
+                    existing_reference = export_reference
+                    started_at = datetime.now()
+                    export_reference = await self._export_table_for_cache(
+                        pending.table,
+                        pending.execution_time,
+                        pending.time_range,
+                        existing_reference,
+                        pending.columns,
+                    )
+                    self._record_export_duration(datetime.now() - started_at)
+                    await self._store_export_reference(
+                        export_table_key, pending.table, export_reference
+                    )
+                    if (
+                        existing_reference is not None
+                        and not existing_reference.covers_columns(pending.columns)
+                    ):
+                        await self._store_export_reference(
+                            self.replaced_table_key(export_table_key),
+                            pending.table,
+                            existing_reference,
+                        )
+                self._completed_exports_count += 1
                 self.event_emitter.emit(
                     "exported_table",
-                    table=table,
-                    execution_time=execution_time,
+                    table=pending.table,
+                    execution_time=pending.execution_time,
                     export_table_key=export_table_key,
                     export_reference=export_reference,
                 )
-                self.export_queue.task_done()
             except Exception as e:
-                self.logger.error(f"Error exporting table {table}: {e}")
-
-                # Save the error for later
-                table_errors = errors.get(export_table_key, [])
-                table_errors.append(e)
-                errors[export_table_key] = table_errors
-
-                in_progress.remove(export_table_key)
-                self.event_emitter.emit(
-                    "exported_table",
-                    table=table,
-                    execution_time=execution_time,
-                    export_table_key=export_table_key,
-                    error=e,
+                self.logger.error(
+                    f"Error exporting table {pending.table} (attempt {pending.attempts}): {e}"
                 )
-                self.logger.debug("emitted error event and waiting for next export")
-                self.export_queue.task_done()
-            tasks.pop(id)
+                if pending.attempts <= self.export_retries:
+                    backoff = self.retry_backoff_seconds * 2 ** (pending.attempts - 1)
+                    self.logger.info(
+                        f"retrying export of {pending.table} in {backoff} seconds"
+                    )
+                    pending.next_attempt_at = datetime.now() + timedelta(
+                        seconds=backoff
+                    )
+                    self._retried_exports_count += 1
+                    queued = self._pending_exports.get(export_table_key)
+                    if queued:
+                        # A request for a larger range arrived in the meantime
+                        queued.merge(pending)
+                        queued.attempts = pending.attempts
+                        queued.next_attempt_at = pending.next_attempt_at
+                    else:
+                        self._pending_exports[export_table_key] = pending
+                else:
+                    self._failed_exports_count += 1
+                    self.event_emitter.emit(
+                        "exported_table",
+                        table=pending.table,
+                        execution_time=pending.execution_time,
+                        export_table_key=export_table_key,
+                        error=e,
+                    )
+                    self.logger.debug("emitted error event and waiting for next export")
+            finally:
+                self._in_flight_exports.pop(export_table_key, None)
+                tasks.pop(id)
+                self._scheduler_wakeup.set()
 
-        tasks: t.Dict[str, asyncio.Task] = {}
         count = 0
+        last_eviction = datetime.now()
         self.logger.info("export queue loop started")
+        await self._evict_safely()
         while not self.stop_signal.is_set():
             count += 1
+            woken = await self._wait_for_scheduler_wakeup()
+            if not woken and count % 60 == 0:
+                self.logger.debug("export queue loop is still running")
+
+            self._collect_queued_exports()
+            await self._wait_for_size_estimates()
+
+            for pending in self._ready_exports():
+                if len(self._in_flight_exports) >= self.max_concurrent_exports:
+                    break
+                if pending.cache_key in self._in_flight_exports:
+                    # An export of a smaller range of the same table is still
+                    # running. This export extends it once it has completed.
+                    continue
+                self._pending_exports.pop(pending.cache_key)
+                self._in_flight_exports[pending.cache_key] = pending
+                if pending.attempts == 0:
+                    self._record_export_wait(datetime.now() - pending.enqueued_at)
+
+                export_task_id = uuid.uuid4().hex
+                tasks[export_task_id] = asyncio.create_task(
+                    export_table(export_task_id, pending)
+                )
+
+            now = datetime.now()
+            if (now - last_eviction).total_seconds() >= self.eviction_interval_seconds:
+                last_eviction = now
+                await self._evict_safely()
+
+        tasks_list = list(tasks.values())
+        self.logger.info(f"waiting for {len(tasks_list)} tasks to complete")
+
+        await asyncio.gather(*tasks_list)
+
+    async def _wait_for_scheduler_wakeup(self) -> bool:
+        """Waits until there is new work for the scheduler or a retry is due.
+        Returns False if the wait timed out"""
+        timeout = 1.0
+        if self._pending_exports:
+            next_attempt_at = min(
+                pending.next_attempt_at for pending in self._pending_exports.values()
+            )
+            timeout = min(
+                timeout,
+                max((next_attempt_at - datetime.now()).total_seconds(), 0),
+            )
+        try:
+            await asyncio.wait_for(self._scheduler_wakeup.wait(), timeout=timeout)
+            return True
+        except asyncio.TimeoutError:
+            return False
+        finally:
+            self._scheduler_wakeup.clear()
+
+    def _collect_queued_exports(self):
+        """Moves all queued exports into the pending exports. Duplicate
+        requests for the same cache key only increase the priority of the
+        export"""
+        while True:
             try:
-                item = await asyncio.wait_for(self.export_queue.get(), timeout=1)
-            except asyncio.TimeoutError:
-                if count % 60 == 0:
-                    self.logger.debug("export queue loop is still running")
-                continue
-            except asyncio.CancelledError:
-                continue
-            except RuntimeError:
+                item = self.export_queue.get_nowait()
+            except asyncio.QueueEmpty:
                 break
+            self.export_queue.task_done()
             self.logger.debug(f"export queue item received: {item}")
-            export_table_key = self.export_table_key(item.table, item.execution_time)
-            if export_table_key in in_progress:
-                # The table is already being exported. Skip this in the queue
+
+            queued = self._pending_exports.get(item.cache_key)
+            if queued:
+                queued.waiters += 1
+                queued.merge_time_range(item.time_range)
+                queued.merge_columns(item.columns)
                 continue
-            if export_table_key in errors:
-                # The table has already errored. Skip this in the queue
+            in_flight = self._in_flight_exports.get(item.cache_key)
+            if in_flight and in_flight.covers(item.time_range, item.columns):
+                in_flight.waiters += 1
                 continue
 
-            in_progress.add(export_table_key)
-
-            export_task_id = uuid.uuid4().hex
-            tasks[export_task_id] = asyncio.create_task(
-                export_table(export_task_id, item.table, item.execution_time)
+            now = datetime.now()
+            pending = PendingExport(
+                table=item.table,
+                execution_time=item.execution_time,
+                cache_key=item.cache_key,
+                enqueued_at=now,
+                next_attempt_at=now,
+                time_range=item.time_range,
+                columns=item.columns,
             )
-
-        tasks_list = list(tasks.values())
-        self.logger.info(f"waiting for {len(tasks_list)} tasks to complete")
-
-        await asyncio.gather(*tasks_list)
+            self._pending_exports[item.cache_key] = pending
+            estimate_task = asyncio.create_task(self._estimate_export_size(pending))
+            self._estimate_tasks.add(estimate_task)
+            estimate_task.add_done_callback(self._estimate_tasks.discard)
+
+    def _ready_exports(self) -> t.List[PendingExport]:
+        now = datetime.now()
+        ready = [
+            pending
+            for pending in self._pending_exports.values()
+            if pending.next_attempt_at <= now
+        ]
+        return sorted(ready, key=lambda pending: pending.priority())
+
+    async def _wait_for_size_estimates(self):
+        """Waits for the size estimates of recently queued exports so that
+        they can be ordered by size. Exports whose estimate takes longer than
+        `size_estimate_wait_seconds` are dispatched without one."""
+        if not self._estimate_tasks:
+            return
+        unestimated = [
+            pending.enqueued_at
+            for pending in self._pending_exports.values()
+            if pending.estimated_size is None and pending.attempts == 0
+        ]
+        if not unestimated:
+            return
+        deadline = max(unestimated) + timedelta(seconds=self.size_estimate_wait_seconds)
+        timeout = (deadline - datetime.now()).total_seconds()
+        if timeout <= 0:
+            return
+        await asyncio.wait(list(self._estimate_tasks), timeout=timeout)
+
+    async def _estimate_export_size(self, pending: PendingExport):
+        try:
+            pending.estimated_size = await self.export_adapter.estimate_table_size(
+                pending.table
+            )
+        except Exception as e:
+            self.logger.debug(f"could not estimate size of {pending.table}: {e}")
+
+    def _record_export_wait(self, wait: timedelta):
+        seconds = wait.total_seconds()
+        self._total_wait_seconds += seconds
+        self._waited_exports_count += 1
+        self._max_wait_seconds = max(self._max_wait_seconds, seconds)
+
+    def _record_export_duration(self, duration: timedelta):
+        seconds = duration.total_seconds()
+        self._total_export_seconds += seconds
+        self._timed_exports_count += 1
+        self._max_export_seconds = max(self._max_export_seconds, seconds)
+
+    def stats(self) -> CacheExportStats:
+        return CacheExportStats(
+            queue_depth=len(self._pending_exports) + self.export_queue.qsize(),
+            in_flight=len(self._in_flight_exports),
+            max_in_flight=self.max_concurrent_exports,
+            completed=self._completed_exports_count,
+            failed=self._failed_exports_count,
+            retried=self._retried_exports_count,
+            average_wait_seconds=(
+                self._total_wait_seconds / self._waited_exports_count
+                if self._waited_exports_count
+                else 0.0
+            ),
+            max_wait_seconds=self._max_wait_seconds,
+            average_export_seconds=(
+                self._total_export_seconds / self._timed_exports_count
+                if self._timed_exports_count
+                else 0.0
+            ),
+            max_export_seconds=self._max_export_seconds,
+        )
 
     async def add_export_table_reference(
         self, table: str, execution_time: datetime, export_reference: ExportReference
@@ -378,62 +1062,257 @@ class CacheExportManager:
     async def add_export_table_references(
         self, table_map: t.Dict[str, ExportReference]
     ):
-        async with self.exported_map_lock:
-            self.exported_map.update(table_map)
+        for export_table_key, export_reference in table_map.items():
+            table = export_table_key.split("::", 1)[0]
+            await self._store_export_reference(
+                export_table_key, table, export_reference
+            )
 
     async def inspect_export_table_references(self):
         async with self.exported_map_lock:
-            return copy.deepcopy(self.exported_map)
+            entries = await self.index.entries()
+        return {entry.key: entry.export_reference for entry in entries}
 
     def export_table_key(self, table: str, execution_time: datetime):
         return f"{table}::{execution_time.isoformat()}"
 
+    def fingerprint_table_key(self, table: str, fingerprint: str):
+        return f"{table}::fingerprint::{fingerprint}"
+
+    def slice_table_key(self, export_table_key: str, time_range: ExportTimeRange):
+        """The cache key for partial exports of a table. Partial exports are
+        keyed by the filtered column so that they can be extended"""
+        return f"{export_table_key}::slice::{time_range.column}"
+
+    def columns_table_key(self, export_table_key: str):
+        """The cache key for exports of only some of the columns of a table.
+        Requests for different columns share the export"""
+        return f"{export_table_key}::columns"
+
+    def replaced_table_key(self, export_table_key: str):
+        """A unique key for an export that was replaced by an export with
+        more columns. It's only kept until it's evicted"""
+        return f"{export_table_key}::replaced::{uuid.uuid4().hex}"
+
+    async def resolve_export_table_key(self, table: str, execution_time: datetime):
+        """Resolves the cache key for a table. If fingerprinting is enabled and
+        the adapter can fingerprint the table, the key is content addressed.
+        Otherwise we fall back to the execution time to ensure that multiple
+        runs don't use stale data accidentally."""
+        if self.use_table_fingerprints:
+            fingerprint = await self.export_adapter.fingerprint_table(table)
+            if fingerprint:
+                return self.fingerprint_table_key(table, fingerprint)
+        return self.export_table_key(table, execution_time)
+
     async def get_export_table_reference(self, table: str, execution_time: datetime):
-        export_table_key = self.export_table_key(table, execution_time)
+        export_table_key = await self.resolve_export_table_key(table, execution_time)
+        return await self._get_export_reference_by_key(export_table_key)
 
+    async def _get_export_reference_by_key(self, export_table_key: str):
         async with self.exported_map_lock:
-            reference = self.exported_map.get(export_table_key)
-            if not reference:
+            entry = await self.index.get(export_table_key)
+            if not entry:
                 return None
-            return copy.deepcopy(reference)
+            await self.index.touch(export_table_key, datetime.now())
+            return entry.export_reference
+
+    async def _store_export_reference(
+        self, export_table_key: str, table: str, export_reference: ExportReference
+    ):
+        now = datetime.now()
+        async with self.exported_map_lock:
+            await self.index.put(
+                CacheIndexEntry(
+                    key=export_table_key,
+                    table=table,
+                    export_reference=export_reference,
+                    created_at=now,
+                    last_accessed_at=now,
+                )
+            )
 
-    async def _export_table_for_cache(self, table: str, execution_time: datetime):
+    async def evict(self, now: t.Optional[datetime] = None):
+        """Evicts any entries selected by the eviction policy and cleans up the
+        exported data for those entries"""
+        now = now or datetime.now()
+        async with self.exported_map_lock:
+            entries = await self.index.entries()
+            evictions = [
+                entry
+                for entry in self.eviction_policy.select_evictions(entries, now)
+                if not self.is_export_pinned(entry.export_reference)
+            ]
+            for entry in evictions:
+                await self.index.remove(entry.key)
+
+        for entry in evictions:
+            self.logger.info(f"evicting cached export {entry.key}")
+            try:
+                await self.export_adapter.clean_export_table(entry.export_reference)
+            except Exception as e:
+                self.logger.error(f"failed to clean evicted export {entry.key}: {e}")
+        return evictions
+
+    def pin_export_references(self, export_references: t.Iterable[ExportReference]):
+        """Keeps the exports from being evicted while a job reads them. Pins
+        are counted, so an export that several jobs read stays pinned until
+        all of them have unpinned it."""
+        for export_reference in export_references:
+            key = self.export_pin_key(export_reference)
+            self._pinned_exports[key] = self._pinned_exports.get(key, 0) + 1
+
+    def unpin_export_references(self, export_references: t.Iterable[ExportReference]):
+        for export_reference in export_references:
+            key = self.export_pin_key(export_reference)
+            count = self._pinned_exports.get(key, 0) - 1
+            if count > 0:
+                self._pinned_exports[key] = count
+            else:
+                self._pinned_exports.pop(key, None)
+
+    def is_export_pinned(self, export_reference: ExportReference) -> bool:
+        return self.export_pin_key(export_reference) in self._pinned_exports
+
+    @staticmethod
+    def export_pin_key(export_reference: ExportReference) -> str:
+        """Identifies the exported data of a reference. Other exports of the
+        same source table, e.g. older or replaced ones, have different keys and
+        can still be evicted while this one is pinned."""
+        export_table_name = export_reference.source_metadata.get("export_table_name")
+        if export_table_name:
+            return export_table_name
+        gcs_path = export_reference.payload.get("gcs_path")
+        if gcs_path:
+            return gcs_path
+        return export_reference.table_fqn()
+
+    async def _evict_safely(self):
+        try:
+            await self.evict()
+        except Exception as e:
+            self.logger.error(f"failed to evict cached exports: {e}")
+
+    async def _export_table_for_cache(
+        self,
+        table: str,
+        execution_time: datetime,
+        time_range: t.Optional[ExportTimeRange] = None,
+        existing_reference: t.Optional[ExportReference] = None,
+        columns: t.Optional[t.List[str]] = None,
+    ):
         """Triggers an export of a table to a cache location in GCS. This does
         this by using the Hive catalog in trino to create a new table with the
         same schema as the original table, but with a different name. This new
-        table is then used as the cache location for the original table."""
+        table is then used as the cache location for the original table.
+
+        If a time range is given, only that range is exported. If a partial
+        export of the table already exists, it is extended instead. If
+        columns are given, only those are exported. Columns can't be added to
+        an existing export so it's replaced by an export of the columns of
+        both."""
 
-        export_reference = await self.export_adapter.export_table(table, execution_time)
+        if existing_reference is not None and not existing_reference.covers_columns(
+            columns
+        ):
+            columns = merge_columns(existing_reference.selected_columns, columns)
+            if time_range is not None and existing_reference.time_range is not None:
+                time_range = existing_reference.time_range.union(time_range)
+            existing_reference = None
+
+        if time_range is None:
+            export_reference = await self.export_adapter.export_table(
+                table, execution_time, columns
+            )
+        elif existing_reference is not None and existing_reference.time_range:
+            export_reference = await self.export_adapter.extend_export_table_slice(
+                existing_reference, time_range
+            )
+        else:
+            export_reference = await self.export_adapter.export_table_slice(
+                table, execution_time, time_range, columns
+            )
         self.logger.info(f"exported table: {table} -> {export_reference}")
         return export_reference
 
+    async def row_counts_by_day(
+        self, export_reference: ExportReference
+    ) -> t.Dict[date, int]:
+        """The number of exported rows per day of a partial export. Empty if
+        they cannot be determined."""
+        try:
+            return await self.export_adapter.row_counts_by_day(export_reference)
+        except Exception as e:
+            self.logger.debug(
+                f"could not count rows of {export_reference.table_fqn()}: {e}"
+            )
+            return {}
+
     async def resolve_export_references(
-        self, tables: t.List[str], execution_time: datetime
+        self,
+        tables: t.List[str],
+        execution_time: datetime,
+        time_ranges: t.Optional[t.Dict[str, ExportTimeRange]] = None,
+        columns: t.Optional[t.Dict[str, t.List[str]]] = None,
     ):
         """Resolves any required export table references or queues up a list of
         tables to be exported to a cache location. Once ready, the map of tables
-        is resolved."""
+        is resolved.
+
+        Tables in `time_ranges` only need to be exported for the given range.
+        Tables in `columns` only need to be exported with the given columns. A
+        full export of such a table is used if one exists."""
         future: asyncio.Future[t.Dict[str, ExportReference]] = (
             asyncio.get_event_loop().create_future()
         )
+        time_ranges = time_ranges or {}
+        columns = columns or {}
 
-        # The tables to export should be unique combinations of the table name
-        # and execution time. This ensures that multiple runs don't use stale
-        # data accidentally.
-        tables_to_export = set(tables)
+        # Ensure we are only comparing unique tables
+        unique_tables = list(set(tables))
+        export_table_keys = dict(
+            zip(
+                unique_tables,
+                await asyncio.gather(
+                    *[
+                        self.resolve_export_table_key(table, execution_time)
+                        for table in unique_tables
+                    ]
+                ),
+            )
+        )
+
+        tables_to_export = set(unique_tables)
         registration = None
         export_map: t.Dict[str, ExportReference] = {}
 
-        # Ensure we are only comparing unique tables
-        for table in set(tables):
-            reference = await self.get_export_table_reference(table, execution_time)
-            if reference is not None:
-                export_map[table] = reference
-                tables_to_export.remove(table)
+        for table, export_table_key in list(export_table_keys.items()):
+            time_range = time_ranges.get(table)
+            table_columns = columns.get(table)
+            # From the most to the least complete export. The last key is
+            # used if the table has to be exported.
+            candidate_keys = [export_table_key]
+            if table_columns is not None:
+                candidate_keys.append(self.columns_table_key(export_table_key))
+            if time_range is not None:
+                slice_key = self.slice_table_key(export_table_key, time_range)
+                candidate_keys.append(slice_key)
+                if table_columns is not None:
+                    candidate_keys.append(self.columns_table_key(slice_key))
+            export_table_keys[table] = candidate_keys[-1]
+
+            for candidate_key in candidate_keys:
+                reference = await self._get_export_reference_by_key(candidate_key)
+                if reference is not None and reference.covers(
+                    time_range, table_columns
+                ):
+                    export_map[table] = reference
+                    tables_to_export.remove(table)
+                    break
         if len(tables_to_export) == 0:
             return export_map
         pending_export_table_keys = set(
-            [self.export_table_key(table, execution_time) for table in tables_to_export]
+            [export_table_keys[table] for table in tables_to_export]
         )
 
         self.logger.debug(f"Unknown tables to export: {tables_to_export}")
@@ -454,9 +1333,7 @@ class CacheExportManager:
                 raise RuntimeError("export_reference or error must be provided")
 
             # If there was an error send it back to the listener
-            self.logger.info(
-                f"exported table update received: {table}::{execution_time}"
-            )
+            self.logger.info(f"exported table update received: {export_table_key}")
             self.logger.debug(
                 f"Checking pending export table keys: {pending_export_table_keys}"
             )
@@ -472,12 +1349,15 @@ class CacheExportManager:
                         assert error is not None
                         future.set_exception(error)
                         return
+                    # An export of a smaller range of the table completed.
+                    # The export for the requested range is still queued.
+                    if not export_reference.covers(
+                        time_ranges.get(table), columns.get(table)
+                    ):
+                        return
                     pending_export_table_keys.remove(export_table_key)
                     export_map[table] = export_reference
                     self.logger.debug(f"updating export map: {export_map}")
-                    await self.add_export_table_reference(
-                        table, execution_time, export_reference
-                    )
                     # Stop listening if we have all the tables
                     if len(pending_export_table_keys) == 0:
                         self.logger.debug(f"all tables exported {export_map}")
@@ -493,6 +1373,13 @@ class CacheExportManager:
         for table in tables_to_export:
             self.logger.info(f"queueing table for export: {table}")
             self.export_queue.put_nowait(
-                ExportCacheQueueItem(table=table, execution_time=execution_time)
+                ExportCacheQueueItem(
+                    table=table,
+                    execution_time=execution_time,
+                    cache_key=export_table_keys[table],
+                    time_range=time_ranges.get(table),
+                    columns=columns.get(table),
+                )
             )
+        self._scheduler_wakeup.set()
         return await future
@@ -0,0 +1,223 @@
+"""Index of exported tables used by the cache export manager.
+
+The index maps a cache key to the export reference that was produced for it.
+The cache key is either a content fingerprint of the source table (for trino
+this is the latest iceberg snapshot id) or the table name and the execution
+time if no fingerprint could be resolved. Keeping this index in a durable
+location allows the metrics calculation service to reuse exports across
+restarts instead of exporting every dependency again.
+"""
+
+import abc
+import asyncio
+import logging
+import typing as t
+from datetime import datetime, timedelta
+
+import duckdb
+from pydantic import BaseModel
+
+from .types import ExportReference
+
+logger = logging.getLogger(__name__)
+
+
+class CacheIndexEntry(BaseModel):
+    key: str
+    table: str
+    export_reference: ExportReference
+    created_at: datetime
+    last_accessed_at: datetime
+
+
+class CacheEvictionPolicy(BaseModel):
+    """Determines which entries of the index should be evicted.
+
+    Entries that have not been accessed within `ttl_seconds` are evicted
+    first. If there are still more than `max_entries` left, the least recently
+    used entries are evicted until the index is within bounds. A value of 0
+    disables the respective check.
+    """
+
+    ttl_seconds: int = 0
+    max_entries: int = 0
+
+    def select_evictions(
+        self, entries: t.List[CacheIndexEntry], now: datetime
+    ) -> t.List[CacheIndexEntry]:
+        evictions: t.List[CacheIndexEntry] = []
+        remaining: t.List[CacheIndexEntry] = []
+
+        for entry in entries:
+            if self.ttl_seconds > 0 and now - entry.last_accessed_at > timedelta(
+                seconds=self.ttl_seconds
+            ):
+                evictions.append(entry)
+            else:
+                remaining.append(entry)
+
+        if self.max_entries > 0 and len(remaining) > self.max_entries:
+            remaining.sort(key=lambda entry: entry.last_accessed_at)
+            overflow = len(remaining) - self.max_entries
+            evictions.extend(remaining[:overflow])
+        return evictions
+
+
+class ExportCacheIndex(abc.ABC):
+    async def get(self, key: str) -> t.Optional[CacheIndexEntry]:
+        raise NotImplementedError()
+
+    async def put(self, entry: CacheIndexEntry):
+        raise NotImplementedError()
+
+    async def touch(self, key: str, accessed_at: datetime):
+        raise NotImplementedError()
+
+    async def remove(self, key: str):
+        raise NotImplementedError()
+
+    async def entries(self) -> t.List[CacheIndexEntry]:
+        raise NotImplementedError()
+
+    async def close(self):
+        return
+
+
+class InMemoryExportCacheIndex(ExportCacheIndex):
+    """An index that only lives as long as the process. This is the default
+    and is mostly useful for testing"""
+
+    def __init__(self):
+        self._entries: t.Dict[str, CacheIndexEntry] = {}
+
+    async def get(self, key: str):
+        entry = self._entries.get(key)
+        if not entry:
+            return None
+        return entry.model_copy(deep=True)
+
+    async def put(self, entry: CacheIndexEntry):
+        self._entries[entry.key] = entry.model_copy(deep=True)
+
+    async def touch(self, key: str, accessed_at: datetime):
+        entry = self._entries.get(key)
+        if entry:
+            entry.last_accessed_at = accessed_at
+
+    async def remove(self, key: str):
+        self._entries.pop(key, None)
+
+    async def entries(self):
+        return [entry.model_copy(deep=True) for entry in self._entries.values()]
+
+
+class DuckDBExportCacheIndex(ExportCacheIndex):
+    """An index stored in a local duckdb file so that it survives restarts of
+    the metrics calculation service.
+
+    All duckdb calls are executed in a thread so that they don't block the
+    event loop. Access is serialized as a single duckdb connection is not safe
+    to use concurrently.
+    """
+
+    def __init__(
+        self,
+        path: str,
+        table_name: str = "export_cache_index",
+        log_override: t.Optional[logging.Logger] = None,
+    ):
+        self.path = path
+        self.table_name = table_name
+        self.logger = log_override or logger
+        self._conn: t.Optional[duckdb.DuckDBPyConnection] = None
+        self._lock = asyncio.Lock()
+
+    def _connection(self):
+        if self._conn is None:
+            self.logger.info(f"opening export cache index at {self.path}")
+            self._conn = duckdb.connect(self.path)
+            self._conn.execute(
+                f"""
+                CREATE TABLE IF NOT EXISTS {self.table_name} (
+                    key VARCHAR PRIMARY KEY,
+                    table_name VARCHAR,
+                    export_reference VARCHAR,
+                    created_at TIMESTAMP,
+                    last_accessed_at TIMESTAMP
+                )
+                """
+            )
+        return self._conn
+
+    async def _run[T](self, f: t.Callable[[duckdb.DuckDBPyConnection], T]) -> T:
+        async with self._lock:
+            return await asyncio.to_thread(lambda: f(self._connection()))
+
+    def _row_to_entry(self, row: t.Tuple[t.Any, ...]) -> CacheIndexEntry:
+        return CacheIndexEntry(
+            key=row[0],
+            table=row[1],
+            export_reference=ExportReference.model_validate_json(row[2]),
+            created_at=row[3],
+            last_accessed_at=row[4],
+        )
+
+    async def get(self, key: str):
+        row = await self._run(
+            lambda conn: conn.execute(
+                f"""
+                SELECT key, table_name, export_reference, created_at, last_accessed_at
+                FROM {self.table_name} WHERE key = ?
+                """,
+                [key],
+            ).fetchone()
+        )
+        if not row:
+            return None
+        return self._row_to_entry(row)
+
+    async def put(self, entry: CacheIndexEntry):
+        await self._run(
+            lambda conn: conn.execute(
+                f"INSERT OR REPLACE INTO {self.table_name} VALUES (?, ?, ?, ?, ?)",
+                [
+                    entry.key,
+                    entry.table,
+                    entry.export_reference.model_dump_json(),
+                    entry.created_at,
+                    entry.last_accessed_at,
+                ],
+            )
+        )
+
+    async def touch(self, key: str, accessed_at: datetime):
+        await self._run(
+            lambda conn: conn.execute(
+                f"UPDATE {self.table_name} SET last_accessed_at = ? WHERE key = ?",
+                [accessed_at, key],
+            )
+        )
+
+    async def remove(self, key: str):
+        await self._run(
+            lambda conn: conn.execute(
+                f"DELETE FROM {self.table_name} WHERE key = ?", [key]
+            )
+        )
+
+    async def entries(self):
+        rows = await self._run(
+            lambda conn: conn.execute(
+                f"""
+                SELECT key, table_name, export_reference, created_at, last_accessed_at
+                FROM {self.table_name}
+                """
+            ).fetchall()
+        )
+        return [self._row_to_entry(row) for row in rows]
+
+    async def close(self):
+        async with self._lock:
+            if self._conn is not None:
+                self._conn.close()
+                self._conn = None
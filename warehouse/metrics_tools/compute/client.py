@@ -1,28 +1,36 @@
 """Metrics Calculation Service Client"""
 
+import asyncio
 import logging
+import threading
 import time
 import typing as t
-from contextlib import contextmanager
+from contextlib import asynccontextmanager, contextmanager
 from datetime import datetime
 from urllib.parse import urljoin
 
 import httpx
 from metrics_tools.compute.types import (
+    CacheExportStatsResponse,
     ClusterStartRequest,
     ClusterStatus,
     EmptyResponse,
     ExportedTableLoadRequest,
     ExportReference,
     InspectCacheResponse,
+    JobStatusErrorResponse,
     JobStatusResponse,
+    JobStatusStreamMessage,
+    JobStatusSubscribeRequest,
     JobSubmitRequest,
     JobSubmitResponse,
     QueryJobStatus,
 )
 from metrics_tools.definition import PeerMetricDependencyRef
-from pydantic import BaseModel
+from pydantic import BaseModel, TypeAdapter
 from pydantic_core import to_jsonable_python
+from websockets.asyncio.client import ClientConnection as AsyncConnection
+from websockets.asyncio.client import connect as async_connect
 from websockets.sync.client import connect
 from websockets.sync.connection import Connection
 
@@ -66,6 +74,24 @@ class ClientRetriesExceeded(Exception):
     pass
 
 
+def raise_unless_retryable(logger: logging.Logger, e: httpx.HTTPError):
+    """Logs a failed request and reraises the error if it can't be retried"""
+    if isinstance(e, httpx.NetworkError):
+        logger.error(f"Failed request with network error, {e}")
+    elif isinstance(e, httpx.TimeoutException):
+        logger.error(f"Failed request with timeout, {e}")
+    elif isinstance(e, httpx.HTTPStatusError):
+        logger.error(f"Failed request with response code: {e.response.status_code}")
+        if e.response.status_code >= 500:
+            logger.debug("server error, retrying")
+        elif e.response.status_code == 408:
+            logger.debug("request timeout, retrying")
+        else:
+            raise e
+    else:
+        raise e
+
+
 @contextmanager
 def default_ws(*, base_url: str, path: str):
     url = urljoin(base_url, path)
@@ -323,6 +349,10 @@ class Client:
         """Inspect the cached export tables for the service"""
         return self.service_get(InspectCacheResponse, "/cache/inspect")
 
+    def cache_stats(self):
+        """Get the export queue statistics for the service"""
+        return self.service_get(CacheExportStatsResponse, "/cache/stats")
+
     def service_request[
         T
     ](
@@ -346,20 +376,12 @@ class Client:
                     response = make_request()
                     response.raise_for_status()
                     return response
-                except httpx.NetworkError as e:
-                    self.logger.error(f"Failed request with network error, {e}")
-                except httpx.TimeoutException as e:
-                    self.logger.error(f"Failed request with timeout, {e}")
-                except httpx.HTTPStatusError as e:
-                    self.logger.error(
-                        f"Failed request with response code: {e.response.status_code}"
-                    )
-                    if e.response.status_code >= 500:
-                        self.logger.debug("server error, retrying")
-                    elif e.response.status_code == 408:
-                        self.logger.debug("request timeout, retrying")
-                    else:
-                        raise e
+                except (
+                    httpx.NetworkError,
+                    httpx.TimeoutException,
+                    httpx.HTTPStatusError,
+                ) as e:
+                    raise_unless_retryable(self.logger, e)
                 time.sleep(2**i)  # Exponential backoff
             raise ClientRetriesExceeded("Request failed after too many retries")
 
@@ -398,3 +420,533 @@ class Client:
             path,
             params=params,
         )
+
+
+class BaseAsyncWebsocketConnector:
+    async def receive(self) -> str:
+        raise NotImplementedError()
+
+    async def send(self, data: str):
+        raise NotImplementedError()
+
+
+class AsyncWebsocketConnectFactory(t.Protocol):
+    def __call__(
+        self, *, base_url: str, path: str
+    ) -> t.AsyncContextManager[BaseAsyncWebsocketConnector]: ...
+
+
+class AsyncWebsocketsConnector(BaseAsyncWebsocketConnector):
+    def __init__(self, connection: AsyncConnection):
+        self.connection = connection
+
+    async def receive(self):
+        data = await self.connection.recv()
+        if isinstance(data, str):
+            return data
+        else:
+            return data.decode()
+
+    async def send(self, data: str):
+        return await self.connection.send(data)
+
+
+@asynccontextmanager
+async def default_async_ws(*, base_url: str, path: str):
+    url = urljoin(base_url, path)
+    async with async_connect(url) as ws:
+        yield AsyncWebsocketsConnector(ws)
+
+
+JobStatusHandler = t.Callable[[JobStatusResponse], None]
+
+JOB_STATUS_STREAM_MESSAGE = TypeAdapter(JobStatusStreamMessage)
+
+
+class JobStatusStream:
+    """Receives the status updates of many jobs over a single websocket.
+
+    The websocket is opened by the first wait and is reopened if it fails
+    while jobs are being waited on. The service sends the current status of a
+    job when it's subscribed to, so no final status is missed on reconnect.
+    """
+
+    def __init__(
+        self,
+        base_url: str,
+        websocket_connect_factory: AsyncWebsocketConnectFactory,
+        retries: int,
+        log_override: t.Optional[logging.Logger] = None,
+    ):
+        self.base_url = base_url
+        self.websocket_connect_factory = websocket_connect_factory
+        self.retries = retries
+        self.logger = log_override or logger
+        self._waiters: t.Dict[
+            str, t.List[t.Tuple[asyncio.Future[JobStatusResponse], JobStatusHandler]]
+        ] = {}
+        self._connection: t.Optional[BaseAsyncWebsocketConnector] = None
+        self._reader: t.Optional[asyncio.Task] = None
+
+    async def wait(
+        self, job_id: str, progress_handler: JobStatusHandler
+    ) -> JobStatusResponse:
+        """Waits for the final status of a job. The progress handler is
+        called with every other status that is received."""
+        future: asyncio.Future[JobStatusResponse] = (
+            asyncio.get_running_loop().create_future()
+        )
+        waiter = (future, progress_handler)
+        self._waiters.setdefault(job_id, []).append(waiter)
+        try:
+            if self._reader is None or self._reader.done():
+                self._reader = asyncio.create_task(self._read())
+            elif self._connection is not None:
+                try:
+                    await self._subscribe(self._connection, [job_id])
+                except Exception as e:
+                    # The reader subscribes again once it has reconnected
+                    self.logger.debug(f"failed to subscribe to job[{job_id}]: {e}")
+            return await future
+        finally:
+            waiters = self._waiters.get(job_id, [])
+            waiters.remove(waiter)
+            if not waiters:
+                self._waiters.pop(job_id, None)
+
+    async def close(self):
+        if self._reader is not None:
+            self._reader.cancel()
+            try:
+                await self._reader
+            except asyncio.CancelledError:
+                pass
+            self._reader = None
+
+    async def _subscribe(
+        self, connection: BaseAsyncWebsocketConnector, job_ids: t.List[str]
+    ):
+        await connection.send(
+            JobStatusSubscribeRequest(job_ids=job_ids).model_dump_json()
+        )
+
+    async def _read(self):
+        failures = 0
+        while self._waiters:
+            try:
+                async with self.websocket_connect_factory(
+                    base_url=self.base_url, path="/job/status/ws"
+                ) as connection:
+                    self._connection = connection
+                    await self._subscribe(connection, list(self._waiters.keys()))
+                    failures = 0
+                    # The connection is kept open for later jobs
+                    while True:
+                        self._dispatch(await connection.receive())
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                failures += 1
+                self.logger.error(f"Job status stream failed, {e}")
+                if failures > self.retries:
+                    self._fail_all(
+                        ClientRetriesExceeded("Job status stream failed too many times")
+                    )
+                    return
+                await asyncio.sleep(2 ** (failures - 1))  # Exponential backoff
+            finally:
+                self._connection = None
+
+    def _dispatch(self, raw_message: str):
+        message = JOB_STATUS_STREAM_MESSAGE.validate_json(raw_message)
+        waiters = list(self._waiters.get(message.job_id, []))
+        if isinstance(message, JobStatusErrorResponse):
+            for future, _ in waiters:
+                if not future.done():
+                    future.set_exception(ValueError(message.error))
+            return
+        for future, progress_handler in waiters:
+            if message.status in [QueryJobStatus.PENDING, QueryJobStatus.RUNNING]:
+                progress_handler(message)
+            elif not future.done():
+                future.set_result(message)
+
+    def _fail_all(self, exception: Exception):
+        for waiters in self._waiters.values():
+            for future, _ in waiters:
+                if not future.done():
+                    future.set_exception(exception)
+
+
+class AsyncClient:
+    """An asyncio metrics calculation service client
+
+    All requests share one pooled http client and the status of every job is
+    received over one websocket. This allows many jobs to be in flight at the
+    same time.
+    """
+
+    client: httpx.AsyncClient
+    logger: logging.Logger
+
+    @classmethod
+    def from_url(
+        cls,
+        url: str,
+        retries: int = 5,
+        log_override: t.Optional[logging.Logger] = None,
+    ):
+        """Create a client from a base url
+
+        Args:
+            url (str): The base url
+            retries (int): The number of retries the client should attempt when connecting
+            log_override (t.Optional[logging.Logger]): An optional logger override
+
+        Returns:
+            AsyncClient: The client instance
+        """
+        return cls(
+            httpx.AsyncClient(base_url=url),
+            retries,
+            default_async_ws,
+            log_override=log_override,
+        )
+
+    def __init__(
+        self,
+        client: httpx.AsyncClient,
+        retries: int,
+        websocket_connect_factory: AsyncWebsocketConnectFactory,
+        log_override: t.Optional[logging.Logger] = None,
+    ):
+        self.client = client
+        self.retries = retries
+        self.logger = log_override or logger
+        self.status_stream = JobStatusStream(
+            f"{client.base_url.copy_with(scheme="ws")}",
+            websocket_connect_factory,
+            retries,
+            log_override=self.logger,
+        )
+        self._cluster_starts: t.Dict[t.Tuple[int, int], asyncio.Task] = {}
+
+    async def __aenter__(self):
+        return self
+
+    async def __aexit__(self, *exc):
+        await self.close()
+
+    async def close(self):
+        await self.status_stream.close()
+        await self.client.aclose()
+
+    async def calculate_metrics(
+        self,
+        *,
+        query_str: str,
+        start: datetime,
+        end: datetime,
+        dialect: str,
+        batch_size: int,
+        columns: t.List[t.Tuple[str, str]],
+        ref: PeerMetricDependencyRef,
+        locals: t.Dict[str, t.Any],
+        dependent_tables_map: t.Dict[str, str],
+        slots: int,
+        progress_handler: t.Optional[JobStatusHandler] = None,
+        cluster_min_size: int = 6,
+        cluster_max_size: int = 6,
+        job_retries: int = 3,
+        do_not_raise_on_failure: bool = False,
+        execution_time: t.Optional[datetime] = None,
+    ) -> t.Optional[ExportReference]:
+        """Calculate metrics for a given period. See `Client.calculate_metrics`"""
+        request = JobSubmitRequest(
+            query_str=query_str,
+            start=start,
+            end=end,
+            dialect=dialect,
+            batch_size=batch_size,
+            columns=columns,
+            ref=ref,
+            locals=locals,
+            dependent_tables_map=dependent_tables_map,
+            slots=slots,
+            retries=job_retries,
+            execution_time=execution_time or datetime.now(),
+        )
+        references = await self.calculate_metrics_batch(
+            [request],
+            progress_handler=progress_handler,
+            cluster_min_size=cluster_min_size,
+            cluster_max_size=cluster_max_size,
+            do_not_raise_on_failure=do_not_raise_on_failure,
+        )
+        return references[0]
+
+    async def calculate_metrics_batch(
+        self,
+        requests: t.List[JobSubmitRequest],
+        progress_handler: t.Optional[JobStatusHandler] = None,
+        cluster_min_size: int = 6,
+        cluster_max_size: int = 6,
+        do_not_raise_on_failure: bool = False,
+    ) -> t.List[t.Optional[ExportReference]]:
+        """Calculate the metrics of many jobs at once. The cluster is started
+        while the jobs are submitted and all of the jobs are waited on
+        together.
+
+        Args:
+            requests (t.List[JobSubmitRequest]): The jobs to submit
+            progress_handler (t.Optional[JobStatusHandler]): Called with the
+                progress of every job
+            cluster_min_size (int): The minimum size of the cluster
+            cluster_max_size (int): The maximum size of the cluster
+            do_not_raise_on_failure (bool): If true, failed jobs are logged and
+                their export reference is None instead of raising an exception.
+
+        Returns:
+            t.List[t.Optional[ExportReference]]: The export reference of each
+                request in the same order
+        """
+        status, job_responses = await asyncio.gather(
+            self.start_cluster(min_size=cluster_min_size, max_size=cluster_max_size),
+            self.submit_jobs(requests),
+        )
+        self.logger.info(f"cluster status: {status}")
+
+        if not progress_handler:
+
+            def _handler(response: JobStatusResponse):
+                self.logger.info(
+                    f"job[{response.job_id}] status: {response.status}, progress: {response.progress}"
+                )
+
+            progress_handler = _handler
+
+        final_statuses = await self.wait_for_jobs(
+            [job_response.job_id for job_response in job_responses], progress_handler
+        )
+
+        references: t.List[t.Optional[ExportReference]] = []
+        failed_job_ids: t.List[str] = []
+        for request, job_response in zip(requests, job_responses):
+            job_id = job_response.job_id
+            final_status = final_statuses[job_id]
+            if final_status.status != QueryJobStatus.FAILED:
+                self.logger.info(
+                    f"job[{job_id}] completed with status {final_status.status}"
+                )
+                references.append(job_response.export_reference)
+                continue
+
+            self.logger.error(f"job[{job_id}] failed with status {final_status.status}")
+            for exc in final_status.exceptions:
+                self.logger.error(f"job[{job_id}] failed with exception {exc}")
+            self.logger.error(
+                f"""
+                job[{job_id}] failed. To restate use the following parameters: 
+                `--restate-model {request.ref['name']} --start {request.start} --end {request.end}`
+            """
+            )
+            failed_job_ids.append(job_id)
+            references.append(None)
+
+        if failed_job_ids and not do_not_raise_on_failure:
+            raise Exception(f"jobs {failed_job_ids} failed")
+        return references
+
+    async def start_cluster(self, min_size: int, max_size: int) -> ClusterStatus:
+        """Start a compute cluster with the given min and max size. Concurrent
+        calls share a single request."""
+        key = (min_size, max_size)
+        task = self._cluster_starts.get(key)
+        if task is None:
+            request = ClusterStartRequest(min_size=min_size, max_size=max_size)
+            task = asyncio.create_task(
+                self.service_post_with_input(ClusterStatus, "/cluster/start", request)
+            )
+            task.add_done_callback(lambda _: self._cluster_starts.pop(key, None))
+            self._cluster_starts[key] = task
+        return await asyncio.shield(task)
+
+    async def submit_job(
+        self,
+        *,
+        query_str: str,
+        start: datetime,
+        end: datetime,
+        dialect: str,
+        batch_size: int,
+        columns: t.List[t.Tuple[str, str]],
+        ref: PeerMetricDependencyRef,
+        locals: t.Dict[str, t.Any],
+        dependent_tables_map: t.Dict[str, str],
+        slots: int,
+        job_retries: t.Optional[int] = None,
+        execution_time: t.Optional[datetime] = None,
+    ) -> JobSubmitResponse:
+        """Submit a job to the metrics calculation service. See
+        `Client.submit_job`"""
+        request = JobSubmitRequest(
+            query_str=query_str,
+            start=start,
+            end=end,
+            dialect=dialect,
+            batch_size=batch_size,
+            columns=columns,
+            ref=ref,
+            locals=locals,
+            dependent_tables_map=dependent_tables_map,
+            slots=slots,
+            retries=job_retries,
+            execution_time=execution_time or datetime.now(),
+        )
+        return await self.service_post_with_input(
+            JobSubmitResponse, "/job/submit", request
+        )
+
+    async def submit_jobs(
+        self, requests: t.List[JobSubmitRequest]
+    ) -> t.List[JobSubmitResponse]:
+        """Submit many jobs concurrently"""
+        return list(
+            await asyncio.gather(
+                *[
+                    self.service_post_with_input(
+                        JobSubmitResponse, "/job/submit", request
+                    )
+                    for request in requests
+                ]
+            )
+        )
+
+    async def wait_for_job(
+        self, job_id: str, progress_handler: JobStatusHandler
+    ) -> JobStatusResponse:
+        """Wait for the final status of a job"""
+        return await self.status_stream.wait(job_id, progress_handler)
+
+    async def wait_for_jobs(
+        self, job_ids: t.List[str], progress_handler: JobStatusHandler
+    ) -> t.Dict[str, JobStatusResponse]:
+        """Wait for the final status of many jobs"""
+        responses = await asyncio.gather(
+            *[self.status_stream.wait(job_id, progress_handler) for job_id in job_ids]
+        )
+        return dict(zip(job_ids, responses))
+
+    async def get_job_status(self, job_id: str):
+        """Get the status of a job"""
+        return await self.service_get(JobStatusResponse, f"/job/status/{job_id}")
+
+    async def service_request[
+        T
+    ](
+        self,
+        method: str,
+        factory: ResponseObject[T],
+        path: str,
+        client_retries: t.Optional[int] = None,
+        **kwargs,
+    ) -> T:
+        retries = client_retries or self.retries
+        for i in range(retries):
+            try:
+                response = await self.client.request(method, path, **kwargs)
+                response.raise_for_status()
+                return factory.model_validate(response.json())
+            except (
+                httpx.NetworkError,
+                httpx.TimeoutException,
+                httpx.HTTPStatusError,
+            ) as e:
+                raise_unless_retryable(self.logger, e)
+            await asyncio.sleep(2**i)  # Exponential backoff
+        raise ClientRetriesExceeded("Request failed after too many retries")
+
+    async def service_post_with_input[
+        T
+    ](
+        self,
+        factory: ResponseObject[T],
+        path: str,
+        input: BaseModel,
+        params: t.Optional[t.Dict[str, t.Any]] = None,
+    ) -> T:
+        return await self.service_request(
+            "POST",
+            factory,
+            path,
+            json=to_jsonable_python(input),
+            params=params,
+        )
+
+    async def service_get[
+        T
+    ](
+        self,
+        factory: ResponseObject[T],
+        path: str,
+        params: t.Optional[t.Dict[str, t.Any]] = None,
+    ) -> T:
+        return await self.service_request(
+            "GET",
+            factory,
+            path,
+            params=params,
+        )
+
+
+class BackgroundClient:
+    """Runs an AsyncClient on an event loop in a background thread. This
+    allows synchronous callers on many threads, like the concurrent model
+    evaluations of sqlmesh, to share its connections and overlap their jobs."""
+
+    def __init__(self, client_factory: t.Callable[[], AsyncClient]):
+        self._loop = asyncio.new_event_loop()
+        self._thread = threading.Thread(
+            target=self._loop.run_forever, name="mcs-client", daemon=True
+        )
+        self._thread.start()
+        self.client = self.run(self._create_client(client_factory))
+
+    @staticmethod
+    async def _create_client(client_factory: t.Callable[[], AsyncClient]):
+        return client_factory()
+
+    def run[
+        T
+    ](self, coro: t.Coroutine[t.Any, t.Any, T]) -> T:
+        return asyncio.run_coroutine_threadsafe(coro, self._loop).result()
+
+    def calculate_metrics(self, **kwargs) -> t.Optional[ExportReference]:
+        """See `AsyncClient.calculate_metrics`"""
+        return self.run(self.client.calculate_metrics(**kwargs))
+
+    def calculate_metrics_batch(
+        self, requests: t.List[JobSubmitRequest], **kwargs
+    ) -> t.List[t.Optional[ExportReference]]:
+        """See `AsyncClient.calculate_metrics_batch`"""
+        return self.run(self.client.calculate_metrics_batch(requests, **kwargs))
+
+    def close(self):
+        self.run(self.client.close())
+        self._loop.call_soon_threadsafe(self._loop.stop)
+        self._thread.join()
+        self._loop.close()
+
+
+_shared_clients: t.Dict[str, BackgroundClient] = {}
+_shared_clients_lock = threading.Lock()
+
+
+def shared_client(url: str, retries: int = 5) -> BackgroundClient:
+    """The process wide client for the service at the given url"""
+    with _shared_clients_lock:
+        if url not in _shared_clients:
+            _shared_clients[url] = BackgroundClient(
+                lambda: AsyncClient.from_url(url, retries=retries)
+            )
+        return _shared_clients[url]
@@ -1,23 +1,35 @@
-"""Sets up a dask cluster
-"""
+"""Sets up a dask cluster"""
 
 import abc
 import asyncio
 import inspect
 import logging
 import typing as t
+import uuid
 
 from dask.distributed import Client
 from dask.distributed import Future as DaskFuture
 from dask.distributed import LocalCluster
 from dask_kubernetes.operator import KubeCluster, make_cluster_spec
-from metrics_tools.compute.types import ClusterConfig, ClusterStatus
+from metrics_tools.compute.result_writer import (
+    DEFAULT_COMPRESSION,
+    DEFAULT_ROW_GROUP_SIZE,
+    DEFAULT_UPLOAD_BLOCK_SIZE,
+)
+from metrics_tools.compute.types import (
+    ClusterConfig,
+    ClusterStatus,
+    ExportReference,
+    ParquetCompression,
+    WorkerCacheMode,
+)
 from pyee.asyncio import AsyncIOEventEmitter
 
 from .worker import (
     DuckDBMetricsWorkerPlugin,
     DummyMetricsWorkerPlugin,
     MetricsWorkerPlugin,
+    preload_worker_cache,
 )
 
 logger = logging.getLogger(__name__)
@@ -215,11 +227,26 @@ class ClusterManager:
         gcs_secret: str,
         duckdb_path: str,
         cluster_factory: ClusterFactory,
+        cache_mode: WorkerCacheMode = WorkerCacheMode.TABLE,
+        cache_max_bytes: int = 0,
+        cache_local_dir: str = "",
+        result_row_group_size: int = DEFAULT_ROW_GROUP_SIZE,
+        result_compression: ParquetCompression = DEFAULT_COMPRESSION,
+        result_upload_block_size: int = DEFAULT_UPLOAD_BLOCK_SIZE,
         log_override: t.Optional[logging.Logger] = None,
     ):
         def plugin_factory():
             return DuckDBMetricsWorkerPlugin(
-                gcs_bucket, gcs_key_id, gcs_secret, duckdb_path
+                gcs_bucket,
+                gcs_key_id,
+                gcs_secret,
+                duckdb_path,
+                cache_mode=cache_mode,
+                cache_max_bytes=cache_max_bytes,
+                cache_local_dir=cache_local_dir,
+                result_row_group_size=result_row_group_size,
+                result_compression=result_compression,
+                result_upload_block_size=result_upload_block_size,
             )
 
         return cls(plugin_factory, cluster_factory, log_override)
@@ -249,6 +276,7 @@ class ClusterManager:
         self._lock = asyncio.Lock()
         self.factory = cluster_factory
         self._start_task: t.Optional[asyncio.Task] = None
+        self._known_workers: t.Set[str] = set()
         self.event_emitter = AsyncIOEventEmitter()
 
     async def start_cluster(self, min_size: int, max_size: int) -> ClusterStatus:
@@ -364,6 +392,33 @@ class ClusterManager:
         if self._cluster:
             await self._cluster.stop()
 
+    async def new_workers(self) -> t.List[str]:
+        """Returns the workers that joined the cluster since the last call"""
+        async with self._lock:
+            client = self._client
+        if client is None:
+            return []
+        workers = set(client.scheduler_info().get("workers", {}).keys())
+        new_workers = workers - self._known_workers
+        self._known_workers = workers
+        return sorted(new_workers)
+
+    async def preload_worker_cache(
+        self, address: str, dependencies: t.Dict[str, ExportReference]
+    ):
+        """Loads the dependencies into the cache of the given worker"""
+        client = await self.client
+        self.logger.info(f"preloading {len(dependencies)} dependencies on {address}")
+        future = client.submit(
+            preload_worker_cache,
+            dependencies,
+            key=f"preload-{uuid.uuid4().hex}",
+            workers=[address],
+            allow_other_workers=False,
+            pure=False,
+        )
+        return await future
+
     async def wait_for_ready(self) -> bool:
         async with self._lock:
             if self._cluster is not None:
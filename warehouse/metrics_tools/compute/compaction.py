@@ -0,0 +1,226 @@
+"""Compacts the per batch result files of a job before they're imported.
+
+Every task of a job writes its own parquet file. A large backfill leaves
+thousands of small files that make the import, and every later scan, slow.
+The files are merged with duckdb, which sorts out of core, and streamed into
+files of about `target_file_bytes`.
+"""
+
+import logging
+import typing as t
+from datetime import date, datetime
+
+import duckdb
+import fsspec
+import pyarrow as pa
+import pyarrow.compute as pc
+
+from .result_writer import ParquetResultWriter
+from .types import ResultCompaction, ResultCompactionOptions
+
+logger = logging.getLogger(__name__)
+
+HIVE_DEFAULT_PARTITION = "__HIVE_DEFAULT_PARTITION__"
+
+
+class CompactionError(Exception):
+    pass
+
+
+def sql_string(value: str):
+    return "'" + value.replace("'", "''") + "'"
+
+
+def sql_identifier(name: str):
+    return '"' + name.replace('"', '""') + '"'
+
+
+def partition_dir_name(column: str, value: t.Any) -> str:
+    if value is None:
+        formatted = HIVE_DEFAULT_PARTITION
+    elif isinstance(value, datetime):
+        formatted = value.isoformat(sep=" ")
+    elif isinstance(value, date):
+        formatted = value.isoformat()
+    else:
+        formatted = str(value)
+    return f"{column}={formatted}"
+
+
+def partition_runs(
+    batch: pa.RecordBatch, column: str
+) -> t.Iterator[t.Tuple[t.Any, pa.RecordBatch]]:
+    """Splits a batch that's sorted by the column into runs of equal values"""
+    values = batch.column(column)
+    if batch.num_rows == 0:
+        return
+    differs = pc.not_equal(values.slice(1), values.slice(0, len(values) - 1))
+    # pyarrow's stubs don't type the result of comparisons as a BooleanArray
+    changes = pc.indices_nonzero(t.cast(pa.BooleanArray, differs.fill_null(True)))
+    # Nulls compare as null, so a run of nulls is split into single rows.
+    # They're merged back by the writer as they have the same partition.
+    starts = [0] + [index.as_py() + 1 for index in changes]
+    ends = starts[1:] + [batch.num_rows]
+    for start, end in zip(starts, ends):
+        yield values[start].as_py(), batch.slice(start, end - start)
+
+
+class _CompactedFileWriter:
+    """Writes batches to files of at most `rows_per_file` rows. A new file is
+    started for every partition."""
+
+    def __init__(
+        self,
+        fs: fsspec.AbstractFileSystem,
+        dest_dir: str,
+        rows_per_file: int,
+        options: ResultCompactionOptions,
+        log_override: t.Optional[logging.Logger] = None,
+    ):
+        self.fs = fs
+        self.dest_dir = dest_dir
+        self.rows_per_file = rows_per_file
+        self.options = options
+        self.logger = log_override or logger
+        self.files: t.List[str] = []
+        self.rows_written = 0
+        self._partition_dir: t.Optional[str] = None
+        self._file: t.Optional[t.BinaryIO] = None
+        self._writer: t.Optional[ParquetResultWriter] = None
+        self._rows_in_file = 0
+
+    def write(self, batch: pa.RecordBatch, partition_dir: str = ""):
+        if partition_dir != self._partition_dir:
+            self.close()
+            self._partition_dir = partition_dir
+        offset = 0
+        while offset < batch.num_rows:
+            if self._writer is None or self._rows_in_file >= self.rows_per_file:
+                self._open()
+            assert self._writer is not None
+            rows = min(batch.num_rows - offset, self.rows_per_file - self._rows_in_file)
+            self._writer.write_batch(batch.slice(offset, rows))
+            self._rows_in_file += rows
+            offset += rows
+
+    def _open(self):
+        self.close()
+        directory = self.dest_dir
+        if self._partition_dir:
+            directory = f"{directory}/{self._partition_dir}"
+        self.fs.makedirs(directory, exist_ok=True)
+        path = f"{directory}/part-{len(self.files):05d}.parquet"
+        self._file = t.cast(t.BinaryIO, self.fs.open(path, "wb"))
+        self._writer = ParquetResultWriter(
+            self._file,
+            row_group_size=self.options.row_group_size,
+            compression=self.options.compression,
+            log_override=self.logger,
+        )
+        self.files.append(path)
+
+    def close(self):
+        if self._writer is not None:
+            self._writer.close()
+            self.rows_written += self._writer.rows_written
+            self._writer = None
+        if self._file is not None:
+            self._file.close()
+            self._file = None
+        self._rows_in_file = 0
+
+
+def parquet_rows(conn: duckdb.DuckDBPyConnection, urls: t.List[str]) -> int:
+    """The number of rows of the parquet files from their footers"""
+    files = ", ".join(sql_string(url) for url in urls)
+    result = conn.execute(
+        f"SELECT coalesce(sum(num_rows), 0) FROM parquet_file_metadata([{files}])"
+    ).fetchone()
+    assert result is not None
+    return int(result[0])
+
+
+def compact_parquet_files(
+    conn: duckdb.DuckDBPyConnection,
+    fs: fsspec.AbstractFileSystem,
+    source_dir: str,
+    dest_dir: str,
+    options: ResultCompactionOptions,
+    url_prefix: str = "",
+    log_override: t.Optional[logging.Logger] = None,
+) -> ResultCompaction:
+    """Compacts the parquet files of `source_dir` into `dest_dir`.
+
+    The source files are read by duckdb from `url_prefix` + their path on
+    the filesystem (e.g. "gs://"). The source files are not changed. Raises a
+    CompactionError if the compacted files don't have as many rows as the
+    source files.
+    """
+    log = log_override or logger
+    sources = sorted(
+        (
+            entry
+            for entry in fs.ls(source_dir, detail=True)
+            if entry["type"] == "file" and entry["name"].endswith(".parquet")
+        ),
+        key=lambda entry: entry["name"],
+    )
+    if not sources:
+        raise CompactionError(f"no parquet files to compact in {source_dir}")
+    if fs.exists(dest_dir):
+        # Left behind by a failed compaction
+        fs.rm(dest_dir, recursive=True)
+
+    source_urls = [f"{url_prefix}{entry['name']}" for entry in sources]
+    source_rows = parquet_rows(conn, source_urls)
+    source_bytes = sum(entry["size"] for entry in sources)
+    rows_per_file = max(
+        options.row_group_size,
+        (options.target_file_bytes * source_rows) // max(source_bytes, 1),
+    )
+    log.info(
+        f"compacting {len(sources)} files with {source_rows} rows into files of {rows_per_file} rows"
+    )
+
+    order_by = list(options.sort_by)
+    if options.partition_by:
+        order_by = [options.partition_by] + [
+            column for column in order_by if column != options.partition_by
+        ]
+    query = "SELECT * FROM read_parquet([{files}])".format(
+        files=", ".join(sql_string(url) for url in source_urls)
+    )
+    if order_by:
+        query += " ORDER BY " + ", ".join(sql_identifier(c) for c in order_by)
+
+    writer = _CompactedFileWriter(fs, dest_dir, rows_per_file, options, log)
+    try:
+        reader = conn.execute(query).fetch_record_batch(options.row_group_size)
+        for batch in reader:
+            if not options.partition_by:
+                writer.write(batch)
+                continue
+            for value, run in partition_runs(batch, options.partition_by):
+                writer.write(
+                    run.drop_columns([options.partition_by]),
+                    partition_dir_name(options.partition_by, value),
+                )
+    finally:
+        writer.close()
+
+    written_rows = (
+        parquet_rows(conn, [f"{url_prefix}{path}" for path in writer.files])
+        if writer.files
+        else 0
+    )
+    if writer.rows_written != source_rows or written_rows != source_rows:
+        fs.rm(dest_dir, recursive=True)
+        raise CompactionError(
+            f"compacted {written_rows} rows but the source files have {source_rows} rows"
+        )
+    return ResultCompaction(
+        source_files=len(sources),
+        rows=source_rows,
+        files=writer.files,
+        partition_by=options.partition_by,
+    )
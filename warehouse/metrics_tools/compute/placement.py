@@ -0,0 +1,153 @@
+"""Placement of query tasks on the workers of the dask cluster.
+
+By default dask spreads the tasks of a job across all workers, so each worker
+loads every dependency of the job into its cache. The locality aware placer
+tracks which workers have loaded which exported tables. It hints the scheduler
+to run a task on the least busy worker that already holds the most of the
+task's dependencies. If all of those workers are busy the task is spread as
+usual.
+"""
+
+import abc
+import logging
+import typing as t
+
+from pydantic import BaseModel
+
+from .types import ExportReference
+from .worker_cache import WorkerTableCache
+
+logger = logging.getLogger(__name__)
+
+
+class WorkerCapacity(BaseModel):
+    address: str
+    # The number of tasks that can run on the worker at the same time
+    tasks: int
+
+
+def worker_capacities(
+    scheduler_info: t.Dict[str, t.Any], slots: int
+) -> t.Dict[str, WorkerCapacity]:
+    """Calculates the number of tasks requiring `slots` slots that each worker
+    can run concurrently"""
+    capacities: t.Dict[str, WorkerCapacity] = {}
+    for address, info in scheduler_info.get("workers", {}).items():
+        worker_slots = info.get("resources", {}).get("slots")
+        if worker_slots is None:
+            tasks = info.get("nthreads", 1)
+        else:
+            tasks = int(worker_slots // max(slots, 1))
+        capacities[address] = WorkerCapacity(address=address, tasks=max(tasks, 1))
+    return capacities
+
+
+class TaskPlacer(abc.ABC):
+    # Whether the placer needs to know the workers that executed a task
+    tracks_workers: bool = False
+
+    def place(
+        self,
+        dependencies: t.Dict[str, ExportReference],
+        capacities: t.Dict[str, WorkerCapacity],
+    ) -> t.Optional[str]:
+        """Returns the address of the preferred worker for a task with the
+        given dependencies or None to let the scheduler decide"""
+        raise NotImplementedError()
+
+    def task_finished(
+        self,
+        preferred_worker: t.Optional[str],
+        executed_on: t.Iterable[str],
+        dependencies: t.Dict[str, ExportReference],
+    ):
+        """Records that a task finished. `executed_on` are the workers that
+        hold the result of the task and therefore loaded its dependencies."""
+        raise NotImplementedError()
+
+    def task_failed(self, preferred_worker: t.Optional[str]):
+        raise NotImplementedError()
+
+
+class SpreadTaskPlacer(TaskPlacer):
+    """Leaves the placement of tasks to the dask scheduler"""
+
+    def place(self, dependencies, capacities):
+        return None
+
+    def task_finished(self, preferred_worker, executed_on, dependencies):
+        return
+
+    def task_failed(self, preferred_worker):
+        return
+
+
+class LocalityTaskPlacer(TaskPlacer):
+    tracks_workers = True
+
+    def __init__(self, log_override: t.Optional[logging.Logger] = None):
+        self.logger = log_override or logger
+        # cache key -> workers that have loaded the export
+        self._holders: t.Dict[str, t.Set[str]] = {}
+        # worker -> number of running tasks that were placed on it
+        self._running: t.Dict[str, int] = {}
+
+    def holders(self, export_reference: ExportReference) -> t.Set[str]:
+        return set(self._holders.get(WorkerTableCache.cache_key(export_reference), []))
+
+    def place(self, dependencies, capacities):
+        self._forget_removed_workers(capacities)
+        if not dependencies:
+            return None
+
+        scores: t.Dict[str, int] = {}
+        for export_reference in dependencies.values():
+            for address in self.holders(export_reference):
+                scores[address] = scores.get(address, 0) + 1
+
+        candidates = [
+            address
+            for address in scores
+            if self._running.get(address, 0) < capacities[address].tasks
+        ]
+        if not candidates:
+            if scores:
+                self.logger.debug("workers holding the dependencies are busy")
+            return None
+        # Prefer the workers with the most dependencies and then the least
+        # busy ones
+        preferred = max(
+            candidates,
+            key=lambda address: (scores[address], -self._running.get(address, 0)),
+        )
+        self._running[preferred] = self._running.get(preferred, 0) + 1
+        return preferred
+
+    def task_finished(self, preferred_worker, executed_on, dependencies):
+        self._release(preferred_worker)
+        for export_reference in dependencies.values():
+            key = WorkerTableCache.cache_key(export_reference)
+            self._holders.setdefault(key, set()).update(executed_on)
+
+    def task_failed(self, preferred_worker):
+        self._release(preferred_worker)
+
+    def _release(self, preferred_worker: t.Optional[str]):
+        if preferred_worker is None:
+            return
+        running = self._running.get(preferred_worker, 0)
+        if running <= 1:
+            self._running.pop(preferred_worker, None)
+        else:
+            self._running[preferred_worker] = running - 1
+
+    def _forget_removed_workers(self, capacities: t.Dict[str, WorkerCapacity]):
+        for key in list(self._holders.keys()):
+            holders = self._holders[key] & capacities.keys()
+            if holders:
+                self._holders[key] = holders
+            else:
+                del self._holders[key]
+        for address in list(self._running.keys()):
+            if address not in capacities:
+                del self._running[address]
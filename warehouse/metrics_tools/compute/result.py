@@ -157,12 +157,24 @@ class TrinoImportAdapter(DBImportAdapter):
         elif import_path.endswith("/") or import_path.endswith("*"):
             import_path = f"{import_path[:-1]}/"
 
+        # Compacted results may be stored in hive style partition
+        # directories. Trino requires the partition column to be the last
+        # column of the table.
+        partitioned_by: t.Optional[str] = source_ref.payload.get("partitioned_by")
+        columns = list(source_ref.columns)
+        partition_property = ""
+        if partitioned_by:
+            columns = [col for col in columns if col[0] != partitioned_by] + [
+                col for col in columns if col[0] == partitioned_by
+            ]
+            partition_property = f", partitioned_by = ARRAY['{partitioned_by}']"
+
         base_create_query = f"""
             CREATE table "{dest_ref.table.catalog_name}"."{dest_ref.table.schema_name}"."{dest_ref.table.table_name}" (
                 placeholder VARCHAR,
             ) WITH (
                 format = 'PARQUET',
-                external_location = '{import_path}'
+                external_location = '{import_path}'{partition_property}
             )
         """
 
@@ -175,7 +187,7 @@ class TrinoImportAdapter(DBImportAdapter):
                     into=exp.DataType,
                 ),
             )
-            for column_name, column_type in source_ref.columns
+            for column_name, column_type in columns
         ]
         column_defs = [row[1] for row in processed_columns]
 
@@ -183,6 +195,19 @@ class TrinoImportAdapter(DBImportAdapter):
         create_query.this.set("expressions", column_defs)
         await self.run_query(create_query.sql(dialect="trino"))
 
+        if partitioned_by:
+            # The partitions of an external table aren't discovered
+            # automatically
+            await self.run_query(
+                f"""
+                CALL "{dest_ref.table.catalog_name}".system.sync_partition_metadata(
+                    schema_name => '{dest_ref.table.schema_name}',
+                    table_name => '{dest_ref.table.table_name}',
+                    mode => 'ADD'
+                )
+                """
+            )
+
     def process_columns_for_import(
         self,
         column_name: str,
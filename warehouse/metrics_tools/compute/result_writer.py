@@ -0,0 +1,108 @@
+"""Streams the results of metrics queries into a single parquet file.
+
+The results of each query are fetched from duckdb as arrow record batches and
+written to the parquet file one row group at a time. This keeps the memory
+used by a task bounded by the row group size instead of by the size of the
+results of all of its queries.
+"""
+
+import logging
+import typing as t
+
+import duckdb
+import pyarrow as pa
+import pyarrow.parquet as pq
+
+from .types import ParquetCompression
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_ROW_GROUP_SIZE = 122_880
+DEFAULT_COMPRESSION: ParquetCompression = "zstd"
+# Results are uploaded to gcs in chunks of this size. Must be a multiple of
+# 256KiB.
+DEFAULT_UPLOAD_BLOCK_SIZE = 16 * 1024 * 1024
+
+
+class ParquetResultWriter:
+    def __init__(
+        self,
+        file: t.BinaryIO,
+        row_group_size: int = DEFAULT_ROW_GROUP_SIZE,
+        compression: ParquetCompression = DEFAULT_COMPRESSION,
+        log_override: t.Optional[logging.Logger] = None,
+    ):
+        self.file = file
+        self.row_group_size = row_group_size
+        self.compression: ParquetCompression = compression
+        self.logger = log_override or logger
+        self.rows_written = 0
+        self._writer: t.Optional[pq.ParquetWriter] = None
+        self._schema: t.Optional[pa.Schema] = None
+        self._buffer: t.List[pa.RecordBatch] = []
+        self._buffered_rows = 0
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        if exc_type is None:
+            self.close()
+        elif self._writer:
+            self._writer.close()
+
+    def write_query(self, conn: duckdb.DuckDBPyConnection, query: str) -> int:
+        """Executes the query and writes its results. Returns the number of
+        rows of the query."""
+        reader = conn.execute(query).fetch_record_batch(self.row_group_size)
+        if self._schema is None:
+            self._open(reader.schema)
+        rows = 0
+        for batch in reader:
+            rows += self.write_batch(batch)
+        return rows
+
+    def write_batch(self, batch: pa.RecordBatch) -> int:
+        """Writes a record batch. Returns the number of rows of the batch."""
+        if self._schema is None:
+            self._open(batch.schema)
+        assert self._schema is not None
+        if not batch.schema.equals(self._schema):
+            # All queries of a task must produce the same columns. Only
+            # the types may differ slightly (e.g. an untyped NULL column)
+            batch = batch.cast(self._schema)
+        self._buffer.append(batch)
+        self._buffered_rows += batch.num_rows
+        if self._buffered_rows >= self.row_group_size:
+            self._flush()
+        return batch.num_rows
+
+    def _open(self, schema: pa.Schema):
+        self._schema = schema
+        self._writer = pq.ParquetWriter(
+            self.file, self._schema, compression=self.compression
+        )
+
+    def _flush(self, final: bool = False):
+        """Writes the buffered rows as full row groups. The remaining rows
+        stay buffered unless this is the final flush."""
+        if not self._buffer:
+            return
+        assert self._writer is not None
+        table = pa.Table.from_batches(self._buffer, schema=self._schema)
+        write_rows = table.num_rows
+        if not final:
+            write_rows -= table.num_rows % self.row_group_size
+        self._writer.write_table(
+            table.slice(0, write_rows), row_group_size=self.row_group_size
+        )
+        self.rows_written += write_rows
+        remaining = table.slice(write_rows)
+        self._buffer = remaining.to_batches()
+        self._buffered_rows = remaining.num_rows
+
+    def close(self):
+        self._flush(final=True)
+        if self._writer:
+            self._writer.close()
+            self._writer = None
@@ -1,26 +1,43 @@
 """Main interface for computing metrics"""
 
 import asyncio
-import copy
 import logging
 import os
+import time
 import typing as t
 import uuid
-from datetime import datetime
+from collections import OrderedDict
+from datetime import date, datetime
 
 from dask.distributed import CancelledError
 from metrics_tools.compute.result import DBImportAdapter
-from metrics_tools.compute.worker import execute_duckdb_load
+from metrics_tools.compute.worker import execute_duckdb_load, execute_result_compaction
 from metrics_tools.runner import FakeEngineAdapter, MetricsRunner
+from metrics_tools.utils.tables import (
+    list_query_table_columns,
+    list_query_time_filtered_tables,
+)
 from pyee.asyncio import AsyncIOEventEmitter
-
+from sqlmesh.core.dialect import parse_one
+
+from .autoscale import AutoscalePolicy
+from .batching import (
+    AdaptiveBatchPlan,
+    DayBatch,
+    TaskSlots,
+    ThroughputEstimator,
+    query_day_weights,
+)
+from .broadcast import JobStatusBroadcaster, JobStatusSubscription
 from .cache import CacheExportManager
 from .cluster import ClusterManager
+from .placement import SpreadTaskPlacer, TaskPlacer, worker_capacities
 from .types import (
     ClusterStartRequest,
     ClusterStatus,
     ColumnsDefinition,
     ExportReference,
+    ExportTimeRange,
     ExportType,
     JobStatusResponse,
     JobSubmitRequest,
@@ -31,9 +48,10 @@ from .types import (
     QueryJobTaskStatus,
     QueryJobTaskUpdate,
     QueryJobUpdate,
-    QueryJobUpdateScope,
+    ResultCompactionOptions,
     TableReference,
 )
+from .worker_cache import WorkerTableCache
 
 logger = logging.getLogger(__name__)
 logger.setLevel(logging.DEBUG)
@@ -84,6 +102,7 @@ class MetricsCalculationService:
     gcs_bucket: str
     cluster_manager: ClusterManager
     cache_manager: CacheExportManager
+    task_placer: TaskPlacer
     last_listener_added_datetime: datetime
     last_listener_removed_datetime: datetime
     listener_count: int
@@ -94,6 +113,7 @@ class MetricsCalculationService:
     daemon: asyncio.Task
     requested_cluster_min_size: int
     requested_cluster_max_size: int
+    autoscale_policy: t.Optional[AutoscalePolicy]
 
     @classmethod
     def setup(
@@ -106,6 +126,15 @@ class MetricsCalculationService:
         import_adapter: DBImportAdapter,
         cluster_scale_down_timeout: int = 300,
         cluster_shutdown_timeout: int = 3600,
+        task_placer: t.Optional[TaskPlacer] = None,
+        target_task_seconds: float = 0.0,
+        task_queue_depth: int = 4,
+        autoscale_policy: t.Optional[AutoscalePolicy] = None,
+        warm_pool_dependencies: int = 10,
+        keep_job_update_log: bool = False,
+        job_status_updates_per_second: float = 2.0,
+        result_compaction: t.Optional[ResultCompactionOptions] = None,
+        prune_dependency_columns: bool = True,
         log_override: t.Optional[logging.Logger] = None,
     ):
         service = cls(
@@ -117,6 +146,15 @@ class MetricsCalculationService:
             cluster_scale_down_timeout=cluster_scale_down_timeout,
             cluster_shutdown_timeout=cluster_shutdown_timeout,
             import_adapter=import_adapter,
+            task_placer=task_placer,
+            target_task_seconds=target_task_seconds,
+            task_queue_depth=task_queue_depth,
+            autoscale_policy=autoscale_policy,
+            warm_pool_dependencies=warm_pool_dependencies,
+            keep_job_update_log=keep_job_update_log,
+            job_status_updates_per_second=job_status_updates_per_second,
+            result_compaction=result_compaction,
+            prune_dependency_columns=prune_dependency_columns,
             log_override=log_override,
         )
         service.start_daemon()
@@ -132,6 +170,15 @@ class MetricsCalculationService:
         import_adapter: DBImportAdapter,
         cluster_scale_down_timeout: int = 300,
         cluster_shutdown_timeout: int = 3600,
+        task_placer: t.Optional[TaskPlacer] = None,
+        target_task_seconds: float = 0.0,
+        task_queue_depth: int = 4,
+        autoscale_policy: t.Optional[AutoscalePolicy] = None,
+        warm_pool_dependencies: int = 10,
+        keep_job_update_log: bool = False,
+        job_status_updates_per_second: float = 2.0,
+        result_compaction: t.Optional[ResultCompactionOptions] = None,
+        prune_dependency_columns: bool = True,
         log_override: t.Optional[logging.Logger] = None,
     ):
         self.id = id
@@ -140,6 +187,10 @@ class MetricsCalculationService:
         self.cluster_manager = cluster_manager
         self.cache_manager = cache_manager
         self.import_adapter = import_adapter
+        self.task_placer = task_placer or SpreadTaskPlacer()
+        self.target_task_seconds = target_task_seconds
+        self.task_queue_depth = task_queue_depth
+        self.throughput = ThroughputEstimator()
         self.job_state = {}
         self.job_tasks = {}
         self.job_state_lock = asyncio.Lock()
@@ -152,6 +203,21 @@ class MetricsCalculationService:
         self.cluster_scale_down_timeout = cluster_scale_down_timeout
         self.last_listener_added_datetime = datetime.now()
         self.last_listener_removed_datetime = datetime.now()
+        self.autoscale_policy = autoscale_policy
+        self.warm_pool_dependencies = warm_pool_dependencies
+        self.keep_job_update_log = keep_job_update_log
+        self.result_compaction = result_compaction
+        self.prune_dependency_columns = prune_dependency_columns
+        self.job_status_broadcaster = JobStatusBroadcaster(
+            max_updates_per_second=job_status_updates_per_second,
+            log_override=self.logger,
+        )
+        self.job_slots: t.Dict[str, int] = {}
+        # The most recently used dependencies keyed by their cache key. These
+        # are preloaded by new workers of a warm pool.
+        self._hot_dependencies: t.OrderedDict[str, ExportReference] = OrderedDict()
+        self._autoscale_min_size: t.Optional[int] = None
+        self._preload_tasks: t.Set[asyncio.Task] = set()
 
     async def handle_query_job_submit_request(
         self,
@@ -193,11 +259,24 @@ class MetricsCalculationService:
                     f"MCS scale down daemon: listener_count={self.listener_count}"
                 )
             last_listener_removed_delta = now - self.last_listener_removed_datetime
+            if self.autoscale_policy is not None and count % 5 == 0:
+                idle = (
+                    self.listener_count == 0
+                    and last_listener_removed_delta.total_seconds()
+                    >= self.cluster_scale_down_timeout
+                )
+                try:
+                    await self._autoscale(now, idle)
+                except Exception as e:
+                    logger.error(f"failed to autoscale cluster: {e}")
             if self.listener_count == 0:
+                # Scaling down is otherwise handled by the autoscale policy
                 if (
                     last_listener_removed_delta.total_seconds()
                     >= self.cluster_scale_down_timeout
-                ) and not scaled_down:
+                    and not scaled_down
+                    and self.autoscale_policy is None
+                ):
                     # If the cluster is already at 0 we don't need to do
                     # anything just make sure everything is stopped
                     logger.debug("MCS scale down daemon: scaling down")
@@ -210,7 +289,9 @@ class MetricsCalculationService:
                 if (
                     last_listener_removed_delta.total_seconds()
                     >= self.cluster_shutdown_timeout
-                ) and not shutdown:
+                    and not shutdown
+                    and await self._allow_shutdown(now)
+                ):
                     logger.debug("MCS shutdown down daemon: scaling down")
                     try:
                         await self.cluster_manager.stop_cluster()
@@ -237,6 +318,81 @@ class MetricsCalculationService:
             return
         await self.cluster_manager.resize_cluster(0, self.requested_cluster_max_size)
 
+    async def queued_slots(self) -> int:
+        """The slots required by the remaining tasks of all unfinished jobs"""
+        async with self.job_state_lock:
+            return sum(
+                max(state.tasks_count - state.tasks_completed, 0)
+                * self.job_slots.get(job_id, 1)
+                for job_id, state in self.job_state.items()
+                if state.status in (QueryJobStatus.PENDING, QueryJobStatus.RUNNING)
+            )
+
+    async def _allow_shutdown(self, now: datetime) -> bool:
+        if self.autoscale_policy is None:
+            return True
+        decision = self.autoscale_policy.decide(
+            now,
+            await self.queued_slots(),
+            self.requested_cluster_min_size,
+            self.requested_cluster_max_size,
+            idle=True,
+        )
+        return decision.allow_shutdown
+
+    async def _autoscale(self, now: datetime, idle: bool):
+        """Resizes the cluster to the minimum size chosen by the autoscale
+        policy and warms any new workers"""
+        assert self.autoscale_policy is not None
+        status = await self.cluster_manager.get_cluster_status()
+        if not status.is_ready:
+            self._autoscale_min_size = None
+            return
+        decision = self.autoscale_policy.decide(
+            now,
+            await self.queued_slots(),
+            self.requested_cluster_min_size,
+            self.requested_cluster_max_size,
+            idle,
+        )
+        if decision.min_size != self._autoscale_min_size:
+            logger.debug(f"MCS autoscale: resizing cluster to min={decision.min_size}")
+            await self.cluster_manager.resize_cluster(
+                decision.min_size,
+                max(self.requested_cluster_max_size, decision.min_size),
+            )
+            self._autoscale_min_size = decision.min_size
+
+        if self.autoscale_policy.warm_pool_size <= 0:
+            return
+        new_workers = await self.cluster_manager.new_workers()
+        if not self._hot_dependencies:
+            return
+        for address in new_workers:
+            task = asyncio.create_task(
+                self._preload_worker(address, dict(self._hot_dependencies))
+            )
+            self._preload_tasks.add(task)
+            task.add_done_callback(self._preload_tasks.discard)
+
+    async def _preload_worker(
+        self, address: str, dependencies: t.Dict[str, ExportReference]
+    ):
+        try:
+            await self.cluster_manager.preload_worker_cache(address, dependencies)
+        except Exception as e:
+            self.logger.warning(f"failed to preload worker[{address}]: {e}")
+            return
+        self.task_placer.task_finished(None, [address], dependencies)
+
+    def _record_hot_dependencies(self, dependencies: t.Dict[str, ExportReference]):
+        for export_reference in dependencies.values():
+            key = WorkerTableCache.cache_key(export_reference)
+            self._hot_dependencies[key] = export_reference
+            self._hot_dependencies.move_to_end(key)
+        while len(self._hot_dependencies) > self.warm_pool_dependencies:
+            self._hot_dependencies.popitem(last=False)
+
     async def _handle_query_job_submit_request(
         self,
         job_id: str,
@@ -256,39 +412,48 @@ class MetricsCalculationService:
             self.logger.error(f"job[{job_id}] failed to export dependencies: {e}")
             raise e
         self.logger.debug(f"job[{job_id}] dependencies exported")
-
-        tasks = await self._batch_query_to_scheduler(
-            job_id, result_path_base, input, exported_dependent_tables_map
-        )
-
-        total = len(tasks)
-        if total != input.batch_count():
-            self.logger.warning(f"job[{job_id}] batch count mismatch")
+        self._record_hot_dependencies(exported_dependent_tables_map)
 
         exceptions = []
         cancellations = []
 
-        for next_task in asyncio.as_completed(tasks):
-            try:
-                await next_task
-            except JobTaskCancelled as e:
-                cancellations.append(e.task_id)
-            except JobTaskFailed as e:
-                exceptions.append(e.exception)
-            except Exception as e:
-                self.logger.error(
-                    f"job[{job_id}] task failed with uncaught exception: {e}"
-                )
-                exceptions.append(e)
-                # Report failure early for any listening clients. The server
-                # will collect all errors for any internal reporting needed
-                await self._notify_job_failed(job_id, True, e)
+        # The exports must not be evicted while the tasks read them
+        self.cache_manager.pin_export_references(exported_dependent_tables_map.values())
+        try:
+            tasks = await self._batch_query_to_scheduler(
+                job_id, result_path_base, input, exported_dependent_tables_map
+            )
+            self.logger.debug(f"job[{job_id}] submitted {len(tasks)} tasks")
+
+            for next_task in asyncio.as_completed(tasks):
+                try:
+                    await next_task
+                except JobTaskCancelled as e:
+                    cancellations.append(e.task_id)
+                except JobTaskFailed as e:
+                    exceptions.append(e.exception)
+                except Exception as e:
+                    self.logger.error(
+                        f"job[{job_id}] task failed with uncaught exception: {e}"
+                    )
+                    exceptions.append(e)
+                    # Report failure early for any listening clients. The server
+                    # will collect all errors for any internal reporting needed
+                    await self._notify_job_failed(job_id, True, e)
+        finally:
+            self.cache_manager.unpin_export_references(
+                exported_dependent_tables_map.values()
+            )
 
         # If there are any exceptions then we report those as failed and short
         # circuit this method
         if len(exceptions) > 0 or len(cancellations) > 0:
             raise JobFailed(job_id, len(exceptions), exceptions, cancellations)
 
+        calculation_export = await self._compact_results(
+            job_id, result_path_base, input, calculation_export
+        )
+
         # Import the final result into the database
         self.logger.info(f"job[{job_id}]: importing final result into the database")
         await self.import_adapter.import_reference(calculation_export, final_export)
@@ -296,6 +461,67 @@ class MetricsCalculationService:
         self.logger.debug(f"job[{job_id}]: notifying job completed")
         await self._notify_job_completed(job_id)
 
+    async def _compact_results(
+        self,
+        job_id: str,
+        result_path_base: str,
+        input: JobSubmitRequest,
+        calculation_export: ExportReference,
+    ) -> ExportReference:
+        """Compacts the result files of a job on a worker. Returns the export
+        to import. If compaction fails the original files are imported."""
+        if self.result_compaction is None:
+            return calculation_export
+
+        column_names = {name for name, _ in input.columns}
+        options = self.result_compaction.model_copy(
+            update={
+                "sort_by": [
+                    name
+                    for name in self.result_compaction.sort_by
+                    if name in column_names
+                ],
+                "partition_by": (
+                    self.result_compaction.partition_by
+                    if self.result_compaction.partition_by in column_names
+                    else None
+                ),
+            }
+        )
+        client = await self.cluster_manager.client
+        self.logger.info(f"job[{job_id}]: compacting result files")
+        try:
+            compaction = await client.submit(
+                execute_result_compaction,
+                job_id,
+                result_path_base,
+                options,
+                key=f"{job_id}-compaction",
+            )
+        except Exception as e:
+            self.logger.error(
+                f"job[{job_id}]: compaction failed, importing the uncompacted results: {e}"
+            )
+            return calculation_export
+        if compaction is None:
+            return calculation_export
+
+        self.logger.info(
+            f"job[{job_id}]: compacted {compaction.source_files} files with {compaction.rows} rows into {len(compaction.files)} files"
+        )
+        compacted_path = os.path.join(
+            f"gs://{self.gcs_bucket}", result_path_base, "compacted"
+        )
+        payload: t.Dict[str, t.Any] = {
+            "gcs_path": os.path.join(compacted_path, "*.parquet")
+        }
+        if compaction.partition_by:
+            payload = {
+                "gcs_path": f"{compacted_path}/",
+                "partitioned_by": compaction.partition_by,
+            }
+        return calculation_export.model_copy(update={"payload": payload})
+
     async def _batch_query_to_scheduler(
         self,
         job_id: str,
@@ -303,27 +529,69 @@ class MetricsCalculationService:
         input: JobSubmitRequest,
         exported_dependent_tables_map: t.Dict[str, ExportReference],
     ):
-        """Given a query job: break down into batches and submit to the scheduler"""
+        """Given a query job: break down into batches and submit to the scheduler
+
+        Batches are taken from an adaptive plan whenever one of the job's task
+        slots on the cluster is free. This sizes each batch by the work that
+        remains when it is submitted. Up to `task_queue_depth` tasks more than
+        the cluster can run are submitted so that it can scale up to them.
+        """
+        runner = self.create_runner(input)
+        days = list(runner.iter_query_days(input.start, input.end))
+        weights = await self.estimate_query_day_weights(
+            input, days, exported_dependent_tables_map
+        )
+        plan = AdaptiveBatchPlan(days, weights, max_batch_days=input.batch_size)
+
+        client = await self.cluster_manager.client
+        slots = TaskSlots(queue_depth=self.task_queue_depth)
+
+        def parallelism():
+            capacities = worker_capacities(client.scheduler_info(), input.slots)
+            return sum(capacity.tasks for capacity in capacities.values())
 
         tasks: t.List[asyncio.Task] = []
-        count = 0
-        async for batch_id, batch in self.generate_query_batches(
-            input, input.batch_size
-        ):
-            if count == 0:
-                await self._notify_job_running(job_id)
+        tasks_count = input.batch_count()
+        batch_id = 0
+        while plan.remaining_days > 0:
+            await slots.acquire(parallelism)
+            # Queued tasks are included so that the batches are also split
+            # across the workers that the cluster scales up to
+            current_parallelism = slots.limit(parallelism())
+            target_weight = self.throughput.target_batch_weight(
+                self.target_task_seconds
+            )
+            batch = plan.next_batch(current_parallelism, target_weight)
+            assert batch is not None
+            queries = await asyncio.to_thread(runner.render_rolling_batch, batch.days)
+
+            estimated_tasks_count = (
+                batch_id
+                + 1
+                + plan.estimate_remaining_batches(current_parallelism, target_weight)
+            )
+            if batch_id == 0:
+                tasks_count = estimated_tasks_count
+                await self._notify_job_running(job_id, tasks_count)
+            elif estimated_tasks_count != tasks_count:
+                tasks_count = estimated_tasks_count
+                await self._notify_job_tasks_count(job_id, tasks_count)
 
             task_id = f"{job_id}-{batch_id}"
             result_path = os.path.join(result_path_base, f"{batch_id}.parquet")
 
-            self.logger.debug(f"job[{job_id}]: Submitting task {task_id}")
+            self.logger.debug(
+                f"job[{job_id}]: Submitting task {task_id} for {len(batch.days)} days"
+            )
 
             task = asyncio.create_task(
-                self._submit_query_task_to_scheduler(
+                self._run_batch_task(
+                    slots,
+                    batch,
                     job_id,
                     task_id,
                     result_path,
-                    batch,
+                    queries,
                     input.slots,
                     exported_dependent_tables_map,
                     retries=3,
@@ -332,9 +600,38 @@ class MetricsCalculationService:
             tasks.append(task)
 
             self.logger.debug(f"job[{job_id}]: Submitted task {task_id}")
-            count += 1
+            batch_id += 1
         return tasks
 
+    async def _run_batch_task(
+        self,
+        slots: TaskSlots,
+        batch: DayBatch,
+        job_id: str,
+        task_id: str,
+        result_path: str,
+        queries: t.List[str],
+        slots_per_task: int,
+        exported_dependent_tables_map: t.Dict[str, ExportReference],
+        retries: int,
+    ):
+        """Runs a task and records its throughput to size later batches"""
+        started_at = time.monotonic()
+        try:
+            result = await self._submit_query_task_to_scheduler(
+                job_id,
+                task_id,
+                result_path,
+                queries,
+                slots_per_task,
+                exported_dependent_tables_map,
+                retries=retries,
+            )
+            self.throughput.record(batch.weight, time.monotonic() - started_at)
+            return result
+        finally:
+            await slots.release()
+
     async def _submit_query_task_to_scheduler(
         self,
         job_id: str,
@@ -348,6 +645,20 @@ class MetricsCalculationService:
         """Submit a single query task to the scheduler"""
         client = await self.cluster_manager.client
 
+        preferred_worker = self.task_placer.place(
+            exported_dependent_tables_map,
+            worker_capacities(client.scheduler_info(), slots),
+        )
+        placement_options: t.Dict[str, t.Any] = {}
+        if preferred_worker:
+            self.logger.debug(
+                f"job[{job_id}] task_id={task_id} prefers worker {preferred_worker}"
+            )
+            placement_options = {
+                "workers": [preferred_worker],
+                "allow_other_workers": True,
+            }
+
         task_future = client.submit(
             execute_duckdb_load,
             job_id,
@@ -358,20 +669,31 @@ class MetricsCalculationService:
             retries=retries,
             key=task_id,
             resources={"slots": slots},
+            **placement_options,
         )
 
         try:
             await task_future
             self.logger.info(f"job[{job_id}] task_id={task_id} completed")
-            await self._notify_job_task_completed(job_id, task_id)
         except CancelledError as e:
+            self.task_placer.task_failed(preferred_worker)
             self.logger.error(f"job[{job_id}] task cancelled {e.args}")
             await self._notify_job_task_cancelled(job_id, task_id)
             raise JobTaskCancelled(task_id)
         except Exception as e:
+            self.task_placer.task_failed(preferred_worker)
             self.logger.error(f"job[{job_id}] task failed with exception: {e}")
             await self._notify_job_task_failed(job_id, task_id, e)
             raise JobTaskFailed(e)
+
+        executed_on: t.List[str] = []
+        if self.task_placer.tracks_workers:
+            who_has = await client.who_has(task_future)
+            executed_on = list(who_has.get(task_future.key, []))
+        self.task_placer.task_finished(
+            preferred_worker, executed_on, exported_dependent_tables_map
+        )
+        await self._notify_job_task_completed(job_id, task_id)
         return task_id
 
     async def close(self):
@@ -431,6 +753,9 @@ class MetricsCalculationService:
             calculation_export
         )
 
+        self.job_slots[job_id] = input.slots
+        if self.autoscale_policy is not None:
+            self.autoscale_policy.record_job_arrival(datetime.now())
         await self._notify_job_pending(job_id, input)
         task = asyncio.create_task(
             self.handle_query_job_submit_request(
@@ -455,17 +780,23 @@ class MetricsCalculationService:
             input,
         )
 
-    async def _notify_job_running(self, job_id: str):
+    async def _notify_job_running(
+        self, job_id: str, tasks_count: t.Optional[int] = None
+    ):
         await self._update_job_state(
             job_id,
             QueryJobUpdate.create_job_update(
                 payload=QueryJobStateUpdate(
                     status=QueryJobStatus.RUNNING,
                     has_remaining_tasks=True,
+                    tasks_count=tasks_count,
                 ),
             ),
         )
 
+    async def _notify_job_tasks_count(self, job_id: str, tasks_count: int):
+        await self._notify_job_running(job_id, tasks_count)
+
     async def _notify_job_task_completed(self, job_id: str, task_id: str):
         await self._update_job_state(
             job_id,
@@ -532,21 +863,10 @@ class MetricsCalculationService:
 
     async def _create_job_state(self, job_id: str, input: JobSubmitRequest):
         async with self.job_state_lock:
-            now = datetime.now()
-            self.job_state[job_id] = QueryJobState(
-                job_id=job_id,
-                created_at=now,
-                tasks_count=input.batch_count(),
-                updates=[
-                    QueryJobUpdate(
-                        time=now,
-                        scope=QueryJobUpdateScope.JOB,
-                        payload=QueryJobStateUpdate(
-                            status=QueryJobStatus.PENDING,
-                            has_remaining_tasks=True,
-                        ),
-                    )
-                ],
+            self.job_state[job_id] = QueryJobState.start(
+                job_id,
+                input.batch_count(),
+                keep_updates=self.keep_job_update_log,
             )
 
             state = self.job_state[job_id]
@@ -563,42 +883,58 @@ class MetricsCalculationService:
             assert state is not None, f"job[{job_id}] not found"
             state.update(update)
             self.job_state[job_id] = state
+            if state.status in (QueryJobStatus.COMPLETED, QueryJobStatus.FAILED):
+                # Only unfinished jobs count towards the queued slots
+                self.job_slots.pop(job_id, None)
             self.emit_job_state(job_id, state)
 
     def emit_job_state(self, job_id: str, state: QueryJobState):
-        copied_state = copy.deepcopy(state)
-        self.logger.info("emitting job update events")
+        # Websocket subscribers get coalesced updates
+        self.job_status_broadcaster.publish(state)
+        if not self.emitter.listeners("job_update") and not self.emitter.listeners(
+            f"job_update:{job_id}"
+        ):
+            return
+        copied_state = state.snapshot()
+        self.logger.debug("emitting job update events")
         self.emitter.emit("job_update", job_id, copied_state)
         self.emitter.emit(f"job_update:{job_id}", copied_state)
 
     async def _get_job_state(self, job_id: str):
-        """Get the current state of a job as a deep copy (to prevent
+        """Get a snapshot of the current state of a job (to prevent
         mutation)"""
         async with self.job_state_lock:
-            state = copy.deepcopy(self.job_state.get(job_id))
-        return state
+            state = self.job_state.get(job_id)
+            return state.snapshot() if state else None
 
-    async def generate_query_batches(self, input: JobSubmitRequest, batch_size: int):
-        runner = MetricsRunner.from_engine_adapter(
+    def create_runner(self, input: JobSubmitRequest):
+        return MetricsRunner.from_engine_adapter(
             FakeEngineAdapter("duckdb"),
             input.query_as("duckdb"),
             input.ref,
             input.locals,
         )
 
-        batch: t.List[str] = []
-        batch_num = 0
-
-        async for rendered_query in runner.render_rolling_queries_async(
-            input.start, input.end
+    async def estimate_query_day_weights(
+        self,
+        input: JobSubmitRequest,
+        days: t.List[datetime],
+        exported_dependent_tables_map: t.Dict[str, ExportReference],
+    ):
+        """Estimates the work of each query day from the number of rows per
+        day of the exported dependencies"""
+        row_counts: t.Dict[date, int] = {}
+        for counts in await asyncio.gather(
+            *[
+                self.cache_manager.row_counts_by_day(export_reference)
+                for export_reference in exported_dependent_tables_map.values()
+            ]
         ):
-            batch.append(rendered_query)
-            if len(batch) >= batch_size:
-                yield (batch_num, batch)
-                batch = []
-                batch_num += 1
-        if len(batch) > 0:
-            yield (batch_num, batch)
+            for day, count in counts.items():
+                row_counts[day] = row_counts.get(day, 0) + count
+        return query_day_weights(
+            days, row_counts, input.ref.get("window"), input.ref.get("unit")
+        )
 
     async def resolve_dependent_tables(self, input: JobSubmitRequest):
         """Resolve the dependent tables for the given input and returns the
@@ -622,7 +958,10 @@ class MetricsCalculationService:
 
         # First use the cache manager to resolve the export references
         references = await self.cache_manager.resolve_export_references(
-            tables_to_export, input.execution_time
+            tables_to_export,
+            input.execution_time,
+            self.resolve_dependency_time_ranges(input),
+            await self.resolve_dependency_columns(input),
         )
         self.logger.debug(f"resolved references: {references}")
 
@@ -634,6 +973,81 @@ class MetricsCalculationService:
 
         return exported_dependent_tables_map
 
+    def resolve_dependency_time_ranges(
+        self, input: JobSubmitRequest
+    ) -> t.Dict[str, ExportTimeRange]:
+        """Resolves the time ranges of the dependent tables that the job reads.
+
+        Only tables that the query filters with `@metrics_start` and
+        `@metrics_end` are included. Any other dependency must be exported in
+        full. The returned map is keyed by the actual table name."""
+        bounds = input.dependency_time_bounds()
+        if bounds is None:
+            return {}
+        try:
+            time_columns = list_query_time_filtered_tables(
+                parse_one(input.query_str, dialect=input.dialect)
+            )
+        except Exception as e:
+            self.logger.warning(
+                f"could not determine time ranges of dependencies, exporting in full: {e}"
+            )
+            return {}
+        start, end = bounds
+        return {
+            input.dependent_tables_map[reference_name]: ExportTimeRange.from_bounds(
+                column, start, end
+            )
+            for reference_name, column in time_columns.items()
+            if reference_name in input.dependent_tables_map
+        }
+
+    async def resolve_dependency_columns(
+        self, input: JobSubmitRequest
+    ) -> t.Dict[str, t.List[str]]:
+        """Resolves the columns of the dependent tables that the job reads.
+
+        The columns are taken from the queries rendered for the first day of
+        the job as the columns don't depend on the day. Tables that are read
+        with a star, or whose columns can't be determined, aren't included
+        and must be exported with all of their columns. The returned map is
+        keyed by the actual table name."""
+        if not self.prune_dependency_columns:
+            return {}
+        try:
+            runner = self.create_runner(input)
+            first_day = next(iter(runner.iter_query_days(input.start, input.end)))
+            queries = await asyncio.to_thread(runner.render_rolling_batch, [first_day])
+            queries_columns = [
+                list_query_table_columns(parse_one(query, dialect="duckdb"))
+                for query in queries
+            ]
+        except Exception as e:
+            self.logger.warning(
+                f"could not determine columns of dependencies, exporting all columns: {e}"
+            )
+            return {}
+        if not queries_columns:
+            return {}
+        # A table is only pruned if the columns of every query are known
+        reference_names = set.intersection(
+            *[set(query_columns.keys()) for query_columns in queries_columns]
+        )
+        dependency_columns: t.Dict[str, t.List[str]] = {}
+        for reference_name in reference_names:
+            actual_name = input.dependent_tables_map.get(reference_name)
+            if actual_name is None:
+                continue
+            dependency_columns[actual_name] = sorted(
+                set().union(
+                    *[
+                        query_columns[reference_name]
+                        for query_columns in queries_columns
+                    ]
+                )
+            )
+        return dependency_columns
+
     async def get_job_status(
         self, job_id: str, include_stats: bool = False
     ) -> JobStatusResponse:
@@ -645,18 +1059,16 @@ class MetricsCalculationService:
     async def listen_for_job_updates(
         self, job_id: str, handler: t.Callable[[JobStatusResponse], t.Awaitable[None]]
     ):
+        """Calls the handler with every update of the job. Use
+        `subscribe_to_job_status` if only the latest status is needed."""
         async with self.job_state_lock:
             if job_id not in self.job_state:
                 raise ValueError(f"Job {job_id} not found")
             state = self.job_state[job_id]
             if state.status in (QueryJobStatus.COMPLETED, QueryJobStatus.FAILED):
-                handler(state.as_response())
+                await handler(state.as_response())
                 return lambda: None
-        self.last_listener_added_datetime = datetime.now()
-        self.listener_count += 1
-        self.logger.info(
-            f"Adding listener for job[{job_id}]. Total listeners: {self.listener_count}"
-        )
+        self._add_listener(job_id)
 
         async def convert_to_response(state: QueryJobState):
             self.logger.debug("converting to response")
@@ -666,15 +1078,39 @@ class MetricsCalculationService:
 
         def remove_listener():
             self.emitter.remove_listener(f"job_update:{job_id}", handle)
-            self.last_listener_removed_datetime = datetime.now()
-            self.listener_count -= 1
-            self.logger.info(
-                f"Removed listener for job[{job_id}]. Total listeners: {self.listener_count}"
-            )
+            self._remove_listener(job_id)
             return
 
         return remove_listener
 
+    async def subscribe_to_job_status(self, job_id: str) -> JobStatusSubscription:
+        """Subscribes to the status of a job. The subscription receives the
+        current status and then at most `job_status_updates_per_second`
+        statuses per second. The final status is always received."""
+        async with self.job_state_lock:
+            if job_id not in self.job_state:
+                raise ValueError(f"Job {job_id} not found")
+            subscription = self.job_status_broadcaster.subscribe(
+                self.job_state[job_id],
+                on_close=lambda _: self._remove_listener(job_id),
+            )
+        self._add_listener(job_id)
+        return subscription
+
+    def _add_listener(self, job_id: str):
+        self.last_listener_added_datetime = datetime.now()
+        self.listener_count += 1
+        self.logger.info(
+            f"Adding listener for job[{job_id}]. Total listeners: {self.listener_count}"
+        )
+
+    def _remove_listener(self, job_id: str):
+        self.last_listener_removed_datetime = datetime.now()
+        self.listener_count -= 1
+        self.logger.info(
+            f"Removed listener for job[{job_id}]. Total listeners: {self.listener_count}"
+        )
+
     async def add_existing_exported_table_references(
         self, update: t.Dict[str, ExportReference]
     ):
@@ -684,3 +1120,6 @@ class MetricsCalculationService:
 
     async def inspect_exported_table_references(self):
         return await self.cache_manager.inspect_export_table_references()
+
+    def get_cache_export_stats(self):
+        return self.cache_manager.stats()
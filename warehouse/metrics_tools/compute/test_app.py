@@ -6,7 +6,11 @@ import pytest
 from fastapi.testclient import TestClient
 from metrics_tools.compute.app import app_factory, default_lifecycle
 from metrics_tools.compute.client import BaseWebsocketConnector, Client
-from metrics_tools.compute.types import AppConfig
+from metrics_tools.compute.types import (
+    AppConfig,
+    JobStatusErrorResponse,
+    JobStatusSubscribeRequest,
+)
 from metrics_tools.definition import PeerMetricDependencyRef
 from metrics_tools.utils.logging import setup_module_logging
 from starlette.testclient import WebSocketTestSession
@@ -107,6 +111,15 @@ def test_app_with_all_debugging(app_client_with_all_debugging):
         progress_handler=mock_handler,
     )
 
-    # The pending to running update, and the 3 completion updates
-    assert mock_handler.call_count == 4
+    # The snapshot of the pending job sent on subscription, the pending to
+    # running update and the 3 completion updates. Tasks take longer than
+    # the interval at which updates are coalesced.
+    assert mock_handler.call_count == 5
     assert reference is not None
+
+
+def test_app_job_status_stream_reports_unknown_jobs(app_client_with_all_debugging):
+    with app_client_with_all_debugging.websocket_connect("/job/status/ws") as ws:
+        ws.send_text(JobStatusSubscribeRequest(job_ids=["missing"]).model_dump_json())
+        response = JobStatusErrorResponse.model_validate_json(ws.receive_text())
+        assert response.job_id == "missing"
@@ -0,0 +1,75 @@
+from datetime import datetime, timedelta
+
+from .autoscale import AutoscalePolicy, JobArrivalHistory
+
+
+def test_job_arrival_history_expects_daily_jobs():
+    history = JobArrivalHistory(lookback_days=7)
+    start = datetime(2024, 1, 1, 4, 0)
+    for day in range(6):
+        history.record(start + timedelta(days=day))
+
+    horizon = timedelta(hours=1)
+    now = start + timedelta(days=6) - timedelta(minutes=30)
+    assert history.has_history(now)
+    assert history.daily_arrival_ratio(now, horizon) == 1.0
+    assert history.expects_job(now, horizon)
+
+    # Nothing arrives in the afternoon
+    afternoon = now + timedelta(hours=10)
+    assert history.daily_arrival_ratio(afternoon, horizon) == 0.0
+    assert not history.expects_job(afternoon, horizon)
+
+
+def test_job_arrival_history_expects_frequent_jobs():
+    history = JobArrivalHistory()
+    start = datetime(2024, 1, 1, 4, 0)
+    for minutes in range(0, 60, 10):
+        history.record(start + timedelta(minutes=minutes))
+
+    horizon = timedelta(minutes=30)
+    assert history.median_interval() == timedelta(minutes=10)
+    assert history.expects_job(start + timedelta(minutes=60), horizon)
+    assert not history.expects_job(start + timedelta(hours=3), horizon)
+
+
+def test_autoscale_policy_decide():
+    now = datetime(2024, 1, 1, 4, 0)
+    policy = AutoscalePolicy(worker_slots=32, warm_pool_size=2)
+
+    # Demand is the number of workers required by the queued tasks
+    decision = policy.decide(
+        now, queued_slots=100, requested_min_size=0, requested_max_size=10, idle=False
+    )
+    assert decision.min_size == 4
+    assert not decision.allow_shutdown
+
+    decision = policy.decide(
+        now, queued_slots=1000, requested_min_size=0, requested_max_size=10, idle=False
+    )
+    assert decision.min_size == 10
+
+    # Without a day of history the warm pool is kept
+    decision = policy.decide(
+        now, queued_slots=0, requested_min_size=1, requested_max_size=10, idle=True
+    )
+    assert decision.min_size == 2
+    assert not decision.allow_shutdown
+
+    # With history that predicts no jobs the cluster may scale to 0
+    policy.record_job_arrival(now - timedelta(days=2, hours=12))
+    decision = policy.decide(
+        now, queued_slots=0, requested_min_size=1, requested_max_size=10, idle=True
+    )
+    assert decision.min_size == 0
+    assert decision.allow_shutdown
+
+
+def test_autoscale_policy_without_warm_pool():
+    now = datetime(2024, 1, 1, 4, 0)
+    policy = AutoscalePolicy(worker_slots=32)
+    decision = policy.decide(
+        now, queued_slots=0, requested_min_size=1, requested_max_size=10, idle=True
+    )
+    assert decision.min_size == 0
+    assert decision.allow_shutdown
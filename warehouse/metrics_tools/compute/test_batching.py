@@ -0,0 +1,113 @@
+import asyncio
+import math
+from datetime import date, datetime, timedelta
+
+import pytest
+
+from .batching import (
+    AdaptiveBatchPlan,
+    TaskSlots,
+    ThroughputEstimator,
+    query_day_weights,
+)
+
+
+def test_query_day_weights():
+    days = [datetime(2024, 1, day) for day in range(1, 6)]
+    row_counts = {date(2024, 1, day): day * 10 for day in range(1, 6)}
+
+    assert query_day_weights(days, {}) == [1.0] * 5
+    assert query_day_weights(days, row_counts) == [10, 20, 30, 40, 50]
+    # Rolling windows of 3 days read the rows of the last 3 days
+    assert query_day_weights(days, row_counts, window=3, unit="day") == [
+        10,
+        30,
+        60,
+        90,
+        120,
+    ]
+
+
+def test_adaptive_batch_plan_shrinks_batches():
+    days = [datetime(2024, 1, 1) + timedelta(days=i) for i in range(100)]
+    plan = AdaptiveBatchPlan(days, [1.0] * 100, max_batch_days=30)
+    expected_count = plan.estimate_remaining_batches(4)
+
+    sizes = []
+    while batch := plan.next_batch(4):
+        sizes.append(len(batch.days))
+
+    assert sum(sizes) == 100
+    assert len(sizes) == expected_count
+    assert sizes[0] == 25
+    assert sizes == sorted(sizes, reverse=True)
+    assert sizes[-1] == 1
+
+
+def test_adaptive_batch_plan_sizes_by_weight():
+    days = [datetime(2024, 1, 1) + timedelta(days=i) for i in range(10)]
+    # The last day holds most of the work
+    weights = [1.0] * 9 + [100.0]
+    plan = AdaptiveBatchPlan(days, weights, max_batch_days=10)
+
+    first = plan.next_batch(2)
+    assert first is not None
+    assert len(first.days) == 9
+    last = plan.next_batch(2)
+    assert last is not None
+    assert last.days == [days[-1]]
+    assert plan.next_batch(2) is None
+
+
+def test_adaptive_batch_plan_target_weight():
+    days = [datetime(2024, 1, 1) + timedelta(days=i) for i in range(10)]
+    plan = AdaptiveBatchPlan(days, [10.0] * 10, max_batch_days=10)
+    batch = plan.next_batch(1, target_weight=30.0)
+    assert batch is not None
+    assert len(batch.days) == 3
+    assert batch.weight == 30.0
+
+
+def test_throughput_estimator():
+    estimator = ThroughputEstimator(smoothing=0.5)
+    assert estimator.target_batch_weight(60) == math.inf
+
+    estimator.record(100, 10)
+    assert estimator.weight_per_second == 10
+    estimator.record(200, 10)
+    assert estimator.weight_per_second == 15
+    assert estimator.target_batch_weight(60) == 900
+    assert estimator.target_batch_weight(0) == math.inf
+
+
+@pytest.mark.asyncio
+async def test_task_slots():
+    slots = TaskSlots()
+    await slots.acquire(lambda: 2)
+    await slots.acquire(lambda: 2)
+
+    waiting = asyncio.create_task(slots.acquire(lambda: 2))
+    await asyncio.sleep(0.01)
+    assert not waiting.done()
+
+    await slots.release()
+    await asyncio.wait_for(waiting, timeout=1)
+    assert slots.running == 2
+
+
+@pytest.mark.asyncio
+async def test_task_slots_queue_depth():
+    slots = TaskSlots(queue_depth=2, recheck_seconds=0.01)
+    assert slots.limit(0) == 3
+    for _ in range(3):
+        await slots.acquire(lambda: 1)
+
+    capacity = 1
+    waiting = asyncio.create_task(slots.acquire(lambda: capacity))
+    await asyncio.sleep(0.05)
+    assert not waiting.done()
+
+    # The capacity is checked again without any slot being released
+    capacity = 2
+    await asyncio.wait_for(waiting, timeout=1)
+    assert slots.running == 4
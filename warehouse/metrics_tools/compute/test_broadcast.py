@@ -0,0 +1,79 @@
+import asyncio
+
+import pytest
+
+from .broadcast import JobStatusBroadcaster
+from .types import (
+    QueryJobState,
+    QueryJobStateUpdate,
+    QueryJobStatus,
+    QueryJobTaskStatus,
+    QueryJobTaskUpdate,
+    QueryJobUpdate,
+)
+
+
+def complete_task(state: QueryJobState, i: int):
+    state.update(
+        QueryJobUpdate.create_task_update(
+            QueryJobTaskUpdate(status=QueryJobTaskStatus.SUCCEEDED, task_id=f"{i}")
+        )
+    )
+
+
+@pytest.mark.asyncio
+async def test_broadcaster_coalesces_updates_and_sends_final_state():
+    broadcaster = JobStatusBroadcaster(max_updates_per_second=10)
+    state = QueryJobState.start("job_id", 1000)
+    fast = broadcaster.subscribe(state)
+    slow = broadcaster.subscribe(state)
+
+    first = await fast.get(timeout=1)
+    assert first is not None and first.response.progress.completed == 0
+
+    for i in range(1000):
+        complete_task(state, i)
+        broadcaster.publish(state)
+
+    # Only the first update is sent right away. The others are sent together
+    # once the interval has passed.
+    update = await fast.get(timeout=1)
+    assert update is not None and update.response.progress.completed == 1
+    update = await fast.get(timeout=1)
+    assert update is not None and update.response.progress.completed == 1000
+
+    state.update(
+        QueryJobUpdate.create_job_update(
+            QueryJobStateUpdate(
+                status=QueryJobStatus.COMPLETED, has_remaining_tasks=False
+            )
+        )
+    )
+    broadcaster.publish(state)
+    update = await fast.get(timeout=0)
+    assert update is not None and update.is_final
+
+    # The slow subscriber only gets the latest update
+    update = await slow.get(timeout=0)
+    assert update is not None and update.is_final
+    assert slow.dropped > 0
+
+    fast.close()
+    slow.close()
+    assert broadcaster.subscribers_count("job_id") == 0
+    await asyncio.sleep(0)
+
+
+@pytest.mark.asyncio
+async def test_subscription_skips_updates_identical_to_the_snapshot():
+    broadcaster = JobStatusBroadcaster(max_updates_per_second=10)
+    state = QueryJobState.start("job_id", 2)
+    subscription = broadcaster.subscribe(state)
+
+    broadcaster.publish(state)
+    update = await subscription.get(timeout=0)
+    assert update is not None and update.response.progress.completed == 0
+    assert subscription.dropped == 0
+    assert await subscription.get(timeout=0.2) is None
+
+    subscription.close()
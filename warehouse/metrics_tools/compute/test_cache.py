@@ -1,12 +1,23 @@
 import asyncio
+import typing as t
+import uuid
 from datetime import datetime, timedelta
 from unittest.mock import AsyncMock
 
 import pytest
-from metrics_tools.compute.cache import CacheExportManager, FakeExportAdapter
+from metrics_tools.compute.cache import (
+    CacheExportManager,
+    FakeExportAdapter,
+    PendingExport,
+)
+from metrics_tools.compute.cache_index import (
+    CacheEvictionPolicy,
+    DuckDBExportCacheIndex,
+)
 from metrics_tools.compute.types import (
     ColumnsDefinition,
     ExportReference,
+    ExportTimeRange,
     ExportType,
     TableReference,
 )
@@ -72,3 +83,426 @@ async def test_cache_export_manager_fails():
         failed = True
     await cache.stop()
     assert failed, "Expected exception to be raised"
+
+
+@pytest.mark.asyncio
+async def test_cache_export_manager_reuses_fingerprinted_exports(tmp_path):
+    adapter_mock = AsyncMock(FakeExportAdapter)
+    adapter_mock.fingerprint_table.return_value = "snapshot1"
+    adapter_mock.export_table.return_value = ExportReference(
+        table=TableReference(table_name="test"),
+        type=ExportType.GCS,
+        columns=ColumnsDefinition(columns=[]),
+        payload={},
+    )
+    index_path = str(tmp_path / "index.db")
+    cache = await CacheExportManager.setup(
+        adapter_mock,
+        index=DuckDBExportCacheIndex(index_path),
+        use_table_fingerprints=True,
+    )
+    await asyncio.wait_for(
+        cache.resolve_export_references(["table1", "table2"], datetime.now()),
+        timeout=10,
+    )
+    await cache.stop()
+    assert adapter_mock.export_table.call_count == 2
+
+    # A new manager using the same index (e.g. after a restart) should not
+    # export unchanged tables again even with a different execution time
+    cache = await CacheExportManager.setup(
+        adapter_mock,
+        index=DuckDBExportCacheIndex(index_path),
+        use_table_fingerprints=True,
+    )
+    export_map = await asyncio.wait_for(
+        cache.resolve_export_references(
+            ["table1", "table2"], datetime.now() + timedelta(days=1)
+        ),
+        timeout=10,
+    )
+    assert export_map.keys() == {"table1", "table2"}
+    assert adapter_mock.export_table.call_count == 2
+
+    # Changing the fingerprint should trigger a new export
+    adapter_mock.fingerprint_table.return_value = "snapshot2"
+    await asyncio.wait_for(
+        cache.resolve_export_references(["table1"], datetime.now()),
+        timeout=10,
+    )
+    assert adapter_mock.export_table.call_count == 3
+    await cache.stop()
+
+
+@pytest.mark.asyncio
+async def test_cache_export_manager_evicts_expired_exports():
+    adapter_mock = AsyncMock(FakeExportAdapter)
+    adapter_mock.export_table.return_value = ExportReference(
+        table=TableReference(table_name="test"),
+        type=ExportType.GCS,
+        columns=ColumnsDefinition(columns=[]),
+        payload={},
+    )
+    cache = await CacheExportManager.setup(
+        adapter_mock,
+        eviction_policy=CacheEvictionPolicy(ttl_seconds=60, max_entries=2),
+    )
+    execution_time = datetime.now()
+    await asyncio.wait_for(
+        cache.resolve_export_references(["table1", "table2", "table3"], execution_time),
+        timeout=10,
+    )
+
+    evicted = await cache.evict()
+    assert len(evicted) == 1
+    assert adapter_mock.clean_export_table.call_count == 1
+    assert len(await cache.inspect_export_table_references()) == 2
+
+    evicted = await cache.evict(now=datetime.now() + timedelta(minutes=5))
+    assert len(evicted) == 2
+    assert adapter_mock.clean_export_table.call_count == 3
+    assert len(await cache.inspect_export_table_references()) == 0
+    await cache.stop()
+
+
+@pytest.mark.asyncio
+async def unique_export(
+    table: str, execution_time: datetime, columns: t.Optional[t.List[str]] = None
+):
+    # Like the trino adapter, every export is a new table of the source table
+    export_table_name = f"export_{table}_{uuid.uuid4().hex}"
+    return ExportReference(
+        table=TableReference(table_name=table),
+        type=ExportType.GCS,
+        columns=ColumnsDefinition(columns=[]),
+        payload={"gcs_path": f"gs://bucket/{export_table_name}/"},
+        source_metadata={"export_table_name": export_table_name},
+    )
+
+
+@pytest.mark.asyncio
+async def test_cache_export_manager_keeps_pinned_exports():
+    adapter_mock = AsyncMock(FakeExportAdapter)
+    adapter_mock.export_table = AsyncMock(side_effect=unique_export)
+    cache = await CacheExportManager.setup(
+        adapter_mock,
+        eviction_policy=CacheEvictionPolicy(ttl_seconds=60),
+    )
+    export_map = await asyncio.wait_for(
+        cache.resolve_export_references(["table1", "table2"], datetime.now()),
+        timeout=10,
+    )
+    # Two jobs read table1
+    cache.pin_export_references([export_map["table1"]])
+    cache.pin_export_references([export_map["table1"]])
+
+    expired = datetime.now() + timedelta(minutes=5)
+    evicted = await cache.evict(now=expired)
+    assert [entry.table for entry in evicted] == ["table2"]
+
+    cache.unpin_export_references([export_map["table1"]])
+    assert await cache.evict(now=expired) == []
+
+    cache.unpin_export_references([export_map["table1"]])
+    evicted = await cache.evict(now=expired)
+    assert [entry.table for entry in evicted] == ["table1"]
+    assert adapter_mock.clean_export_table.call_count == 2
+    await cache.stop()
+
+
+@pytest.mark.asyncio
+async def test_cache_export_manager_evicts_older_exports_of_pinned_tables():
+    adapter_mock = AsyncMock(FakeExportAdapter)
+    adapter_mock.export_table = AsyncMock(side_effect=unique_export)
+    cache = await CacheExportManager.setup(
+        adapter_mock,
+        eviction_policy=CacheEvictionPolicy(ttl_seconds=60),
+    )
+    old_export = await asyncio.wait_for(
+        cache.resolve_export_references(["table1"], datetime.now()), timeout=10
+    )
+    new_export = await asyncio.wait_for(
+        cache.resolve_export_references(["table1"], datetime.now() + timedelta(days=1)),
+        timeout=10,
+    )
+    cache.pin_export_references([new_export["table1"]])
+    assert not cache.is_export_pinned(old_export["table1"])
+
+    evicted = await cache.evict(now=datetime.now() + timedelta(minutes=5))
+    assert [entry.export_reference for entry in evicted] == [old_export["table1"]]
+    adapter_mock.clean_export_table.assert_called_once_with(old_export["table1"])
+    await cache.stop()
+
+
+@pytest.mark.asyncio
+async def test_cache_export_manager_limits_concurrent_exports():
+    in_flight = 0
+    max_in_flight = 0
+
+    async def slow_export(
+        table: str, execution_time: datetime, columns: t.Optional[t.List[str]] = None
+    ):
+        nonlocal in_flight, max_in_flight
+        in_flight += 1
+        max_in_flight = max(max_in_flight, in_flight)
+        await asyncio.sleep(0.1)
+        in_flight -= 1
+        return ExportReference(
+            table=TableReference(table_name=table),
+            type=ExportType.GCS,
+            columns=ColumnsDefinition(columns=[]),
+            payload={},
+        )
+
+    adapter_mock = AsyncMock(FakeExportAdapter)
+    adapter_mock.export_table = AsyncMock(side_effect=slow_export)
+    adapter_mock.estimate_table_size.return_value = None
+    cache = await CacheExportManager.setup(adapter_mock, max_concurrent_exports=2)
+
+    export_map = await asyncio.wait_for(
+        cache.resolve_export_references(
+            [f"table{i}" for i in range(6)], datetime.now()
+        ),
+        timeout=10,
+    )
+    assert len(export_map) == 6
+    assert max_in_flight == 2
+
+    stats = cache.stats()
+    assert stats.completed == 6
+    assert stats.queue_depth == 0
+    assert stats.in_flight == 0
+    await cache.stop()
+
+
+@pytest.mark.asyncio
+async def test_cache_export_manager_retries_failed_exports():
+    adapter_mock = AsyncMock(FakeExportAdapter)
+    adapter_mock.estimate_table_size.return_value = None
+    adapter_mock.export_table = AsyncMock(
+        side_effect=[
+            TestException("test"),
+            ExportReference(
+                table=TableReference(table_name="table1"),
+                type=ExportType.GCS,
+                columns=ColumnsDefinition(columns=[]),
+                payload={},
+            ),
+        ]
+    )
+    cache = await CacheExportManager.setup(
+        adapter_mock, export_retries=1, retry_backoff_seconds=0.1
+    )
+
+    export_map = await asyncio.wait_for(
+        cache.resolve_export_references(["table1"], datetime.now()), timeout=5
+    )
+    assert export_map.keys() == {"table1"}
+    assert adapter_mock.export_table.call_count == 2
+
+    stats = cache.stats()
+    assert stats.retried == 1
+    assert stats.failed == 0
+    await cache.stop()
+
+
+@pytest.mark.asyncio
+async def test_cache_export_manager_extends_partial_exports():
+    adapter = FakeExportAdapter()
+    adapter_mock = AsyncMock(FakeExportAdapter)
+    adapter_mock.estimate_table_size.return_value = None
+    adapter_mock.export_table = AsyncMock(wraps=adapter.export_table)
+    adapter_mock.export_table_slice = AsyncMock(wraps=adapter.export_table_slice)
+    adapter_mock.extend_export_table_slice = AsyncMock(
+        wraps=adapter.extend_export_table_slice
+    )
+    cache = await CacheExportManager.setup(adapter_mock)
+    execution_time = datetime.now()
+
+    def time_range(start: datetime, end: datetime):
+        return ExportTimeRange(column="bucket_day", start=start, end=end)
+
+    export_map = await asyncio.wait_for(
+        cache.resolve_export_references(
+            ["table1"],
+            execution_time,
+            {"table1": time_range(datetime(2024, 1, 10), datetime(2024, 1, 20))},
+        ),
+        timeout=5,
+    )
+    assert export_map["table1"].time_range == time_range(
+        datetime(2024, 1, 10), datetime(2024, 1, 20)
+    )
+    assert adapter_mock.export_table_slice.call_count == 1
+
+    # A range within the exported range is a cache hit
+    await asyncio.wait_for(
+        cache.resolve_export_references(
+            ["table1"],
+            execution_time,
+            {"table1": time_range(datetime(2024, 1, 12), datetime(2024, 1, 18))},
+        ),
+        timeout=1,
+    )
+    assert adapter_mock.export_table_slice.call_count == 1
+    assert adapter_mock.extend_export_table_slice.call_count == 0
+
+    # A larger range extends the existing export
+    export_map = await asyncio.wait_for(
+        cache.resolve_export_references(
+            ["table1"],
+            execution_time,
+            {"table1": time_range(datetime(2024, 1, 1), datetime(2024, 1, 15))},
+        ),
+        timeout=5,
+    )
+    assert export_map["table1"].time_range == time_range(
+        datetime(2024, 1, 1), datetime(2024, 1, 20)
+    )
+    assert adapter_mock.export_table_slice.call_count == 1
+    assert adapter_mock.extend_export_table_slice.call_count == 1
+
+    # Full exports satisfy any range
+    await cache.add_export_table_reference(
+        "table2",
+        execution_time,
+        ExportReference(
+            table=TableReference(table_name="table2"),
+            type=ExportType.GCS,
+            columns=ColumnsDefinition(columns=[]),
+            payload={},
+        ),
+    )
+    export_map = await asyncio.wait_for(
+        cache.resolve_export_references(
+            ["table2"],
+            execution_time,
+            {"table2": time_range(datetime(2024, 1, 1), datetime(2024, 1, 15))},
+        ),
+        timeout=1,
+    )
+    assert export_map["table2"].time_range is None
+    assert adapter_mock.export_table.call_count == 0
+    await cache.stop()
+
+
+@pytest.mark.asyncio
+async def test_cache_export_manager_shares_column_pruned_exports():
+    adapter = FakeExportAdapter()
+    adapter_mock = AsyncMock(FakeExportAdapter)
+    adapter_mock.estimate_table_size.return_value = None
+    adapter_mock.export_table = AsyncMock(wraps=adapter.export_table)
+    adapter_mock.clean_export_table = AsyncMock(wraps=adapter.clean_export_table)
+    cache = await CacheExportManager.setup(
+        adapter_mock, eviction_policy=CacheEvictionPolicy(ttl_seconds=60)
+    )
+    execution_time = datetime.now()
+
+    export_map = await asyncio.wait_for(
+        cache.resolve_export_references(
+            ["table1"], execution_time, columns={"table1": ["a", "b"]}
+        ),
+        timeout=5,
+    )
+    assert export_map["table1"].selected_columns == ["a", "b"]
+
+    # A subset of the exported columns is a cache hit
+    export_map = await asyncio.wait_for(
+        cache.resolve_export_references(
+            ["table1"], execution_time, columns={"table1": ["B"]}
+        ),
+        timeout=1,
+    )
+    assert export_map["table1"].selected_columns == ["a", "b"]
+    assert adapter_mock.export_table.call_count == 1
+
+    # Other columns replace the export with one of the columns of both
+    export_map = await asyncio.wait_for(
+        cache.resolve_export_references(
+            ["table1"], execution_time, columns={"table1": ["b", "c"]}
+        ),
+        timeout=5,
+    )
+    assert export_map["table1"].selected_columns == ["a", "b", "c"]
+    assert adapter_mock.export_table.call_count == 2
+    assert len(await cache.inspect_export_table_references()) == 2
+
+    # The replaced export is only cleaned once it's evicted
+    assert adapter_mock.clean_export_table.call_count == 0
+    await cache.index.touch(
+        cache.columns_table_key(cache.export_table_key("table1", execution_time)),
+        datetime.now() + timedelta(minutes=5),
+    )
+    evicted = await cache.evict(now=datetime.now() + timedelta(minutes=2))
+    assert [entry.export_reference.selected_columns for entry in evicted] == [
+        ["a", "b"]
+    ]
+
+    # Requests for all of the columns need a full export
+    export_map = await asyncio.wait_for(
+        cache.resolve_export_references(["table1"], execution_time),
+        timeout=5,
+    )
+    assert export_map["table1"].selected_columns is None
+    assert adapter_mock.export_table.call_count == 3
+    await cache.stop()
+
+
+def test_pending_export_priority():
+    now = datetime.now()
+
+    def pending(table: str, waiters: int, estimated_size: t.Optional[float]):
+        return PendingExport(
+            table=table,
+            execution_time=now,
+            cache_key=table,
+            enqueued_at=now,
+            next_attempt_at=now,
+            waiters=waiters,
+            estimated_size=estimated_size,
+        )
+
+    exports = [
+        pending("big", 1, 1000),
+        pending("unknown", 1, None),
+        pending("small", 1, 10),
+        pending("popular", 3, 5000),
+    ]
+    ordered = sorted(exports, key=lambda p: p.priority())
+    assert [p.table for p in ordered] == ["popular", "small", "big", "unknown"]
+
+
+@pytest.mark.asyncio
+async def test_cache_export_manager_waits_for_size_estimates():
+    sizes = {f"table{i}": 10.0**i for i in range(5)}
+    exported: t.List[str] = []
+
+    async def slow_estimate(table: str):
+        # The estimates arrive after the exports have been queued
+        await asyncio.sleep(0.05)
+        return sizes[table]
+
+    async def record_export(
+        table: str, execution_time: datetime, columns: t.Optional[t.List[str]] = None
+    ):
+        exported.append(table)
+        return ExportReference(
+            table=TableReference(table_name=table),
+            type=ExportType.GCS,
+            columns=ColumnsDefinition(columns=[]),
+            payload={},
+        )
+
+    adapter_mock = AsyncMock(FakeExportAdapter)
+    adapter_mock.estimate_table_size = AsyncMock(side_effect=slow_estimate)
+    adapter_mock.export_table = AsyncMock(side_effect=record_export)
+    cache = await CacheExportManager.setup(
+        adapter_mock, max_concurrent_exports=1, size_estimate_wait_seconds=1.0
+    )
+
+    await asyncio.wait_for(
+        cache.resolve_export_references(list(sizes), datetime.now()),
+        timeout=5,
+    )
+    assert exported == list(sizes)
+    await cache.stop()
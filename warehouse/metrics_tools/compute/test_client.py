@@ -0,0 +1,140 @@
+import asyncio
+import json
+import typing as t
+from contextlib import asynccontextmanager
+from datetime import datetime
+
+import httpx
+import pytest
+from metrics_tools.compute.client import AsyncClient, BaseAsyncWebsocketConnector
+from metrics_tools.compute.types import (
+    ColumnsDefinition,
+    ExportReference,
+    ExportType,
+    JobStatusResponse,
+    JobSubmitRequest,
+    JobSubmitResponse,
+    QueryJobProgress,
+    QueryJobStatus,
+    TableReference,
+)
+from metrics_tools.definition import PeerMetricDependencyRef
+
+
+def job_status(job_id: str, status: QueryJobStatus, completed: int = 0):
+    return JobStatusResponse(
+        job_id=job_id,
+        created_at=datetime.now(),
+        updated_at=datetime.now(),
+        status=status,
+        progress=QueryJobProgress(completed=completed, total=2),
+    )
+
+
+class FakeService:
+    def __init__(self, failing_metrics: t.Set[str]):
+        self.failing_metrics = failing_metrics
+        self.requests: t.List[str] = []
+        self.connections = 0
+        self.metrics: t.Dict[str, str] = {}
+
+    def handle(self, request: httpx.Request):
+        self.requests.append(request.url.path)
+        if request.url.path == "/cluster/start":
+            return httpx.Response(
+                200,
+                json=dict(status="started", is_ready=True, dashboard_url="", workers=1),
+            )
+        body = json.loads(request.content)
+        job_id = f"job_{len(self.metrics)}"
+        self.metrics[job_id] = body["ref"]["name"]
+        response = JobSubmitResponse(
+            job_id=job_id,
+            export_reference=ExportReference(
+                table=TableReference(table_name=body["ref"]["name"]),
+                type=ExportType.GCS,
+                columns=ColumnsDefinition(columns=[]),
+                payload={},
+            ),
+        )
+        return httpx.Response(200, json=json.loads(response.model_dump_json()))
+
+    @asynccontextmanager
+    async def connect(self, *, base_url: str, path: str):
+        self.connections += 1
+        yield FakeStatusStream(self)
+
+
+class FakeStatusStream(BaseAsyncWebsocketConnector):
+    def __init__(self, service: FakeService):
+        self.service = service
+        self.messages: asyncio.Queue[str] = asyncio.Queue()
+
+    async def receive(self):
+        return await self.messages.get()
+
+    async def send(self, data: str):
+        for job_id in json.loads(data)["job_ids"]:
+            final = (
+                QueryJobStatus.FAILED
+                if self.service.metrics[job_id] in self.service.failing_metrics
+                else QueryJobStatus.COMPLETED
+            )
+            for status in [
+                job_status(job_id, QueryJobStatus.RUNNING, 1),
+                job_status(job_id, final, 2),
+            ]:
+                await self.messages.put(status.model_dump_json())
+
+
+def submit_request(name: str):
+    return JobSubmitRequest(
+        query_str="SELECT * FROM test",
+        start=datetime(2024, 1, 1),
+        end=datetime(2024, 1, 2),
+        dialect="duckdb",
+        batch_size=1,
+        columns=[],
+        ref=PeerMetricDependencyRef(
+            name=name, entity_type="artifact", window=1, unit="day"
+        ),
+        locals={},
+        dependent_tables_map={},
+        execution_time=datetime.now(),
+    )
+
+
+@pytest.mark.asyncio
+async def test_async_client_multiplexes_jobs():
+    service = FakeService(failing_metrics={"metric_2", "metric_5"})
+    client = AsyncClient(
+        httpx.AsyncClient(
+            base_url="http://mcs", transport=httpx.MockTransport(service.handle)
+        ),
+        retries=1,
+        websocket_connect_factory=service.connect,
+    )
+    progress: t.List[JobStatusResponse] = []
+
+    async with client:
+        references = await client.calculate_metrics_batch(
+            [submit_request(f"metric_{i}") for i in range(4)],
+            progress_handler=progress.append,
+            do_not_raise_on_failure=True,
+        )
+
+        assert [ref.table.table_name if ref else None for ref in references] == [
+            "metric_0",
+            "metric_1",
+            None,
+            "metric_3",
+        ]
+        assert service.requests.count("/cluster/start") == 1
+        assert service.connections == 1
+        assert len(progress) == 4
+
+        with pytest.raises(Exception):
+            await client.calculate_metrics_batch(
+                [submit_request("metric_4"), submit_request("metric_5")]
+            )
+        assert service.connections == 1
@@ -0,0 +1,112 @@
+import os
+import typing as t
+from datetime import date, timedelta
+
+import duckdb
+import pyarrow as pa
+import pyarrow.parquet as pq
+import pytest
+from fsspec.implementations.local import LocalFileSystem
+
+from .compaction import CompactionError, compact_parquet_files
+from .types import ResultCompactionOptions
+
+
+def write_result_files(directory: str, files: int, rows_per_file: int):
+    os.makedirs(directory)
+    for i in range(files):
+        # Each task writes the metrics of a few days in no particular order
+        days = [date(2024, 1, 1) + timedelta(days=(i * 7 + j) % 10) for j in range(3)]
+        table = pa.table(
+            {
+                "metrics_sample_date": [
+                    days[j % len(days)] for j in range(rows_per_file)
+                ],
+                "to_artifact_id": [f"artifact_{i}_{j}" for j in range(rows_per_file)],
+                "amount": [float(j) for j in range(rows_per_file)],
+            }
+        )
+        pq.write_table(table, f"{directory}/{i}.parquet")
+
+
+@pytest.fixture
+def result_dir(tmp_path):
+    directory = str(tmp_path / "job")
+    write_result_files(directory, files=20, rows_per_file=500)
+    return directory
+
+
+def test_compaction_merges_and_sorts_files(result_dir: str):
+    conn = duckdb.connect()
+    fs = LocalFileSystem()
+    options = ResultCompactionOptions(
+        target_file_bytes=4_000,
+        sort_by=["metrics_sample_date", "to_artifact_id"],
+        row_group_size=1_000,
+    )
+
+    compaction = compact_parquet_files(
+        conn, fs, result_dir, f"{result_dir}/compacted", options
+    )
+
+    assert compaction.source_files == 20
+    assert compaction.rows == 10_000
+    # Files are at least a row group
+    assert len(compaction.files) == 10
+    table = pa.concat_tables([pq.read_table(path) for path in compaction.files])
+    assert table.num_rows == 10_000
+    dates = t.cast(t.List[date], table.column("metrics_sample_date").to_pylist())
+    assert dates == sorted(dates)
+
+    # A new compaction replaces the previous one
+    compaction = compact_parquet_files(
+        conn, fs, result_dir, f"{result_dir}/compacted", options
+    )
+    assert len(fs.ls(f"{result_dir}/compacted")) == 10
+
+
+def test_compaction_writes_hive_partitions(result_dir: str):
+    conn = duckdb.connect()
+    fs = LocalFileSystem()
+    options = ResultCompactionOptions(
+        sort_by=["to_artifact_id"],
+        partition_by="metrics_sample_date",
+    )
+
+    compaction = compact_parquet_files(
+        conn, fs, result_dir, f"{result_dir}/compacted", options
+    )
+
+    partitions = sorted(os.listdir(f"{result_dir}/compacted"))
+    assert partitions == [
+        f"metrics_sample_date={date(2024, 1, 1) + timedelta(days=i)}" for i in range(10)
+    ]
+    assert len(compaction.files) == 10
+    assert compaction.partition_by == "metrics_sample_date"
+
+    partitioned = conn.execute(
+        f"""
+        SELECT metrics_sample_date, count(*)
+        FROM read_parquet('{result_dir}/compacted/*/*.parquet', hive_partitioning = true)
+        GROUP BY 1
+        """
+    ).fetchall()
+    original = conn.execute(
+        f"""
+        SELECT metrics_sample_date, count(*)
+        FROM read_parquet('{result_dir}/*.parquet')
+        GROUP BY 1
+        """
+    ).fetchall()
+    assert sorted(partitioned) == sorted(original)
+
+
+def test_compaction_requires_files(tmp_path):
+    with pytest.raises(CompactionError):
+        compact_parquet_files(
+            duckdb.connect(),
+            LocalFileSystem(),
+            str(tmp_path),
+            str(tmp_path / "compacted"),
+            ResultCompactionOptions(),
+        )
@@ -0,0 +1,66 @@
+from .placement import LocalityTaskPlacer, WorkerCapacity, worker_capacities
+from .types import ColumnsDefinition, ExportReference, ExportType, TableReference
+
+
+def export_reference(name: str):
+    return ExportReference(
+        table=TableReference(table_name=name),
+        type=ExportType.GCS,
+        columns=ColumnsDefinition(columns=[("col1", "INT")], dialect="duckdb"),
+        payload={"gcs_path": f"gs://bucket/export/{name}"},
+    )
+
+
+def capacities(**tasks: int):
+    return {
+        address: WorkerCapacity(address=address, tasks=count)
+        for address, count in tasks.items()
+    }
+
+
+def test_worker_capacities():
+    result = worker_capacities(
+        {
+            "workers": {
+                "a": {"resources": {"slots": 32}, "nthreads": 8},
+                "b": {"resources": {"slots": 4}, "nthreads": 8},
+                "c": {"resources": {}, "nthreads": 2},
+            }
+        },
+        slots=16,
+    )
+    assert {address: capacity.tasks for address, capacity in result.items()} == {
+        "a": 2,
+        "b": 1,
+        "c": 2,
+    }
+
+
+def test_locality_task_placer():
+    placer = LocalityTaskPlacer()
+    deps = {
+        "source.foo": export_reference("foo"),
+        "source.bar": export_reference("bar"),
+    }
+    workers = capacities(a=1, b=1, c=1)
+
+    # Nothing is known so the scheduler decides
+    assert placer.place(deps, workers) is None
+    placer.task_finished(None, ["a"], {"source.foo": deps["source.foo"]})
+    placer.task_finished(None, ["b"], deps)
+
+    # b holds both dependencies
+    assert placer.place(deps, workers) == "b"
+    # b is busy so the next best worker is used
+    assert placer.place(deps, workers) == "a"
+    # all workers holding the dependencies are busy
+    assert placer.place(deps, workers) is None
+
+    placer.task_finished("b", ["b"], deps)
+    assert placer.place(deps, workers) == "b"
+    placer.task_failed("b")
+    placer.task_failed("a")
+
+    # Workers that left the cluster are forgotten
+    assert placer.place(deps, capacities(a=1, c=1)) == "a"
+    assert placer.holders(deps["source.bar"]) == set()
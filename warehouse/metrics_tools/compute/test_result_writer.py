@@ -0,0 +1,47 @@
+import duckdb
+import pyarrow.parquet as pq
+
+from .result_writer import ParquetResultWriter
+
+
+def test_parquet_result_writer_streams_row_groups(tmp_path):
+    conn = duckdb.connect()
+    path = tmp_path / "result.parquet"
+    queries = [
+        f"""
+        SELECT
+            DATE '2024-01-01' + INTERVAL {day} DAY AS metrics_sample_date,
+            CAST(i AS VARCHAR) AS to_artifact_id,
+            SUM(i) OVER () AS amount
+        FROM range(0, 250) AS r(i)
+        """
+        for day in range(4)
+    ]
+    with open(path, "wb") as f:
+        with ParquetResultWriter(f, row_group_size=100) as writer:
+            for query in queries:
+                assert writer.write_query(conn, query) == 250
+    assert writer.rows_written == 1000
+
+    parquet_file = pq.ParquetFile(path)
+    assert parquet_file.metadata.num_rows == 1000
+    assert parquet_file.metadata.num_row_groups == 10
+    assert parquet_file.schema_arrow.names == [
+        "metrics_sample_date",
+        "to_artifact_id",
+        "amount",
+    ]
+
+
+def test_parquet_result_writer_casts_to_first_schema(tmp_path):
+    conn = duckdb.connect()
+    path = tmp_path / "result.parquet"
+    with open(path, "wb") as f:
+        with ParquetResultWriter(f) as writer:
+            writer.write_query(conn, "SELECT 1::BIGINT AS amount")
+            writer.write_query(conn, "SELECT 2::INTEGER AS amount")
+            writer.write_query(conn, "SELECT 1::BIGINT AS amount WHERE false")
+
+    table = pq.read_table(path)
+    assert table.column("amount").to_pylist() == [1, 2]
+    assert str(table.schema.field("amount").type) == "int64"
@@ -3,8 +3,14 @@ import typing as t
 from datetime import datetime
 
 import pytest
+from metrics_tools.compute.batching import TaskSlots
 from metrics_tools.compute.cache import CacheExportManager, FakeExportAdapter
 from metrics_tools.compute.cluster import ClusterManager, LocalClusterFactory
+from metrics_tools.compute.placement import (
+    LocalityTaskPlacer,
+    SpreadTaskPlacer,
+    TaskPlacer,
+)
 from metrics_tools.compute.result import DummyImportAdapter
 from metrics_tools.compute.service import MetricsCalculationService
 from metrics_tools.compute.types import (
@@ -21,7 +27,8 @@ from metrics_tools.definition import PeerMetricDependencyRef
 
 
 @pytest.mark.asyncio
-async def test_metrics_calculation_service():
+@pytest.mark.parametrize("task_placer", [SpreadTaskPlacer(), LocalityTaskPlacer()])
+async def test_metrics_calculation_service(task_placer: TaskPlacer):
     service = MetricsCalculationService.setup(
         "someid",
         "bucket",
@@ -29,6 +36,7 @@ async def test_metrics_calculation_service():
         ClusterManager.with_dummy_metrics_plugin(LocalClusterFactory()),
         await CacheExportManager.setup(FakeExportAdapter()),
         DummyImportAdapter(),
+        task_placer=task_placer,
     )
     await service.start_cluster(ClusterStartRequest(min_size=1, max_size=1))
     await service.add_existing_exported_table_references(
@@ -84,6 +92,17 @@ async def test_metrics_calculation_service():
 
     status = await service.get_job_status(response.job_id)
     assert status.status == QueryJobStatus.COMPLETED
+    # Finished jobs don't hold on to their slots
+    assert response.job_id not in service.job_slots
+    assert await service.queued_slots() == 0
+
+    dependency = await service.cache_manager.resolve_export_references(
+        ["source.table123"], datetime.now()
+    )
+    # Finished jobs don't keep their dependencies from being evicted
+    assert not service.cache_manager.is_export_pinned(dependency["source.table123"])
+    if isinstance(task_placer, LocalityTaskPlacer):
+        assert len(task_placer.holders(dependency["source.table123"])) == 1
 
     await service.close()
 
@@ -154,3 +173,138 @@ async def test_metrics_calculation_service_using_monthly_cron():
     assert status.status == QueryJobStatus.COMPLETED
 
     await service.close()
+
+
+class NoQueriesRunner:
+    def iter_query_days(self, start: datetime, end: datetime):
+        yield start
+
+    def render_rolling_batch(self, days: t.List[datetime]) -> t.List[str]:
+        return []
+
+
+@pytest.mark.asyncio
+async def test_resolve_dependency_columns_without_queries(
+    monkeypatch: pytest.MonkeyPatch,
+):
+    service = MetricsCalculationService.setup(
+        "someid",
+        "bucket",
+        "result_path_prefix",
+        ClusterManager.with_dummy_metrics_plugin(LocalClusterFactory()),
+        await CacheExportManager.setup(FakeExportAdapter()),
+        DummyImportAdapter(),
+    )
+    monkeypatch.setattr(service, "create_runner", lambda input: NoQueriesRunner())
+    request = JobSubmitRequest(
+        query_str="SELECT * FROM ref.table123",
+        start=datetime(2021, 1, 1),
+        end=datetime(2021, 1, 3),
+        dialect="duckdb",
+        batch_size=1,
+        columns=[("col1", "int")],
+        ref=PeerMetricDependencyRef(
+            name="test",
+            entity_type="artifact",
+            window=30,
+            unit="day",
+            cron="@daily",
+        ),
+        execution_time=datetime.now(),
+        locals={},
+        dependent_tables_map={"source.table123": "source.table123"},
+    )
+
+    # Every table is exported with all of its columns
+    assert await service.resolve_dependency_columns(request) == {}
+
+    await service.close()
+
+
+class FakeSchedulerClient:
+    def __init__(self, workers: int):
+        self.workers = workers
+
+    def scheduler_info(self) -> t.Dict[str, t.Any]:
+        return {
+            "workers": {
+                f"tcp://worker-{i}": {"nthreads": 1} for i in range(self.workers)
+            }
+        }
+
+
+class FakeClusterManager:
+    def __init__(self, client: FakeSchedulerClient):
+        self._client = client
+
+    @property
+    async def client(self):
+        return self._client
+
+
+@pytest.mark.asyncio
+async def test_batch_query_submits_tasks_for_workers_that_join():
+    client = FakeSchedulerClient(workers=1)
+    service = MetricsCalculationService(
+        "someid",
+        "bucket",
+        "result_path_prefix",
+        t.cast(ClusterManager, FakeClusterManager(client)),
+        t.cast(CacheExportManager, None),
+        DummyImportAdapter(),
+        task_queue_depth=2,
+    )
+    submitted: t.List[str] = []
+    finish = asyncio.Event()
+
+    async def run_batch_task(slots: TaskSlots, batch, job_id, task_id, *args, **kwargs):
+        submitted.append(task_id)
+        try:
+            await finish.wait()
+        finally:
+            await slots.release()
+
+    async def notify(*args, **kwargs):
+        pass
+
+    setattr(service, "_run_batch_task", run_batch_task)
+    setattr(service, "_notify_job_running", notify)
+    setattr(service, "_notify_job_tasks_count", notify)
+
+    input = JobSubmitRequest(
+        query_str="SELECT * FROM ref.table123",
+        start=datetime(2021, 1, 1),
+        end=datetime(2021, 1, 20),
+        dialect="duckdb",
+        batch_size=1,
+        columns=[("col1", "int"), ("col2", "string")],
+        ref=PeerMetricDependencyRef(
+            name="test", entity_type="artifact", window=30, unit="day", cron="@daily"
+        ),
+        execution_time=datetime.now(),
+        locals={},
+        dependent_tables_map={},
+    )
+    batching = asyncio.create_task(
+        service._batch_query_to_scheduler("job", "result_path", input, {})
+    )
+
+    async def wait_for_submitted(count: int):
+        while len(submitted) < count:
+            await asyncio.sleep(0.01)
+
+    # The one connected worker can run one task. Two more are queued.
+    await asyncio.wait_for(wait_for_submitted(3), timeout=5)
+    await asyncio.sleep(0.1)
+    assert len(submitted) == 3
+
+    # Workers that join are given tasks without waiting for a task to finish
+    client.workers = 4
+    await asyncio.wait_for(wait_for_submitted(6), timeout=5)
+    await asyncio.sleep(0.1)
+    assert len(submitted) == 6
+
+    finish.set()
+    tasks = await asyncio.wait_for(batching, timeout=10)
+    await asyncio.gather(*tasks)
+    assert len(submitted) == len(tasks)
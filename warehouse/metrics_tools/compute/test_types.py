@@ -1,6 +1,11 @@
+from datetime import datetime
+
 import pytest
+from metrics_tools.definition import PeerMetricDependencyRef
 
 from .types import (
+    ExportTimeRange,
+    JobSubmitRequest,
     QueryJobState,
     QueryJobStateUpdate,
     QueryJobStatus,
@@ -162,3 +167,115 @@ def test_query_job_state(
     response = state.as_response()
     assert response.status == expected_status, description
     assert len(response.exceptions) == expected_exceptions_count, description
+
+
+def test_query_job_state_aggregates_updates():
+    state = QueryJobState.start("job_id", 1000)
+    state.update(
+        QueryJobUpdate.create_job_update(
+            QueryJobStateUpdate(status=QueryJobStatus.RUNNING, has_remaining_tasks=True)
+        )
+    )
+    snapshot = state.snapshot()
+    for i in range(1000):
+        state.update(
+            QueryJobUpdate.create_task_update(
+                QueryJobTaskUpdate(
+                    status=QueryJobTaskStatus.FAILED,
+                    task_id=f"task_{i}",
+                    exception=f"failed {i}",
+                )
+            )
+        )
+    state.update(
+        QueryJobUpdate.create_job_update(
+            QueryJobStateUpdate(
+                status=QueryJobStatus.COMPLETED, has_remaining_tasks=False
+            )
+        )
+    )
+
+    assert state.updates is None
+    assert len(state.exceptions) == state.max_exceptions
+    response = state.as_response(include_stats=True, include_exceptions_count=3)
+    assert response.progress.completed == 1000
+    assert response.status == QueryJobStatus.FAILED
+    assert response.exceptions == ["failed 999", "failed 998", "failed 997"]
+    assert set(response.stats.keys()) == {
+        "pending_to_running_seconds",
+        "running_to_completed_seconds",
+        "running_to_failed_seconds",
+    }
+    assert response.updated_at == state.latest_update().time
+
+    # Snapshots don't change with the state
+    assert snapshot.tasks_completed == 0
+    assert snapshot.exceptions == []
+
+
+def test_query_job_state_keeps_updates_if_requested():
+    state = QueryJobState.start("job_id", 4, keep_updates=True)
+    state.update(
+        QueryJobUpdate.create_task_update(
+            QueryJobTaskUpdate(status=QueryJobTaskStatus.SUCCEEDED, task_id="task_id")
+        )
+    )
+    assert state.updates is not None and len(state.updates) == 2
+    assert state.snapshot().updates is None
+
+
+def test_export_time_range_missing_ranges():
+    exported = ExportTimeRange(
+        column="bucket_day", start=datetime(2024, 1, 10), end=datetime(2024, 1, 20)
+    )
+    requested = ExportTimeRange(
+        column="bucket_day", start=datetime(2024, 1, 1), end=datetime(2024, 2, 1)
+    )
+    assert not exported.covers(requested)
+    assert exported.missing_ranges(requested) == [
+        ExportTimeRange(
+            column="bucket_day", start=datetime(2024, 1, 1), end=datetime(2024, 1, 9)
+        ),
+        ExportTimeRange(
+            column="bucket_day", start=datetime(2024, 1, 21), end=datetime(2024, 2, 1)
+        ),
+    ]
+    assert exported.union(requested).covers(requested)
+    assert exported.missing_ranges(exported) == []
+
+
+@pytest.mark.parametrize(
+    "window,unit,expected_start",
+    [
+        (30, "day", datetime(2023, 12, 3)),
+        (1, "day", datetime(2024, 1, 1)),
+        (6, "month", datetime(2023, 8, 1)),
+        (None, None, None),
+    ],
+)
+def test_job_submit_request_dependency_time_bounds(
+    window, unit, expected_start: datetime | None
+):
+    request = JobSubmitRequest(
+        query_str="SELECT * FROM foo",
+        start=datetime(2024, 1, 1),
+        end=datetime(2024, 1, 31),
+        dialect="duckdb",
+        batch_size=1,
+        columns=[],
+        ref=PeerMetricDependencyRef(
+            name="test",
+            entity_type="artifact",
+            window=window,
+            unit=unit,
+            cron="@daily",
+        ),
+        execution_time=datetime.now(),
+        locals={},
+        dependent_tables_map={},
+    )
+    bounds = request.dependency_time_bounds()
+    if expected_start is None:
+        assert bounds is None
+    else:
+        assert bounds == (expected_start, datetime(2024, 1, 31))
@@ -0,0 +1,121 @@
+import os
+import typing as t
+from datetime import datetime
+
+import duckdb
+import pytest
+from fsspec.implementations.local import LocalFileSystem
+from metrics_tools.compute.types import (
+    ColumnsDefinition,
+    ExportReference,
+    ExportTimeRange,
+    ExportType,
+    TableReference,
+    WorkerCacheMode,
+)
+from metrics_tools.compute.worker_cache import WorkerTableCache
+
+
+def write_export(conn: duckdb.DuckDBPyConnection, path: str, rows: int):
+    os.makedirs(path, exist_ok=True)
+    conn.execute(
+        f"COPY (SELECT range AS id FROM range({rows})) TO '{os.path.join(path, 'data.parquet')}'"
+    )
+    return ExportReference(
+        table=TableReference(table_name="events"),
+        type=ExportType.GCS,
+        columns=ColumnsDefinition(columns=[("id", "BIGINT")]),
+        payload={"gcs_path": path},
+    )
+
+
+@pytest.fixture
+def conn():
+    conn = duckdb.connect()
+    yield conn
+    conn.close()
+
+
+@pytest.mark.parametrize("mode", [WorkerCacheMode.TABLE, WorkerCacheMode.LOCAL_PARQUET])
+def test_worker_table_cache_is_keyed_by_export(
+    tmp_path, conn: duckdb.DuckDBPyConnection, mode: WorkerCacheMode
+):
+    cache = WorkerTableCache(
+        lambda: conn.cursor(),
+        LocalFileSystem(),
+        mode=mode,
+        local_dir=str(tmp_path / "local"),
+    )
+    cache.setup()
+    export_0 = write_export(conn, str(tmp_path / "export_0"), 10)
+    export_1 = write_export(conn, str(tmp_path / "export_1"), 20)
+
+    query = "SELECT COUNT(*) FROM metrics.events WHERE events.id >= 0"
+    with cache.tables({"metrics.events": export_0}) as tables_map:
+        rewritten = cache.rewrite_query(query, tables_map)
+        assert conn.execute(rewritten).fetchone() == (10,)
+
+    # A new export of the same table must not use the previously loaded table
+    with cache.tables({"metrics.events": export_1}) as tables_map:
+        rewritten = cache.rewrite_query(query, tables_map)
+        assert conn.execute(rewritten).fetchone() == (20,)
+
+
+def test_worker_table_cache_evicts_least_recently_used(
+    tmp_path, conn: duckdb.DuckDBPyConnection
+):
+    exports = [
+        write_export(conn, str(tmp_path / f"export_{i}"), 1000) for i in range(3)
+    ]
+    export_size = t.cast(
+        int, LocalFileSystem().du(exports[0].payload["gcs_path"], total=True)
+    )
+
+    cache = WorkerTableCache(
+        lambda: conn.cursor(), LocalFileSystem(), max_bytes=export_size * 2
+    )
+    cache.setup()
+
+    with cache.tables({"a": exports[0]}):
+        pass
+    with cache.tables({"b": exports[1]}):
+        # The first export isn't in use and is evicted to make room
+        with cache.tables({"c": exports[2]}):
+            pass
+    assert cache.total_bytes <= export_size * 2
+    cached_keys = {entry.key for entry in cache._entries.values()}
+    assert cached_keys == {
+        WorkerTableCache.cache_key(exports[1]),
+        WorkerTableCache.cache_key(exports[2]),
+    }
+
+
+def test_worker_table_cache_reuses_covering_partial_export(
+    tmp_path, conn: duckdb.DuckDBPyConnection
+):
+    cache = WorkerTableCache(lambda: conn.cursor(), LocalFileSystem())
+    cache.setup()
+
+    path = str(tmp_path / "export")
+    write_export(conn, os.path.join(path, "_export_day=2024-01-01"), 5)
+    wide = write_export(conn, os.path.join(path, "_export_day=2024-01-02"), 5)
+    wide.payload["gcs_path"] = path
+    wide.time_range = ExportTimeRange(
+        column="bucket_day", start=datetime(2024, 1, 1), end=datetime(2024, 1, 31)
+    )
+    narrow = wide.model_copy(
+        update={
+            "time_range": ExportTimeRange(
+                column="bucket_day",
+                start=datetime(2024, 1, 5),
+                end=datetime(2024, 1, 10),
+            )
+        }
+    )
+
+    with cache.tables({"metrics.events": wide}) as tables_map:
+        assert conn.execute(
+            cache.rewrite_query("SELECT COUNT(*) FROM metrics.events", tables_map)
+        ).fetchone() == (10,)
+    with cache.tables({"metrics.events": narrow}) as narrow_tables_map:
+        assert narrow_tables_map == tables_map
@@ -1,9 +1,10 @@
 import logging
 import math
 import typing as t
-from datetime import datetime
+from datetime import datetime, timedelta
 from enum import Enum
 
+import arrow
 import pandas as pd
 from fastapi import FastAPI
 from metrics_tools.definition import PeerMetricDependencyRef
@@ -99,6 +100,64 @@ class TableReference(BaseModel):
         return ".".join(names)
 
 
+class ExportTimeRange(BaseModel):
+    """An inclusive range of days of a table that has been exported. The range
+    is applied to `column` of the source table."""
+
+    column: str
+    start: datetime
+    end: datetime
+
+    @classmethod
+    def from_bounds(cls, column: str, start: datetime, end: datetime):
+        """Creates a range truncated to whole days"""
+        return cls(
+            column=column,
+            start=datetime(start.year, start.month, start.day),
+            end=datetime(end.year, end.month, end.day),
+        )
+
+    def covers(self, other: "ExportTimeRange") -> bool:
+        return (
+            self.column == other.column
+            and self.start <= other.start
+            and self.end >= other.end
+        )
+
+    def union(self, other: "ExportTimeRange") -> "ExportTimeRange":
+        """The smallest range covering both ranges. Any gap between the two
+        ranges is included so that the result is contiguous."""
+        assert self.column == other.column, "cannot union ranges of different columns"
+        return ExportTimeRange(
+            column=self.column,
+            start=min(self.start, other.start),
+            end=max(self.end, other.end),
+        )
+
+    def missing_ranges(self, other: "ExportTimeRange") -> t.List["ExportTimeRange"]:
+        """The ranges that need to be added to this range so that it covers
+        the union of both ranges"""
+        union = self.union(other)
+        missing: t.List[ExportTimeRange] = []
+        if union.start < self.start:
+            missing.append(
+                ExportTimeRange(
+                    column=self.column,
+                    start=union.start,
+                    end=self.start - timedelta(days=1),
+                )
+            )
+        if union.end > self.end:
+            missing.append(
+                ExportTimeRange(
+                    column=self.column,
+                    start=self.end + timedelta(days=1),
+                    end=union.end,
+                )
+            )
+        return missing
+
+
 class ExportReference(BaseModel):
     columns: ColumnsDefinition
     table: TableReference
@@ -108,9 +167,42 @@ class ExportReference(BaseModel):
     # Used to provide any additional metadata about the export by an exporter
     source_metadata: t.Dict[str, t.Any] = Field(default_factory=dict)
 
+    # If set, only the given range of the table has been exported and the
+    # export is partitioned by day.
+    time_range: t.Optional[ExportTimeRange] = None
+
+    # If set, only these columns of the table have been exported. Otherwise
+    # the export has all the columns of the table.
+    selected_columns: t.Optional[t.List[str]] = None
+
     def table_fqn(self):
         return self.table.fqn
 
+    def covers(
+        self,
+        time_range: t.Optional[ExportTimeRange],
+        columns: t.Optional[t.Iterable[str]] = None,
+    ) -> bool:
+        """Whether or not this export contains all the rows of the given range
+        and all of the given columns. A full export covers any range and any
+        columns. If no columns are given all the columns are required."""
+        return self.covers_time_range(time_range) and self.covers_columns(columns)
+
+    def covers_time_range(self, time_range: t.Optional[ExportTimeRange]) -> bool:
+        if self.time_range is None:
+            return True
+        if time_range is None:
+            return False
+        return self.time_range.covers(time_range)
+
+    def covers_columns(self, columns: t.Optional[t.Iterable[str]]) -> bool:
+        if self.selected_columns is None:
+            return True
+        if columns is None:
+            return False
+        selected = {column.lower() for column in self.selected_columns}
+        return all(column.lower() in selected for column in columns)
+
 
 class QueryJobStatus(str, Enum):
     PENDING = "pending"
@@ -147,6 +239,9 @@ class QueryJobStateUpdate(BaseModel):
     status: QueryJobStatus
     has_remaining_tasks: bool
     exception: t.Optional[str] = None
+    # The current estimate of the number of tasks of the job. Jobs are
+    # batched while they run so this can change.
+    tasks_count: t.Optional[int] = None
 
 
 QueryJobUpdateTypes = t.Union[
@@ -212,6 +307,18 @@ class JobSubmitRequest(BaseModel):
         inclusive_day_length = (self.end - self.start).days + 1
         return math.ceil(inclusive_day_length / self.batch_size)
 
+    def dependency_time_bounds(self) -> t.Optional[t.Tuple[datetime, datetime]]:
+        """The inclusive range of days of the dependencies that the rolling
+        windows of this job read. The first window starts `window - 1` units
+        before the start of the job. Returns None if the job is not a rolling
+        job."""
+        window = self.ref.get("window")
+        unit = self.ref.get("unit")
+        if not window or unit not in ["day", "week", "month", "quarter", "year"]:
+            return None
+        start = arrow.get(self.start).shift(**{f"{unit}s": -(window - 1)})
+        return (start.naive, self.end)
+
 
 class JobSubmitResponse(BaseModel):
     type: t.Literal["JobSubmitResponse"] = "JobSubmitResponse"
@@ -231,122 +338,131 @@ class JobStatusResponse(BaseModel):
 
 
 class QueryJobState(BaseModel):
+    """The state of a job aggregated from its updates as they arrive. The
+    full history of updates is only kept in `updates` if the job was started
+    with `keep_updates`."""
+
     job_id: str
     created_at: datetime
     tasks_count: int
     tasks_completed: int = 0
     has_remaining_tasks: bool = True
     status: QueryJobStatus = QueryJobStatus.PENDING
-    updates: t.List[QueryJobUpdate]
+    last_update: QueryJobUpdate
+
+    # The times used for the stats of the job
+    running_at: t.Optional[datetime] = None
+    completed_at: t.Optional[datetime] = None
+    failed_at: t.Optional[datetime] = None
+
+    # The most recent exceptions, oldest first
+    exceptions: t.List[str] = Field(default_factory=list)
+    max_exceptions: int = 20
+
+    updates: t.Optional[t.List[QueryJobUpdate]] = None
 
     @classmethod
-    def start(cls, job_id: str, tasks_count: int) -> "QueryJobState":
+    def start(
+        cls, job_id: str, tasks_count: int, keep_updates: bool = False
+    ) -> "QueryJobState":
         now = datetime.now()
+        update = QueryJobUpdate(
+            time=now,
+            scope=QueryJobUpdateScope.JOB,
+            payload=QueryJobStateUpdate(
+                status=QueryJobStatus.PENDING,
+                has_remaining_tasks=True,
+            ),
+        )
         return cls(
             job_id=job_id,
             created_at=now,
             tasks_count=tasks_count,
-            updates=[
-                QueryJobUpdate(
-                    time=now,
-                    scope=QueryJobUpdateScope.JOB,
-                    payload=QueryJobStateUpdate(
-                        status=QueryJobStatus.PENDING,
-                        has_remaining_tasks=True,
-                    ),
-                )
-            ],
+            last_update=update,
+            updates=[update] if keep_updates else None,
         )
 
     def latest_update(self) -> QueryJobUpdate:
-        return self.updates[-1]
+        return self.last_update
 
     def update(self, update: QueryJobUpdate):
         """Add an update to the job state and change any relevant job state"""
-        self.updates.append(update)
+        self.last_update = update
+        if self.updates is not None:
+            self.updates.append(update)
         if update.scope == QueryJobUpdateScope.JOB:
             payload = t.cast(QueryJobStateUpdate, update.payload)
+            if payload.tasks_count is not None:
+                self.tasks_count = payload.tasks_count
             if payload.status == QueryJobStatus.COMPLETED:
                 if self.status != QueryJobStatus.FAILED:
                     self.status = QueryJobStatus.COMPLETED
                 self.has_remaining_tasks = False
+                self.completed_at = update.time
             elif payload.status == QueryJobStatus.FAILED:
                 self.has_remaining_tasks = payload.has_remaining_tasks
                 self.status = payload.status
+                self.failed_at = self.failed_at or update.time
             elif payload.status == QueryJobStatus.RUNNING:
-                self.status = payload.status
+                if self.status != QueryJobStatus.FAILED:
+                    self.status = payload.status
+                self.running_at = update.time
+            if payload.exception:
+                self._add_exception(payload.exception)
         else:
             payload = t.cast(QueryJobTaskUpdate, update.payload)
             if payload.status == QueryJobTaskStatus.FAILED:
                 self.status = QueryJobStatus.FAILED
+                self.failed_at = self.failed_at or update.time
+                if payload.exception:
+                    self._add_exception(payload.exception)
             elif payload.status == QueryJobTaskStatus.CANCELLED:
                 self.status = QueryJobStatus.FAILED
+                self.failed_at = self.failed_at or update.time
             self.tasks_completed += 1
 
+    def _add_exception(self, exception: str):
+        self.exceptions.append(exception)
+        if len(self.exceptions) > self.max_exceptions:
+            del self.exceptions[0]
+
+    def snapshot(self) -> "QueryJobState":
+        """A copy of the state without the update history. The copy does not
+        change with the state."""
+        return self.model_copy(
+            update={"exceptions": list(self.exceptions), "updates": None}
+        )
+
     def as_response(
         self, include_stats: bool = False, include_exceptions_count: int = 5
     ) -> JobStatusResponse:
-        # Turn update events into stats
         stats = {}
         if include_stats:
-            # Calculate the time between each status change
-            pending_to_running = None
-            running_to_completed = None
-            running_to_failed = None
-
-            for update in self.updates:
-                match update.scope:
-                    case QueryJobUpdateScope.JOB:
-                        if update.payload.status == QueryJobStatus.RUNNING:
-                            pending_to_running = update.time
-                        elif update.payload.status == QueryJobStatus.COMPLETED:
-                            running_to_completed = update.time
-                        elif update.payload.status == QueryJobStatus.FAILED:
-                            if running_to_failed is None:
-                                running_to_failed = update.time
-                    case QueryJobUpdateScope.TASK:
-                        if update.payload.status == QueryJobTaskStatus.FAILED:
-                            if running_to_failed is None:
-                                running_to_failed = update.time
-                        elif update.payload.status == QueryJobTaskStatus.CANCELLED:
-                            if running_to_failed is None:
-                                running_to_failed = update.time
-
-            if pending_to_running:
+            # The time between each status change
+            if self.running_at:
                 stats["pending_to_running_seconds"] = (
-                    pending_to_running - self.created_at
+                    self.running_at - self.created_at
                 ).total_seconds()
-            if running_to_completed:
+            if self.completed_at:
                 stats["running_to_completed_seconds"] = (
-                    (running_to_completed - pending_to_running).total_seconds()
-                    if pending_to_running
+                    (self.completed_at - self.running_at).total_seconds()
+                    if self.running_at
                     else None
                 )
-            if running_to_failed:
+            if self.failed_at:
                 stats["running_to_failed_seconds"] = (
-                    (running_to_failed - pending_to_running).total_seconds()
-                    if pending_to_running
+                    (self.failed_at - self.running_at).total_seconds()
+                    if self.running_at
                     else None
                 )
         exceptions: t.List[str] = []
-        if self.status == QueryJobStatus.FAILED:
-            for update in reversed(self.updates):
-                if update.scope == QueryJobUpdateScope.TASK:
-                    payload = t.cast(QueryJobTaskUpdate, update.payload)
-                    if payload.status == QueryJobTaskStatus.FAILED:
-                        if payload.exception:
-                            exceptions.append(payload.exception)
-                else:
-                    payload = t.cast(QueryJobStateUpdate, update.payload)
-                    if payload.exception:
-                        exceptions.append(payload.exception)
-                if len(exceptions) >= include_exceptions_count:
-                    break
+        if self.status == QueryJobStatus.FAILED and include_exceptions_count > 0:
+            exceptions = self.exceptions[-include_exceptions_count:][::-1]
 
         return JobStatusResponse(
             job_id=self.job_id,
             created_at=self.created_at,
-            updated_at=self.latest_update().time,
+            updated_at=self.last_update.time,
             status=self.status,
             progress=QueryJobProgress(
                 completed=self.tasks_completed,
@@ -373,6 +489,25 @@ class JobStatusRequest(BaseModel):
     include_stats: bool
 
 
+class JobStatusSubscribeRequest(BaseModel):
+    """Sent over the multiplexed job status websocket to receive the status
+    updates of the given jobs"""
+
+    type: t.Literal["JobStatusSubscribeRequest"] = "JobStatusSubscribeRequest"
+    job_ids: t.List[str]
+
+
+class JobStatusErrorResponse(BaseModel):
+    type: t.Literal["JobStatusErrorResponse"] = "JobStatusErrorResponse"
+    job_id: str
+    error: str
+
+
+JobStatusStreamMessage = t.Annotated[
+    t.Union[JobStatusResponse, JobStatusErrorResponse], Field(discriminator="type")
+]
+
+
 class ExportedTableLoadRequest(BaseModel):
     type: t.Literal["ExportedTableLoadRequest"] = "ExportedTableLoadRequest"
     map: t.Dict[str, ExportReference]
@@ -387,6 +522,24 @@ class InspectCacheResponse(BaseModel):
     map: t.Dict[str, ExportReference]
 
 
+class CacheExportStats(BaseModel):
+    queue_depth: int
+    in_flight: int
+    max_in_flight: int
+    completed: int
+    failed: int
+    retried: int
+    average_wait_seconds: float
+    max_wait_seconds: float
+    average_export_seconds: float
+    max_export_seconds: float
+
+
+class CacheExportStatsResponse(BaseModel):
+    type: t.Literal["CacheExportStatsResponse"] = "CacheExportStatsResponse"
+    stats: CacheExportStats
+
+
 class ErrorResponse(BaseModel):
     type: t.Literal["ErrorResponse"] = "ErrorResponse"
     message: str
@@ -410,6 +563,7 @@ ServiceResponseTypes = t.Union[
     JobStatusResponse,
     EmptyResponse,
     InspectCacheResponse,
+    CacheExportStatsResponse,
     ErrorResponse,
 ]
 
@@ -419,6 +573,41 @@ class ServiceResponse(BaseModel):
     response: ServiceResponseTypes = Field(discriminator="type")
 
 
+class WorkerCacheMode(str, Enum):
+    TABLE = "table"
+    LOCAL_PARQUET = "local_parquet"
+
+
+class TaskPlacementMode(str, Enum):
+    SPREAD = "spread"
+    LOCALITY = "locality"
+
+
+# The compression codecs of parquet files written with pyarrow
+ParquetCompression = t.Literal["gzip", "bz2", "brotli", "lz4", "zstd", "snappy", "none"]
+
+
+class ResultCompactionOptions(BaseModel):
+    """How the result files of a job are compacted before they're imported"""
+
+    target_file_bytes: int = 256 * 1024 * 1024
+    sort_by: t.List[str] = Field(default_factory=list)
+    # If set, files are written to hive style directories by the value of
+    # this column. The column is then only stored in the directory name.
+    partition_by: t.Optional[str] = None
+    row_group_size: int = 122_880
+    compression: ParquetCompression = "zstd"
+
+
+class ResultCompaction(BaseModel):
+    """The result of compacting the result files of a job"""
+
+    source_files: int
+    rows: int
+    files: t.List[str]
+    partition_by: t.Optional[str] = None
+
+
 class ClusterConfig(BaseSettings):
     model_config = SettingsConfigDict(env_prefix="metrics_")
 
@@ -439,6 +628,25 @@ class ClusterConfig(BaseSettings):
     worker_pool_type: str = "sqlmesh-worker"
     worker_duckdb_path: str
 
+    # Exported tables cached on a worker are evicted once they exceed this
+    # budget. A value of 0 disables eviction. If `worker_cache_mode` is
+    # "local_parquet" tables are kept on the worker's disk instead of in
+    # memory and are stored in `worker_cache_local_dir` (defaults to a
+    # directory next to the duckdb file).
+    worker_cache_mode: WorkerCacheMode = WorkerCacheMode.TABLE
+    worker_cache_max_bytes: int = 0
+    worker_cache_local_dir: str = ""
+
+    # Query results are streamed to gcs as parquet. The upload block size
+    # must be a multiple of 256KiB.
+    worker_result_row_group_size: int = 122_880
+    worker_result_compression: ParquetCompression = "zstd"
+    worker_result_upload_block_size: int = 16 * 1024 * 1024
+
+    # With "locality" tasks are preferably placed on workers that already
+    # cached the task's dependencies
+    task_placement_mode: TaskPlacementMode = TaskPlacementMode.SPREAD
+
 
 class GCSConfig(BaseSettings):
     model_config = SettingsConfigDict(env_prefix="metrics_")
@@ -458,12 +666,57 @@ class TrinoCacheExportConfig(BaseSettings):
     hive_catalog: str = "source"
     hive_schema: str = "export"
 
+    # Path to a local duckdb file used to persist the export cache index. If
+    # empty, the index is only kept in memory.
+    cache_index_path: str = ""
+    cache_use_table_fingerprints: bool = True
+    cache_ttl_seconds: int = 7 * 24 * 60 * 60
+    cache_max_entries: int = 0
+
+    cache_max_concurrent_exports: int = 4
+    cache_export_retries: int = 3
+    cache_export_retry_backoff_seconds: float = 10.0
+    # How long new exports wait for their size estimate before they are
+    # dispatched without one
+    cache_export_size_estimate_wait_seconds: float = 0.5
+
+    # Only export the columns of the dependencies that the queries of a job
+    # read. Jobs that read different columns of a table share its export.
+    cache_export_prune_columns: bool = True
+
 
 class AppConfig(ClusterConfig, TrinoCacheExportConfig, GCSConfig):
     model_config = SettingsConfigDict(env_prefix="metrics_")
 
     results_path_prefix: str = "mcs-results"
 
+    # Batches of a job are sized so that a task is expected to take about
+    # this long. A value of 0 only balances the batches across the cluster.
+    job_target_task_seconds: float = 0.0
+
+    # The number of tasks of a job that are submitted beyond what the
+    # connected workers can run. The queued tasks let the cluster scale up.
+    job_task_queue_depth: int = 4
+
+    # Keep the full history of updates of every job. Job state is otherwise
+    # only kept as aggregates.
+    job_update_log: bool = False
+
+    # The status of a job is sent to each websocket at most this many times
+    # per second. The final status is always sent.
+    job_status_updates_per_second: float = 2.0
+
+    # The result files of a job are merged into files of about this size,
+    # sorted by the given columns, before they're imported. Columns that a
+    # metric doesn't have are ignored.
+    result_compaction_enabled: bool = True
+    result_compaction_target_file_bytes: int = 256 * 1024 * 1024
+    result_compaction_sort_by: t.List[str] = Field(
+        default_factory=lambda: ["metrics_sample_date"]
+    )
+    # Store the compacted files in hive style partitions of this column
+    result_compaction_partition_by: str = ""
+
     debug_all: bool = False
     debug_with_duckdb: bool = False
     debug_cache: bool = False
@@ -473,6 +726,19 @@ class AppConfig(ClusterConfig, TrinoCacheExportConfig, GCSConfig):
     cluster_shutdown_timeout: int = 180
     cluster_scale_down_timeout: int = 60
 
+    # With autoscaling the minimum size of the cluster follows the queued
+    # tasks of the running jobs instead of the cluster being scaled to 0 once
+    # no client has been listening for `cluster_scale_down_timeout` seconds.
+    cluster_autoscale_enabled: bool = False
+
+    # Number of workers kept while the service is idle if the history of job
+    # arrivals suggests that a job arrives within the horizon. New workers
+    # preload the exports of the most recently used dependencies. Requires
+    # autoscaling.
+    cluster_warm_pool_size: int = 0
+    cluster_warm_pool_horizon_seconds: int = 3600
+    cluster_warm_pool_dependencies: int = 10
+
     @model_validator(mode="after")
     def handle_debugging(self):
         if self.debug_all:
@@ -5,21 +5,31 @@ import time
 import typing as t
 import uuid
 from contextlib import contextmanager
-from threading import Lock
 
 import duckdb
 import gcsfs
-import polars as pl
 from dask.distributed import Worker, WorkerPlugin, get_worker
 from google.cloud import storage
-from metrics_tools.compute.types import ExportReference, ExportType
+from metrics_tools.compute.compaction import compact_parquet_files
+from metrics_tools.compute.result_writer import (
+    DEFAULT_COMPRESSION,
+    DEFAULT_ROW_GROUP_SIZE,
+    DEFAULT_UPLOAD_BLOCK_SIZE,
+    ParquetResultWriter,
+)
+from metrics_tools.compute.types import (
+    ExportReference,
+    ExportType,
+    ParquetCompression,
+    ResultCompaction,
+    ResultCompactionOptions,
+    WorkerCacheMode,
+)
+from metrics_tools.compute.worker_cache import WorkerTableCache
 from metrics_tools.utils.logging import setup_module_logging
-from sqlglot import exp
 
 logger = logging.getLogger(__name__)
 
-mutex = Lock()
-
 
 class MetricsWorkerPlugin(WorkerPlugin):
     logger: logging.Logger
@@ -42,6 +52,20 @@ class MetricsWorkerPlugin(WorkerPlugin):
         """Execute a query on the worker"""
         raise NotImplementedError()
 
+    def preload(self, dependencies: t.Dict[str, ExportReference]):
+        """Loads dependencies into the worker's cache ahead of any query"""
+        return
+
+    def compact_results(
+        self,
+        job_id: str,
+        result_path_base: str,
+        options: ResultCompactionOptions,
+    ) -> t.Optional[ResultCompaction]:
+        """Compacts the result files of a job. Returns None if the plugin
+        doesn't support compaction"""
+        return None
+
 
 class DummyMetricsWorkerPlugin(MetricsWorkerPlugin):
     def handle_query(
@@ -66,14 +90,28 @@ class DuckDBMetricsWorkerPlugin(MetricsWorkerPlugin):
         gcs_key_id: str,
         gcs_secret: str,
         duckdb_path: str,
+        cache_mode: WorkerCacheMode = WorkerCacheMode.TABLE,
+        cache_max_bytes: int = 0,
+        cache_local_dir: str = "",
+        result_row_group_size: int = DEFAULT_ROW_GROUP_SIZE,
+        result_compression: ParquetCompression = DEFAULT_COMPRESSION,
+        result_upload_block_size: int = DEFAULT_UPLOAD_BLOCK_SIZE,
     ):
         self._gcs_bucket = gcs_bucket
         self._gcs_key_id = gcs_key_id
         self._gcs_secret = gcs_secret
         self._duckdb_path = duckdb_path
+        self._cache_mode = cache_mode
+        self._cache_max_bytes = cache_max_bytes
+        self._cache_local_dir = cache_local_dir or os.path.join(
+            os.path.dirname(os.path.abspath(duckdb_path)), "mcs-cache"
+        )
+        self._result_row_group_size = result_row_group_size
+        self._result_compression: ParquetCompression = result_compression
+        self._result_upload_block_size = result_upload_block_size
         self._conn = None
         self._fs = None
-        self._cache_status: t.Dict[str, bool] = {}
+        self._cache: t.Optional[WorkerTableCache] = None
         self._catalog = None
         self._mode = "duckdb"
         self._uuid = uuid.uuid4().hex
@@ -96,7 +134,23 @@ class DuckDBMetricsWorkerPlugin(MetricsWorkerPlugin):
         self._conn.sql(sql)
         self._fs = gcsfs.GCSFileSystem()
 
+        # The cache is created here as it can't be sent to the worker
+        self._cache = WorkerTableCache(
+            lambda: self.connection,
+            self._fs,
+            mode=self._cache_mode,
+            max_bytes=self._cache_max_bytes,
+            local_dir=(
+                self._cache_local_dir
+                if self._cache_mode == WorkerCacheMode.LOCAL_PARQUET
+                else ""
+            ),
+        )
+        self._cache.setup()
+
     def teardown(self, worker: Worker):
+        if self._cache:
+            self._cache.teardown()
         if self._conn:
             self._conn.close()
 
@@ -105,12 +159,17 @@ class DuckDBMetricsWorkerPlugin(MetricsWorkerPlugin):
         assert self._conn is not None
         return self._conn.cursor()
 
-    def get_for_cache(
+    @property
+    def cache(self):
+        assert self._cache is not None, "Worker cache not initialized"
+        return self._cache
+
+    def validate_dependency(
         self,
         table_ref_name: str,
         export_reference: ExportReference,
     ):
-        """Checks if a table is cached in the local duckdb"""
+        """Checks that the export can be loaded by this worker"""
         logger.info(
             f"[{self._uuid}] got a cache request for {table_ref_name}:{export_reference.table.table_name}"
         )
@@ -119,38 +178,6 @@ class DuckDBMetricsWorkerPlugin(MetricsWorkerPlugin):
             export_reference.payload.get("gcs_path") is not None
         ), "A gcs_path is required"
 
-        if self._cache_status.get(table_ref_name):
-            return
-        with mutex:
-            if self._cache_status.get(table_ref_name):
-                return
-            destination_table = exp.to_table(table_ref_name)
-
-            gcs_path = export_reference.payload["gcs_path"]
-
-            self.load_using_gcs_parquet(table_ref_name, gcs_path, destination_table)
-
-            self._cache_status[table_ref_name] = True
-
-    def load_using_gcs_parquet(
-        self,
-        table_ref_name: str,
-        gcs_path: str,
-        destination_table: exp.Table,
-    ):
-        self.connection.execute(f"CREATE SCHEMA IF NOT EXISTS {destination_table.db}")
-        logger.info(f"CACHING TABLE {table_ref_name} WITH PARQUET")
-
-        path_to_load = os.path.join(gcs_path, "*")
-
-        cache_sql = f"""
-            CREATE TABLE IF NOT EXISTS "{destination_table.db}"."{destination_table.this.this}" AS
-            SELECT * FROM read_parquet('{path_to_load}')
-        """
-        logger.debug(f"Executing SQL: {cache_sql}")
-        self.connection.sql(cache_sql)
-        logger.info(f"LOADING EXPORTED TABLE {table_ref_name} COMPLETED")
-
     @contextmanager
     def gcs_client(self):
         client = storage.Client()
@@ -177,6 +204,13 @@ class DuckDBMetricsWorkerPlugin(MetricsWorkerPlugin):
         assert self._fs is not None, "GCSFS not initialized"
         return self._fs
 
+    def preload(self, dependencies: t.Dict[str, ExportReference]):
+        for ref, actual in dependencies.items():
+            self.logger.info(f"[{self._uuid}] Preloading cache for {ref}:{actual}")
+            self.validate_dependency(ref, actual)
+        with self.cache.tables(dependencies):
+            pass
+
     def handle_query(
         self,
         job_id: str,
@@ -187,35 +221,70 @@ class DuckDBMetricsWorkerPlugin(MetricsWorkerPlugin):
     ) -> t.Any:
         """Execute a duckdb load on a worker.
 
-        This executes the query with duckdb and writes the results to a gcs
-        path. We need to use polars or pyarrow here because the pandas parquet
-        writer doesn't write the correct datatypes for trino.
+        This executes the query with duckdb and streams the results to a gcs
+        path. The results are written with pyarrow because the pandas parquet
+        writer doesn't write the correct datatypes for trino. The file is
+        uploaded in chunks of `result_upload_block_size` bytes while the
+        queries are still running.
         """
 
         for ref, actual in dependencies.items():
             self.logger.info(
                 f"job[{job_id}][{task_id}] Loading cache for {ref}:{actual}"
             )
-            self.get_for_cache(ref, actual)
+            self.validate_dependency(ref, actual)
         conn = self.connection
-        results: t.List[pl.DataFrame] = []
-        for query in queries:
-            self.logger.info(f"job[{job_id}][{task_id}]: Executing query {query}")
-            result = conn.execute(query).pl()
-            results.append(result)
-        # Concatenate the results
-        self.logger.info(f"job[{job_id}][{task_id}]: Concatenating results")
-        combined_results = pl.concat(results)
-
-        # Export the results to a parquet file in memory
         self.logger.info(
-            f"job[{job_id}][{task_id}]: Uploading to gcs {result_path} with polars"
+            f"job[{job_id}][{task_id}]: Streaming results to {result_path}"
+        )
+        with self.cache.tables(dependencies) as tables_map:
+            with t.cast(
+                t.BinaryIO,
+                self.fs.open(
+                    f"{self._gcs_bucket}/{result_path}",
+                    "wb",
+                    block_size=self._result_upload_block_size,
+                ),
+            ) as f:
+                with ParquetResultWriter(
+                    f,
+                    row_group_size=self._result_row_group_size,
+                    compression=self._result_compression,
+                    log_override=self.logger,
+                ) as writer:
+                    for query in queries:
+                        query = self.cache.rewrite_query(query, tables_map)
+                        self.logger.info(
+                            f"job[{job_id}][{task_id}]: Executing query {query}"
+                        )
+                        writer.write_query(conn, query)
+        self.logger.info(
+            f"job[{job_id}][{task_id}]: Upload completed with {writer.rows_written} rows"
         )
-        with self.fs.open(f"{self._gcs_bucket}/{result_path}", "wb") as f:
-            combined_results.write_parquet(f)  # type: ignore
-        self.logger.info(f"job[{job_id}][{task_id}]: Upload completed")
         return task_id
 
+    def compact_results(
+        self,
+        job_id: str,
+        result_path_base: str,
+        options: ResultCompactionOptions,
+    ) -> t.Optional[ResultCompaction]:
+        source = f"{self._gcs_bucket}/{result_path_base}"
+        self.logger.info(f"job[{job_id}]: Compacting result files in {source}")
+        compaction = compact_parquet_files(
+            self.connection,
+            self.fs,
+            source,
+            f"{source}/compacted",
+            options,
+            url_prefix="gs://",
+            log_override=self.logger,
+        )
+        self.logger.info(
+            f"job[{job_id}]: Compacted {compaction.source_files} files into {len(compaction.files)} files"
+        )
+        return compaction
+
 
 def execute_duckdb_load(
     job_id: str,
@@ -237,6 +306,26 @@ def execute_duckdb_load(
     return task_id
 
 
+def preload_worker_cache(dependencies: t.Dict[str, ExportReference]):
+    """Loads the dependencies into the cache of the worker so that the first
+    tasks using them don't have to"""
+    worker = get_worker()
+
+    plugin = t.cast(MetricsWorkerPlugin, worker.plugins["metrics"])
+    plugin.preload(dependencies)
+    return worker.address
+
+
+def execute_result_compaction(
+    job_id: str, result_path_base: str, options: ResultCompactionOptions
+):
+    """Compacts the result files of a job on a worker"""
+    worker = get_worker()
+
+    plugin = t.cast(MetricsWorkerPlugin, worker.plugins["metrics"])
+    return plugin.compact_results(job_id, result_path_base, options)
+
+
 def bad_execute(*args, **kwargs):
     """Intentionally throws an exception
 
@@ -0,0 +1,283 @@
+"""Cache of exported tables on a metrics worker.
+
+Exported tables are loaded into the worker's duckdb under a name derived from
+the export reference. Queries are rewritten to read from these tables so that
+tasks for different exports of the same table (e.g. from different execution
+times) never see each other's data. The cache is bounded by a byte budget and
+evicts the least recently used tables that no running task is reading.
+
+Tables are either materialized in duckdb (the default) or downloaded as
+parquet to the local disk of the node and attached as views. The latter keeps
+the memory usage of long lived workers low.
+"""
+
+import hashlib
+import logging
+import os
+import shutil
+import time
+import typing as t
+from contextlib import contextmanager
+from threading import Lock
+
+import duckdb
+import fsspec
+from metrics_tools.utils.tables import resolve_table_fqn
+from pydantic import BaseModel
+from sqlglot import exp
+from sqlmesh.core.dialect import parse_one
+
+from .types import ExportReference, WorkerCacheMode
+
+logger = logging.getLogger(__name__)
+
+
+class CachedTable(BaseModel):
+    key: str
+    table_name: str
+    export_reference: ExportReference
+    size_bytes: int
+    local_path: t.Optional[str] = None
+    last_used_at: float
+    in_use: int = 0
+
+
+class WorkerTableCache:
+    def __init__(
+        self,
+        connection_factory: t.Callable[[], duckdb.DuckDBPyConnection],
+        fs: fsspec.AbstractFileSystem,
+        mode: WorkerCacheMode = WorkerCacheMode.TABLE,
+        max_bytes: int = 0,
+        local_dir: str = "",
+        schema: str = "mcs_cache",
+        log_override: t.Optional[logging.Logger] = None,
+    ):
+        assert (
+            mode != WorkerCacheMode.LOCAL_PARQUET or local_dir
+        ), "local_dir is required to cache tables as local parquet"
+        self.connection_factory = connection_factory
+        self.fs = fs
+        self.mode = mode
+        self.max_bytes = max_bytes
+        self.local_dir = local_dir
+        self.schema = schema
+        self.logger = log_override or logger
+        self._entries: t.Dict[str, CachedTable] = {}
+        self._lock = Lock()
+        self._load_locks: t.Dict[str, Lock] = {}
+
+    def setup(self):
+        """Removes any tables left from a previous worker using the same duckdb
+        file"""
+        conn = self.connection_factory()
+        conn.execute(f"DROP SCHEMA IF EXISTS {self.schema} CASCADE")
+        conn.execute(f"CREATE SCHEMA {self.schema}")
+        if self.local_dir:
+            shutil.rmtree(self.local_dir, ignore_errors=True)
+
+    def teardown(self):
+        if self.local_dir:
+            shutil.rmtree(self.local_dir, ignore_errors=True)
+
+    @staticmethod
+    def cache_key(export_reference: ExportReference) -> str:
+        time_range = export_reference.time_range
+        identity = "|".join(
+            [
+                export_reference.payload.get("gcs_path", ""),
+                time_range.model_dump_json() if time_range else "",
+            ]
+        )
+        return hashlib.sha1(identity.encode("utf-8")).hexdigest()[:16]
+
+    @property
+    def total_bytes(self) -> int:
+        with self._lock:
+            return sum(entry.size_bytes for entry in self._entries.values())
+
+    @contextmanager
+    def tables(self, dependencies: t.Dict[str, ExportReference]):
+        """Loads the dependencies and yields a map of the referenced table
+        names to the cached table names. The cached tables cannot be evicted
+        until the context exits."""
+        acquired: t.List[str] = []
+        try:
+            tables_map: t.Dict[str, str] = {}
+            for table_ref_name, export_reference in dependencies.items():
+                entry = self.acquire(export_reference)
+                acquired.append(entry.key)
+                tables_map[table_ref_name] = entry.table_name
+            yield tables_map
+        finally:
+            for key in acquired:
+                self.release(key)
+
+    def acquire(self, export_reference: ExportReference) -> CachedTable:
+        """Returns the cached table for the export reference, loading it if
+        necessary. Only loads of the same export are serialized."""
+        key = self.cache_key(export_reference)
+        with self._lock:
+            entry = self._use_existing(key, export_reference)
+            if entry:
+                return entry
+            load_lock = self._load_locks.setdefault(key, Lock())
+
+        with load_lock:
+            with self._lock:
+                entry = self._use_existing(key, export_reference)
+                if entry:
+                    return entry
+            entry = self._load(key, export_reference)
+            with self._lock:
+                entry.in_use += 1
+                self._entries[key] = entry
+                self._load_locks.pop(key, None)
+            return entry
+
+    def release(self, key: str):
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry:
+                entry.in_use -= 1
+                entry.last_used_at = time.monotonic()
+
+    def _use_existing(
+        self, key: str, export_reference: ExportReference
+    ) -> t.Optional[CachedTable]:
+        """Finds a cached table for the export. A table loaded from a larger
+        range of the same partial export can also be used. Must be called
+        while holding the lock."""
+        entry = self._entries.get(key)
+        if not entry:
+            gcs_path = export_reference.payload.get("gcs_path")
+            entry = next(
+                (
+                    candidate
+                    for candidate in self._entries.values()
+                    if candidate.export_reference.payload.get("gcs_path") == gcs_path
+                    and candidate.export_reference.covers(export_reference.time_range)
+                ),
+                None,
+            )
+        if entry:
+            entry.in_use += 1
+            entry.last_used_at = time.monotonic()
+        return entry
+
+    def _load(self, key: str, export_reference: ExportReference) -> CachedTable:
+        gcs_path = export_reference.payload["gcs_path"]
+        table_name = f"{self.schema}.t_{key}"
+        size_bytes = self._remote_size(gcs_path)
+        self._make_room(size_bytes)
+
+        # Partial exports are written into one directory per day. The
+        # partition column is not part of the files.
+        glob = os.path.join("*", "*") if export_reference.time_range else "*"
+
+        local_path: t.Optional[str] = None
+        if self.mode == WorkerCacheMode.LOCAL_PARQUET:
+            local_path = os.path.join(self.local_dir, key)
+            self.logger.info(f"downloading {gcs_path} to {local_path}")
+            self.fs.get(gcs_path.rstrip("/") + "/", local_path, recursive=True)
+            size_bytes = _local_size(local_path)
+            create_sql = f"""
+                CREATE OR REPLACE VIEW {table_name} AS
+                SELECT * FROM read_parquet('{os.path.join(local_path, glob)}', hive_partitioning = false)
+            """
+        else:
+            create_sql = f"""
+                CREATE OR REPLACE TABLE {table_name} AS
+                SELECT * FROM read_parquet('{os.path.join(gcs_path, glob)}', hive_partitioning = false)
+            """
+        self.logger.info(
+            f"CACHING TABLE {export_reference.table_fqn()} AS {table_name} ({self.mode.value})"
+        )
+        self.logger.debug(f"Executing SQL: {create_sql}")
+        self.connection_factory().execute(create_sql)
+        self.logger.info(f"LOADING EXPORTED TABLE {table_name} COMPLETED")
+
+        return CachedTable(
+            key=key,
+            table_name=table_name,
+            export_reference=export_reference,
+            size_bytes=size_bytes,
+            local_path=local_path,
+            last_used_at=time.monotonic(),
+        )
+
+    def _remote_size(self, gcs_path: str) -> int:
+        """The size of the exported files. For materialized tables this is
+        only an approximation of the memory used by the table."""
+        try:
+            return t.cast(int, self.fs.du(gcs_path, total=True))
+        except Exception as e:
+            self.logger.warning(f"could not determine size of {gcs_path}: {e}")
+            return 0
+
+    def _make_room(self, size_bytes: int):
+        """Evicts the least recently used tables that aren't in use until the
+        new table fits into the budget. If every table is in use the budget is
+        exceeded temporarily."""
+        if self.max_bytes <= 0:
+            return
+        evictions: t.List[CachedTable] = []
+        with self._lock:
+            total = sum(entry.size_bytes for entry in self._entries.values())
+            candidates = sorted(
+                (entry for entry in self._entries.values() if entry.in_use == 0),
+                key=lambda entry: entry.last_used_at,
+            )
+            for entry in candidates:
+                if total + size_bytes <= self.max_bytes:
+                    break
+                del self._entries[entry.key]
+                total -= entry.size_bytes
+                evictions.append(entry)
+            if total + size_bytes > self.max_bytes:
+                self.logger.warning(
+                    f"worker cache budget of {self.max_bytes} bytes exceeded by tables in use"
+                )
+
+        for entry in evictions:
+            self._drop(entry)
+
+    def _drop(self, entry: CachedTable):
+        self.logger.info(f"evicting cached table {entry.table_name}")
+        kind = "VIEW" if entry.local_path else "TABLE"
+        self.connection_factory().execute(f"DROP {kind} IF EXISTS {entry.table_name}")
+        if entry.local_path:
+            shutil.rmtree(entry.local_path, ignore_errors=True)
+
+    def rewrite_query(self, query: str, tables_map: t.Dict[str, str]) -> str:
+        """Rewrites a duckdb query to read the cached tables. References that
+        weren't aliased keep their original name as the alias so that qualified
+        columns still resolve."""
+
+        def replace_table(node: exp.Expression):
+            if not isinstance(node, exp.Table):
+                return node
+            cached_table_name = tables_map.get(resolve_table_fqn(node))
+            if not cached_table_name:
+                return node
+            cached_table = exp.to_table(cached_table_name)
+            cached_table.set(
+                "alias",
+                node.args.get("alias")
+                or exp.TableAlias(this=exp.to_identifier(node.name)),
+            )
+            return cached_table
+
+        return (
+            parse_one(query, dialect="duckdb")
+            .transform(replace_table)
+            .sql(dialect="duckdb")
+        )
+
+
+def _local_size(path: str) -> int:
+    size = 0
+    for root, _, files in os.walk(path):
+        for file in files:
+            size += os.path.getsize(os.path.join(root, file))
+    return size
@@ -3,7 +3,7 @@ import typing as t
 from datetime import datetime
 
 import pandas as pd
-from metrics_tools.compute.client import Client
+from metrics_tools.compute.client import shared_client
 from metrics_tools.compute.types import ExportType
 from metrics_tools.definition import PeerMetricDependencyRef
 from metrics_tools.factory.constants import METRICS_COLUMNS_BY_ENTITY
@@ -89,8 +89,10 @@ def generated_rolling_query(
     else:
         logger.info("metrics calculation service enabled")
 
+        # The client is shared by all the models evaluated by this process so
+        # that their jobs overlap over the same connections
         mcs_url = env.required_str("SQLMESH_MCS_URL")
-        mcs_client = Client.from_url(url=mcs_url)
+        mcs_client = shared_client(mcs_url)
 
         columns = [
             (col_name, col_type.sql(dialect="duckdb"))
@@ -253,7 +253,13 @@ class Config(BaseModel):
     table_mapping: TableMappingConfig
     repo_dir: str
     max_days: int = 7
+    # The maximum number of rows loaded per table. 0 loads all rows, including
+    # for tables with a row restriction (these used to be loaded empty).
     max_results_per_query: int = 0
+    # The number of streams used to read a table from bigquery
+    bq_max_stream_count: int = 4
+    # The number of tables that are loaded at the same time
+    max_concurrent_table_loads: int = 4
     project_id: str = "opensource-observer"
     timeseries_start: str = "2024-12-01"
     loader: LoaderConfig
@@ -1,8 +1,12 @@
 import json
 import logging
 import os
+import queue
 import re
+import threading
 import typing as t
+import uuid
+from concurrent.futures import ThreadPoolExecutor
 from datetime import datetime, timedelta
 
 import duckdb
@@ -15,6 +19,7 @@ from metrics_tools.local.config import (
     LocalTrinoLoaderConfig,
     TableMappingDestination,
 )
+from metrics_tools.local.sampling import sample_window_start
 from metrics_tools.source.rewrite import DUCKDB_REWRITE_RULES, oso_source_rewrite
 from minio import Minio
 from pyiceberg.catalog import Catalog
@@ -24,6 +29,9 @@ from sqlmesh.core.dialect import parse_one
 
 logger = logging.getLogger(__name__)
 
+# The number of rows appended to an iceberg table per commit
+ICEBERG_APPEND_ROWS = 1_000_000
+
 
 def remove_metadata_from_schema(schema: pa.Schema) -> pa.Schema:
     """Remove metadata from a schema
@@ -121,13 +129,93 @@ def convert_bq_schema_to_duckdb_columns(
     return result
 
 
-def bq_read_with_options(
-    start: datetime,
-    end: datetime,
+def read_session_schema(session: bigquery_storage_v1.types.ReadSession) -> pa.Schema:
+    return pa.ipc.read_schema(pa.py_buffer(session.arrow_schema.serialized_schema))
+
+
+def read_session_streams(
+    client: bigquery_storage_v1.BigQueryReadClient,
+    session: bigquery_storage_v1.types.ReadSession,
+) -> t.Iterator[pa.RecordBatch]:
+    """Reads all the streams of a read session concurrently. The record
+    batches are yielded in the order they arrive. Only a few batches per
+    stream are buffered."""
+    streams = list(session.streams)
+    if not streams:
+        return
+    batches: queue.Queue = queue.Queue(maxsize=2 * len(streams))
+    stream_done = object()
+    stop = threading.Event()
+
+    def put(item: t.Any):
+        # Stop waiting for space in the queue once the reader is closed
+        while not stop.is_set():
+            try:
+                batches.put(item, timeout=0.1)
+                return
+            except queue.Full:
+                continue
+
+    def read_stream(stream_name: str):
+        try:
+            for page in client.read_rows(stream_name).rows(session).pages:
+                if stop.is_set():
+                    return
+                put(page.to_arrow())
+        except Exception as e:
+            put(e)
+        finally:
+            put(stream_done)
+
+    with ThreadPoolExecutor(max_workers=len(streams)) as pool:
+        for stream in streams:
+            pool.submit(read_stream, stream.name)
+        remaining = len(streams)
+        try:
+            while remaining > 0:
+                item = batches.get()
+                if item is stream_done:
+                    remaining -= 1
+                elif isinstance(item, Exception):
+                    raise item
+                else:
+                    yield item
+        finally:
+            stop.set()
+
+
+def limit_batches(
+    batches: t.Iterator[pa.RecordBatch], max_rows: int
+) -> t.Iterator[pa.RecordBatch]:
+    """Stops reading once `max_rows` rows have been read. The source iterator
+    is closed so that the streams stop being read."""
+    remaining = max_rows
+    try:
+        for batch in batches:
+            if batch.num_rows > remaining:
+                batch = batch.slice(0, remaining)
+            remaining -= batch.num_rows
+            yield batch
+            if remaining <= 0:
+                break
+    finally:
+        close = getattr(batches, "close", None)
+        if close is not None:
+            close()
+
+
+def bq_read_table(
     source_table: str,
-    dest: TableMappingDestination,
     project_id: str,
-):
+    row_restriction: str = "",
+    max_stream_count: int = 1,
+    max_rows: int = 0,
+    allow_empty: bool = True,
+) -> t.Optional[pa.RecordBatchReader]:
+    """Opens a read session on a bigquery table with up to `max_stream_count`
+    streams. The returned reader reads the streams concurrently and stops
+    after `max_rows` rows if it is set. If the session has no streams None is
+    returned unless `allow_empty` is set."""
     client = bigquery_storage_v1.BigQueryReadClient()
     source_table_split = source_table.split(".")
     table = "projects/{}/datasets/{}/tables/{}".format(
@@ -137,19 +225,43 @@ def bq_read_with_options(
     requested_session.table = table
 
     requested_session.data_format = bigquery_storage_v1.types.DataFormat.ARROW
-    row_restrictions = dest.row_restriction.as_str(start, end)
-    logger.info(f"Row restrictions: {row_restrictions}")
-    requested_session.read_options.row_restriction = row_restrictions
+    if row_restriction:
+        logger.info(f"Row restrictions: {row_restriction}")
+        requested_session.read_options.row_restriction = row_restriction
 
     parent = "projects/{}".format(project_id)
     session = client.create_read_session(
-        parent=parent, read_session=requested_session, max_stream_count=1
+        parent=parent,
+        read_session=requested_session,
+        max_stream_count=max_stream_count,
     )
-    if len(session.streams) == 0:
+    if len(session.streams) == 0 and not allow_empty:
         logger.info("No result found for the given restrictions")
         return None
-    reader = client.read_rows(session.streams[0].name)
-    return reader.to_arrow(session)
+    logger.info(f"Reading {source_table} with {len(session.streams)} streams")
+    batches = read_session_streams(client, session)
+    if max_rows:
+        batches = limit_batches(batches, max_rows)
+    return pa.RecordBatchReader.from_batches(read_session_schema(session), batches)
+
+
+def bq_read_with_options(
+    start: datetime,
+    end: datetime,
+    source_table: str,
+    dest: TableMappingDestination,
+    project_id: str,
+    max_stream_count: int = 1,
+    max_rows: int = 0,
+):
+    return bq_read_table(
+        source_table,
+        project_id,
+        row_restriction=dest.row_restriction.as_str(start, end),
+        max_stream_count=max_stream_count,
+        max_rows=max_rows,
+        allow_empty=False,
+    )
 
 
 def bq_try_read_with_options(
@@ -159,20 +271,29 @@ def bq_try_read_with_options(
     dest: TableMappingDestination,
     project_id: str,
     max_results_per_query: int,
+    max_stream_count: int = 1,
 ):
+    """Reads at most `max_results_per_query` rows of the restricted table.
+    If it is 0 all the rows of the restriction are read."""
     result = None
     increment = timedelta(days=1)
     # Exponential increments for reading from bigquery, in case the initial
-    # restriction is too small
+    # restriction is too small. This is only a fallback for tables without
+    # partition metadata (see `sample_window_start`)
     while result is None:
-        result = bq_read_with_options(start, end, source_table, dest, project_id)
+        result = bq_read_with_options(
+            start,
+            end,
+            source_table,
+            dest,
+            project_id,
+            max_stream_count,
+            max_results_per_query,
+        )
         start = start - increment
         increment = increment * 2
 
-    return result.slice(
-        0,
-        min(result.num_rows, max_results_per_query),
-    )
+    return result
 
 
 class BaseDestinationLoader(DestinationLoader):
@@ -186,6 +307,19 @@ class BaseDestinationLoader(DestinationLoader):
         self._duckdb_conn = duckdb_conn
         self._bqclient = bqclient
         self._created_schemas = set()
+        # Tables are loaded concurrently. Each thread uses its own cursor and
+        # changes to the catalog are serialized.
+        self._local = threading.local()
+        self._catalog_lock = threading.RLock()
+
+    @property
+    def duckdb_conn(self) -> duckdb.DuckDBPyConnection:
+        """The duckdb cursor of the current thread"""
+        cursor = getattr(self._local, "cursor", None)
+        if cursor is None:
+            cursor = self._duckdb_conn.cursor()
+            self._local.cursor = cursor
+        return cursor
 
     def destination_table_exists(self, table: exp.Table) -> bool:
         raise NotImplementedError("table_exists not implemented")
@@ -201,7 +335,7 @@ class BaseDestinationLoader(DestinationLoader):
         source_name: str,
         destination: TableMappingDestination,
         rewritten_destination: exp.Table,
-        table_as_arrow: pa.Table,
+        arrow_reader: pa.RecordBatchReader,
         table_schema: t.List[bigquery.SchemaField],
     ):
         raise NotImplementedError("save_pyarrow_table not implemented")
@@ -243,7 +377,8 @@ class BaseDestinationLoader(DestinationLoader):
         config = self._config
 
         # Load the schema from bigqouery
-        table_schema = self._bqclient.get_table(source_table).schema
+        source_bq_table = self._bqclient.get_table(source_table)
+        table_schema = source_bq_table.schema
 
         if self.destination_table_exists(rewritten_destination):
             if self.has_schema_changed(rewritten_destination, table_schema):
@@ -259,48 +394,43 @@ class BaseDestinationLoader(DestinationLoader):
 
         if destination.has_restriction():
             logger.info(f"Table {destination.table} has restrictions")
-            table_as_arrow = bq_try_read_with_options(
+            # Use the partition metadata to read a window that has enough
+            # rows in a single read session
+            start = sample_window_start(
+                self._bqclient,
+                source_bq_table,
+                destination.row_restriction,
+                start,
+                end,
+                config.max_results_per_query,
+            )
+            arrow_reader = bq_try_read_with_options(
                 start,
                 end,
                 source_name,
                 destination,
                 config.project_id,
                 config.max_results_per_query,
+                config.bq_max_stream_count,
             )
         else:
             if config.max_results_per_query:
                 logger.info(f"Limiting results to {config.max_results_per_query}")
-                rows = self._bqclient.list_rows(source_table)
-                # COLLECT SOME NUMBER OF ROWS
-                total_rows = 0
-                to_concat: t.List[pa.RecordBatch] = []
-                client = bigquery_storage_v1.BigQueryReadClient()
-                for record_batch in rows.to_arrow_iterable(bqstorage_client=client):
-                    to_concat.append(record_batch)
-                    total_rows += record_batch.num_rows
-                    if total_rows >= config.max_results_per_query:
-                        break
-                if total_rows == 0:
-                    logger.info(
-                        "No rows found when limiting rows, resorting to full copy to get schema"
-                    )
-                    rows = self._bqclient.list_rows(source_table)
-                    table_as_arrow = rows.to_arrow(create_bqstorage_client=True)
-                else:
-                    table_as_arrow = pa.Table.from_batches(to_concat)
-                logger.info(f"Rows in arrow table {table_as_arrow.num_rows}")
-            else:
-                rows = self._bqclient.list_rows(source_table)
-                table_as_arrow = rows.to_arrow(
-                    create_bqstorage_client=True
-                )  # noqa: F841
+            arrow_reader = bq_read_table(
+                source_name,
+                config.project_id,
+                max_stream_count=config.bq_max_stream_count,
+                max_rows=config.max_results_per_query,
+            )
+            assert arrow_reader is not None
 
-        # Load the table
+        # Load the table. The rows are streamed from bigquery while the
+        # table is committed
         self.commit_table(
             source_name,
             destination,
             rewritten_destination,
-            table_as_arrow,
+            arrow_reader,
             table_schema,
         )
         logger.info(f"Loaded {source_name} into {destination.table}")
@@ -354,12 +484,15 @@ class DuckDbDestinationLoader(BaseDestinationLoader):
         return convert_bq_schema_to_duckdb_columns(bq_schema)
 
     def drop_table(self, table: exp.Table):
-        self._duckdb_conn.execute(f"DROP TABLE IF EXISTS {table.sql(dialect='duckdb')}")
+        with self._catalog_lock:
+            self.duckdb_conn.execute(
+                f"DROP TABLE IF EXISTS {table.sql(dialect='duckdb')}"
+            )
 
     def destination_table_exists(self, table: exp.Table) -> bool:
         table_name = table.sql(dialect="duckdb")
         logger.debug(f"Checking if {table_name} exists")
-        response = self._duckdb_conn.query(
+        response = self.duckdb_conn.query(
             f"""
             SELECT 1 
             FROM information_schema.tables 
@@ -371,7 +504,7 @@ class DuckDbDestinationLoader(BaseDestinationLoader):
 
     def destination_table_schema(self, table: exp.Table) -> t.List[t.Tuple[str, str]]:
         table_name = table.sql(dialect="duckdb")
-        response = self._duckdb_conn.query(
+        response = self.duckdb_conn.query(
             f"""
             DESCRIBE {table_name}
         """
@@ -394,17 +527,18 @@ class DuckDbDestinationLoader(BaseDestinationLoader):
         return oso_source_rewrite(DUCKDB_REWRITE_RULES, table_fqn)
 
     def commit_to_destination(self, duckdb_table_name: str, destination: exp.Table):
-        self._duckdb_conn.execute(f"CREATE SCHEMA IF NOT EXISTS {destination.db}")
-        self._duckdb_conn.execute(
-            f"CREATE TABLE {destination.sql(dialect='duckdb')} AS SELECT * FROM {duckdb_table_name}"
-        )
-        # Drop the temporary table
-        self._duckdb_conn.execute(f"DROP TABLE {duckdb_table_name}")
+        with self._catalog_lock:
+            self.duckdb_conn.execute(f"CREATE SCHEMA IF NOT EXISTS {destination.db}")
+            self.duckdb_conn.execute(
+                f"CREATE TABLE {destination.sql(dialect='duckdb')} AS SELECT * FROM {duckdb_table_name}"
+            )
+            # Drop the temporary table
+            self.duckdb_conn.execute(f"DROP TABLE {duckdb_table_name}")
 
     def drop_like_schema_name(self, like_schema_name: str, not_like: bool = False):
         not_like_str = "NOT " if not_like else ""
 
-        schemas = self._duckdb_conn.execute(
+        schemas = self.duckdb_conn.execute(
             f"""
             SELECT schema_name 
             FROM information_schema.schemata 
@@ -416,14 +550,14 @@ class DuckDbDestinationLoader(BaseDestinationLoader):
         for schema in schemas:
             schema_name = schema[0]
             logger.info(f"Dropping schema {schema_name}")
-            self._duckdb_conn.execute(f"DROP SCHEMA {schema_name} CASCADE")
+            self.duckdb_conn.execute(f"DROP SCHEMA {schema_name} CASCADE")
 
     def commit_table(
         self,
         source_name: str,
         destination: TableMappingDestination,
         rewritten_destination: exp.Table,
-        table_as_arrow: pa.Table,
+        arrow_reader: pa.RecordBatchReader,
         table_schema: t.List[bigquery.SchemaField],
     ):
         duckdb_table_name = f"oso_local_temp.{rewritten_destination.this.sql(dialect="duckdb")}_{datetime.now().strftime('%Y%m%d%H%M%S')}"
@@ -432,17 +566,18 @@ class DuckDbDestinationLoader(BaseDestinationLoader):
         logger.debug(f"Column types: {table_schema}")
 
         # Remove all metadata from the schema
-        new_schema = remove_metadata_from_schema(table_as_arrow.schema)
-        table_as_arrow = table_as_arrow.cast(new_schema)
+        new_schema = remove_metadata_from_schema(arrow_reader.schema)
+        arrow_reader = arrow_reader.cast(new_schema)
 
         duckdb_table_split = duckdb_table_name.split(".")
         schema = duckdb_table_split[0]
 
-        logger.debug(f"copying {table_as_arrow.num_rows} rows to {duckdb_table_name}")
-        if schema not in self._created_schemas:
-            logger.info(f"Creating schema {schema}")
-            self._duckdb_conn.execute(f"CREATE SCHEMA IF NOT EXISTS {schema}")
-            self._created_schemas.add(schema)
+        logger.debug(f"copying rows to {duckdb_table_name}")
+        with self._catalog_lock:
+            if schema not in self._created_schemas:
+                logger.info(f"Creating schema {schema}")
+                self.duckdb_conn.execute(f"CREATE SCHEMA IF NOT EXISTS {schema}")
+                self._created_schemas.add(schema)
 
         create_query = parse_one(
             f"""
@@ -467,10 +602,12 @@ class DuckDbDestinationLoader(BaseDestinationLoader):
             ],
         )
         logger.debug(f"EXECUTING={create_query.sql(dialect="duckdb")}")
-        self._duckdb_conn.execute(create_query.sql(dialect="duckdb"))
+        with self._catalog_lock:
+            self.duckdb_conn.execute(create_query.sql(dialect="duckdb"))
 
+        arrow_view_name = f"arrow_reader_{uuid.uuid4().hex}"
         insert_query = parse_one(
-            f"INSERT INTO {duckdb_table_name} (placeholder) SELECT placeholder FROM table_as_arrow"
+            f"INSERT INTO {duckdb_table_name} (placeholder) SELECT placeholder FROM {arrow_view_name}"
         )
         insert_query.this.set(
             "expressions",
@@ -484,7 +621,11 @@ class DuckDbDestinationLoader(BaseDestinationLoader):
             [exp.to_column(column_name, quoted=True) for column_name, _ in columns],
         )
         logger.debug(f"EXECUTING={insert_query.sql(dialect="duckdb")}")
-        self._duckdb_conn.execute(insert_query.sql(dialect="duckdb"))
+        self.duckdb_conn.register(arrow_view_name, arrow_reader)
+        try:
+            self.duckdb_conn.execute(insert_query.sql(dialect="duckdb"))
+        finally:
+            self.duckdb_conn.unregister(arrow_view_name)
 
         self.commit_to_destination(duckdb_table_name, rewritten_destination)
 
@@ -614,22 +755,22 @@ class LocalTrinoDestinationLoader(BaseDestinationLoader):
     def save_bigquery_schema(
         self, table: exp.Table, schema: t.List[bigquery.SchemaField]
     ):
-        self._duckdb_conn.execute(
+        self.duckdb_conn.execute(
             f"CREATE SCHEMA IF NOT EXISTS {self._schema_table_schema}"
         )
-        self._duckdb_conn.execute(
+        self.duckdb_conn.execute(
             f"CREATE TABLE IF NOT EXISTS {self.schema_table} (table_name VARCHAR, serialized_schema JSON)"
         )
 
         serialized_schema = json.dumps(self.serialize_bigquery_schema(schema))
 
-        self._duckdb_conn.execute(
+        self.duckdb_conn.execute(
             f"INSERT INTO {self.schema_table} VALUES ('{table.sql(dialect="trino")}', '{serialized_schema}')"
         )
 
     def load_bigquery_schema(self, table: exp.Table) -> t.List[bigquery.SchemaField]:
         try:
-            response = self._duckdb_conn.query(
+            response = self.duckdb_conn.query(
                 f"SELECT serialized_schema FROM {self.schema_table} WHERE table_name = '{table.sql(dialect='trino')}'"
             )
         except duckdb.CatalogException:
@@ -681,25 +822,39 @@ class LocalTrinoDestinationLoader(BaseDestinationLoader):
         source_name: str,
         destination: TableMappingDestination,
         rewritten_destination: exp.Table,
-        table_as_arrow: pa.Table,
+        arrow_reader: pa.RecordBatchReader,
         table_schema: t.List[bigquery.SchemaField],
     ):
         logger.info(f"Committing {rewritten_destination} to iceberg")
-        self._iceberg_catalog.create_namespace_if_not_exists(rewritten_destination.db)
-        table = self._iceberg_catalog.create_table_if_not_exists(
-            f"{rewritten_destination.db}.{rewritten_destination.this}",
-            schema=table_as_arrow.schema,
-        )
+        with self._catalog_lock:
+            self._iceberg_catalog.create_namespace_if_not_exists(
+                rewritten_destination.db
+            )
+            table = self._iceberg_catalog.create_table_if_not_exists(
+                f"{rewritten_destination.db}.{rewritten_destination.this}",
+                schema=arrow_reader.schema,
+            )
 
-        logger.info("Storing bigquery schema in duckdb")
-        self.save_bigquery_schema(rewritten_destination, table_schema)
+            logger.info("Storing bigquery schema in duckdb")
+            self.save_bigquery_schema(rewritten_destination, table_schema)
 
         # This seems to be necessary to rewrite the minio url because pyiceberg
         # ignores the initial config. Likely, it reads the minio url from
         # the catalog.
         table.io.properties["s3.endpoint"] = self._minio_url
         try:
-            table.append(table_as_arrow)
+            # Each append is a commit so batches are appended in chunks
+            chunk: t.List[pa.RecordBatch] = []
+            chunk_rows = 0
+            for batch in arrow_reader:
+                chunk.append(batch)
+                chunk_rows += batch.num_rows
+                if chunk_rows >= ICEBERG_APPEND_ROWS:
+                    table.append(pa.Table.from_batches(chunk, arrow_reader.schema))
+                    chunk = []
+                    chunk_rows = 0
+            if chunk:
+                table.append(pa.Table.from_batches(chunk, arrow_reader.schema))
         except Exception as e:
             logger.error(f"Failed to append data to {rewritten_destination}")
             logger.error(e)
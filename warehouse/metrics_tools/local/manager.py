@@ -1,5 +1,6 @@
 import logging
 import typing as t
+from concurrent.futures import ThreadPoolExecutor, as_completed
 from datetime import datetime, timedelta
 
 from metrics_tools.local.config import (
@@ -29,10 +30,20 @@ class LocalWarehouseManager:
     def load_tables_into(self, loader: DestinationLoader):
         start = datetime.now() - timedelta(days=self.config.max_days)
         end = datetime.now()
-        for source_name, destination in self.table_mapping.items():
-            if isinstance(destination, str):
-                destination = TableMappingDestination(table=destination)
-            loader.load_from_bq(start, end, source_name, destination)
+        with ThreadPoolExecutor(
+            max_workers=max(self.config.max_concurrent_table_loads, 1)
+        ) as pool:
+            futures = []
+            for source_name, destination in self.table_mapping.items():
+                if isinstance(destination, str):
+                    destination = TableMappingDestination(table=destination)
+                futures.append(
+                    pool.submit(
+                        loader.load_from_bq, start, end, source_name, destination
+                    )
+                )
+            for future in as_completed(futures):
+                future.result()
         logger.info("Loaded all tables into warehouse")
 
     def initialize(self):
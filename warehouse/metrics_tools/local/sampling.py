@@ -0,0 +1,144 @@
+"""Plans the date window that is read for tables with a row restriction.
+
+Instead of widening the window until a read session has streams, the row
+counts of the table's partitions are used to find the smallest window that
+contains the number of rows we want.
+"""
+
+import bisect
+import logging
+import typing as t
+from datetime import datetime
+
+from google.cloud import bigquery
+from metrics_tools.local.config import RowRestriction
+
+logger = logging.getLogger(__name__)
+
+# The formats of the partition ids of time partitioned tables by their length
+PARTITION_ID_FORMATS = {
+    4: "%Y",
+    6: "%Y%m",
+    8: "%Y%m%d",
+    10: "%Y%m%d%H",
+}
+
+
+class PartitionRowCount(t.NamedTuple):
+    start: datetime
+    rows: int
+
+
+def parse_partition_id(partition_id: str) -> t.Optional[datetime]:
+    """Returns the start of a time partition or None for the special
+    partitions (e.g. `__NULL__`)"""
+    partition_format = PARTITION_ID_FORMATS.get(len(partition_id))
+    if not partition_format or not partition_id.isdigit():
+        return None
+    return datetime.strptime(partition_id, partition_format)
+
+
+def partition_row_counts(
+    bqclient: bigquery.Client,
+    table: bigquery.Table,
+    time_column: str,
+) -> t.Optional[t.List[PartitionRowCount]]:
+    """The row counts of a table's partitions. None is returned if the table
+    isn't partitioned by `time_column`"""
+    partitioning = table.time_partitioning
+    if not partitioning or not partitioning.field:
+        return None
+    if partitioning.field.lower() != time_column.lower():
+        return None
+
+    query = f"""
+        SELECT partition_id, total_rows
+        FROM `{table.project}.{table.dataset_id}.INFORMATION_SCHEMA.PARTITIONS`
+        WHERE table_name = @table_name
+    """
+    job_config = bigquery.QueryJobConfig(
+        query_parameters=[
+            bigquery.ScalarQueryParameter("table_name", "STRING", table.table_id)
+        ]
+    )
+    counts: t.List[PartitionRowCount] = []
+    for row in bqclient.query(query, job_config=job_config).result():
+        start = parse_partition_id(row.partition_id)
+        if start is None or not row.total_rows:
+            continue
+        counts.append(PartitionRowCount(start=start, rows=row.total_rows))
+    return counts
+
+
+def plan_window_start(
+    partitions: t.List[PartitionRowCount],
+    start: datetime,
+    end: datetime,
+    target_rows: int,
+) -> t.Optional[datetime]:
+    """Finds the latest start of a window that ends at `end` and contains at
+    least `target_rows` rows. Without a target the window from `start` is kept
+    unless it is empty, in which case it is widened to the latest partition
+    with rows.
+
+    The rows before `end` are counted from the newest partition backwards and
+    the start is found with a binary search on those cumulative counts. If the
+    table doesn't have enough rows the start of the oldest partition is
+    returned. None is returned if there are no rows before `end`.
+    """
+    end_day = end.replace(hour=0, minute=0, second=0, microsecond=0)
+    # The restriction is `time_column < end` on the day of `end`
+    newest_first = sorted(
+        (partition for partition in partitions if partition.start < end_day),
+        key=lambda partition: partition.start,
+        reverse=True,
+    )
+    if not newest_first:
+        return None
+
+    cumulative_rows: t.List[int] = []
+    total = 0
+    for partition in newest_first:
+        total += partition.rows
+        cumulative_rows.append(total)
+
+    if not target_rows:
+        if newest_first[0].start >= start:
+            return start
+        return newest_first[0].start
+
+    index = bisect.bisect_left(cumulative_rows, target_rows)
+    index = min(index, len(newest_first) - 1)
+    return newest_first[index].start
+
+
+def sample_window_start(
+    bqclient: bigquery.Client,
+    table: bigquery.Table,
+    row_restriction: RowRestriction,
+    start: datetime,
+    end: datetime,
+    target_rows: int,
+) -> datetime:
+    """Chooses the start of the window that is read from a table. If the
+    partition metadata can't be used `start` is returned unchanged.
+
+    Other `wheres` of the restriction aren't known to the planner so the
+    window may contain fewer rows than planned."""
+    if not row_restriction.time_column:
+        return start
+    try:
+        partitions = partition_row_counts(bqclient, table, row_restriction.time_column)
+    except Exception as e:
+        logger.warning(f"Failed to load partitions of {table.full_table_id}: {e}")
+        return start
+    if partitions is None:
+        return start
+
+    planned_start = plan_window_start(partitions, start, end, target_rows)
+    if planned_start is None:
+        return start
+    logger.info(
+        f"Reading {table.full_table_id} from {planned_start.strftime('%Y-%m-%d')}"
+    )
+    return planned_start
@@ -0,0 +1,190 @@
+import threading
+import typing as t
+from datetime import datetime
+
+import pyarrow as pa
+import pytest
+from google.cloud import bigquery_storage_v1
+
+from .config import RowRestriction, TableMappingDestination
+from .loader import bq_read_table, bq_try_read_with_options
+
+SCHEMA = pa.schema([("id", pa.int64())])
+
+
+class FakeStream(t.NamedTuple):
+    name: str
+
+
+class FakeArrowSchema(t.NamedTuple):
+    serialized_schema: bytes
+
+
+class FakeReadSession(t.NamedTuple):
+    streams: t.List[FakeStream]
+    arrow_schema: FakeArrowSchema
+
+
+class FakePage:
+    def __init__(self, batch: pa.RecordBatch):
+        self.batch = batch
+
+    def to_arrow(self):
+        return self.batch
+
+
+class FakeRowsIterable:
+    def __init__(self, client: "FakeReadClient", stream: str):
+        self.client = client
+        self.stream = stream
+
+    @property
+    def pages(self) -> t.Iterator[FakePage]:
+        for page in range(self.client.pages_per_stream):
+            if self.stream == self.client.failing_stream and page == 1:
+                raise ValueError("stream failed")
+            with self.client.lock:
+                self.client.pages_read += 1
+            start = (int(self.stream) * self.client.pages_per_stream + page) * 100
+            yield FakePage(
+                pa.record_batch([pa.array(range(start, start + 100))], schema=SCHEMA)
+            )
+
+
+class FakeReadRowsStream:
+    def __init__(self, client: "FakeReadClient", stream: str):
+        self.client = client
+        self.stream = stream
+
+    def rows(self, session: FakeReadSession):
+        return FakeRowsIterable(self.client, self.stream)
+
+
+class FakeReadClient:
+    """A read client whose sessions have up to `streams` streams of
+    `pages_per_stream` pages of 100 rows. Sessions whose row restriction
+    contains one of `empty_restrictions` have no streams."""
+
+    def __init__(
+        self,
+        streams: int = 3,
+        pages_per_stream: int = 5,
+        empty_restrictions: t.Optional[t.List[str]] = None,
+        failing_stream: str = "",
+    ):
+        self.streams = streams
+        self.pages_per_stream = pages_per_stream
+        self.empty_restrictions = empty_restrictions or []
+        self.failing_stream = failing_stream
+        self.restrictions: t.List[str] = []
+        self.pages_read = 0
+        self.lock = threading.Lock()
+
+    def __call__(self):
+        return self
+
+    def create_read_session(
+        self,
+        parent: str,
+        read_session: bigquery_storage_v1.types.ReadSession,
+        max_stream_count: int,
+    ):
+        restriction = read_session.read_options.row_restriction
+        self.restrictions.append(restriction)
+        streams = min(self.streams, max_stream_count)
+        if any(empty in restriction for empty in self.empty_restrictions):
+            streams = 0
+        return FakeReadSession(
+            streams=[FakeStream(str(i)) for i in range(streams)],
+            arrow_schema=FakeArrowSchema(SCHEMA.serialize().to_pybytes()),
+        )
+
+    def read_rows(self, stream: str):
+        return FakeReadRowsStream(self, stream)
+
+
+@pytest.fixture
+def read_client(monkeypatch: pytest.MonkeyPatch):
+    client = FakeReadClient()
+    monkeypatch.setattr(bigquery_storage_v1, "BigQueryReadClient", client)
+    return client
+
+
+def test_bq_read_table_reads_all_streams(read_client: FakeReadClient):
+    reader = bq_read_table("project.dataset.table", "project", max_stream_count=3)
+    assert reader is not None
+    table = reader.read_all()
+
+    assert table.schema == SCHEMA
+    ids = t.cast(t.List[int], table.column("id").to_pylist())
+    assert sorted(ids) == list(range(1500))
+    assert read_client.pages_read == 15
+
+
+def test_bq_read_table_stops_after_max_rows(read_client: FakeReadClient):
+    reader = bq_read_table(
+        "project.dataset.table", "project", max_stream_count=3, max_rows=150
+    )
+    assert reader is not None
+
+    assert reader.read_all().num_rows == 150
+    # The streams stop once the rows have been read. Only the pages that
+    # were buffered are read in addition.
+    assert read_client.pages_read < 15
+
+
+def test_bq_read_table_raises_stream_errors(read_client: FakeReadClient):
+    read_client.failing_stream = "1"
+    reader = bq_read_table("project.dataset.table", "project", max_stream_count=3)
+    assert reader is not None
+    with pytest.raises(ValueError, match="stream failed"):
+        reader.read_all()
+
+
+def test_bq_read_table_without_streams(read_client: FakeReadClient):
+    read_client.streams = 0
+    assert bq_read_table("project.dataset.table", "project", allow_empty=False) is None
+    reader = bq_read_table("project.dataset.table", "project")
+    assert reader is not None
+    assert reader.read_all().num_rows == 0
+
+
+def test_bq_try_read_widens_empty_restrictions(read_client: FakeReadClient):
+    read_client.empty_restrictions = ["2024-01-05"]
+    destination = TableMappingDestination(
+        table="dest", row_restriction=RowRestriction(time_column="time")
+    )
+
+    reader = bq_try_read_with_options(
+        datetime(2024, 1, 5),
+        datetime(2024, 1, 8),
+        "project.dataset.table",
+        destination,
+        "project",
+        max_results_per_query=0,
+        max_stream_count=3,
+    )
+
+    # The first window is empty and the start is moved back a day
+    assert len(read_client.restrictions) == 2
+    assert "2024-01-04" in read_client.restrictions[1]
+    # Without a limit all the rows of the restriction are read
+    assert reader.read_all().num_rows == 1500
+
+
+def test_bq_try_read_limits_rows(read_client: FakeReadClient):
+    destination = TableMappingDestination(
+        table="dest", row_restriction=RowRestriction(time_column="time")
+    )
+
+    reader = bq_try_read_with_options(
+        datetime(2024, 1, 5),
+        datetime(2024, 1, 8),
+        "project.dataset.table",
+        destination,
+        "project",
+        max_results_per_query=250,
+        max_stream_count=3,
+    )
+
+    assert reader.read_all().num_rows == 250
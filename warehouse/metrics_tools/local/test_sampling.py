@@ -0,0 +1,39 @@
+from datetime import datetime
+
+from .sampling import PartitionRowCount, parse_partition_id, plan_window_start
+
+
+def test_parse_partition_id():
+    assert parse_partition_id("20240105") == datetime(2024, 1, 5)
+    assert parse_partition_id("2024010513") == datetime(2024, 1, 5, 13)
+    assert parse_partition_id("202401") == datetime(2024, 1, 1)
+    assert parse_partition_id("__NULL__") is None
+    assert parse_partition_id("__UNPARTITIONED__") is None
+
+
+def test_plan_window_start():
+    partitions = [
+        PartitionRowCount(start=datetime(2024, 1, day), rows=100) for day in range(1, 8)
+    ]
+    start = datetime(2024, 1, 5)
+    end = datetime(2024, 1, 7, 12)
+
+    # The partition of the end day is excluded by the restriction
+    assert plan_window_start(partitions, start, end, 100) == datetime(2024, 1, 6)
+    assert plan_window_start(partitions, start, end, 250) == datetime(2024, 1, 4)
+    # Not enough rows reads the whole table
+    assert plan_window_start(partitions, start, end, 10_000) == datetime(2024, 1, 1)
+    # Without a target the original window is kept
+    assert plan_window_start(partitions, start, end, 0) == start
+    assert plan_window_start([], start, end, 100) is None
+
+
+def test_plan_window_start_widens_empty_windows():
+    partitions = [
+        PartitionRowCount(start=datetime(2023, 6, 1), rows=10),
+        PartitionRowCount(start=datetime(2023, 3, 1), rows=10),
+    ]
+    start = datetime(2024, 1, 1)
+    end = datetime(2024, 1, 8)
+    assert plan_window_start(partitions, start, end, 0) == datetime(2023, 6, 1)
+    assert plan_window_start(partitions, start, end, 15) == datetime(2023, 3, 1)
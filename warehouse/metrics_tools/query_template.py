@@ -0,0 +1,116 @@
+"""Compile-once templates of metrics queries.
+
+Rendering a metrics query runs the sqlmesh macro evaluator over the whole
+query. When a query is rendered for many days only the date macros
+(`@metrics_start`, `@metrics_end` and `@metrics_sample_date`) and the
+`@start_ds`/`@end_ds` variables change. A template evaluates everything else
+once and leaves a typed placeholder for each date macro. The placeholders are
+rendered with sentinel dates so that rendering a day is a string
+substitution.
+"""
+
+import re
+import typing as t
+from datetime import datetime
+
+from metrics_tools.batched_rolling import is_macro_call
+from sqlglot import exp
+from sqlmesh.core.dialect import MacroFunc, MacroVar
+
+DATE_MACROS = ("metrics_start", "metrics_end", "metrics_sample_date")
+DATE_VARIABLES = ("start_ds", "end_ds")
+
+START_DS_SENTINEL = "__metrics_start_ds__"
+END_DS_SENTINEL = "__metrics_end_ds__"
+
+PLACEHOLDER_PREFIX = "__metrics_placeholder_"
+
+# Renders a list of expressions with the given start_ds and end_ds
+RenderFunc = t.Callable[[t.List[exp.Expression], str, str], str]
+
+
+def _is_date_expression(node: exp.Expression) -> bool:
+    if isinstance(node, MacroFunc):
+        return any(is_macro_call(node, name) for name in DATE_MACROS)
+    if isinstance(node, MacroVar):
+        return node.name in DATE_VARIABLES
+    return False
+
+
+class TemplatePlaceholder(t.NamedTuple):
+    name: str
+    # The date macro call or variable that was replaced
+    expression: exp.Expression
+    # The rendered expression with the sentinel dates
+    fragment: str = ""
+
+
+def replace_date_expressions(
+    query: t.List[exp.Expression],
+) -> t.Tuple[t.List[exp.Expression], t.List[TemplatePlaceholder]]:
+    """Replaces the outermost date macros and variables of the query with
+    placeholder columns."""
+    placeholders: t.List[TemplatePlaceholder] = []
+
+    def replace(node: exp.Expression):
+        if not _is_date_expression(node):
+            return node
+        name = f"{PLACEHOLDER_PREFIX}{len(placeholders)}__"
+        placeholders.append(TemplatePlaceholder(name=name, expression=node.copy()))
+        return exp.column(name)
+
+    replaced = [expression.copy().transform(replace) for expression in query]
+    return replaced, placeholders
+
+
+class QueryTemplate:
+    """A rendered query with placeholders for the date dependent parts"""
+
+    def __init__(self, sql: str, placeholders: t.List[TemplatePlaceholder]):
+        self.sql = sql
+        self.placeholders = {
+            placeholder.name: placeholder.fragment for placeholder in placeholders
+        }
+        self._pattern = (
+            re.compile("|".join(re.escape(name) for name in self.placeholders))
+            if self.placeholders
+            else None
+        )
+
+    @classmethod
+    def compile(
+        cls, query: t.List[exp.Expression], render: RenderFunc
+    ) -> t.Optional["QueryTemplate"]:
+        """Compiles a template of the query. Returns None if the query depends
+        on the dates in any other way than through the date macros."""
+        replaced, placeholders = replace_date_expressions(query)
+        sql = render(replaced, START_DS_SENTINEL, END_DS_SENTINEL)
+        if START_DS_SENTINEL in sql or END_DS_SENTINEL in sql:
+            return None
+        placeholders = [
+            placeholder._replace(
+                fragment=render(
+                    [placeholder.expression], START_DS_SENTINEL, END_DS_SENTINEL
+                )
+            )
+            for placeholder in placeholders
+        ]
+        for placeholder in placeholders:
+            # The placeholder must be rendered verbatim so that it can be
+            # substituted
+            if placeholder.name not in sql:
+                return None
+        return cls(sql, placeholders)
+
+    def render(self, start: datetime, end: datetime) -> str:
+        if not self._pattern:
+            return self.sql
+        start_ds = start.strftime("%Y-%m-%d")
+        end_ds = end.strftime("%Y-%m-%d")
+        fragments = {
+            name: fragment.replace(START_DS_SENTINEL, start_ds).replace(
+                END_DS_SENTINEL, end_ds
+            )
+            for name, fragment in self.placeholders.items()
+        }
+        return self._pattern.sub(lambda match: fragments[match.group(0)], self.sql)
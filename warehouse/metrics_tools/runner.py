@@ -9,10 +9,16 @@ from datetime import datetime
 import arrow
 import duckdb
 import pandas as pd
+from metrics_tools.batched_rolling import (
+    SPINE_TABLE,
+    BatchedRollingQuery,
+    create_batched_rolling_query,
+)
 from metrics_tools.definition import PeerMetricDependencyRef, RollingCronOptions
 from metrics_tools.intermediate import run_macro_evaluator
 from metrics_tools.macros import metrics_end, metrics_sample_date, metrics_start
 from metrics_tools.models import create_unregistered_macro_registry
+from metrics_tools.query_template import QueryTemplate
 from metrics_tools.utils.glot import str_or_expressions
 from sqlglot import exp
 from sqlmesh import EngineAdapter
@@ -81,6 +87,10 @@ class FakeEngineAdapter(EngineAdapter):
         self.dialect = dialect
 
 
+# The number of days calculated by a single query when running rolling queries
+# that can be batched
+DEFAULT_ROLLING_BATCH_SIZE = 30
+
 ROLLING_CRON_TO_ARROW_UNIT: t.Dict[
     RollingCronOptions, t.Literal["day", "month", "year", "week"]
 ] = {
@@ -139,6 +149,12 @@ class MetricsRunner:
         self._query = query
         self._ref = ref
         self._locals = locals or {}
+        self._batched_rolling_query: t.Optional[BatchedRollingQuery] = None
+        # The sample date of a time aggregation is the bucket of each row and
+        # not the rendered day, so it can't be part of the spine
+        if len(query) == 1 and not ref.get("time_aggregation"):
+            self._batched_rolling_query = create_batched_rolling_query(query[0])
+        self._templates: t.Dict[str, t.Optional[QueryTemplate]] = {}
 
     def run(self, start: datetime, end: datetime):
         """Run metrics for a given period and return the results as pandas dataframes"""
@@ -152,34 +168,79 @@ class MetricsRunner:
         logger.debug("executing time aggregation", extra={"query": rendered_query})
         return self._context.engine_adapter.fetchdf(rendered_query)
 
-    def run_rolling(self, start: datetime, end: datetime):
+    def run_rolling(
+        self,
+        start: datetime,
+        end: datetime,
+        batch_size: int = DEFAULT_ROLLING_BATCH_SIZE,
+    ):
         df: pd.DataFrame = pd.DataFrame()
         logger.debug(
             f"run_rolling[{self._ref['name']}]: called with start={start} and end={end}"
         )
         count = 0
         total_rows = 0
-        for rendered_query in self.render_rolling_queries(start, end):
-            count += 1
-            logger.debug(
-                f"run_rolling[{self._ref['name']}]: executing rolling window: {rendered_query}",
-                extra={"query": rendered_query},
-            )
-            day_result = self._context.engine_adapter.fetchdf(rendered_query)
-            day_rows = len(day_result)
-            total_rows += day_rows
-            logger.debug(
-                f"run_rolling[{self._ref['name']}]: rolling window period resulted in {day_rows} rows"
-            )
-            df = pd.concat([df, day_result])
+        for batch in self.render_rolling_batches(start, end, batch_size):
+            for rendered_query in batch:
+                count += 1
+                logger.debug(
+                    f"run_rolling[{self._ref['name']}]: executing rolling window: {rendered_query}",
+                    extra={"query": rendered_query},
+                )
+                day_result = self._context.engine_adapter.fetchdf(rendered_query)
+                day_rows = len(day_result)
+                total_rows += day_rows
+                logger.debug(
+                    f"run_rolling[{self._ref['name']}]: rolling window period resulted in {day_rows} rows"
+                )
+                df = pd.concat([df, day_result])
         logger.debug(f"run_rolling[{self._ref['name']}]: total rows {total_rows}")
 
         return df
 
     def render_query(self, start: datetime, end: datetime) -> str:
+        return self._render_with_template("query", self._query, start, end)
+
+    def _render_with_template(
+        self,
+        key: str,
+        query: t.List[exp.Expression],
+        start: datetime,
+        end: datetime,
+    ) -> str:
+        """Renders the query using a template that is compiled on first use.
+        The template is only used if it renders the same query as the macro
+        evaluator for the first rendered dates."""
+        if key not in self._templates:
+            rendered_query = self._render_expressions(query, start, end)
+            template: t.Optional[QueryTemplate] = None
+            try:
+                template = QueryTemplate.compile(query, self._evaluate)
+            except Exception as e:
+                logger.debug(f"could not compile a template of the {key}: {e}")
+            if template and template.render(start, end) != rendered_query:
+                logger.debug(f"template of the {key} does not match the query")
+                template = None
+            self._templates[key] = template
+            return rendered_query
+        template = self._templates[key]
+        if template is None:
+            return self._render_expressions(query, start, end)
+        return template.render(start, end)
+
+    def _render_expressions(
+        self, query: t.List[exp.Expression], start: datetime, end: datetime
+    ) -> str:
+        return self._evaluate(
+            query, start.strftime("%Y-%m-%d"), end.strftime("%Y-%m-%d")
+        )
+
+    def _evaluate(
+        self, query: t.List[exp.Expression], start_ds: str, end_ds: str
+    ) -> str:
         variables: t.Dict[str, t.Any] = {
-            "start_ds": start.strftime("%Y-%m-%d"),
-            "end_ds": end.strftime("%Y-%m-%d"),
+            "start_ds": start_ds,
+            "end_ds": end_ds,
         }
         logger.debug(f"start_ds={variables['start_ds']} end_ds={variables['end_ds']}")
         time_aggregation = self._ref.get("time_aggregation")
@@ -199,7 +260,7 @@ class MetricsRunner:
             ]
         )
         evaluated_query = run_macro_evaluator(
-            self._query,
+            query,
             additional_macros=additional_macros,
             variables=variables,
             engine_adapter=self._context.engine_adapter,
@@ -220,6 +281,66 @@ class MetricsRunner:
             rendered_query = self.render_query(day, day)
             yield rendered_query
 
+    @property
+    def supports_batched_rolling(self) -> bool:
+        return self._batched_rolling_query is not None
+
+    def render_batched_rolling_query(self, days: t.List[datetime]) -> t.Optional[str]:
+        """Renders a single query that calculates the rolling query for all of
+        the given days. Returns None if the query cannot be batched."""
+        if not self._batched_rolling_query or not days:
+            return None
+        spine_rows = [
+            self._render_with_template(
+                "spine", [self._batched_rolling_query.spine_select], day, day
+            )
+            for day in days
+        ]
+        # Any remaining macros of the query are independent of the day
+        query = self._render_with_template(
+            "batched_query", [self._batched_rolling_query.query], days[-1], days[-1]
+        )
+        return f"WITH {SPINE_TABLE} AS ({' UNION ALL '.join(spine_rows)}) {query}"
+
+    def render_rolling_batches(
+        self,
+        start: datetime,
+        end: datetime,
+        batch_size: int = DEFAULT_ROLLING_BATCH_SIZE,
+    ) -> t.Iterator[t.List[str]]:
+        """Renders the rolling queries in batches of `batch_size` days. A batch
+        is a single query if the query can be batched and otherwise a query
+        per day."""
+        for days in self.iter_query_day_batches(start, end, batch_size):
+            yield self.render_rolling_batch(days)
+
+    async def render_rolling_batches_async(
+        self,
+        start: datetime,
+        end: datetime,
+        batch_size: int = DEFAULT_ROLLING_BATCH_SIZE,
+    ):
+        for days in self.iter_query_day_batches(start, end, batch_size):
+            yield await asyncio.to_thread(self.render_rolling_batch, days)
+
+    def render_rolling_batch(self, days: t.List[datetime]) -> t.List[str]:
+        batched_query = self.render_batched_rolling_query(days)
+        if batched_query is not None:
+            return [batched_query]
+        return [self.render_query(day, day) for day in days]
+
+    def iter_query_day_batches(
+        self, start: datetime, end: datetime, batch_size: int
+    ) -> t.Iterator[t.List[datetime]]:
+        days: t.List[datetime] = []
+        for day in self.iter_query_days(start, end):
+            days.append(day)
+            if len(days) >= batch_size:
+                yield days
+                days = []
+        if days:
+            yield days
+
     def iter_query_days(self, start: datetime, end: datetime):
         cron = self._ref.get("cron")
         assert cron is not None, "cron is required for rolling queries"
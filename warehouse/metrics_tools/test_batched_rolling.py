@@ -0,0 +1,94 @@
+import pytest
+from metrics_tools.batched_rolling import SPINE_TABLE, create_batched_rolling_query
+from sqlglot import exp
+from sqlmesh.core.dialect import parse_one
+
+
+@pytest.mark.parametrize(
+    "query",
+    [
+        """
+        select @metrics_sample_date(events.bucket_day) as metrics_sample_date,
+            events.to_artifact_id,
+            sum(events.amount) as amount
+        from events
+        where events.event_type = 'STARRED'
+            and events.bucket_day between @metrics_start('DATE') and @metrics_end('DATE')
+        group by 1, events.to_artifact_id
+        """,
+        """
+        select @metrics_sample_date(bucket_day) as metrics_sample_date,
+            to_artifact_id,
+            count(distinct from_artifact_id) as amount
+        from events
+        where bucket_day between @metrics_start('DATE') and @metrics_end('DATE')
+        group by @metrics_sample_date(bucket_day), to_artifact_id
+        """,
+        """
+        select @metrics_sample_date(bucket_day) as metrics_sample_date, to_artifact_id
+        from events
+        where bucket_day between @metrics_start('DATE') and @metrics_end('DATE')
+        """,
+    ],
+)
+def test_create_batched_rolling_query(query: str):
+    batched = create_batched_rolling_query(parse_one(query))
+    assert batched is not None
+
+    assert not list(batched.query.find_all(exp.Between))[0].find(exp.Literal)
+    joins = batched.query.args["joins"]
+    assert len(joins) == 1
+    assert joins[0].this.name == SPINE_TABLE
+    assert batched.query.expressions[0].alias == "metrics_sample_date"
+    assert batched.spine_select.named_selects == [
+        "metrics_start",
+        "metrics_end",
+        "metrics_sample_date",
+    ]
+
+
+@pytest.mark.parametrize(
+    "query",
+    [
+        # Not grouped by the sample date
+        """
+        select @metrics_sample_date(bucket_day) as metrics_sample_date,
+            sum(amount) as amount
+        from events
+        where bucket_day between @metrics_start('DATE') and @metrics_end('DATE')
+        group by to_artifact_id
+        """,
+        # Not filtered by the rolling window
+        """
+        select @metrics_sample_date(bucket_day) as metrics_sample_date,
+            sum(amount) as amount
+        from events
+        group by 1
+        """,
+        # Date macros used outside of the window filter
+        """
+        select @metrics_sample_date(bucket_day) as metrics_sample_date,
+            sum(amount) / datediff(@metrics_start('DATE'), @metrics_end('DATE')) as amount
+        from events
+        where bucket_day between @metrics_start('DATE') and @metrics_end('DATE')
+        group by 1
+        """,
+        # Window functions span rows of all days
+        """
+        select @metrics_sample_date(bucket_day) as metrics_sample_date,
+            rank() over (order by amount) as amount
+        from events
+        where bucket_day between @metrics_start('DATE') and @metrics_end('DATE')
+        """,
+        # Subqueries
+        """
+        select @metrics_sample_date(bucket_day) as metrics_sample_date,
+            sum(amount) as amount
+        from (select * from events) as events
+        where bucket_day between @metrics_start('DATE') and @metrics_end('DATE')
+        group by 1
+        """,
+    ],
+)
+def test_create_batched_rolling_query_unsupported(query: str):
+    assert create_batched_rolling_query(parse_one(query)) is None
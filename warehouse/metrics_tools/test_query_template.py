@@ -0,0 +1,53 @@
+from datetime import datetime
+
+from metrics_tools.query_template import QueryTemplate, replace_date_expressions
+from sqlglot import exp
+from sqlmesh.core.dialect import MacroVar, parse
+
+
+def test_replace_date_expressions():
+    query = parse(
+        """
+        select @metrics_sample_date(@metrics_end('DATE')) as metrics_sample_date,
+            @end_ds as end_ds,
+            @other_var as other
+        from events
+        where bucket_day between @metrics_start('DATE') and @metrics_end('DATE')
+        """
+    )
+    replaced, placeholders = replace_date_expressions(query)
+    # Nested date macros are part of the outermost placeholder
+    assert len(placeholders) == 4
+    sql = replaced[0].sql()
+    for placeholder in placeholders:
+        assert placeholder.name in sql
+    assert "@other_var" in sql
+    # The original query is unchanged
+    assert "@metrics_start" in query[0].sql()
+
+
+def test_query_template_render():
+    def render(query: list[exp.Expression], start_ds: str, end_ds: str):
+        return "\n".join(
+            expression.transform(
+                lambda node: (
+                    exp.Literal.string(end_ds) if isinstance(node, MacroVar) else node
+                )
+            ).sql()
+            for expression in query
+        )
+
+    template = QueryTemplate.compile(
+        parse("select * from events where day = @end_ds"), render
+    )
+    assert template is not None
+    day = datetime(2024, 1, 10)
+    assert template.render(day, day) == "SELECT * FROM events WHERE day = '2024-01-10'"
+
+
+def test_query_template_rejects_other_date_dependencies():
+    def render(query: list[exp.Expression], start_ds: str, end_ds: str):
+        # Simulates a macro that embeds the date outside of a placeholder
+        return f"SELECT '{end_ds}' AS day"
+
+    assert QueryTemplate.compile(parse("select @custom_macro() as day"), render) is None
@@ -1,6 +1,8 @@
 from datetime import datetime
 
 import duckdb
+import pandas as pd
+import pytest
 from metrics_tools.definition import PeerMetricDependencyRef
 from metrics_tools.runner import MetricsRunner
 
@@ -26,3 +28,123 @@ def test_runner_rendering():
     end = datetime.strptime("2024-12-31", "%Y-%m-%d")
     rendered = list(runner.render_rolling_queries(start, end))
     assert len(rendered) == 12
+
+
+@pytest.mark.parametrize(
+    "ref,batched",
+    [
+        (
+            PeerMetricDependencyRef(
+                name="test", entity_type="artifact", window=7, unit="day", cron="@daily"
+            ),
+            True,
+        ),
+        # The sample date of time aggregations depends on the rows
+        (
+            PeerMetricDependencyRef(
+                name="test",
+                entity_type="artifact",
+                time_aggregation="daily",
+                cron="@daily",
+            ),
+            False,
+        ),
+    ],
+)
+def test_runner_batched_rolling_matches_daily(
+    ref: PeerMetricDependencyRef, batched: bool
+):
+    conn = duckdb.connect()
+    # There are no events from 2024-01-20 to 2024-02-05. Some days of the
+    # range therefore have no source rows at all.
+    conn.execute(
+        """
+        CREATE TABLE events AS
+        SELECT * FROM (
+            SELECT
+                CAST(DATE '2024-01-01' + INTERVAL (i % 60) DAY AS DATE) AS bucket_day,
+                'artifact_' || CAST(i % 3 AS VARCHAR) AS to_artifact_id,
+                CAST(i AS DOUBLE) AS amount
+            FROM range(0, 600) AS r(i)
+        )
+        WHERE bucket_day NOT BETWEEN DATE '2024-01-20' AND DATE '2024-02-05'
+        """
+    )
+    runner = MetricsRunner.create_duckdb_execution_context(
+        conn=conn,
+        query="""
+        select @metrics_sample_date(events.bucket_day) as metrics_sample_date,
+            events.to_artifact_id,
+            sum(events.amount) as amount
+        from events
+        where events.bucket_day between @metrics_start('DATE') and @metrics_end('DATE')
+        group by 1, events.to_artifact_id
+        """,
+        ref=ref,
+        locals={},
+    )
+    assert runner.supports_batched_rolling == batched
+
+    start = datetime.strptime("2024-01-05", "%Y-%m-%d")
+    end = datetime.strptime("2024-02-20", "%Y-%m-%d")
+    batches = list(runner.render_rolling_batches(start, end, batch_size=10))
+    assert len(batches) == 5
+    if batched:
+        assert all(len(batch) == 1 for batch in batches)
+
+    # The queries of each day without the batched rewrite
+    daily_frames = [
+        conn.sql(runner.render_query(day, day)).df()
+        for day in runner.iter_query_days(start, end)
+    ]
+    assert any(frame.empty for frame in daily_frames)
+    daily = pd.concat(daily_frames, ignore_index=True)
+
+    sort_columns = ["metrics_sample_date", "to_artifact_id", "amount"]
+    result = (
+        runner.run_rolling(start, end, batch_size=10)
+        .sort_values(sort_columns)
+        .reset_index(drop=True)
+    )
+    daily = daily.sort_values(sort_columns).reset_index(drop=True)
+    assert len(result) > 0
+    pd.testing.assert_frame_equal(result, daily, check_dtype=False)
+
+
+@pytest.mark.parametrize(
+    "ref",
+    [
+        PeerMetricDependencyRef(
+            name="test", entity_type="artifact", window=30, unit="day", cron="@daily"
+        ),
+        PeerMetricDependencyRef(
+            name="test",
+            entity_type="artifact",
+            time_aggregation="monthly",
+            cron="@daily",
+        ),
+    ],
+)
+def test_runner_template_rendering_matches_evaluation(ref: PeerMetricDependencyRef):
+    runner = MetricsRunner.create_duckdb_execution_context(
+        conn=duckdb.connect(),
+        query="""
+        select @metrics_sample_date(events.bucket_day) as metrics_sample_date,
+            @metric_name as metric,
+            strptime(@end_ds, '%Y-%m-%d') as end_date,
+            sum(events.amount) as amount
+        from events
+        where events.bucket_day between @metrics_start('DATE') and @metrics_end('DATE')
+        group by 1, 2, 3
+        """,
+        ref=ref,
+        locals={"metric_name": "test"},
+    )
+    start = datetime.strptime("2024-01-01", "%Y-%m-%d")
+    end = datetime.strptime("2024-03-01", "%Y-%m-%d")
+    rendered = list(runner.render_rolling_queries(start, end))
+    assert runner._templates["query"] is not None
+
+    for day, query in zip(runner.iter_query_days(start, end), rendered):
+        assert query == runner._render_expressions(runner._query, day, day)
+    assert len(set(rendered)) == len(rendered)
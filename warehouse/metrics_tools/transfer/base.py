@@ -1,12 +1,27 @@
 import typing as t
 from datetime import datetime
 
-from metrics_tools.compute.types import ExportReference, ExportType, TableReference
+from metrics_tools.compute.types import (
+    ExportReference,
+    ExportTimeRange,
+    ExportType,
+    TableReference,
+)
+
+
+class IncrementalImportUnavailable(Exception):
+    """Raised by an importer that cannot import a partial export into the
+    destination table (e.g. the table doesn't exist or its schema changed).
+    The whole table needs to be exported instead."""
 
 
 class ExporterInterface(t.Protocol):
     async def export_table(
-        self, table: TableReference, supported_types: t.Set[ExportType]
+        self,
+        table: TableReference,
+        supported_types: t.Set[ExportType],
+        *,
+        time_range: t.Optional[ExportTimeRange] = None,
     ) -> ExportReference: ...
 
     async def cleanup_ref(self, export_reference: ExportReference): ...
@@ -24,7 +39,11 @@ class ImporterInterface(t.Protocol):
 
 class Exporter(ExporterInterface):
     async def export_table(
-        self, table: TableReference, supported_types: t.Set[ExportType]
+        self,
+        table: TableReference,
+        supported_types: t.Set[ExportType],
+        *,
+        time_range: t.Optional[ExportTimeRange] = None,
     ) -> ExportReference:
         raise NotImplementedError("export_table not implemented")
 
@@ -4,21 +4,65 @@ from datetime import datetime
 from urllib.parse import urlparse
 
 from clickhouse_connect.driver.client import Client
-from metrics_tools.compute.types import ExportReference, ExportType, TableReference
-from metrics_tools.transfer.base import ImporterInterface
+from metrics_tools.compute.types import (
+    ExportReference,
+    ExportTimeRange,
+    ExportType,
+    TableReference,
+)
+from metrics_tools.transfer.base import ImporterInterface, IncrementalImportUnavailable
 from oso_dagster.utils.clickhouse import (
     create_table,
+    drop_partition,
     drop_table,
     import_data,
     rename_table,
+    replace_partition,
 )
 
 logger = logging.getLogger(__name__)
 
 
+def partition_expression(time_column: str) -> str:
+    """Tables imported incrementally are partitioned by month. Daily
+    partitions would make the full import of a table with a long history
+    write to more partitions per insert than clickhouse allows
+    (`max_partitions_per_insert_block`). Rows without a time fall into the
+    197001 partition."""
+    return f"toYYYYMM(assumeNotNull(`{time_column}`))"
+
+
+def month_partition_ids(time_range: ExportTimeRange) -> t.List[str]:
+    """The ids of the monthly partitions that overlap the time range"""
+    partition_ids: t.List[str] = []
+    year, month = time_range.start.year, time_range.start.month
+    while (year, month) <= (time_range.end.year, time_range.end.month):
+        partition_ids.append(f"{year:04d}{month:02d}")
+        year, month = (year + 1, 1) if month == 12 else (year, month + 1)
+    return partition_ids
+
+
+class TableLayout(t.NamedTuple):
+    columns: t.List[t.Tuple[str, str]]
+    engine: str
+    partition_key: str
+    sorting_key: str
+
+
 class ClickhouseImporter(ImporterInterface):
-    def __init__(self, ch: Client, log_override: t.Optional[logging.Logger] = None):
+    def __init__(
+        self,
+        ch: Client,
+        partition_columns: t.Optional[t.Dict[str, str]] = None,
+        log_override: t.Optional[logging.Logger] = None,
+    ):
+        """Imports exports into clickhouse.
+
+        `partition_columns` maps the fully qualified names of destination
+        tables to the time column they are partitioned by. Partial exports of
+        these tables only replace the partitions of the exported days."""
         self.ch = ch
+        self.partition_columns = partition_columns or {}
         self.logger = log_override or logger
 
     def supported_types(self):
@@ -42,11 +86,15 @@ class ClickhouseImporter(ImporterInterface):
         loading_table_fqn = (
             f"{destination_table.fqn}_{datetime.now().strftime('%Y%m%d%H%M%S')}"
         )
+        time_column = self.partition_columns.get(destination_table.fqn)
+        if export_reference.time_range:
+            time_column = export_reference.time_range.column
         self.logger.debug(f"Creating table {loading_table_fqn}")
         create_table(
             self.ch,
             loading_table_fqn,
             export_reference.columns.columns_as("clickhouse"),
+            partition_by=partition_expression(time_column) if time_column else None,
         )
         # We need the `2*` to match the files that are created by the export
         # this is a bit of a hack due to some weird behavior in clickhouse that
@@ -54,6 +102,19 @@ class ClickhouseImporter(ImporterInterface):
         # prefixes files with the date. So this will work for the next 975 years
         # or so. Hopefully that's enough time.
         import_path = f"https://storage.googleapis.com/{gcs_bucket}/{gcs_blob_path}/2*"
+
+        if export_reference.time_range:
+            try:
+                self._import_partitions(
+                    loading_table_fqn,
+                    destination_table,
+                    export_reference.time_range,
+                    import_path,
+                )
+            finally:
+                drop_table(self.ch, loading_table_fqn)
+            return
+
         self.logger.debug(f"Importing table {loading_table_fqn} from {gcs_path}")
         import_data(
             self.ch,
@@ -72,3 +133,101 @@ class ClickhouseImporter(ImporterInterface):
         rename_table(self.ch, loading_table_fqn, final_table_fqn)
 
         self.logger.debug(f"Table {final_table_fqn} imported successfully")
+
+    def _import_partitions(
+        self,
+        loading_table_fqn: str,
+        destination_table: TableReference,
+        time_range: ExportTimeRange,
+        import_path: str,
+    ):
+        """Swaps the monthly partitions that overlap the exported range into
+        the destination. The destination must have the same layout as the
+        loading table."""
+        final_table_fqn = destination_table.fqn
+        destination_layout = self.table_layout(final_table_fqn)
+        if destination_layout is None:
+            raise IncrementalImportUnavailable(f"{final_table_fqn} does not exist")
+        if destination_layout != self.table_layout(loading_table_fqn):
+            raise IncrementalImportUnavailable(
+                f"the layout of {final_table_fqn} does not match the export"
+            )
+
+        self.logger.debug(f"Importing table {loading_table_fqn} from {import_path}")
+        import_data(self.ch, loading_table_fqn, import_path, format="Parquet")
+
+        # Partitions are replaced as a whole. The rows of the overlapping
+        # months that are outside of the exported days are kept by copying
+        # them from the destination into the loading table first.
+        partition_ids = month_partition_ids(time_range)
+        partition_list = ", ".join(f"'{p}'" for p in partition_ids)
+        self.ch.command(
+            f"INSERT INTO {loading_table_fqn} SELECT * FROM {final_table_fqn} "
+            f"WHERE _partition_id IN ({partition_list}) "
+            f"AND NOT (toDate(assumeNotNull(`{time_range.column}`)) "
+            f"BETWEEN toDate('{time_range.start.date().isoformat()}') "
+            f"AND toDate('{time_range.end.date().isoformat()}'))"
+        )
+
+        loaded_partitions = self.partition_ids(loading_table_fqn)
+        replaced = 0
+        for partition_id in partition_ids:
+            if partition_id in loaded_partitions:
+                replace_partition(
+                    self.ch, final_table_fqn, loading_table_fqn, partition_id
+                )
+                replaced += 1
+            else:
+                # The month has no rows (anymore)
+                drop_partition(self.ch, final_table_fqn, partition_id)
+        self.logger.debug(
+            f"Replaced {replaced} partitions of {final_table_fqn} for {time_range}"
+        )
+
+    def _query_system_table(
+        self, query: str, table_fqn: str
+    ) -> t.Sequence[t.Sequence[t.Any]]:
+        """Runs a query on a system table. `{database_filter}` in the query is
+        replaced with the filter for the table's database and `{table:String}`
+        is bound to the table's name."""
+        parts = table_fqn.split(".")
+        database_filter = "database = currentDatabase()"
+        parameters = {"table": parts[-1]}
+        if len(parts) > 1:
+            database_filter = "database = {database:String}"
+            parameters["database"] = parts[-2]
+        return self.ch.query(
+            query.replace("{database_filter}", database_filter),
+            parameters=parameters,
+        ).result_rows
+
+    def table_layout(self, table_fqn: str) -> t.Optional[TableLayout]:
+        """The structure of a table as reported by clickhouse or None if the
+        table doesn't exist"""
+        tables = self._query_system_table(
+            "SELECT engine, partition_key, sorting_key FROM system.tables "
+            "WHERE {database_filter} AND name = {table:String}",
+            table_fqn,
+        )
+        if not tables:
+            return None
+        engine, partition_key, sorting_key = tables[0]
+        columns = self._query_system_table(
+            "SELECT name, type FROM system.columns "
+            "WHERE {database_filter} AND table = {table:String} ORDER BY position",
+            table_fqn,
+        )
+        return TableLayout(
+            columns=[(name, column_type) for name, column_type in columns],
+            engine=engine,
+            partition_key=partition_key,
+            sorting_key=sorting_key,
+        )
+
+    def partition_ids(self, table_fqn: str) -> t.Set[str]:
+        rows = self._query_system_table(
+            "SELECT DISTINCT partition_id FROM system.parts "
+            "WHERE {database_filter} AND table = {table:String} AND active",
+            table_fqn,
+        )
+        return {row[0] for row in rows}
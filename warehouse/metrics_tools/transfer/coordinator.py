@@ -5,12 +5,23 @@ figured out through things like dlt. However, there are instances where we need
 to transfer between databases through gcs.
 """
 
+import asyncio
 import logging
 import typing as t
 from dataclasses import dataclass
+from enum import Enum
 
-from metrics_tools.compute.types import ExportType, TableReference
-from metrics_tools.transfer.base import ExporterInterface, ImporterInterface
+from metrics_tools.compute.types import (
+    ExportReference,
+    ExportTimeRange,
+    ExportType,
+    TableReference,
+)
+from metrics_tools.transfer.base import (
+    ExporterInterface,
+    ImporterInterface,
+    IncrementalImportUnavailable,
+)
 
 module_logger = logging.getLogger(__name__)
 
@@ -19,6 +30,16 @@ module_logger = logging.getLogger(__name__)
 class Source:
     exporter: ExporterInterface
     table: TableReference
+    # If set, only this range of the table is exported and the importer
+    # replaces just the affected days of the destination
+    time_range: t.Optional[ExportTimeRange] = None
+
+    async def export(self, supported_types: t.Set[ExportType], full: bool = False):
+        if self.time_range is None or full:
+            return await self.exporter.export_table(self.table, supported_types)
+        return await self.exporter.export_table(
+            self.table, supported_types, time_range=self.time_range
+        )
 
 
 @dataclass(kw_only=True)
@@ -39,11 +60,155 @@ async def transfer(
 
     supported_types = destination.supported_types()
     logger.info(f"Exporting table {source.table.fqn}")
-    export_reference = await source.exporter.export_table(source.table, supported_types)
+    export_reference = await source.export(supported_types)
 
     try:
-        logger.info(f"Importing exported result into {destination.table.fqn}")
-        await destination.importer.import_table(destination.table, export_reference)
+        await _import_export(source, destination, export_reference, logger)
     finally:
         logger.info("Cleaning up export reference")
         await source.exporter.cleanup_ref(export_reference)
+
+
+async def _import_export(
+    source: Source,
+    destination: Destination,
+    export_reference: ExportReference,
+    logger: logging.Logger,
+):
+    """Imports the export into the destination. If the destination cannot
+    take a partial export the whole table is exported and imported instead."""
+    try:
+        logger.info(f"Importing exported result into {destination.table.fqn}")
+        await destination.importer.import_table(destination.table, export_reference)
+    except IncrementalImportUnavailable as e:
+        logger.info(f"Falling back to a full import of {destination.table.fqn}: {e}")
+        full_export_reference = await source.export(
+            destination.supported_types(), full=True
+        )
+        try:
+            await destination.importer.import_table(
+                destination.table, full_export_reference
+            )
+        finally:
+            await source.exporter.cleanup_ref(full_export_reference)
+
+
+class TransferStage(Enum):
+    EXPORTING = "exporting"
+    IMPORTING = "importing"
+    CLEANING_UP = "cleaning_up"
+    COMPLETED = "completed"
+    FAILED = "failed"
+
+
+@dataclass(kw_only=True)
+class TransferProgress:
+    source: Source
+    destination: Destination
+    stage: TransferStage
+    error: t.Optional[Exception] = None
+
+
+@dataclass(kw_only=True)
+class TransferResult:
+    source: Source
+    destination: Destination
+    error: t.Optional[Exception] = None
+
+    @property
+    def succeeded(self) -> bool:
+        return self.error is None
+
+
+ProgressCallback = t.Callable[[TransferProgress], None]
+
+
+class TransferBatchFailed(Exception):
+    def __init__(self, failures: t.List[TransferResult]):
+        self.failures = failures
+        tables = ", ".join(result.destination.table.fqn for result in failures)
+        super().__init__(f"Failed to transfer {len(failures)} table(s): {tables}")
+
+
+async def transfer_many(
+    transfers: t.Iterable[t.Tuple[Source, Destination]],
+    export_concurrency: int = 2,
+    import_concurrency: int = 2,
+    max_pending_exports: t.Optional[int] = None,
+    on_progress: t.Optional[ProgressCallback] = None,
+    log_override: t.Optional[logging.Logger] = None,
+) -> t.AsyncIterator[TransferResult]:
+    """Transfers many tables, yielding the result of each table as it
+    finishes.
+
+    The stages of the transfers are pipelined. While one table is imported the
+    next tables can already be exported. Each stage has its own concurrency
+    limit. `max_pending_exports` limits the exports that exist at the same
+    time (those being exported, waiting for an import or being imported) so
+    that the exports don't run too far ahead of the imports. It defaults to the
+    sum of both concurrency limits. A failed table doesn't stop the transfer
+    of the others; its error is part of its result.
+    """
+    logger = log_override or module_logger
+    export_semaphore = asyncio.Semaphore(export_concurrency)
+    import_semaphore = asyncio.Semaphore(import_concurrency)
+    pending_semaphore = asyncio.Semaphore(
+        max_pending_exports or export_concurrency + import_concurrency
+    )
+
+    def notify(
+        source: Source,
+        destination: Destination,
+        stage: TransferStage,
+        error: t.Optional[Exception] = None,
+    ):
+        if on_progress is None:
+            return
+        try:
+            on_progress(
+                TransferProgress(
+                    source=source, destination=destination, stage=stage, error=error
+                )
+            )
+        except Exception as e:
+            logger.warning(f"Transfer progress callback failed: {e}")
+
+    async def transfer_one(source: Source, destination: Destination):
+        try:
+            async with pending_semaphore:
+                async with export_semaphore:
+                    notify(source, destination, TransferStage.EXPORTING)
+                    logger.info(f"Exporting table {source.table.fqn}")
+                    export_reference = await source.export(
+                        destination.supported_types()
+                    )
+                try:
+                    async with import_semaphore:
+                        notify(source, destination, TransferStage.IMPORTING)
+                        await _import_export(
+                            source, destination, export_reference, logger
+                        )
+                finally:
+                    notify(source, destination, TransferStage.CLEANING_UP)
+                    logger.info("Cleaning up export reference")
+                    await source.exporter.cleanup_ref(export_reference)
+        except Exception as e:
+            logger.error(
+                f"Transfer of {source.table.fqn} to {destination.table.fqn} failed: {e}"
+            )
+            notify(source, destination, TransferStage.FAILED, e)
+            return TransferResult(source=source, destination=destination, error=e)
+        notify(source, destination, TransferStage.COMPLETED)
+        return TransferResult(source=source, destination=destination)
+
+    tasks = [
+        asyncio.create_task(transfer_one(source, destination))
+        for source, destination in transfers
+    ]
+    try:
+        for next_result in asyncio.as_completed(tasks):
+            yield await next_result
+    finally:
+        for task in tasks:
+            task.cancel()
+        await asyncio.gather(*tasks, return_exceptions=True)
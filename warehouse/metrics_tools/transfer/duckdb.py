@@ -1,15 +1,22 @@
+import asyncio
 import logging
 import os
+import threading
 import typing as t
 import uuid
+from concurrent.futures import Future, ThreadPoolExecutor
 from datetime import datetime
-from urllib.parse import urlparse
 
 import duckdb
-from google.cloud import storage
+import fsspec
+import gcsfs
+import pyarrow as pa
+import pyarrow.parquet as pq
+from fsspec import AbstractFileSystem
 from metrics_tools.compute.types import (
     ColumnsDefinition,
     ExportReference,
+    ExportTimeRange,
     ExportType,
     TableReference,
 )
@@ -19,6 +26,84 @@ from sqlglot import exp
 
 logger = logging.getLogger(__name__)
 
+# Exports are split into parquet files of about this size. At most
+# `upload_concurrency + 1` files are held in memory at the same time.
+DEFAULT_EXPORT_FILE_SIZE = 128 * 1024 * 1024
+DEFAULT_EXPORT_BATCH_SIZE = 122_880
+DEFAULT_UPLOAD_CONCURRENCY = 4
+
+
+class ParquetPartWriter:
+    """Writes a stream of record batches as parquet files of bounded size
+    into a directory of a filesystem. Each file is written in memory and
+    uploaded in a thread pool while the next file is written."""
+
+    def __init__(
+        self,
+        fs: AbstractFileSystem,
+        directory: str,
+        max_file_size: int = DEFAULT_EXPORT_FILE_SIZE,
+        upload_concurrency: int = DEFAULT_UPLOAD_CONCURRENCY,
+        log_override: t.Optional[logging.Logger] = None,
+    ):
+        self.fs = fs
+        self.directory = directory.rstrip("/")
+        self.max_file_size = max_file_size
+        self.upload_concurrency = max(upload_concurrency, 1)
+        self.logger = log_override or logger
+
+    def write(self, reader: pa.RecordBatchReader) -> t.List[str]:
+        """Writes all batches of the reader and returns the paths of the
+        written files. An empty reader still produces one file so that the
+        schema is kept."""
+        paths: t.List[str] = []
+        uploads: t.List[Future] = []
+        # Bounds the number of finished files waiting for their upload
+        upload_slots = threading.Semaphore(self.upload_concurrency)
+
+        with ThreadPoolExecutor(max_workers=self.upload_concurrency) as pool:
+            buffer: t.Optional[pa.BufferOutputStream] = None
+            writer: t.Optional[pq.ParquetWriter] = None
+
+            def finish_file():
+                assert buffer is not None and writer is not None
+                writer.close()
+                path = f"{self.directory}/part-{len(paths):05d}.parquet"
+                paths.append(path)
+                upload_slots.acquire()
+                uploads.append(
+                    pool.submit(self._upload, path, buffer.getvalue(), upload_slots)
+                )
+
+            for batch in reader:
+                if writer is None:
+                    buffer = pa.BufferOutputStream()
+                    writer = pq.ParquetWriter(buffer, reader.schema)
+                assert buffer is not None
+                writer.write_batch(batch)
+                if buffer.tell() >= self.max_file_size:
+                    finish_file()
+                    buffer = None
+                    writer = None
+
+            if writer is not None or not paths:
+                if writer is None:
+                    buffer = pa.BufferOutputStream()
+                    writer = pq.ParquetWriter(buffer, reader.schema)
+                finish_file()
+
+            for upload in uploads:
+                upload.result()
+        return paths
+
+    def _upload(self, path: str, data: pa.Buffer, slots: threading.Semaphore):
+        try:
+            self.logger.debug(f"Uploading {data.size} bytes to {path}")
+            with t.cast(t.BinaryIO, self.fs.open(path, "wb")) as f:
+                f.write(memoryview(data))
+        finally:
+            slots.release()
+
 
 class DuckDBExporter(ExporterInterface):
     def __init__(
@@ -27,6 +112,10 @@ class DuckDBExporter(ExporterInterface):
         connection: duckdb.DuckDBPyConnection,
         log_override: t.Optional[logging.Logger] = None,
         gcs_bucket_name: t.Optional[str] = None,
+        fs: t.Optional[AbstractFileSystem] = None,
+        max_file_size: int = DEFAULT_EXPORT_FILE_SIZE,
+        upload_concurrency: int = DEFAULT_UPLOAD_CONCURRENCY,
+        batch_size: int = DEFAULT_EXPORT_BATCH_SIZE,
     ):
         """
         Initializes the DuckDBExporter with a TimeOrderedStorage instance
@@ -37,17 +126,26 @@ class DuckDBExporter(ExporterInterface):
             connection (duckdb.DuckDBPyConnection): The DuckDB connection.
             log_override (t.Optional[logging.Logger]): Optional logger override.
             gcs_bucket_name (t.Optional[str]): Optional GCS bucket name for uploads.
+            fs (t.Optional[AbstractFileSystem]): The filesystem of the bucket.
+                Defaults to GCS.
+            max_file_size (int): The maximum size of each exported file.
+            upload_concurrency (int): The number of files uploaded in parallel.
+            batch_size (int): The number of rows read from duckdb at a time.
+                Files can exceed `max_file_size` by one batch.
         """
 
         self.time_ordered_storage = time_ordered_storage
         self.connection = connection
         self.logger = log_override or logger
         self.gcs_bucket_name = gcs_bucket_name
+        self.max_file_size = max_file_size
+        self.upload_concurrency = upload_concurrency
+        self.batch_size = batch_size
 
         if self.gcs_bucket_name:
-            self.storage_client = storage.Client()
+            self.fs = fs or gcsfs.GCSFileSystem()
         else:
-            self.storage_client = None
+            self.fs = fsspec.filesystem("file")
 
     def process_columns(
         self, column_name: str, column_type: exp.Expression
@@ -88,19 +186,50 @@ class DuckDBExporter(ExporterInterface):
         self.logger.info(f"Executing SQL: {query}")
         return self.connection.execute(query)
 
+    def export_to(
+        self, table: TableReference, fs: AbstractFileSystem, directory: str
+    ) -> t.List[str]:
+        """
+        Streams the table into parquet files in the given directory.
+
+        Args:
+            table (TableReference): The table reference to export.
+            fs (AbstractFileSystem): The filesystem to write to.
+            directory (str): The directory of the exported files.
+        """
+
+        reader = self.run_query(f"SELECT * FROM {table.fqn}").fetch_record_batch(
+            self.batch_size
+        )
+        writer = ParquetPartWriter(
+            fs,
+            directory,
+            max_file_size=self.max_file_size,
+            upload_concurrency=self.upload_concurrency,
+            log_override=self.logger,
+        )
+        paths = writer.write(reader)
+        self.logger.info(f"Exported {table.fqn} into {len(paths)} files")
+        return paths
+
     async def export_table(
         self,
         table: TableReference,
         supported_types: t.Set[ExportType],
+        *,
         export_time: t.Optional[datetime] = None,
+        time_range: t.Optional[ExportTimeRange] = None,
     ) -> ExportReference:
         """
-        Exports a table to a file and optionally uploads to GCS.
+        Exports a table to parquet files on GCS or the local filesystem. The
+        files are streamed to GCS without any local copies.
 
         Args:
             table (TableReference): The table reference to export.
             supported_types (t.Set[ExportType]): The set of supported export types.
             export_time (t.Optional[datetime]): The export time.
+            time_range (t.Optional[ExportTimeRange]): Ignored. The whole table
+                is always exported.
         """
 
         if not ({ExportType.LOCALFS, ExportType.GCS} & supported_types):
@@ -112,39 +241,41 @@ class DuckDBExporter(ExporterInterface):
         columns: t.List[t.Tuple[str, str]] = [(row[0], row[1]) for row in col_result]
 
         export_table_name = f"export_{table.table_name}_{uuid.uuid4().hex}"
-        local_file_path = self.local_export_path(export_table_name)
-
-        export_query = (
-            f"COPY (SELECT * FROM {table.fqn}) TO '{local_file_path}' (FORMAT PARQUET)"
-        )
-        self.run_query(export_query)
 
-        gcs_path = None
         if ExportType.GCS in supported_types and self.gcs_bucket_name:
-            gcs_path = await self.upload_to_gcs(local_file_path, export_table_name)
+            directory = f"{self.gcs_bucket_name}/exports/{export_table_name}"
+            # The export blocks on duckdb and the uploads so it runs in a
+            # thread to keep the event loop responsive
+            await asyncio.to_thread(self.export_to, table, self.fs, directory)
+            gcs_path = f"{self.fs.unstrip_protocol(directory)}/"
+            self.logger.info(f"Table {table.fqn} exported to {gcs_path}")
+            return ExportReference(
+                table=TableReference(table_name=table.table_name),
+                type=ExportType.GCS,
+                payload={"gcs_path": gcs_path},
+                columns=ColumnsDefinition(columns=columns, dialect="duckdb"),
+            )
 
+        local_directory = self.local_export_path(export_table_name)
+        await asyncio.to_thread(self.export_to, table, self.fs, local_directory)
         return ExportReference(
             table=TableReference(table_name=table.table_name),
-            type=ExportType.GCS if gcs_path else ExportType.LOCALFS,
-            payload=(
-                {"file_path": local_file_path, "gcs_path": gcs_path}
-                if gcs_path
-                else {"file_path": local_file_path}
-            ),
+            type=ExportType.LOCALFS,
+            payload={"file_path": local_directory},
             columns=ColumnsDefinition(columns=columns, dialect="duckdb"),
         )
 
     def local_export_path(self, export_table_name: str) -> str:
         """
-        Generates a local path for file export
+        Generates a local directory for file export
 
         Args:
             export_table_name (str): The name of the exported table.
         """
 
-        export_dir = "/tmp/_duckdb_exports"
+        export_dir = os.path.join("/tmp/_duckdb_exports", export_table_name)
         os.makedirs(export_dir, exist_ok=True)
-        return os.path.join(export_dir, f"{export_table_name}.parquet")
+        return export_dir
 
     def export_path(self, export_time: datetime, export_table_name: str) -> str:
         """
@@ -159,47 +290,23 @@ class DuckDBExporter(ExporterInterface):
             export_time, f"{export_table_name}.parquet"
         )
 
-    async def upload_to_gcs(self, file_path: str, export_table_name: str) -> str:
-        """
-        Uploads a file to Google Cloud Storage.
-
-        Args:
-            file_path (str): The local path to the file to upload.
-            export_table_name (str): The name of the exported table for the GCS path.
-
-        Returns:
-            str: The GCS URI of the uploaded file.
-        """
-
-        if not self.storage_client or not self.gcs_bucket_name:
-            raise ValueError("GCS storage client or bucket name not configured.")
-
-        bucket = self.storage_client.bucket(self.gcs_bucket_name)
-        blob_path = f"exports/{export_table_name}.parquet"
-        blob = bucket.blob(blob_path)
-
-        self.logger.info(f"Uploading {file_path} to GCS at {blob_path}...")
-        blob.upload_from_filename(file_path)
-        gcs_uri = f"gs://{self.gcs_bucket_name}/{blob_path}"
-
-        self.logger.info(f"File successfully uploaded to GCS: {gcs_uri}")
-        return gcs_uri
-
     async def cleanup_ref(self, export_reference: ExportReference):
         """
-        Cleans up a file associated with an export reference.
+        Deletes the exported files of an export reference.
 
         Args:
             export_reference (ExportReference): The export reference.
         """
 
-        file_path = export_reference.payload.get("file_path")
-        if file_path:
-            self.logger.debug(f"Deleting file: {file_path}")
+        path = export_reference.payload.get("gcs_path") or export_reference.payload.get(
+            "file_path"
+        )
+        if path:
+            self.logger.debug(f"Deleting exported files: {path}")
             try:
-                os.remove(file_path)
+                await asyncio.to_thread(self.fs.rm, path, recursive=True)
             except FileNotFoundError:
-                self.logger.warning(f"File {file_path} not found for deletion")
+                self.logger.warning(f"Exported files {path} not found for deletion")
 
     async def cleanup_expired(self, expiration: datetime, dry_run: bool = False):
         """
@@ -229,20 +336,25 @@ class DuckDBImporter(ImporterInterface):
         self,
         connection: duckdb.DuckDBPyConnection,
         log_override: t.Optional[logging.Logger] = None,
+        fs: t.Optional[AbstractFileSystem] = None,
     ):
         """
-        Initializes the DuckDBImporter with a DuckDB connection and a GCS client.
+        Initializes the DuckDBImporter with a DuckDB connection. The GCS
+        filesystem is registered with DuckDB so that exports are read
+        directly from GCS.
 
         Args:
             connection (duckdb.DuckDBPyConnection): The DuckDB connection.
             log_override (t.Optional[logging.Logger]): Optional logger override.
+            fs (t.Optional[AbstractFileSystem]): The filesystem of the exports.
+                Defaults to GCS.
         """
 
         self.connection = connection
         self.logger = log_override or logger
-        self.storage_client = storage.Client()
-        self.local_import_dir = "/tmp/_duckdb_imports"
-        os.makedirs(self.local_import_dir, exist_ok=True)
+        self.fs = fs or gcsfs.GCSFileSystem()
+        # duckdb's stubs type the filesystem as a str
+        self.connection.register_filesystem(t.cast(str, self.fs))
 
     def supported_types(self) -> t.Set[ExportType]:
         """
@@ -252,37 +364,34 @@ class DuckDBImporter(ImporterInterface):
 
         return {ExportType.GCS}
 
-    def download_from_gcs(self, gcs_uri: str) -> str:
+    def list_export_files(self, gcs_uri: str) -> t.List[str]:
         """
-        Downloads the file from the provided GCS URI to a local temporary location.
+        Lists the files of an export. Exports are either a single file or a
+        directory of files.
 
         Args:
-            gcs_uri (str): The GCS URI (e.g. "gs://<bucket>/<path>") to download.
+            gcs_uri (str): The GCS URI (e.g. "gs://<bucket>/<path>") of the export.
 
         Returns:
-            str: The local file path where the file was downloaded.
+            t.List[str]: The URIs of the exported files.
         """
 
-        parsed = urlparse(gcs_uri)
-        bucket_name = parsed.netloc
-        blob_path = parsed.path.lstrip("/")
-        bucket = self.storage_client.bucket(bucket_name)
-        blob = bucket.blob(blob_path)
-
-        local_file = os.path.join(self.local_import_dir, f"{uuid.uuid4().hex}.parquet")
-        self.logger.info(f"Downloading {gcs_uri} to {local_file}...")
-        blob.download_to_filename(local_file)
-        self.logger.info(f"Downloaded file to {local_file}.")
-        return local_file
+        if self.fs.isfile(gcs_uri):
+            return [gcs_uri]
+        return [
+            self.fs.unstrip_protocol(path)
+            for path in sorted(self.fs.find(gcs_uri))
+            if not path.endswith("/")
+        ]
 
     async def import_table(
         self, destination_table: TableReference, export_reference: ExportReference
     ):
         """
-        Imports a table into DuckDB from a Parquet file stored on GCS.
+        Imports a table into DuckDB from Parquet files stored on GCS.
 
-        The method downloads the file from GCS, drops the destination table if it exists,
-        and creates a new table using DuckDB's read_parquet() function.
+        DuckDB reads the files directly from GCS so no local copy is made.
+        The destination table is replaced.
 
         Args:
             destination_table (TableReference): The target table reference in DuckDB.
@@ -299,36 +408,26 @@ class DuckDBImporter(ImporterInterface):
         if not gcs_path:
             raise ValueError("GCS path is missing in the export reference payload.")
 
-        local_file_path = self.download_from_gcs(gcs_path)
-        try:
-            self.logger.debug(f"Dropping table {destination_table.fqn}...")
-            self.connection.execute(f"DROP TABLE IF EXISTS {destination_table.fqn}")
+        files = await asyncio.to_thread(self.list_export_files, gcs_path)
+        if not files:
+            raise ValueError(f"No files found in GCS path {gcs_path}")
 
-            self.logger.debug(
-                f"Creating table {destination_table.fqn} from {local_file_path}..."
-            )
-            create_sql = (
-                f"CREATE TABLE {destination_table.fqn} AS "
-                f"SELECT * FROM read_parquet('{local_file_path}')"
-            )
-            self.connection.execute(create_sql)
-            self.logger.info(
-                f"Table {destination_table.fqn} imported successfully in DuckDB."
-            )
-        finally:
-            self.logger.debug(f"Deleting temporary file {local_file_path}...")
-            try:
-                os.remove(local_file_path)
-                self.logger.debug("Temporary file deleted successfully.")
-            except Exception as e:
-                self.logger.warning(
-                    f"Failed to delete temporary file {local_file_path}: {e}"
-                )
+        self.logger.debug(
+            f"Creating table {destination_table.fqn} from {len(files)} files in {gcs_path}..."
+        )
+        file_list = ", ".join(f"'{file}'" for file in files)
+        create_sql = (
+            f"CREATE OR REPLACE TABLE {destination_table.fqn} AS "
+            f"SELECT * FROM read_parquet([{file_list}])"
+        )
+        await asyncio.to_thread(self.connection.execute, create_sql)
+        self.logger.info(
+            f"Table {destination_table.fqn} imported successfully in DuckDB."
+        )
 
     async def cleanup_ref(self, export_reference: ExportReference):
         """
         This importer does not retain external state that requires cleanup.
-        Temporary files are removed immediately after table creation.
         """
 
         self.logger.debug("No additional cleanup required for DuckDBImporter.")
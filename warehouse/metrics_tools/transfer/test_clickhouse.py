@@ -0,0 +1,148 @@
+import typing as t
+from datetime import datetime
+
+import pytest
+from clickhouse_connect.driver.client import Client
+from metrics_tools.compute.types import ExportTimeRange, TableReference
+
+from .base import IncrementalImportUnavailable
+from .clickhouse import ClickhouseImporter, TableLayout, month_partition_ids
+
+COLUMNS = [("bucket_day", "DateTime"), ("amount", "Float64")]
+PARTITION_KEY = "toYYYYMM(assumeNotNull(bucket_day))"
+
+
+class FakeQueryResult(t.NamedTuple):
+    result_rows: t.List[t.Tuple[t.Any, ...]]
+
+
+class FakeClient:
+    """Answers the queries on the system tables from in memory tables"""
+
+    def __init__(self):
+        self.tables: t.Dict[str, t.Tuple[TableLayout, t.Set[str]]] = {}
+        self.commands: t.List[str] = []
+        self.queries: t.List[t.Tuple[str, t.Dict[str, str]]] = []
+
+    def add_table(
+        self,
+        name: str,
+        partition_ids: t.Set[str],
+        columns: t.Optional[t.List[t.Tuple[str, str]]] = None,
+    ):
+        layout = TableLayout(
+            columns=columns or COLUMNS,
+            engine="MergeTree",
+            partition_key=PARTITION_KEY,
+            sorting_key="",
+        )
+        self.tables[name] = (layout, partition_ids)
+
+    def command(self, cmd: str):
+        self.commands.append(cmd)
+
+    def query(self, query: str, parameters: t.Dict[str, str]):
+        self.queries.append((query, parameters))
+        table = self.tables.get(parameters["table"])
+        if table is None:
+            return FakeQueryResult([])
+        layout, partition_ids = table
+        if "system.tables" in query:
+            return FakeQueryResult(
+                [(layout.engine, layout.partition_key, layout.sorting_key)]
+            )
+        if "system.columns" in query:
+            return FakeQueryResult(list(layout.columns))
+        return FakeQueryResult([(partition_id,) for partition_id in partition_ids])
+
+
+@pytest.fixture
+def client():
+    return FakeClient()
+
+
+@pytest.fixture
+def importer(client: FakeClient):
+    return ClickhouseImporter(t.cast(Client, client))
+
+
+def test_month_partition_ids():
+    time_range = ExportTimeRange.from_bounds(
+        "bucket_day", datetime(2023, 11, 20), datetime(2024, 2, 3)
+    )
+    assert month_partition_ids(time_range) == ["202311", "202312", "202401", "202402"]
+
+
+def test_table_layout(client: FakeClient, importer: ClickhouseImporter):
+    client.add_table("events", set())
+
+    layout = importer.table_layout("metrics.events")
+    assert layout == TableLayout(
+        columns=COLUMNS,
+        engine="MergeTree",
+        partition_key=PARTITION_KEY,
+        sorting_key="",
+    )
+    query, parameters = client.queries[0]
+    assert "database = {database:String}" in query
+    assert parameters == {"table": "events", "database": "metrics"}
+
+    assert importer.table_layout("missing") is None
+    query, parameters = client.queries[-1]
+    assert "database = currentDatabase()" in query
+    assert parameters == {"table": "missing"}
+
+
+def test_import_partitions(client: FakeClient, importer: ClickhouseImporter):
+    client.add_table("events", {"202312", "202401", "202402"})
+    # The loaded export has no rows for february
+    client.add_table("events_loading", {"202312", "202401"})
+    time_range = ExportTimeRange.from_bounds(
+        "bucket_day", datetime(2023, 12, 30), datetime(2024, 2, 2)
+    )
+
+    importer._import_partitions(
+        "events_loading",
+        TableReference(table_name="events"),
+        time_range,
+        "https://storage.googleapis.com/bucket/export/2*",
+    )
+
+    commands = [command for command in client.commands if not command.startswith("SET")]
+    assert commands[0] == (
+        "INSERT INTO events_loading SELECT * FROM s3Cluster('default', "
+        "'https://storage.googleapis.com/bucket/export/2*', 'Parquet')"
+    )
+    # The rows of the months outside of the exported days are kept
+    assert commands[1] == (
+        "INSERT INTO events_loading SELECT * FROM events "
+        "WHERE _partition_id IN ('202312', '202401', '202402') "
+        "AND NOT (toDate(assumeNotNull(`bucket_day`)) "
+        "BETWEEN toDate('2023-12-30') AND toDate('2024-02-02'))"
+    )
+    assert commands[2:] == [
+        "ALTER TABLE events REPLACE PARTITION ID '202312' FROM events_loading",
+        "ALTER TABLE events REPLACE PARTITION ID '202401' FROM events_loading",
+        "ALTER TABLE events DROP PARTITION ID '202402'",
+    ]
+
+
+def test_import_partitions_requires_matching_layout(
+    client: FakeClient, importer: ClickhouseImporter
+):
+    time_range = ExportTimeRange.from_bounds(
+        "bucket_day", datetime(2024, 1, 1), datetime(2024, 1, 3)
+    )
+    client.add_table("events_loading", set())
+    with pytest.raises(IncrementalImportUnavailable):
+        importer._import_partitions(
+            "events_loading", TableReference(table_name="events"), time_range, ""
+        )
+
+    client.add_table("events", {"202401"}, columns=COLUMNS[:1])
+    with pytest.raises(IncrementalImportUnavailable):
+        importer._import_partitions(
+            "events_loading", TableReference(table_name="events"), time_range, ""
+        )
+    # Nothing is imported or replaced
+    assert client.commands == []
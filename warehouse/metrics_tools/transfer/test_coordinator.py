@@ -0,0 +1,159 @@
+import asyncio
+import typing as t
+from datetime import datetime
+
+import pytest
+from metrics_tools.compute.types import (
+    ColumnsDefinition,
+    ExportReference,
+    ExportTimeRange,
+    ExportType,
+    TableReference,
+)
+
+from .base import Exporter, Importer, IncrementalImportUnavailable
+from .coordinator import (
+    Destination,
+    Source,
+    TransferProgress,
+    TransferStage,
+    transfer,
+    transfer_many,
+)
+
+
+class FakeExporter(Exporter):
+    def __init__(self):
+        self.running = 0
+        self.max_running = 0
+        self.cleaned_up: t.List[str] = []
+
+    async def export_table(self, table, supported_types, *, time_range=None):
+        self.running += 1
+        self.max_running = max(self.max_running, self.running)
+        await asyncio.sleep(0.01)
+        self.running -= 1
+        if table.table_name == "broken_export":
+            raise ValueError("export failed")
+        return ExportReference(
+            table=table,
+            type=ExportType.GCS,
+            columns=ColumnsDefinition(columns=[("id", "INTEGER")]),
+            payload={"gcs_path": table.table_name},
+        )
+
+    async def cleanup_ref(self, export_reference):
+        self.cleaned_up.append(export_reference.table.table_name)
+
+    async def cleanup_expired(self, expiration: datetime):
+        return
+
+
+class FakeImporter(Importer):
+    def __init__(self, exporter: FakeExporter):
+        self.exporter = exporter
+        self.imported: t.List[str] = []
+        self.overlapped_exports = False
+
+    def supported_types(self):
+        return {ExportType.GCS}
+
+    async def import_table(self, destination_table, export_reference):
+        await asyncio.sleep(0.02)
+        if self.exporter.running > 0:
+            self.overlapped_exports = True
+        if destination_table.table_name == "broken_import":
+            raise ValueError("import failed")
+        self.imported.append(destination_table.table_name)
+
+
+@pytest.mark.asyncio
+async def test_transfer_many_pipelines_and_isolates_failures():
+    exporter = FakeExporter()
+    importer = FakeImporter(exporter)
+    names = ["a", "b", "broken_export", "c", "broken_import", "d"]
+    progress: t.List[TransferProgress] = []
+
+    results = [
+        result
+        async for result in transfer_many(
+            [
+                (
+                    Source(exporter=exporter, table=TableReference(table_name=name)),
+                    Destination(
+                        importer=importer, table=TableReference(table_name=name)
+                    ),
+                )
+                for name in names
+            ],
+            export_concurrency=2,
+            import_concurrency=1,
+            on_progress=progress.append,
+        )
+    ]
+
+    failed = {
+        result.destination.table.table_name
+        for result in results
+        if not result.succeeded
+    }
+    assert len(results) == len(names)
+    assert failed == {"broken_export", "broken_import"}
+    assert sorted(importer.imported) == ["a", "b", "c", "d"]
+    # Every export is cleaned up, including the one whose import failed
+    assert sorted(exporter.cleaned_up) == ["a", "b", "broken_import", "c", "d"]
+    assert exporter.max_running == 2
+    assert importer.overlapped_exports
+
+    stages = [p.stage for p in progress if p.destination.table.table_name == "a"]
+    assert stages == [
+        TransferStage.EXPORTING,
+        TransferStage.IMPORTING,
+        TransferStage.CLEANING_UP,
+        TransferStage.COMPLETED,
+    ]
+
+
+class IncrementalImporter(FakeImporter):
+    def __init__(self, exporter: FakeExporter, tables: t.Set[str]):
+        super().__init__(exporter)
+        self.tables = tables
+        self.partial_imports: t.List[str] = []
+
+    async def import_table(self, destination_table, export_reference):
+        if export_reference.time_range is None:
+            self.imported.append(destination_table.table_name)
+        elif destination_table.table_name in self.tables:
+            self.partial_imports.append(destination_table.table_name)
+        else:
+            raise IncrementalImportUnavailable("table does not exist")
+
+
+class PartialExporter(FakeExporter):
+    async def export_table(self, table, supported_types, *, time_range=None):
+        export_reference = await super().export_table(table, supported_types)
+        return export_reference.model_copy(update={"time_range": time_range})
+
+
+@pytest.mark.asyncio
+async def test_transfer_falls_back_to_full_import():
+    exporter = PartialExporter()
+    importer = IncrementalImporter(exporter, tables={"existing"})
+    time_range = ExportTimeRange.from_bounds(
+        "bucket_day", datetime(2024, 1, 1), datetime(2024, 1, 3)
+    )
+
+    for name in ["existing", "missing"]:
+        await transfer(
+            Source(
+                exporter=exporter,
+                table=TableReference(table_name=name),
+                time_range=time_range,
+            ),
+            Destination(importer=importer, table=TableReference(table_name=name)),
+        )
+
+    assert importer.partial_imports == ["existing"]
+    assert importer.imported == ["missing"]
+    # Both the partial and the full export of the missing table are cleaned up
+    assert exporter.cleaned_up == ["existing", "missing", "missing"]
@@ -0,0 +1,80 @@
+import typing as t
+
+import duckdb
+import fsspec
+import pytest
+from metrics_tools.compute.types import ExportType, TableReference
+
+from .duckdb import DuckDBExporter, DuckDBImporter
+from .storage import TimeOrderedStorage
+
+
+@pytest.fixture
+def memory_fs():
+    fs = fsspec.filesystem("memory")
+    yield fs
+    fs.rm("/", recursive=True)
+
+
+@pytest.mark.asyncio
+async def test_duckdb_streaming_export_and_import(memory_fs):
+    source = duckdb.connect()
+    source.execute(
+        """
+        CREATE TABLE events AS
+        SELECT i AS id, md5(i::VARCHAR) AS payload
+        FROM range(200000) AS t(i)
+        """
+    )
+    exporter = DuckDBExporter(
+        t.cast(TimeOrderedStorage, None),
+        source,
+        gcs_bucket_name="bucket",
+        fs=memory_fs,
+        max_file_size=1024 * 1024,
+        upload_concurrency=2,
+        batch_size=10_000,
+    )
+    export_reference = await exporter.export_table(
+        TableReference(table_name="events"), {ExportType.GCS}
+    )
+    assert export_reference.type == ExportType.GCS
+    gcs_path = export_reference.payload["gcs_path"]
+    # The export is split into several size bounded files
+    files = memory_fs.find(gcs_path)
+    assert len(files) > 1
+    assert all(memory_fs.size(file) < 2 * 1024 * 1024 for file in files)
+
+    destination = duckdb.connect()
+    importer = DuckDBImporter(destination, fs=memory_fs)
+    await importer.import_table(TableReference(table_name="events"), export_reference)
+    assert destination.execute(
+        "SELECT COUNT(*), COUNT(DISTINCT id) FROM events"
+    ).fetchone() == (200000, 200000)
+
+    await exporter.cleanup_ref(export_reference)
+    assert not memory_fs.exists(gcs_path)
+
+
+@pytest.mark.asyncio
+async def test_duckdb_export_of_empty_table(memory_fs):
+    source = duckdb.connect()
+    source.execute("CREATE TABLE empty (id INTEGER)")
+    exporter = DuckDBExporter(
+        t.cast(TimeOrderedStorage, None),
+        source,
+        gcs_bucket_name="bucket",
+        fs=memory_fs,
+    )
+    export_reference = await exporter.export_table(
+        TableReference(table_name="empty"), {ExportType.GCS}
+    )
+
+    destination = duckdb.connect()
+    importer = DuckDBImporter(destination, fs=memory_fs)
+    await importer.import_table(TableReference(table_name="empty"), export_reference)
+    assert destination.execute("SELECT COUNT(*) FROM empty").fetchone() == (0,)
+    assert destination.execute("DESCRIBE empty").fetchall()[0][:2] == (
+        "id",
+        "INTEGER",
+    )
@@ -0,0 +1,76 @@
+import typing as t
+from datetime import datetime
+
+import pytest
+from aiotrino.dbapi import Connection
+from metrics_tools.compute.types import ExportTimeRange, ExportType, TableReference
+from sqlglot import exp
+from sqlmesh.core.dialect import parse_one
+
+from .storage import TimeOrderedStorage
+from .trino import TrinoExporter
+
+
+class FakeStorage:
+    def generate_path(self, stored_time: datetime, *joins: str) -> str:
+        return "gs://bucket/exports/" + "".join(joins)
+
+
+class RecordingTrinoExporter(TrinoExporter):
+    def __init__(self):
+        super().__init__(
+            "hive",
+            "export",
+            t.cast(TimeOrderedStorage, FakeStorage()),
+            t.cast(Connection, None),
+        )
+        self.queries: t.List[str] = []
+
+    async def run_query(self, query: str) -> t.List[t.List[t.Any]]:
+        self.queries.append(query)
+        if query.startswith("SHOW COLUMNS"):
+            return [["bucket_day", "date"], ["amount", "double"]]
+        return []
+
+
+def insert_query(queries: t.List[str]) -> exp.Insert:
+    insert = parse_one(
+        next(query for query in queries if query.startswith("INSERT")),
+        dialect="trino",
+    )
+    assert isinstance(insert, exp.Insert)
+    return insert
+
+
+@pytest.mark.asyncio
+async def test_trino_export_filters_the_time_range():
+    exporter = RecordingTrinoExporter()
+    time_range = ExportTimeRange.from_bounds(
+        "bucket_day", datetime(2024, 1, 1), datetime(2024, 1, 31)
+    )
+
+    export_reference = await exporter.export_table(
+        TableReference(catalog_name="iceberg", schema_name="metrics", table_name="t"),
+        {ExportType.GCS},
+        time_range=time_range,
+    )
+
+    assert export_reference.time_range == time_range
+    where = insert_query(exporter.queries).expression.args["where"]
+    # The end of the range is inclusive of the whole last day
+    assert where.sql(dialect="trino") == (
+        "WHERE bucket_day >= CAST('2024-01-01 00:00:00' AS TIMESTAMP) "
+        "AND bucket_day < CAST('2024-02-01 00:00:00' AS TIMESTAMP)"
+    )
+
+
+@pytest.mark.asyncio
+async def test_trino_export_of_the_whole_table():
+    exporter = RecordingTrinoExporter()
+
+    export_reference = await exporter.export_table(
+        TableReference(table_name="t"), {ExportType.GCS}
+    )
+
+    assert export_reference.time_range is None
+    assert insert_query(exporter.queries).expression.args.get("where") is None
@@ -2,12 +2,13 @@ import asyncio
 import logging
 import typing as t
 import uuid
-from datetime import datetime
+from datetime import datetime, timedelta
 
 from aiotrino.dbapi import Connection
 from metrics_tools.compute.types import (
     ColumnsDefinition,
     ExportReference,
+    ExportTimeRange,
     ExportType,
     TableReference,
 )
@@ -85,8 +86,12 @@ class TrinoExporter(Exporter):
         self,
         table: TableReference,
         supported_types: t.Set[ExportType],
+        *,
         export_time: t.Optional[datetime] = None,
+        time_range: t.Optional[ExportTimeRange] = None,
     ) -> ExportReference:
+        """Exports the table to gcs. If a time range is given only the rows
+        of those days are exported."""
         # Trino only supports GCS exports
         if ExportType.GCS not in supported_types:
             raise ValueError("Trino only supports GCS exports")
@@ -166,6 +171,30 @@ class TrinoExporter(Exporter):
         select = t.cast(exp.Select, insert_query.expression)
         select.set("expressions", column_selects)
 
+        if time_range:
+            # The range is inclusive of the end day. Comparing against
+            # timestamps keeps this correct for date and timestamp columns
+            end = time_range.end + timedelta(days=1)
+            select.where(
+                exp.and_(
+                    exp.GTE(
+                        this=exp.column(time_range.column),
+                        expression=exp.cast(
+                            exp.Literal.string(time_range.start.isoformat(" ")),
+                            exp.DataType.build("TIMESTAMP"),
+                        ),
+                    ),
+                    exp.LT(
+                        this=exp.column(time_range.column),
+                        expression=exp.cast(
+                            exp.Literal.string(end.isoformat(" ")),
+                            exp.DataType.build("TIMESTAMP"),
+                        ),
+                    ),
+                ),
+                copy=False,
+            )
+
         # Execute the insert query which will populate the export table
         await self.run_query(insert_query.sql(dialect="trino"))
 
@@ -178,6 +207,7 @@ class TrinoExporter(Exporter):
             type=ExportType.GCS,
             payload={"gcs_path": gcs_path},
             columns=ColumnsDefinition(columns=columns, dialect="trino"),
+            time_range=time_range,
         )
 
     def export_path(self, export_time: datetime, export_table_name: str):
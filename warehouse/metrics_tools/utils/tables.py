@@ -2,9 +2,9 @@ import copy
 import typing as t
 
 from sqlglot import exp
-from sqlglot.optimizer.scope import Scope, build_scope
+from sqlglot.optimizer.scope import Scope, build_scope, traverse_scope
 from sqlmesh import ExecutionContext
-from sqlmesh.core.dialect import parse_one
+from sqlmesh.core.dialect import MacroFunc, parse_one
 
 
 def resolve_identifier_or_string(i: exp.Expression | str) -> t.Optional[str]:
@@ -71,6 +71,145 @@ def list_query_table_dependencies(
     return tables
 
 
+def _is_macro_call(expression: exp.Expression, name: str) -> bool:
+    return isinstance(expression, MacroFunc) and expression.this.name.lower() == name
+
+
+def _metrics_time_column_for_table(table: exp.Table) -> t.Optional[str]:
+    """Returns the column of the table that is filtered with `<column> BETWEEN
+    @metrics_start(...) AND @metrics_end(...)` in the select that reads the
+    table. Unqualified columns are only attributed to the table if it is the
+    only source of the select."""
+    if not isinstance(table.parent, (exp.From, exp.Join)):
+        return None
+    select = table.parent_select
+    if not select:
+        return None
+    where = select.args.get("where")
+    if not where:
+        return None
+
+    sources = [select.args["from"].this] + [
+        join.this for join in select.args.get("joins") or []
+    ]
+    alias = table.alias_or_name
+
+    conditions = (
+        list(where.this.flatten()) if isinstance(where.this, exp.And) else [where.this]
+    )
+    for condition in conditions:
+        if not isinstance(condition, exp.Between):
+            continue
+        column = condition.this
+        if not isinstance(column, exp.Column):
+            continue
+        if not _is_macro_call(condition.args["low"], "metrics_start"):
+            continue
+        if not _is_macro_call(condition.args["high"], "metrics_end"):
+            continue
+        if column.table == alias or (not column.table and len(sources) == 1):
+            return column.name
+    return None
+
+
+def list_query_time_filtered_tables(query: exp.Expression) -> t.Dict[str, str]:
+    """Lists the tables of a metrics query that are only ever read within the
+    bounds of `@metrics_start` and `@metrics_end` along with the column used to
+    filter them. Only these tables can be exported partially for a given time
+    range. Tables that are read anywhere in the query without that filter are
+    not returned."""
+    cte_names = {cte.alias for cte in query.find_all(exp.CTE)}
+    time_columns: t.Dict[str, t.Optional[str]] = {}
+    for table in query.find_all(exp.Table):
+        table_fqn = resolve_table_fqn(table)
+        if table_fqn in cte_names:
+            continue
+        column = _metrics_time_column_for_table(table)
+        if table_fqn in time_columns and time_columns[table_fqn] != column:
+            column = None
+        time_columns[table_fqn] = column
+    return {table_fqn: column for table_fqn, column in time_columns.items() if column}
+
+
+def _scope_tables(scope: Scope) -> t.Dict[str, exp.Table]:
+    return {
+        name: source
+        for name, source in scope.sources.items()
+        if isinstance(source, exp.Table)
+    }
+
+
+def list_query_table_columns(query: exp.Expression) -> t.Dict[str, t.Set[str]]:
+    """Lists the columns that a query reads from each of its tables.
+
+    Columns are attributed to tables through the scopes of the query.
+    Unqualified columns are attributed to every table of their scope, so the
+    columns of a table may include some that it doesn't have. Tables that are
+    read with a star, or that can't be found in any scope, are not returned
+    as all of their columns are needed."""
+    cte_names = {cte.alias for cte in query.find_all(exp.CTE)}
+    table_columns: t.Dict[str, t.Optional[t.Set[str]]] = {}
+
+    def add(table: exp.Table, names: t.Iterable[str]):
+        table_fqn = resolve_table_fqn(table)
+        current = table_columns.setdefault(table_fqn, set())
+        if current is not None:
+            current.update(names)
+
+    def read_all(table: exp.Table):
+        table_columns[resolve_table_fqn(table)] = None
+
+    for scope in traverse_scope(query):
+        tables = _scope_tables(scope)
+        for table in tables.values():
+            add(table, [])
+
+        stars = [
+            select
+            for select in (
+                scope.expression.selects
+                if isinstance(scope.expression, exp.Select)
+                else []
+            )
+            if isinstance(select, exp.Star)
+            or (isinstance(select, exp.Column) and isinstance(select.this, exp.Star))
+        ]
+        for star in stars:
+            star_table = star.table if isinstance(star, exp.Column) else ""
+            for name, (_, source) in scope.selected_sources.items():
+                if isinstance(source, exp.Table) and star_table in ("", name):
+                    read_all(source)
+
+        for column in scope.columns:
+            if column.table in tables:
+                add(tables[column.table], [column.name])
+            elif column.table in scope.sources:
+                # A column of a cte or a subquery
+                continue
+            else:
+                # Unqualified columns, and struct fields that are parsed
+                # like qualified columns (e.g. `struct_col.field`)
+                for table in tables.values():
+                    add(table, [column.table or column.name])
+
+        for join in scope.expression.args.get("joins") or []:
+            using = [identifier.name for identifier in join.args.get("using") or []]
+            for table in tables.values():
+                add(table, using)
+
+    # Tables that weren't found in any scope must be read in full
+    for table in query.find_all(exp.Table):
+        table_fqn = resolve_table_fqn(table)
+        if table_fqn not in cte_names and table_fqn not in table_columns:
+            table_columns[table_fqn] = None
+
+    return {
+        table_fqn: columns
+        for table_fqn, columns in table_columns.items()
+        if columns is not None
+    }
+
+
 def resolve_table_map_from_scope(
     context: ExecutionContext, scope: Scope
 ) -> t.Dict[str, str]:
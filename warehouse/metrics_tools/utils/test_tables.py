@@ -2,7 +2,12 @@ import typing as t
 from unittest.mock import MagicMock
 
 import pytest
-from metrics_tools.utils.tables import create_dependent_tables_map
+from metrics_tools.utils.tables import (
+    create_dependent_tables_map,
+    list_query_table_columns,
+    list_query_time_filtered_tables,
+)
+from sqlmesh.core.dialect import parse_one
 
 
 def test_create_dependent_tables_map():
@@ -129,3 +134,121 @@ def test_create_dependent_tables_map_parameterized(
 
     actual_tables_map = create_dependent_tables_map(mock, input)
     assert actual_tables_map == expected
+
+
+@pytest.mark.parametrize(
+    "input,expected",
+    [
+        (
+            """
+            select * from metrics.events as events
+            where events.event_type in ('STARRED')
+              and events.bucket_day between @metrics_start('DATE') and @metrics_end('DATE')
+            """,
+            {"metrics.events": "bucket_day"},
+        ),
+        (
+            """
+            select * from metrics.events
+            where "time" between @metrics_start('DATE') and @metrics_end('DATE')
+            """,
+            {"metrics.events": "time"},
+        ),
+        (
+            """
+            select * from metrics.events as events
+            inner join metrics.artifacts as artifacts
+              on events.to_artifact_id = artifacts.artifact_id
+            where bucket_day between @metrics_start('DATE') and @metrics_end('DATE')
+            """,
+            {},
+        ),
+        (
+            """
+            with filtered as (
+              select * from metrics.events as events
+              where events.bucket_day between @metrics_start('DATE') and @metrics_end('DATE')
+            )
+            select * from filtered
+            inner join metrics.first_events as first_events
+              on filtered.id = first_events.id
+            where first_events.first_event_date < @metrics_start('DATE')
+            """,
+            {"metrics.events": "bucket_day"},
+        ),
+        (
+            """
+            select * from metrics.events as events
+            where events.bucket_day between @metrics_start('DATE') and @metrics_end('DATE')
+            union all
+            select * from metrics.events
+            """,
+            {},
+        ),
+    ],
+)
+def test_list_query_time_filtered_tables(input: str, expected: t.Dict[str, str]):
+    assert list_query_time_filtered_tables(parse_one(input)) == expected
+
+
+@pytest.mark.parametrize(
+    "input,expected",
+    [
+        (
+            """
+            select events.to_artifact_id, sum(events.amount) as amount
+            from metrics.events as events
+            where events.bucket_day between '2024-01-01' and '2024-01-31'
+            group by 1
+            """,
+            {"metrics.events": {"to_artifact_id", "amount", "bucket_day"}},
+        ),
+        (
+            """
+            with active as (
+              select events.to_artifact_id, events.from_artifact_id, events.amount
+              from metrics.events as events
+            )
+            select active.to_artifact_id, count(distinct active.from_artifact_id)
+            from active
+            inner join metrics.artifacts as artifacts
+              on active.to_artifact_id = artifacts.artifact_id
+            group by 1
+            """,
+            {
+                "metrics.events": {"to_artifact_id", "from_artifact_id", "amount"},
+                "metrics.artifacts": {"artifact_id"},
+            },
+        ),
+        (
+            # Unqualified columns may belong to any table of the select
+            """
+            select first_event_date, amount
+            from metrics.events as events
+            inner join metrics.first_events using (id)
+            """,
+            {
+                "metrics.events": {"first_event_date", "amount", "id"},
+                "metrics.first_events": {"first_event_date", "amount", "id"},
+            },
+        ),
+        (
+            """
+            with filtered as (
+              select * from metrics.events
+            )
+            select filtered.amount, artifacts.*
+            from filtered
+            inner join metrics.artifacts as artifacts
+              on filtered.id = artifacts.artifact_id
+            """,
+            {},
+        ),
+        (
+            "select count(*) from metrics.events",
+            {"metrics.events": set()},
+        ),
+    ],
+)
+def test_list_query_table_columns(input: str, expected: t.Dict[str, t.Set[str]]):
+    assert list_query_table_columns(parse_one(input, dialect="duckdb")) == expected
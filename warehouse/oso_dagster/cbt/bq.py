@@ -1,13 +1,13 @@
 # Query tools for bigquery tables
 import logging
-from functools import cache
-from typing import Dict, List, NotRequired, Optional, TypedDict, cast
+from typing import Any, Dict, List, NotRequired, Optional, TypedDict, cast
 
 from google.cloud.bigquery import Client, Table, TableReference
 from google.cloud.bigquery.table import RowIterator
 from sqlglot import expressions as exp
 
 from .context import ColumnList, Connector
+from .metadata import table_metadata_cache
 
 type ExtraVarType = str | int
 
@@ -42,7 +42,7 @@ class BigQueryTableQueryHelper:
     def __init__(self, bq: Client, table_ref: TableReference):
         self._bq = bq
         self._table_ref: TableReference = table_ref
-        self._column_list = None
+        self._column_list: Optional[List[Any]] = None
 
     def select_columns(
         self,
@@ -68,18 +68,9 @@ class BigQueryTableQueryHelper:
         return ", ".join(ordered_columns)
 
     @property
-    def columns(self):
-        if self._column_list is not None:
-            return self._column_list
-
-        column_list_query = f"""
-        SELECT column_name, data_type
-        FROM `{self._table_ref.project}`.`{self._table_ref.dataset_id}`.INFORMATION_SCHEMA.COLUMNS
-        WHERE table_name = '{self.name}'
-        """
-
-        result = self._bq.query_and_wait(column_list_query)
-        self._column_list = list(result)
+    def columns(self) -> List[Any]:
+        self._load()
+        assert self._column_list is not None
         return self._column_list
 
     def filtered_columns(
@@ -117,14 +108,7 @@ class BigQueryTableQueryHelper:
         if self._column_list is not None:
             return
 
-        column_list_query = f"""
-        SELECT column_name, data_type
-        FROM `{self._table_ref.project}`.`{self._table_ref.dataset_id}`.INFORMATION_SCHEMA.COLUMNS
-        WHERE table_name = '{self.name}'
-        """
-
-        result = self._bq.query_and_wait(column_list_query)
-        self._column_list = list(result)
+        self._column_list = table_metadata_cache.get_columns(self._bq, self._table_ref)
 
     def update_columns_with(
         self,
@@ -166,26 +150,13 @@ class BigQueryConnector(Connector[RowIterator]):
 
     def __init__(self, bq: Client):
         self._bq = bq
-        self._table_columns: Optional[ColumnList] = None
 
     def get_table_columns(self, table: exp.Table) -> ColumnList:
         project = table.catalog or self._bq.project
 
-        return self._cached_get_table_columns(project, table.db, table.name)
-
-    @cache
-    def _cached_get_table_columns(
-        self, project: str, dataset: str, table_name: str
-    ) -> ColumnList:
-
-        column_list_query = f"""
-        SELECT column_name, data_type
-        FROM `{project}`.`{dataset}`.INFORMATION_SCHEMA.COLUMNS
-        WHERE table_name = '{table_name}'
-        """
-
-        result = self._bq.query_and_wait(column_list_query)
-        return list(result)
+        return table_metadata_cache.get_columns(
+            self._bq, TableReference.from_string(f"{project}.{table.db}.{table.name}")
+        )
 
     def execute_expression(self, exp: exp.Expression):
         query = exp.sql(self.dialect)
@@ -11,11 +11,11 @@ import arrow
 from dagster import ConfigurableResource, DagsterLogManager
 from dagster_gcp import BigQueryResource
 from google.cloud.bigquery import Client, TableReference
-from google.cloud.exceptions import NotFound
 from jinja2 import Environment, FileSystemLoader, meta
 
 from .bq import BigQueryConnector, BigQueryTableQueryHelper
 from .context import ContextQuery, DataContext, Transformation
+from .metadata import table_metadata_cache
 
 
 class UpdateStrategy(Enum):
@@ -127,11 +127,7 @@ class CBT:
         **vars,
     ):
         with self.bigquery.get_client() as client:
-            table_exists = True
-            try:
-                client.get_table(destination_table)
-            except NotFound:
-                table_exists = False
+            table_exists = table_metadata_cache.table_exists(client, destination_table)
 
             if update_strategy == UpdateStrategy.REPLACE or not table_exists:
                 return self._transform_replace(
@@ -170,11 +166,7 @@ class CBT:
         **vars,
     ):
         with self.bigquery.get_client() as client:
-            table_exists = True
-            try:
-                client.get_table(destination_table)
-            except NotFound:
-                table_exists = False
+            table_exists = table_metadata_cache.table_exists(client, destination_table)
 
             if update_strategy == UpdateStrategy.REPLACE or not table_exists:
                 return self._transform_replace(
@@ -284,6 +276,7 @@ class CBT:
             self.log.debug({"message": "updating", "query": update_query})
             job = client.query(update_query, timeout=timeout)
             job.result()
+            table_metadata_cache.invalidate(client, destination_table)
         else:
             self.log.debug(f"dry_run: {update_query}")
 
@@ -324,6 +317,7 @@ class CBT:
                 {"message": "replacing with query", "query": create_or_replace_query}
             )
             job.result()
+            table_metadata_cache.invalidate(client, destination_table)
         else:
             self.log.debug(f"dry_run: {create_or_replace_query}")
 
@@ -370,6 +364,7 @@ class CBT:
                 }
             )
             job.result()
+            table_metadata_cache.invalidate(client, destination_table)
         else:
             self.log.debug(f"dry_run: {replace_partition_query}")
 
@@ -0,0 +1,117 @@
+# A process wide cache of bigquery table metadata
+#
+# CBT and the connectors are created for every query, so metadata is cached
+# here instead of on those objects. Anything that writes to a table through
+# CBT invalidates the table's entries.
+import logging
+import threading
+import time
+from typing import Any, Dict, List, Optional, Tuple
+
+from google.cloud.bigquery import Client, Table, TableReference
+from google.cloud.exceptions import NotFound
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_TTL_SECONDS = 300.0
+DEFAULT_NOT_FOUND_TTL_SECONDS = 30.0
+
+
+class TableMetadataCache:
+    def __init__(
+        self,
+        ttl_seconds: float = DEFAULT_TTL_SECONDS,
+        not_found_ttl_seconds: float = DEFAULT_NOT_FOUND_TTL_SECONDS,
+    ):
+        """Caches tables and their columns for `ttl_seconds`. Tables that
+        don't exist are cached for `not_found_ttl_seconds`."""
+        self.ttl_seconds = ttl_seconds
+        self.not_found_ttl_seconds = not_found_ttl_seconds
+        self._lock = threading.Lock()
+        self._tables: Dict[str, Tuple[float, Optional[Table]]] = {}
+        self._columns: Dict[str, Tuple[float, List[Any]]] = {}
+
+    @staticmethod
+    def table_key(client: Client, table_ref: TableReference | Table | str) -> str:
+        if isinstance(table_ref, str):
+            table_ref = TableReference.from_string(
+                table_ref, default_project=client.project
+            )
+        return f"{table_ref.project}.{table_ref.dataset_id}.{table_ref.table_id}"
+
+    def _get(self, entries: Dict[str, Tuple[float, Any]], key: str):
+        with self._lock:
+            entry = entries.get(key)
+            if entry is None:
+                return False, None
+            expires_at, value = entry
+            if expires_at < time.monotonic():
+                del entries[key]
+                return False, None
+            return True, value
+
+    def _set(
+        self, entries: Dict[str, Tuple[float, Any]], key: str, value: Any, ttl: float
+    ):
+        with self._lock:
+            entries[key] = (time.monotonic() + ttl, value)
+
+    def get_table(
+        self, client: Client, table_ref: TableReference | Table | str
+    ) -> Optional[Table]:
+        """Returns the table or None if it doesn't exist"""
+        key = self.table_key(client, table_ref)
+        found, table = self._get(self._tables, key)
+        if found:
+            return table
+        try:
+            table = client.get_table(key)
+        except NotFound:
+            logger.debug(f"Caching that {key} does not exist")
+            self._set(self._tables, key, None, self.not_found_ttl_seconds)
+            return None
+        self._set(self._tables, key, table, self.ttl_seconds)
+        return table
+
+    def table_exists(
+        self, client: Client, table_ref: TableReference | Table | str
+    ) -> bool:
+        return self.get_table(client, table_ref) is not None
+
+    def get_columns(
+        self, client: Client, table_ref: TableReference | Table | str
+    ) -> List[Any]:
+        """The rows of `INFORMATION_SCHEMA.COLUMNS` (column_name, data_type)
+        for the table"""
+        key = self.table_key(client, table_ref)
+        found, columns = self._get(self._columns, key)
+        if found:
+            assert columns is not None
+            return columns
+        project, dataset, table_name = key.split(".")
+        column_list_query = f"""
+        SELECT column_name, data_type
+        FROM `{project}`.`{dataset}`.INFORMATION_SCHEMA.COLUMNS
+        WHERE table_name = '{table_name}'
+        """
+        columns = list(client.query_and_wait(column_list_query))
+        # Tables without columns don't exist (yet)
+        ttl = self.ttl_seconds if columns else self.not_found_ttl_seconds
+        self._set(self._columns, key, columns, ttl)
+        return columns
+
+    def invalidate(self, client: Client, table_ref: TableReference | Table | str):
+        """Drops the cached metadata of a table. Call this after the table
+        has been written to."""
+        key = self.table_key(client, table_ref)
+        with self._lock:
+            self._tables.pop(key, None)
+            self._columns.pop(key, None)
+
+    def clear(self):
+        with self._lock:
+            self._tables.clear()
+            self._columns.clear()
+
+
+table_metadata_cache = TableMetadataCache()
@@ -0,0 +1,56 @@
+import typing as t
+
+from google.cloud.bigquery import Client
+from google.cloud.exceptions import NotFound
+
+from .metadata import TableMetadataCache
+
+
+class FakeClient:
+    project = "project"
+
+    def __init__(self, tables):
+        self.tables = tables
+        self.get_table_calls = 0
+        self.queries = 0
+
+    def get_table(self, table_ref):
+        self.get_table_calls += 1
+        if table_ref not in self.tables:
+            raise NotFound(table_ref)
+        return table_ref
+
+    def query_and_wait(self, query):
+        self.queries += 1
+        return [("id", "INT64")]
+
+
+def test_table_metadata_cache():
+    fake = FakeClient({"project.dataset.exists"})
+    client = t.cast(Client, fake)
+    cache = TableMetadataCache()
+
+    assert cache.table_exists(client, "dataset.exists")
+    assert cache.table_exists(client, "project.dataset.exists")
+    assert not cache.table_exists(client, "dataset.missing")
+    assert not cache.table_exists(client, "dataset.missing")
+    assert fake.get_table_calls == 2
+
+    assert cache.get_columns(client, "dataset.exists") == [("id", "INT64")]
+    assert cache.get_columns(client, "dataset.exists") == [("id", "INT64")]
+    assert fake.queries == 1
+
+    # Writes invalidate the cached metadata
+    fake.tables.add("project.dataset.missing")
+    cache.invalidate(client, "dataset.missing")
+    assert cache.table_exists(client, "dataset.missing")
+    assert fake.get_table_calls == 3
+
+
+def test_table_metadata_cache_expires():
+    fake = FakeClient(set())
+    client = t.cast(Client, fake)
+    cache = TableMetadataCache(ttl_seconds=0, not_found_ttl_seconds=0)
+    assert not cache.table_exists(client, "dataset.missing")
+    assert not cache.table_exists(client, "dataset.missing")
+    assert fake.get_table_calls == 2
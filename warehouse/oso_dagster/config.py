@@ -69,6 +69,10 @@ class DagsterConfig(BaseSettings):
 
     sqlmesh_gateway: str = "local"
 
+    # Only export the days of incremental sqlmesh models that changed since
+    # their previous export to clickhouse
+    clickhouse_incremental_export: bool = False
+
     enable_k8s_executor: bool = False
 
     # Setting this is different than `enable_k8s_executor`
@@ -111,6 +111,7 @@ def load_definitions():
             destination_schema="default",
             source_catalog="metrics",
             source_schema="metrics",
+            incremental=global_config.clickhouse_incremental_export,
         ),
         Trino2BigQuerySQLMeshExporter(
             ["bigquery_metrics"],
@@ -154,6 +155,7 @@ def load_definitions():
                 destination_schema="default",
                 source_catalog="metrics",
                 source_schema="metrics",
+                incremental=global_config.clickhouse_incremental_export,
             ),
             Trino2BigQuerySQLMeshExporter(
                 ["bigquery_metrics"],
@@ -1,14 +1,26 @@
 import asyncio
-import heapq
-import io
 import logging
 import os
-import random
 import re
-import threading
 import time
+from collections import deque
+from concurrent.futures import Future, ThreadPoolExecutor
 from dataclasses import dataclass
-from typing import Any, Callable, Dict, List, Mapping, Optional, Tuple, Unpack, cast
+from typing import (
+    Any,
+    Callable,
+    Deque,
+    Dict,
+    Iterable,
+    Iterator,
+    List,
+    Mapping,
+    Optional,
+    Set,
+    Tuple,
+    Unpack,
+    cast,
+)
 
 import arrow
 import polars
@@ -34,7 +46,13 @@ from dagster import (
 from dagster_gcp import BigQueryResource, GCSResource
 from google.api_core.exceptions import ClientError, InternalServerError, NotFound
 from google.cloud.bigquery import Client as BQClient
-from google.cloud.bigquery import LoadJobConfig, SourceFormat, TableReference
+from google.cloud.bigquery import (
+    CopyJobConfig,
+    LoadJobConfig,
+    SourceFormat,
+    TableReference,
+    WriteDisposition,
+)
 from google.cloud.bigquery.schema import SchemaField
 from oso_dagster.utils.bq import (
     compare_schemas_and_ignore_safe_changes,
@@ -43,175 +61,25 @@ from oso_dagster.utils.bq import (
 from polars.type_aliases import PolarsDataType
 
 from ...cbt import CBTResource, TimePartitioning, UpdateStrategy
+from ...cbt.metadata import table_metadata_cache
 from ...utils import AlertManager, add_tags, batch_delete_blobs
 from .. import AssetFactoryResponse
 from ..common import AssetDeps, AssetList
 from .config import GoldskyConfig, GoldskyConfigInterface, SchemaDict
 from .errors import NoNewData
+from .listing import GenerationFilter, GoldskyBlobLister
+from .pointers import GoldskyPointerUpdater
+from .queues import (
+    GoldskyCheckpoint,
+    GoldskyCheckpointRange,
+    GoldskyQueue,
+    GoldskyQueues,
+)
+from .schema import GoldskySchemaSampler, ParquetSchema, goldsky_schema_cache
 
 GenericExecutionContext = AssetExecutionContext | OpExecutionContext
 
 
-@dataclass
-class GoldskyCheckpoint:
-    """Orderable representation of the components of the file names for goldsky
-    parquet files.
-
-    The file names are in the form:
-
-    * {timestamp}-{job_id}-{worker_number}-{checkpoint}.parquet
-    """
-
-    job_id: str
-    timestamp: int
-    worker_checkpoint: int
-
-    def __lt__(self, other):
-        if self.timestamp < other.timestamp:
-            return True
-        else:
-            if self.timestamp != other.timestamp:
-                return False
-            if self.job_id < other.job_id:
-                return True
-            else:
-                if self.job_id != other.job_id:
-                    return False
-                return self.worker_checkpoint < other.worker_checkpoint
-
-    def __le__(self, other):
-        if self == other:
-            return True
-        return self < other
-
-    def __eq__(self, other):
-        return (
-            self.timestamp == other.timestamp
-            and self.job_id == other.job_id
-            and self.worker_checkpoint == other.worker_checkpoint
-        )
-
-    def __gt__(self, other):
-        if self == other:
-            return False
-        return other < self
-
-    def __ge__(self, other):
-        if self == other:
-            return True
-        return self > other
-
-
-class GoldskyCheckpointRange:
-    def __init__(
-        self,
-        start: Optional[GoldskyCheckpoint] = None,
-        end: Optional[GoldskyCheckpoint] = None,
-    ):
-        self._start = start or GoldskyCheckpoint("0", 0, 0)
-        self._end = end
-
-    def in_range(self, checkpoint: GoldskyCheckpoint) -> bool:
-        if checkpoint >= self._start:
-            if self._end is None:
-                return True
-            else:
-                return checkpoint < self._end
-        else:
-            return False
-
-
-@dataclass
-class GoldskyQueueItem:
-    checkpoint: GoldskyCheckpoint
-    blob_name: str
-    blob_match: re.Match
-
-    def __lt__(self, other):
-        return self.checkpoint < other.checkpoint
-
-
-class GoldskyQueue:
-    def __init__(self, max_size: int):
-        self.queue = []
-        self._dequeues = 0
-        self.max_size = max_size
-
-    def enqueue(self, item: GoldskyQueueItem):
-        heapq.heappush(self.queue, item)
-
-    def dequeue(self) -> GoldskyQueueItem | None:
-        if self._dequeues > self.max_size - 1:
-            return None
-        try:
-            item = heapq.heappop(self.queue)
-            self._dequeues += 1
-            return item
-        except IndexError:
-            return None
-
-    def len(self):
-        return len(self.queue)
-
-    def clear(self):
-        self.queue = []
-
-
-class GoldskyQueues:
-    def __init__(self, max_size: int):
-        self.queues: Dict[str, GoldskyQueue] = {}
-        self.max_size = max_size
-
-    def enqueue(self, worker: str, item: GoldskyQueueItem):
-        queue = self.queues.get(worker, GoldskyQueue(max_size=self.max_size))
-        queue.enqueue(item)
-        self.queues[worker] = queue
-
-    def dequeue(self, worker: str) -> GoldskyQueueItem | None:
-        queue = self.queues.get(worker, GoldskyQueue(max_size=self.max_size))
-        return queue.dequeue()
-
-    def peek(self) -> GoldskyQueueItem | None:
-        """Get a value off the top of the queue without popping it"""
-        keys = list(self.queues.keys())
-        if len(keys) > 0:
-            queue = self.queues.get(keys[0])
-            if not queue:
-                return None
-            item = queue.dequeue()
-            if not item:
-                return None
-            queue.enqueue(item)
-            return item
-        return None
-
-    def is_empty(self):
-        if not self.peek():
-            return True
-        return False
-
-    def clear(self, worker: str):
-        queue = self.queues.get(worker, None)
-        if queue:
-            queue.clear()
-
-    def clear_all(self):
-        for _, queue in self.queues.items():
-            queue.clear()
-
-    def workers(self):
-        return self.queues.keys()
-
-    def status(self):
-        status: Mapping[str, int] = {}
-        for worker, queue in self.queues.items():
-            status[worker] = queue.len()
-        return status
-
-    def worker_queues(self):
-        return self.queues.items()
-
-
 @dataclass
 class GoldskyProcessItem:
     source: str
@@ -268,8 +136,17 @@ class GoldskyWorker:
     def worker_wildcard_uri(self):
         return self.worker_destination_uri("table_*.parquet")
 
+    @property
+    def staging_dataset(self) -> str:
+        return self.config.working_destination_dataset_name
+
+    def staging_table_name(self, slot: int) -> str:
+        return f"{self.config.destination_table_name}_{self.name}_stage_{slot}"
+
     async def process(
-        self, context: GenericExecutionContext, pointer_table_mutex: threading.Lock
+        self,
+        context: GenericExecutionContext,
+        pointer_updater: GoldskyPointerUpdater,
     ):
         raise NotImplementedError("process not implemented on the base class")
 
@@ -296,109 +173,177 @@ class DirectGoldskyWorker(GoldskyWorker):
     async def process(
         self,
         context: GenericExecutionContext,
-        pointer_table_mutex: threading.Lock,
+        pointer_updater: GoldskyPointerUpdater,
     ):
         await asyncio.to_thread(
             self.run_load_bigquery_load,
             context,
-            pointer_table_mutex,
+            pointer_updater,
         )
         return self
 
+    def load_job_config(
+        self, context: GenericExecutionContext, **options: Any
+    ) -> LoadJobConfig:
+        job_config_options: Dict[str, Any] = dict(
+            source_format=SourceFormat.PARQUET,
+            **options,
+        )
+        if len(self.schema) > 0:
+            context.log.debug("schema being overridden")
+            job_config_options["schema"] = self.schema
+        return LoadJobConfig(**job_config_options)
+
+    def load_files(
+        self,
+        context: GenericExecutionContext,
+        client: BQClient,
+        files_to_load: List[str],
+        destination: TableReference,
+        job_config: LoadJobConfig,
+    ):
+        def load_retry():
+            load_job = client.load_table_from_uri(
+                files_to_load,
+                destination,
+                job_config=job_config,
+                timeout=self.config.load_table_timeout_seconds,
+            )
+            return load_job.result()
+
+        bq_retry(context, load_retry)
+
     def commit_pointer(
         self,
         context: GenericExecutionContext,
         files_to_load: List[str],
         checkpoint: GoldskyCheckpoint,
-        pointer_table_mutex: threading.Lock,
+        pointer_updater: GoldskyPointerUpdater,
     ):
         with self.bigquery.get_client() as client:
-            job_config_options: Dict[str, Any] = dict(
-                source_format=SourceFormat.PARQUET,
+            self.load_files(
+                context,
+                client,
+                files_to_load,
+                self.raw_table,
+                self.load_job_config(context),
             )
-            if len(self.schema) > 0:
-                context.log.debug("schema being overridden")
-                job_config_options["schema"] = self.schema
-            job_config = LoadJobConfig(**job_config_options)
-
-            def load_retry():
-                load_job = client.load_table_from_uri(
-                    files_to_load,
-                    self.raw_table,
-                    job_config=job_config,
-                    timeout=self.config.load_table_timeout_seconds,
-                )
-                return load_job.result()
-
-            bq_retry(context, load_retry)
             context.log.info(f"Worker[{self.name}] Data loaded into bigquery")
 
-            self.update_pointer_table(client, context, checkpoint, pointer_table_mutex)
-            context.log.info(
-                f"Worker[{self.name}] Pointer table updated to {checkpoint.worker_checkpoint}"
-            )
+            self.update_pointer_table(client, context, checkpoint, pointer_updater)
 
-    def run_load_bigquery_load(
-        self,
-        context: GenericExecutionContext,
-        pointer_table_mutex: threading.Lock,
-    ):
+    def batches(self) -> Iterator[Tuple[List[str], GoldskyCheckpoint]]:
+        """Dequeues the files to load in batches of `pointer_size` files along
+        with the checkpoint of the last file in the batch"""
         to_load: List[str] = []
-
+        latest_checkpoint: Optional[GoldskyCheckpoint] = None
         item = self.queue.dequeue()
-        if not item:
-            context.log.info("nothing to load in bigquery")
-            return
-        latest_checkpoint = item.checkpoint
         while item is not None:
-            # For our own convenience we have the option to do a piecemeal
-            # loading. However, for direct loading this shouldn't be
-            # necessary
             source = f"gs://{self.config.source_bucket_name}/{item.blob_name}"
             to_load.append(source)
+            latest_checkpoint = item.checkpoint
             if len(to_load) >= self.config.pointer_size:
-                self.commit_pointer(
-                    context, to_load, item.checkpoint, pointer_table_mutex
-                )
+                yield to_load, latest_checkpoint
                 to_load = []
-            latest_checkpoint = item.checkpoint
             item = self.queue.dequeue()
 
-        if len(to_load) > 0:
-            self.commit_pointer(
-                context, to_load, latest_checkpoint, pointer_table_mutex
-            )
-            to_load = []
+        if len(to_load) > 0 and latest_checkpoint is not None:
+            yield to_load, latest_checkpoint
+
+    def run_load_bigquery_load(
+        self,
+        context: GenericExecutionContext,
+        pointer_updater: GoldskyPointerUpdater,
+    ):
+        if self.queue.len() == 0:
+            context.log.info("nothing to load in bigquery")
+            return
+
+        if self.config.load_jobs_per_worker > 1:
+            self.run_pipelined_load(context, pointer_updater)
+        else:
+            for to_load, checkpoint in self.batches():
+                self.commit_pointer(context, to_load, checkpoint, pointer_updater)
 
         context.log.debug(f"Worker[{self.name}] all data loaded")
 
+    def run_pipelined_load(
+        self,
+        context: GenericExecutionContext,
+        pointer_updater: GoldskyPointerUpdater,
+    ):
+        """Loads several batches at the same time into staging tables. The
+        staging tables are appended to the raw table in checkpoint order and
+        the pointer is moved after each append."""
+        load_jobs = self.config.load_jobs_per_worker
+        with self.bigquery.get_client() as client:
+            dataset = client.get_dataset(self.staging_dataset)
+            stage_job_config = self.load_job_config(
+                context, write_disposition=WriteDisposition.WRITE_TRUNCATE
+            )
+            append_job_config = CopyJobConfig(
+                write_disposition=WriteDisposition.WRITE_APPEND
+            )
+
+            def load_stage(slot: int, files_to_load: List[str]) -> TableReference:
+                stage_table = dataset.table(self.staging_table_name(slot))
+                self.load_files(
+                    context, client, files_to_load, stage_table, stage_job_config
+                )
+                return stage_table
+
+            in_flight: Deque[Tuple[Future[TableReference], GoldskyCheckpoint]] = deque()
+            try:
+                with ThreadPoolExecutor(max_workers=load_jobs) as pool:
+
+                    def append_oldest():
+                        future, checkpoint = in_flight.popleft()
+                        stage_table = future.result()
+                        bq_retry(
+                            context,
+                            lambda: client.copy_table(
+                                stage_table,
+                                self.raw_table,
+                                job_config=append_job_config,
+                            ).result(),
+                        )
+                        context.log.info(
+                            f"Worker[{self.name}] Data loaded into bigquery up to {checkpoint.worker_checkpoint}"
+                        )
+                        self.update_pointer_table(
+                            client, context, checkpoint, pointer_updater
+                        )
+
+                    try:
+                        for index, (to_load, checkpoint) in enumerate(self.batches()):
+                            if len(in_flight) >= load_jobs:
+                                append_oldest()
+                            # Each slot is reused once its batch has been appended
+                            future = pool.submit(load_stage, index % load_jobs, to_load)
+                            in_flight.append((future, checkpoint))
+                        while in_flight:
+                            append_oldest()
+                    finally:
+                        for future, _ in in_flight:
+                            future.cancel()
+            finally:
+                # The staging tables are dropped even if a load failed
+                for slot in range(load_jobs):
+                    client.delete_table(
+                        dataset.table(self.staging_table_name(slot)), not_found_ok=True
+                    )
+
     def update_pointer_table(
         self,
         client: BQClient,
         context: GenericExecutionContext,
         new_checkpoint: GoldskyCheckpoint,
-        pointer_table_mutex: threading.Lock,
+        pointer_updater: GoldskyPointerUpdater,
     ):
-        pointer_table = self.pointer_table
-        # Only one mutation on the table should be happening at a time
-        tx_query = f"""
-            BEGIN TRANSACTION; 
-                DELETE FROM `{pointer_table}` WHERE worker = '{self.name}';
-
-                INSERT INTO `{pointer_table}` (worker, job_id, timestamp, checkpoint)
-                VALUES ('{self.name}', '{new_checkpoint.job_id}', {new_checkpoint.timestamp}, {new_checkpoint.worker_checkpoint}); 
-            COMMIT TRANSACTION;
-        """
-        for i in range(3):
-            try:
-                with pointer_table_mutex:
-                    resp = client.query_and_wait(tx_query)
-                context.log.debug(f"TX response: {list(resp)}")
-                return resp
-            except Exception as e:
-                context.log.debug(f"Pointer update failed with `{e}`. Retrying.")
-                time.sleep(1 * random.random())
-                continue
+        pointer_updater.update(client, self.name, new_checkpoint)
+        context.log.info(
+            f"Worker[{self.name}] Pointer table updated to {new_checkpoint.worker_checkpoint}"
+        )
 
 
 def delete_all_gcs_files_in_prefix(
@@ -512,6 +457,12 @@ class GoldskyAsset:
     def load_schema_from_job_id(
         self, log: DagsterLogManager, job_id: str, timestamp: int
     ):
+        parquet_schema = goldsky_schema_cache.get(
+            self.config.source_bucket_name, job_id
+        )
+        if parquet_schema is not None:
+            self.schema = self.bq_schema_from_parquet(parquet_schema)
+            return self.schema
         queues = self.load_queues(
             log,
             max_objects_to_load=1,
@@ -526,37 +477,40 @@ class GoldskyAsset:
         item = queues.peek()
         if not item:
             raise Exception("cannot load schema. empty queue")
+        # Sample the next file of every worker to find files with a different
+        # schema before any of them are loaded
+        samples = [item]
+        for _, queue in queues.worker_queues():
+            sample = queue.peek()
+            if sample is not None and sample != item:
+                samples.append(sample)
         client = self.gcs.get_client()
         try:
-            # Download the parquet file
-            # Load the parquet file to get the schema
-            bucket = client.bucket(self.config.source_bucket_name)
-            blob = bucket.get_blob(item.blob_name)
-            if not blob:
-                raise Exception("cannot load schema. failed to get blob")
-            blob_as_file = io.BytesIO()
-            blob.download_to_file(blob_as_file)
-            parquet_schema = polars.read_parquet_schema(blob_as_file)
-            schema: List[SchemaField] = []
-            overrides_lookup = dict()
-            for override in self.config.schema_overrides:
-                if isinstance(override, dict):
-                    override = cast(SchemaDict, override)
-                    overrides_lookup[override["name"]] = SchemaField(**override)
-                elif isinstance(override, SchemaField):
-                    overrides_lookup[override.name] = override
-                else:
-                    raise Exception("unexpected input for schema override")
-            for field_name, field in parquet_schema.items():
-                if field_name in overrides_lookup:
-                    schema.append(overrides_lookup[field_name])
-                    continue
-                field_type_converter = PARQUET_TO_BQ_FIELD_TYPES[type(field)]
-                schema_field = field_type_converter(field_name, field)
-                schema.append(schema_field)
-            self.schema = schema
+            sampler = GoldskySchemaSampler(client, self.config.source_bucket_name)
+            schemas = sampler.load(samples)
         finally:
             client.close()
+        self.schema = self.bq_schema_from_parquet(schemas[item.checkpoint.job_id])
+
+    def bq_schema_from_parquet(self, parquet_schema: ParquetSchema):
+        schema: List[SchemaField] = []
+        overrides_lookup = dict()
+        for override in self.config.schema_overrides:
+            if isinstance(override, dict):
+                override = cast(SchemaDict, override)
+                overrides_lookup[override["name"]] = SchemaField(**override)
+            elif isinstance(override, SchemaField):
+                overrides_lookup[override.name] = override
+            else:
+                raise Exception("unexpected input for schema override")
+        for field_name, field in parquet_schema.items():
+            if field_name in overrides_lookup:
+                schema.append(overrides_lookup[field_name])
+                continue
+            field_type_converter = PARQUET_TO_BQ_FIELD_TYPES[type(field)]
+            schema_field = field_type_converter(field_name, field)
+            schema.append(schema_field)
+        return schema
 
     def load_schema_for_bq_table(self, table_ref: str):
         with self.bigquery.get_client() as client:
@@ -590,7 +544,9 @@ class GoldskyAsset:
             if len(self.config.schema_overrides) > 0:
                 self.load_schema(queues)
 
-            pointer_table_mutex = threading.Lock()
+            pointer_updater = GoldskyPointerUpdater(
+                self.pointer_table, log_override=context.log
+            )
             for worker_name, queue in queues.worker_queues():
                 worker = DirectGoldskyWorker(
                     worker_name,
@@ -603,11 +559,19 @@ class GoldskyAsset:
                     queue,
                     self.schema,
                 )
-                worker_coroutines.append(worker.process(context, pointer_table_mutex))
+                worker_coroutines.append(worker.process(context, pointer_updater))
                 workers.append(worker)
-            for coro in asyncio.as_completed(worker_coroutines):
-                worker: GoldskyWorker = await coro
-                context.log.info(f"Worker[{worker.name}] completed latest data load")
+            try:
+                for coro in asyncio.as_completed(worker_coroutines):
+                    worker: GoldskyWorker = await coro
+                    context.log.info(
+                        f"Worker[{worker.name}] completed latest data load"
+                    )
+            finally:
+                # Retry the pointer updates whose MERGE failed. No other
+                # worker flushes them once the last worker is done.
+                with self.bigquery.get_client() as client:
+                    pointer_updater.flush(client)
         else:
             # Check if there are existing worker table. If so we continue from
             # there because likely some failures occured but new data isn't
@@ -713,11 +677,9 @@ class GoldskyAsset:
     @property
     def destination_exists(self):
         with self.bigquery.get_client() as client:
-            try:
-                client.get_table(self.config.destination_table_fqn)
-                return True
-            except NotFound:
-                return False
+            return table_metadata_cache.table_exists(
+                client, self.config.destination_table_fqn
+            )
 
     def ensure_schema_or_fail(
         self, log: logging.Logger, source_table: str, destination_table: str
@@ -772,6 +734,7 @@ class GoldskyAsset:
                 table.schema = updated_schema
 
                 client.update_table(table, ["schema"])
+                table_metadata_cache.invalidate(client, destination_table)
 
     async def clean_working_destination(
         self, context: GenericExecutionContext, workers: List[GoldskyWorker]
@@ -780,8 +743,9 @@ class GoldskyAsset:
         with self.bigquery.get_client() as client:
             for worker in workers:
                 context.log.debug(f"deleting Worker[{worker.name}] working tables")
-                client.delete_table(worker.raw_table)
-                client.delete_table(worker.deduped_table)
+                for table in [worker.raw_table, worker.deduped_table]:
+                    client.delete_table(table)
+                    table_metadata_cache.invalidate(client, table)
 
     def get_worker_status(self, log: DagsterLogManager):
         worker_status: Mapping[str, GoldskyCheckpoint] = {}
@@ -883,33 +847,56 @@ class GoldskyAsset:
             batch_delete_blobs(gcs_client, self.config.source_bucket_name, blobs, 1000)
 
     def gather_stats(self, log: DagsterLogManager):
-        self.load_queues_to_process(log, None)
+        self.load_queues(log, blobs_loader=self._uncached_blobs_loader)
         return {
             "total_files_count": self.total_files_count,
             "bucket_stats": self.bucket_stats,
         }
 
-    def _uncached_blobs_loader(self, log: DagsterLogManager):
+    @property
+    def listing_checkpoint_path(self):
+        return f"{self.config.working_destination_preload_path}/_listing/{self.config.source_name}.json"
+
+    def list_blobs(
+        self,
+        log: DagsterLogManager,
+        worker_status: Optional[Dict[str, GoldskyCheckpoint]] = None,
+    ) -> Iterable[re.Match[str]]:
+        """Lists the goldsky files concurrently and yields the matches as they
+        are found. With a worker status, generations that every worker has
+        moved past are not listed and the files of each worker are listed from
+        its checkpoint."""
         log.info("Loading blobs list for processing")
-        gcs_client = self.gcs.get_client()
-        blobs = gcs_client.list_blobs(
+        lister = GoldskyBlobLister(
+            self.gcs.get_client(),
             self.config.source_bucket_name,
-            prefix=f"{self.config.source_goldsky_dir}/{self.config.source_name}",
+            f"{self.config.source_goldsky_dir}/{self.config.source_name}",
+            self.goldsky_re,
+            self.listing_checkpoint_path,
+            concurrency=self.config.listing_concurrency,
         )
-        blobs_to_process = []
-        total_files_count = 0
-        for blob in blobs:
-            match = self.goldsky_re.match(blob.name)
-            total_files_count += 1
-            if not match:
-                continue
-            blobs_to_process.append(match)
-        self.total_files_count = total_files_count
-        return blobs_to_process
+
+        generation_filter: Optional[GenerationFilter] = None
+        if worker_status:
+
+            def all_workers_passed(timestamp: int, workers: Set[str]):
+                return all(
+                    worker in worker_status
+                    and worker_status[worker].timestamp > timestamp
+                    for worker in workers
+                )
+
+            generation_filter = all_workers_passed
+
+        yield from lister.list_matches(generation_filter, worker_status)
+        self.total_files_count = lister.total_files_count
+
+    def _uncached_blobs_loader(self, log: DagsterLogManager):
+        return self.list_blobs(log)
 
     def _cached_blobs_loader(self, log: DagsterLogManager):
         if self.cached_blobs_to_process is None:
-            self.cached_blobs_to_process = self._uncached_blobs_loader(log)
+            self.cached_blobs_to_process = list(self._uncached_blobs_loader(log))
         else:
             log.info("using cached blobs")
         return self.cached_blobs_to_process
@@ -935,14 +922,20 @@ class GoldskyAsset:
         worker_status: Optional[Dict[str, GoldskyCheckpoint]] = None,
         max_objects_to_load: Optional[int] = None,
         blobs_loader: Optional[
-            Callable[[DagsterLogManager], List[re.Match[str]]]
+            Callable[[DagsterLogManager], Iterable[re.Match[str]]]
         ] = None,
         checkpoint_range: Optional[GoldskyCheckpointRange] = None,
     ) -> GoldskyQueues:
         latest_timestamp = 0
         if not max_objects_to_load:
             max_objects_to_load = self.config.max_objects_to_load
-        queues = GoldskyQueues(max_size=max_objects_to_load)
+        # Only queue checkpoints within the checkpoint range and, if there's
+        # a worker status, those that are after the worker's checkpoint
+        queues = GoldskyQueues(
+            max_size=max_objects_to_load,
+            worker_status=worker_status,
+            checkpoint_range=checkpoint_range,
+        )
 
         if not blobs_loader:
             blobs_loader = self._cached_blobs_loader
@@ -960,39 +953,20 @@ class GoldskyAsset:
             )
 
         for match in blobs_to_process:
-            worker = match.group("worker")
-            job_id = match.group("job_id")
             timestamp = int(match.group("timestamp"))
             if timestamp > latest_timestamp:
                 latest_timestamp = timestamp
-            worker_checkpoint = int(match.group("checkpoint"))
-            checkpoint = GoldskyCheckpoint(job_id, timestamp, worker_checkpoint)
 
             self.record_bucket_stats_from_match(match)
 
-            # If there's a checkpoint range only queue checkpoints within that range
-            if checkpoint_range:
-                if not checkpoint_range.in_range(checkpoint):
-                    continue
-
-            # If there's a worker status then queue if the current checkpoint is
-            # greater than or equal to it
-            if worker_status:
-                worker_checkpoint = worker_status.get(
-                    worker, GoldskyCheckpoint("", 0, 0)
-                )
-                if worker_checkpoint >= checkpoint:
-                    continue
-
-            # log.debug(f"Queueing {match.group()}")
-            queues.enqueue(
-                worker,
-                GoldskyQueueItem(
-                    checkpoint,
-                    match.group(0),
-                    match,
-                ),
+            queues.append(
+                match.group("worker"),
+                timestamp,
+                match.group("job_id"),
+                int(match.group("checkpoint")),
+                match.group(0),
             )
+
         if worker_status:
             keys = list(worker_status.keys())
             if len(keys) > 0:
@@ -1028,7 +1002,10 @@ class GoldskyAsset:
         worker_status = self.get_worker_status(log)
 
         queues = self.load_queues(
-            log, worker_status=worker_status, checkpoint_range=checkpoint_range
+            log,
+            worker_status=worker_status,
+            checkpoint_range=checkpoint_range,
+            blobs_loader=lambda log: self.list_blobs(log, worker_status),
         )
 
         for worker, queue in queues.worker_queues():
@@ -0,0 +1,171 @@
+"""Compares the array backed goldsky queues with the previous heap of queue
+items at the scale of the larger goldsky sources.
+
+Run with:
+
+    python -m oso_dagster.factories.goldsky.bench_queues --files 1000000
+"""
+
+import argparse
+import heapq
+import random
+import re
+import time
+import tracemalloc
+import typing as t
+import uuid
+from dataclasses import dataclass
+
+from .queues import GoldskyCheckpoint, GoldskyCheckpointRange, GoldskyQueues
+
+GOLDSKY_RE = re.compile(
+    r"goldsky/bench/(?P<timestamp>\d+)-(?P<job_id>[0-9a-f-]{36})-(?P<worker>\d+)-(?P<checkpoint>\d+).parquet"
+)
+
+
+@dataclass
+class HeapQueueItem:
+    checkpoint: GoldskyCheckpoint
+    blob_name: str
+    blob_match: re.Match
+
+    def __lt__(self, other):
+        return self.checkpoint < other.checkpoint
+
+
+class HeapQueues:
+    """The previous implementation: one heap of items per worker"""
+
+    def __init__(self, max_size: int):
+        self.queues: t.Dict[str, t.List[HeapQueueItem]] = {}
+        self.dequeues: t.Dict[str, int] = {}
+        self.max_size = max_size
+
+    def enqueue(self, worker: str, item: HeapQueueItem):
+        heapq.heappush(self.queues.setdefault(worker, []), item)
+
+    def dequeue(self, worker: str) -> HeapQueueItem | None:
+        if self.dequeues.get(worker, 0) > self.max_size - 1:
+            return None
+        try:
+            item = heapq.heappop(self.queues[worker])
+            self.dequeues[worker] = self.dequeues.get(worker, 0) + 1
+            return item
+        except (IndexError, KeyError):
+            return None
+
+
+def generate_matches(files: int, workers: int, generations: int):
+    names: t.List[str] = []
+    files_per_worker = files // (workers * generations)
+    for generation in range(generations):
+        timestamp = 1700000000000 + generation * 86_400_000
+        job_id = str(uuid.UUID(int=generation))
+        for worker in range(workers):
+            for checkpoint in range(files_per_worker):
+                names.append(
+                    f"goldsky/bench/{timestamp}-{job_id}-{worker}-{checkpoint}.parquet"
+                )
+    random.Random(0).shuffle(names)
+    return [t.cast(re.Match[str], GOLDSKY_RE.match(name)) for name in names]
+
+
+def status_and_range(workers: int, generations: int, files_per_worker: int):
+    # Every worker has loaded half of the middle generation
+    middle = generations // 2
+    job_id = str(uuid.UUID(int=middle))
+    timestamp = 1700000000000 + middle * 86_400_000
+    worker_status = {
+        str(worker): GoldskyCheckpoint(job_id, timestamp, files_per_worker // 2)
+        for worker in range(workers)
+    }
+    return worker_status, GoldskyCheckpointRange()
+
+
+def bench_heap(matches, worker_status, checkpoint_range, max_size: int):
+    queues = HeapQueues(max_size=max_size)
+    for match in matches:
+        worker = match.group("worker")
+        checkpoint = GoldskyCheckpoint(
+            match.group("job_id"),
+            int(match.group("timestamp")),
+            int(match.group("checkpoint")),
+        )
+        if not checkpoint_range.in_range(checkpoint):
+            continue
+        if worker_status.get(worker, GoldskyCheckpoint("", 0, 0)) >= checkpoint:
+            continue
+        queues.enqueue(worker, HeapQueueItem(checkpoint, match.group(0), match))
+    return queues
+
+
+def bench_arrays(matches, worker_status, checkpoint_range, max_size: int):
+    queues = GoldskyQueues(
+        max_size=max_size,
+        worker_status=worker_status,
+        checkpoint_range=checkpoint_range,
+    )
+    for match in matches:
+        queues.append(
+            match.group("worker"),
+            int(match.group("timestamp")),
+            match.group("job_id"),
+            int(match.group("checkpoint")),
+            match.group(0),
+        )
+    return queues
+
+
+def drain(queues, workers: t.Iterable[str]):
+    count = 0
+    for worker in workers:
+        while queues.dequeue(worker) is not None:
+            count += 1
+    return count
+
+
+def measure(name: str, build: t.Callable[[], t.Any], workers: t.List[str]):
+    tracemalloc.start()
+    started = time.perf_counter()
+    queues = build()
+    built = time.perf_counter()
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    count = drain(queues, workers)
+    drained = time.perf_counter()
+    print(
+        f"{name:>6}: build {built - started:7.2f}s  drain {drained - built:7.2f}s"
+        f"  peak memory {peak / 2**20:8.1f} MiB  items {count}"
+    )
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--files", type=int, default=1_000_000)
+    parser.add_argument("--workers", type=int, default=8)
+    parser.add_argument("--generations", type=int, default=4)
+    args = parser.parse_args()
+
+    matches = generate_matches(args.files, args.workers, args.generations)
+    files_per_worker = args.files // (args.workers * args.generations)
+    worker_status, checkpoint_range = status_and_range(
+        args.workers, args.generations, files_per_worker
+    )
+    workers = [str(worker) for worker in range(args.workers)]
+    max_size = len(matches)
+    print(f"{len(matches)} files, {args.workers} workers")
+
+    measure(
+        "heap",
+        lambda: bench_heap(matches, worker_status, checkpoint_range, max_size),
+        workers,
+    )
+    measure(
+        "arrays",
+        lambda: bench_arrays(matches, worker_status, checkpoint_range, max_size),
+        workers,
+    )
+
+
+if __name__ == "__main__":
+    main()
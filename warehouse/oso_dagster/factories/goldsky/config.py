@@ -36,6 +36,7 @@ class GoldskyConfigInterface(TypedDict):
     destination_table_name: str
     environment: NotRequired[str]
     pointer_size: NotRequired[int]
+    load_jobs_per_worker: NotRequired[int]
     max_objects_to_load: NotRequired[int]
     destination_dataset_name: NotRequired[str]
     destination_bucket_name: str
@@ -54,6 +55,7 @@ class GoldskyConfigInterface(TypedDict):
     partition_column_transform: NotRequired[Callable[[str], str]]
     schema_overrides: NotRequired[List[Schema]]
     retention_files: NotRequired[int]
+    listing_concurrency: NotRequired[int]
     additional_factories: NotRequired[List[AdditionalAssetFactory["GoldskyConfig"]]]
 
 
@@ -71,6 +73,11 @@ class GoldskyConfig:
     # largest this can be is 10000.
     pointer_size: int = int(os.environ.get("GOLDSKY_CHECKPOINT_SIZE", "5000"))
 
+    # The number of load jobs each worker runs at the same time. With more
+    # than one job the files are loaded into staging tables that are appended
+    # to the worker table in checkpoint order.
+    load_jobs_per_worker: int = int(os.environ.get("GOLDSKY_LOAD_JOBS_PER_WORKER", "1"))
+
     max_objects_to_load: int = 200_000
 
     destination_dataset_name: str = "oso_sources"
@@ -99,6 +106,9 @@ class GoldskyConfig:
 
     retention_files: int = 10000
 
+    # The number of concurrent listings of the source bucket
+    listing_concurrency: int = 16
+
     additional_factories: List[AdditionalAssetFactory["GoldskyConfig"]] = field(
         default_factory=lambda: []
     )
@@ -1,2 +1,10 @@
 class NoNewData(Exception):
     pass
+
+
+class SchemaDrift(Exception):
+    pass
+
+
+class PointerUpdateFailed(Exception):
+    pass
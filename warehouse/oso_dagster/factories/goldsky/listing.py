@@ -0,0 +1,318 @@
+import json
+import logging
+import queue
+import re
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from dataclasses import dataclass, field
+from typing import (
+    Any,
+    Callable,
+    Dict,
+    Iterator,
+    List,
+    Mapping,
+    Optional,
+    Set,
+    Tuple,
+    cast,
+)
+
+from google.api_core.exceptions import NotFound
+from google.cloud.storage import Client as GCSClient
+
+from .queues import GoldskyCheckpoint
+
+logger = logging.getLogger(__name__)
+
+# Called with the timestamp of a generation and the workers that were seen in
+# it. Returns True if the generation doesn't need to be listed.
+GenerationFilter = Callable[[int, Set[str]], bool]
+
+
+@dataclass
+class GoldskyListingCheckpoint:
+    """The last seen file of each worker in each generation of a goldsky
+    pipeline. A generation is the timestamp prefix of the file names:
+
+    * {timestamp}-{job_id}-{worker_number}-{checkpoint}.parquet
+    """
+
+    # timestamp -> worker -> (job_id, checkpoint, blob name)
+    generations: Dict[str, Dict[str, Tuple[str, int, str]]] = field(
+        default_factory=dict
+    )
+
+    def record(self, match: re.Match[str]):
+        generation = self.generations.setdefault(match.group("timestamp"), {})
+        seen = (
+            match.group("job_id"),
+            int(match.group("checkpoint")),
+            match.group(0),
+        )
+        last_seen = generation.get(match.group("worker"))
+        if last_seen is None or last_seen[:2] < seen[:2]:
+            generation[match.group("worker")] = seen
+
+    def workers(self, timestamp: str) -> Set[str]:
+        return set(self.generations.get(timestamp, {}).keys())
+
+    def worker_prefixes(self, timestamp: str) -> List[Tuple[str, str, str]]:
+        """The file name prefixes of the workers seen in a generation with
+        the worker and its job id"""
+        return sorted(
+            (f"{timestamp}-{job_id}-{worker}-", worker, job_id)
+            for worker, (job_id, _, _) in self.generations.get(timestamp, {}).items()
+        )
+
+    def to_json(self) -> str:
+        return json.dumps(
+            {
+                timestamp: {
+                    worker: list(last_seen) for worker, last_seen in workers.items()
+                }
+                for timestamp, workers in self.generations.items()
+            }
+        )
+
+    @classmethod
+    def from_json(cls, raw: str):
+        return cls(
+            generations={
+                timestamp: {
+                    worker: (last_seen[0], int(last_seen[1]), last_seen[2])
+                    for worker, last_seen in workers.items()
+                }
+                for timestamp, workers in json.loads(raw).items()
+            }
+        )
+
+
+def first_checkpoint_name_after(checkpoint: int, width: int = 0) -> str:
+    """The smallest name of a checkpoint after `checkpoint`. Checkpoints that
+    are zero padded to `width` digits sort like numbers. Without padding later
+    checkpoints can sort before earlier ones (`10` sorts before `9`), so the
+    name is the smallest one of any later checkpoint."""
+    following = str(checkpoint + 1)
+    if width > 0 and len(following) <= width:
+        return following.zfill(width)
+    current = str(checkpoint)
+    longer = "1" + "0" * len(current)
+    if len(following) == len(current):
+        return min(following, longer)
+    return longer
+
+
+def checkpoint_name_width(blob_name: str) -> int:
+    """The width of the zero padded checkpoint of a goldsky file or 0 if the
+    checkpoint isn't padded"""
+    checkpoint = blob_name.rsplit("-", 1)[-1].split(".", 1)[0]
+    if len(checkpoint) > 1 and checkpoint.startswith("0"):
+        return len(checkpoint)
+    return 0
+
+
+@dataclass
+class ListingShard:
+    prefix: str
+    start_offset: Optional[str] = None
+    end_offset: Optional[str] = None
+
+
+class GoldskyBlobLister:
+    """Lists the goldsky files of a source concurrently.
+
+    The files are split into generations with a delimiter listing. Each
+    generation is split further into one range per worker seen in a previous
+    listing (the checkpoint) so that the ranges can be listed concurrently.
+    The ranges cover the whole generation so new workers are found as well.
+    If the pointers of the workers are given, the range of a worker starts
+    after the worker's pointer so that files that have already been loaded
+    aren't listed again. This is only exact for zero padded checkpoints. For
+    other checkpoints just the files that sort before every later checkpoint
+    are skipped. Generations that are rejected by the
+    `generation_filter` aren't listed at all.
+    """
+
+    def __init__(
+        self,
+        gcs_client: GCSClient,
+        bucket_name: str,
+        prefix: str,
+        blob_re: re.Pattern[str],
+        checkpoint_path: str,
+        concurrency: int = 16,
+        log_override: Optional[logging.Logger] = None,
+    ):
+        self.gcs_client = gcs_client
+        self.bucket_name = bucket_name
+        self.prefix = prefix.rstrip("/") + "/"
+        self.blob_re = blob_re
+        self.checkpoint_path = checkpoint_path
+        self.concurrency = concurrency
+        self.logger = log_override or logger
+        self.total_files_count = 0
+        self._checkpoint: Optional[GoldskyListingCheckpoint] = None
+
+    @property
+    def checkpoint(self) -> GoldskyListingCheckpoint:
+        if self._checkpoint is None:
+            self._checkpoint = self.load_checkpoint()
+        return self._checkpoint
+
+    def load_checkpoint(self) -> GoldskyListingCheckpoint:
+        blob = self.gcs_client.bucket(self.bucket_name).blob(self.checkpoint_path)
+        try:
+            return GoldskyListingCheckpoint.from_json(blob.download_as_text())
+        except NotFound:
+            return GoldskyListingCheckpoint()
+        except (ValueError, KeyError, IndexError, TypeError) as e:
+            self.logger.warning(f"Ignoring invalid listing checkpoint: {e}")
+            return GoldskyListingCheckpoint()
+
+    def save_checkpoint(self):
+        blob = self.gcs_client.bucket(self.bucket_name).blob(self.checkpoint_path)
+        blob.upload_from_string(
+            self.checkpoint.to_json(), content_type="application/json"
+        )
+
+    def generation_prefixes(self) -> List[str]:
+        """Lists the prefixes of all generations, e.g. `{prefix}{timestamp}-`"""
+        blobs = self.gcs_client.list_blobs(
+            self.bucket_name, prefix=self.prefix, delimiter="-"
+        )
+        for page in blobs.pages:
+            # Files without a `-` aren't goldsky files but they're counted
+            self.total_files_count += page.num_items
+        # The storage client adds the prefixes to the iterator as its pages
+        # are read. They are not part of the type of HTTPIterator
+        prefixes: Set[str] = cast(Any, blobs).prefixes
+        return sorted(prefixes)
+
+    def shards(
+        self,
+        generation_prefix: str,
+        timestamp: str,
+        worker_status: Optional[Mapping[str, GoldskyCheckpoint]] = None,
+    ) -> List[ListingShard]:
+        worker_prefixes = self.checkpoint.worker_prefixes(timestamp)
+        if not worker_prefixes:
+            return [ListingShard(prefix=generation_prefix)]
+        boundaries = [
+            f"{self.prefix}{worker_prefix}" for worker_prefix, _, _ in worker_prefixes
+        ]
+        shards = [ListingShard(prefix=generation_prefix, end_offset=boundaries[0])]
+        for (_, worker, job_id), start, end in zip(
+            worker_prefixes, boundaries, boundaries[1:] + [None]
+        ):
+            pointer = (worker_status or {}).get(worker)
+            if (
+                pointer is not None
+                and pointer.timestamp == int(timestamp)
+                and pointer.job_id == job_id
+            ):
+                # The files of the worker up to the pointer have been loaded.
+                # Only the files of the worker are between its prefix and
+                # this offset.
+                _, _, last_seen_name = self.checkpoint.generations[timestamp][worker]
+                start = start + first_checkpoint_name_after(
+                    pointer.worker_checkpoint, checkpoint_name_width(last_seen_name)
+                )
+            shards.append(
+                ListingShard(
+                    prefix=generation_prefix, start_offset=start, end_offset=end
+                )
+            )
+        return shards
+
+    def list_matches(
+        self,
+        generation_filter: Optional[GenerationFilter] = None,
+        worker_status: Optional[Mapping[str, GoldskyCheckpoint]] = None,
+    ) -> Iterator[re.Match[str]]:
+        """Yields the matching files as they are listed. The checkpoint is
+        saved once all files have been listed. Files of a worker up to its
+        checkpoint in `worker_status` may be skipped."""
+        checkpoint = self.checkpoint
+        shards: List[ListingShard] = []
+        listed_generations: Set[str] = set()
+        for generation_prefix in self.generation_prefixes():
+            timestamp = generation_prefix[len(self.prefix) : -1]
+            if not timestamp.isdigit():
+                # Not a goldsky generation
+                continue
+            listed_generations.add(timestamp)
+            workers = checkpoint.workers(timestamp)
+            if (
+                workers
+                and generation_filter
+                and generation_filter(int(timestamp), workers)
+            ):
+                self.logger.debug(f"Skipping listing of generation {timestamp}")
+                continue
+            shards.extend(self.shards(generation_prefix, timestamp, worker_status))
+        self.logger.info(f"Listing goldsky files in {len(shards)} shards")
+
+        for match in self._list_shards(shards):
+            checkpoint.record(match)
+            yield match
+
+        # Generations that were deleted don't need to be remembered
+        for timestamp in list(checkpoint.generations.keys()):
+            if timestamp not in listed_generations:
+                del checkpoint.generations[timestamp]
+        self.save_checkpoint()
+
+    def _list_shards(self, shards: List[ListingShard]) -> Iterator[re.Match[str]]:
+        if not shards:
+            return
+        pages: queue.Queue = queue.Queue(maxsize=4 * self.concurrency)
+        shard_done = object()
+        stop = threading.Event()
+
+        def put(item):
+            while not stop.is_set():
+                try:
+                    pages.put(item, timeout=0.1)
+                    return
+                except queue.Full:
+                    continue
+
+        def list_shard(shard: ListingShard):
+            try:
+                blobs = self.gcs_client.list_blobs(
+                    self.bucket_name,
+                    prefix=shard.prefix,
+                    start_offset=shard.start_offset,
+                    end_offset=shard.end_offset,
+                    fields="items(name),nextPageToken",
+                )
+                for page in blobs.pages:
+                    if stop.is_set():
+                        return
+                    put([blob.name for blob in page])
+            except Exception as e:
+                put(e)
+            finally:
+                put(shard_done)
+
+        with ThreadPoolExecutor(max_workers=self.concurrency) as pool:
+            for shard in shards:
+                pool.submit(list_shard, shard)
+            remaining = len(shards)
+            try:
+                while remaining > 0:
+                    item = pages.get()
+                    if item is shard_done:
+                        remaining -= 1
+                        continue
+                    if isinstance(item, Exception):
+                        raise item
+                    self.total_files_count += len(item)
+                    for name in item:
+                        match = self.blob_re.match(name)
+                        if match:
+                            yield match
+            finally:
+                stop.set()
+                pool.shutdown(wait=False, cancel_futures=True)
@@ -0,0 +1,94 @@
+import logging
+import random
+import threading
+import time
+from typing import Dict, Optional
+
+from google.cloud.bigquery import Client as BQClient
+
+from .errors import PointerUpdateFailed
+from .queues import GoldskyCheckpoint
+
+logger = logging.getLogger(__name__)
+
+
+class GoldskyPointerUpdater:
+    """Coalesces the pointer updates of all workers.
+
+    Workers record their new checkpoint and block until it has been written.
+    Only one MERGE runs at a time. The updates that arrive while it runs are
+    written together by the next MERGE. If a MERGE fails its updates are kept
+    for the next flush and PointerUpdateFailed is raised.
+    """
+
+    def __init__(
+        self,
+        pointer_table: str,
+        retries: int = 3,
+        log_override: Optional[logging.Logger] = None,
+    ):
+        self.pointer_table = pointer_table
+        self.retries = retries
+        self.logger = log_override or logger
+        self._pending: Dict[str, GoldskyCheckpoint] = {}
+        self._pending_lock = threading.Lock()
+        self._flush_lock = threading.Lock()
+
+    def update(self, client: BQClient, worker: str, checkpoint: GoldskyCheckpoint):
+        with self._pending_lock:
+            self._pending[worker] = checkpoint
+        self.flush(client)
+
+    def flush(self, client: BQClient):
+        with self._flush_lock:
+            with self._pending_lock:
+                pending = self._pending
+                self._pending = {}
+            if not pending:
+                # Written by a MERGE of another worker
+                return
+            if not self._merge(client, pending):
+                with self._pending_lock:
+                    # Keep the updates for the next flush unless they've been
+                    # superseded
+                    for worker, checkpoint in pending.items():
+                        self._pending.setdefault(worker, checkpoint)
+                raise PointerUpdateFailed(
+                    f"Failed to update the pointers of workers {sorted(pending)}"
+                )
+
+    def merge_query(self, pointers: Dict[str, GoldskyCheckpoint]) -> str:
+        rows = ",\n".join(
+            f"STRUCT('{worker}' AS worker, '{checkpoint.job_id}' AS job_id, "
+            f"{checkpoint.timestamp} AS timestamp, "
+            f"{checkpoint.worker_checkpoint} AS checkpoint)"
+            for worker, checkpoint in sorted(pointers.items())
+        )
+        return f"""
+            MERGE `{self.pointer_table}` AS pointer
+            USING (SELECT * FROM UNNEST([
+                {rows}
+            ])) AS updated
+            ON pointer.worker = updated.worker
+            WHEN MATCHED THEN UPDATE SET
+                job_id = updated.job_id,
+                timestamp = updated.timestamp,
+                checkpoint = updated.checkpoint
+            WHEN NOT MATCHED THEN
+                INSERT (worker, job_id, timestamp, checkpoint)
+                VALUES (updated.worker, updated.job_id, updated.timestamp, updated.checkpoint)
+        """
+
+    def _merge(self, client: BQClient, pointers: Dict[str, GoldskyCheckpoint]):
+        query = self.merge_query(pointers)
+        for _ in range(self.retries):
+            try:
+                resp = client.query_and_wait(query)
+                self.logger.debug(
+                    f"Pointers of {len(pointers)} workers updated: {list(resp)}"
+                )
+                return True
+            except Exception as e:
+                self.logger.debug(f"Pointer update failed with `{e}`. Retrying.")
+                time.sleep(1 * random.random())
+        return False
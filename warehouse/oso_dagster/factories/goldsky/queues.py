@@ -0,0 +1,360 @@
+"""The queues of goldsky files that are loaded by each worker"""
+
+import bisect
+from array import array
+from dataclasses import dataclass
+from typing import Dict, List, Mapping, Optional, Tuple
+
+import numpy as np
+
+
+@dataclass
+class GoldskyCheckpoint:
+    """Orderable representation of the components of the file names for goldsky
+    parquet files.
+
+    The file names are in the form:
+
+    * {timestamp}-{job_id}-{worker_number}-{checkpoint}.parquet
+    """
+
+    job_id: str
+    timestamp: int
+    worker_checkpoint: int
+
+    def __lt__(self, other):
+        if self.timestamp < other.timestamp:
+            return True
+        else:
+            if self.timestamp != other.timestamp:
+                return False
+            if self.job_id < other.job_id:
+                return True
+            else:
+                if self.job_id != other.job_id:
+                    return False
+                return self.worker_checkpoint < other.worker_checkpoint
+
+    def __le__(self, other):
+        if self == other:
+            return True
+        return self < other
+
+    def __eq__(self, other):
+        return (
+            self.timestamp == other.timestamp
+            and self.job_id == other.job_id
+            and self.worker_checkpoint == other.worker_checkpoint
+        )
+
+    def __gt__(self, other):
+        if self == other:
+            return False
+        return other < self
+
+    def __ge__(self, other):
+        if self == other:
+            return True
+        return self > other
+
+
+class GoldskyCheckpointRange:
+    def __init__(
+        self,
+        start: Optional[GoldskyCheckpoint] = None,
+        end: Optional[GoldskyCheckpoint] = None,
+    ):
+        self._start = start or GoldskyCheckpoint("0", 0, 0)
+        self._end = end
+
+    def in_range(self, checkpoint: GoldskyCheckpoint) -> bool:
+        if checkpoint >= self._start:
+            if self._end is None:
+                return True
+            else:
+                return checkpoint < self._end
+        else:
+            return False
+
+
+@dataclass
+class GoldskyQueueItem:
+    checkpoint: GoldskyCheckpoint
+    blob_name: str
+
+    def __lt__(self, other):
+        return self.checkpoint < other.checkpoint
+
+
+class GoldskyQueue:
+    """The files of a worker in checkpoint order.
+
+    The components of the checkpoints are stored in arrays instead of an
+    object per file. Job ids are stored once and referenced by index. The
+    order is computed with a single sort when the queue is first read and
+    filtering is done on the whole arrays.
+    """
+
+    def __init__(self, max_size: int):
+        self.max_size = max_size
+        self.clear()
+        self._dequeues = 0
+
+    def enqueue(self, item: GoldskyQueueItem):
+        checkpoint = item.checkpoint
+        self.append(
+            checkpoint.timestamp,
+            checkpoint.job_id,
+            checkpoint.worker_checkpoint,
+            item.blob_name,
+        )
+
+    def append(self, timestamp: int, job_id: str, checkpoint: int, blob_name: str):
+        if self._order is not None:
+            # Keep only the remaining items (in order) before adding more
+            self._select(self._order[self._head :])
+        job_index = self._job_indexes.get(job_id)
+        if job_index is None:
+            job_index = len(self._job_ids)
+            self._job_ids.append(job_id)
+            self._job_indexes[job_id] = job_index
+        self._timestamps.append(timestamp)
+        self._jobs.append(job_index)
+        self._checkpoints.append(checkpoint)
+        self._names.append(blob_name)
+
+    def dequeue(self) -> GoldskyQueueItem | None:
+        if self._dequeues > self.max_size - 1:
+            return None
+        item = self.peek()
+        if item is not None:
+            self._head += 1
+            self._dequeues += 1
+        return item
+
+    def peek(self) -> GoldskyQueueItem | None:
+        order = self._sorted_order()
+        if self._head >= len(order):
+            return None
+        return self._item(int(order[self._head]))
+
+    def len(self):
+        if self._order is None:
+            return len(self._names)
+        return len(self._order) - self._head
+
+    def clear(self):
+        self._timestamps = array("q")
+        self._jobs = array("q")
+        self._checkpoints = array("q")
+        self._names: List[str] = []
+        self._job_ids: List[str] = []
+        self._job_indexes: Dict[str, int] = {}
+        # The positions of the items in checkpoint order once sorted
+        self._order: Optional[np.ndarray] = None
+        self._head = 0
+
+    def filter(
+        self,
+        after: Optional[GoldskyCheckpoint] = None,
+        start: Optional[GoldskyCheckpoint] = None,
+        end: Optional[GoldskyCheckpoint] = None,
+    ):
+        """Keeps the items that are after `after`, at or after `start` and
+        before `end`"""
+        if self._order is not None:
+            self._select(self._order[self._head :])
+        keep = np.ones(len(self._names), dtype=bool)
+        if after is not None:
+            keep &= self._compare(after) > 0
+        if start is not None:
+            keep &= self._compare(start) >= 0
+        if end is not None:
+            keep &= self._compare(end) < 0
+        if not keep.all():
+            self._select(np.flatnonzero(keep))
+
+    def _arrays(self):
+        return (
+            np.frombuffer(self._timestamps, dtype=np.int64),
+            np.frombuffer(self._jobs, dtype=np.int64),
+            np.frombuffer(self._checkpoints, dtype=np.int64),
+        )
+
+    def _job_keys(self, job_ids: List[str]):
+        """Keys of the item job ids (odd) and of other job ids (even) that
+        compare like the job ids"""
+        sorted_job_ids = sorted(self._job_ids)
+        ranks = {job_id: rank for rank, job_id in enumerate(sorted_job_ids)}
+        item_keys = np.array(
+            [2 * ranks[job_id] + 1 for job_id in self._job_ids], dtype=np.int64
+        )
+        other_keys = [
+            (
+                2 * ranks[job_id] + 1
+                if job_id in ranks
+                else 2 * bisect.bisect_left(sorted_job_ids, job_id)
+            )
+            for job_id in job_ids
+        ]
+        return item_keys, other_keys
+
+    def _compare(self, checkpoint: GoldskyCheckpoint) -> np.ndarray:
+        """Compares every item with the checkpoint (-1, 0 or 1)"""
+        timestamps, jobs, checkpoints = self._arrays()
+        item_job_keys, (job_key,) = self._job_keys([checkpoint.job_id])
+        result = np.sign(timestamps - checkpoint.timestamp)
+        same = result == 0
+        result[same] = np.sign(item_job_keys[jobs[same]] - job_key)
+        same = result == 0
+        result[same] = np.sign(checkpoints[same] - checkpoint.worker_checkpoint)
+        return result
+
+    def _sorted_order(self) -> np.ndarray:
+        if self._order is not None:
+            return self._order
+        timestamps, jobs, checkpoints = self._arrays()
+        item_job_keys, _ = self._job_keys([])
+        job_keys = item_job_keys[jobs] if len(jobs) else np.array([], dtype=np.int64)
+        order = np.lexsort((checkpoints, job_keys, timestamps))
+        self._order = order
+        self._head = 0
+        return order
+
+    def _select(self, positions: np.ndarray):
+        timestamps, jobs, checkpoints = self._arrays()
+        self._timestamps = array("q", timestamps[positions].tobytes())
+        self._jobs = array("q", jobs[positions].tobytes())
+        self._checkpoints = array("q", checkpoints[positions].tobytes())
+        self._names = [self._names[position] for position in positions]
+        self._order = None
+        self._head = 0
+
+    def _item(self, position: int) -> GoldskyQueueItem:
+        return GoldskyQueueItem(
+            GoldskyCheckpoint(
+                self._job_ids[self._jobs[position]],
+                self._timestamps[position],
+                self._checkpoints[position],
+            ),
+            self._names[position],
+        )
+
+
+def checkpoint_key(checkpoint: GoldskyCheckpoint) -> Tuple[int, str, int]:
+    """A tuple that compares like the checkpoint"""
+    return (checkpoint.timestamp, checkpoint.job_id, checkpoint.worker_checkpoint)
+
+
+class GoldskyQueues:
+    def __init__(
+        self,
+        max_size: int,
+        worker_status: Optional[Mapping[str, GoldskyCheckpoint]] = None,
+        checkpoint_range: Optional[GoldskyCheckpointRange] = None,
+    ):
+        """Files that `filter(worker_status, checkpoint_range)` would remove
+        are skipped when they're appended. This keeps the files that have
+        already been loaded out of memory while listing."""
+        self.queues: Dict[str, GoldskyQueue] = {}
+        self.max_size = max_size
+        self._after: Optional[Dict[str, Tuple[int, str, int]]] = None
+        if worker_status:
+            self._after = {
+                worker: checkpoint_key(checkpoint)
+                for worker, checkpoint in worker_status.items()
+            }
+        self._start: Optional[Tuple[int, str, int]] = None
+        self._end: Optional[Tuple[int, str, int]] = None
+        if checkpoint_range:
+            self._start = checkpoint_key(checkpoint_range._start)
+            if checkpoint_range._end is not None:
+                self._end = checkpoint_key(checkpoint_range._end)
+
+    def queue(self, worker: str) -> GoldskyQueue:
+        queue = self.queues.get(worker)
+        if queue is None:
+            queue = GoldskyQueue(max_size=self.max_size)
+            self.queues[worker] = queue
+        return queue
+
+    def enqueue(self, worker: str, item: GoldskyQueueItem):
+        self.queue(worker).enqueue(item)
+
+    def append(
+        self,
+        worker: str,
+        timestamp: int,
+        job_id: str,
+        checkpoint: int,
+        blob_name: str,
+    ):
+        key = (timestamp, job_id, checkpoint)
+        if self._after is not None and key <= self._after.get(worker, (0, "", 0)):
+            return
+        if self._start is not None and key < self._start:
+            return
+        if self._end is not None and key >= self._end:
+            return
+        self.queue(worker).append(timestamp, job_id, checkpoint, blob_name)
+
+    def dequeue(self, worker: str) -> GoldskyQueueItem | None:
+        queue = self.queues.get(worker, GoldskyQueue(max_size=self.max_size))
+        return queue.dequeue()
+
+    def filter(
+        self,
+        worker_status: Optional[Mapping[str, GoldskyCheckpoint]] = None,
+        checkpoint_range: Optional[GoldskyCheckpointRange] = None,
+    ):
+        """Removes the items that aren't in the checkpoint range or that are
+        at or before the checkpoint of the worker in `worker_status`. Workers
+        without items are removed."""
+        for worker, queue in list(self.queues.items()):
+            after = None
+            if worker_status:
+                after = worker_status.get(worker, GoldskyCheckpoint("", 0, 0))
+            start = None
+            end = None
+            if checkpoint_range:
+                start = checkpoint_range._start
+                end = checkpoint_range._end
+            queue.filter(after=after, start=start, end=end)
+            if queue.len() == 0:
+                del self.queues[worker]
+
+    def peek(self) -> GoldskyQueueItem | None:
+        """Get a value off the top of the queue without popping it"""
+        keys = list(self.queues.keys())
+        if len(keys) > 0:
+            queue = self.queues.get(keys[0])
+            if not queue:
+                return None
+            return queue.peek()
+        return None
+
+    def is_empty(self):
+        if not self.peek():
+            return True
+        return False
+
+    def clear(self, worker: str):
+        queue = self.queues.get(worker, None)
+        if queue:
+            queue.clear()
+
+    def clear_all(self):
+        for _, queue in self.queues.items():
+            queue.clear()
+
+    def workers(self):
+        return self.queues.keys()
+
+    def status(self):
+        status: Mapping[str, int] = {}
+        for worker, queue in self.queues.items():
+            status[worker] = queue.len()
+        return status
+
+    def worker_queues(self):
+        return self.queues.items()
@@ -0,0 +1,141 @@
+# Reads the schemas of goldsky parquet files from their footers
+#
+# A parquet file ends with its metadata, the length of the metadata and the
+# `PAR1` magic bytes. Only that tail is downloaded. All the files of a goldsky
+# job share a schema, so schemas are cached by job id for the process.
+import io
+import logging
+import struct
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from typing import Dict, Iterable, List, Optional, Tuple
+
+import polars
+from google.cloud.storage import Blob
+from google.cloud.storage import Client as GCSClient
+from polars.type_aliases import PolarsDataType
+
+from .errors import SchemaDrift
+from .queues import GoldskyQueueItem
+
+logger = logging.getLogger(__name__)
+
+ParquetSchema = Dict[str, PolarsDataType]
+
+PARQUET_MAGIC = b"PAR1"
+
+# Most footers fit in the first ranged read. Larger ones take a second read.
+FOOTER_READ_SIZE = 64 * 1024
+
+
+def read_parquet_footer(blob: Blob, read_size: int = FOOTER_READ_SIZE) -> bytes:
+    """Downloads the footer of a parquet blob. The footer is returned as a
+    minimal parquet file that only holds the metadata."""
+    if blob.size is None:
+        blob.reload()
+    size = blob.size or 0
+    if size < 12:
+        raise Exception(f"cannot read parquet footer. {blob.name} is too small")
+    # The range end is inclusive
+    tail = blob.download_as_bytes(start=max(size - read_size, 0), end=size - 1)
+    if tail[-4:] != PARQUET_MAGIC:
+        raise Exception(f"cannot read parquet footer. {blob.name} is not parquet")
+    footer_length = struct.unpack("<I", tail[-8:-4])[0]
+    if footer_length + 8 > size - 4:
+        raise Exception(f"cannot read parquet footer. {blob.name} is corrupt")
+    if footer_length + 8 > len(tail):
+        tail = blob.download_as_bytes(start=size - footer_length - 8, end=size - 1)
+    return PARQUET_MAGIC + tail[-(footer_length + 8) :]
+
+
+def read_parquet_schema(blob: Blob) -> ParquetSchema:
+    return polars.read_parquet_schema(io.BytesIO(read_parquet_footer(blob)))
+
+
+class GoldskySchemaCache:
+    def __init__(self):
+        """Caches the parquet schema of goldsky jobs"""
+        self._lock = threading.Lock()
+        self._schemas: Dict[Tuple[str, str], ParquetSchema] = {}
+
+    def get(self, bucket_name: str, job_id: str) -> Optional[ParquetSchema]:
+        with self._lock:
+            return self._schemas.get((bucket_name, job_id))
+
+    def set(self, bucket_name: str, job_id: str, schema: ParquetSchema):
+        with self._lock:
+            self._schemas[(bucket_name, job_id)] = schema
+
+    def clear(self):
+        with self._lock:
+            self._schemas.clear()
+
+
+goldsky_schema_cache = GoldskySchemaCache()
+
+
+class GoldskySchemaSampler:
+    def __init__(
+        self,
+        gcs_client: GCSClient,
+        bucket_name: str,
+        concurrency: int = 8,
+        cache: Optional[GoldskySchemaCache] = None,
+        log_override: Optional[logging.Logger] = None,
+    ):
+        """Reads the schemas of goldsky jobs from a sample of their files. The
+        files are expected to be from different workers so that files written
+        with a different schema are found before anything is loaded."""
+        self.gcs_client = gcs_client
+        self.bucket_name = bucket_name
+        self.concurrency = concurrency
+        self.cache = cache or goldsky_schema_cache
+        self.logger = log_override or logger
+
+    def load(self, items: Iterable[GoldskyQueueItem]) -> Dict[str, ParquetSchema]:
+        """Returns the schema of every job of the given items.
+
+        Raises SchemaDrift if the sampled files of a job have different
+        schemas."""
+        schemas: Dict[str, ParquetSchema] = {}
+        samples: Dict[str, List[str]] = {}
+        for item in items:
+            job_id = item.checkpoint.job_id
+            if job_id in schemas:
+                continue
+            cached = self.cache.get(self.bucket_name, job_id)
+            if cached is not None:
+                schemas[job_id] = cached
+                continue
+            samples.setdefault(job_id, []).append(item.blob_name)
+
+        blob_names = [name for names in samples.values() for name in names]
+        if len(blob_names) == 0:
+            return schemas
+        self.logger.debug(f"Reading parquet footers of {len(blob_names)} files")
+
+        bucket = self.gcs_client.bucket(self.bucket_name)
+        with ThreadPoolExecutor(
+            max_workers=min(self.concurrency, len(blob_names))
+        ) as pool:
+            read_schemas = dict(
+                zip(
+                    blob_names,
+                    pool.map(
+                        lambda name: read_parquet_schema(bucket.blob(name)),
+                        blob_names,
+                    ),
+                )
+            )
+
+        for job_id, names in samples.items():
+            schema = read_schemas[names[0]]
+            for name in names[1:]:
+                if read_schemas[name] != schema:
+                    raise SchemaDrift(
+                        f"schema of {name} differs from {names[0]} in goldsky job {job_id}: "
+                        f"{read_schemas[name]} != {schema}"
+                    )
+            self.cache.set(self.bucket_name, job_id, schema)
+            schemas[job_id] = schema
+        return schemas
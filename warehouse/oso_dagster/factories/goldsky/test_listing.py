@@ -0,0 +1,219 @@
+import re
+import typing as t
+from dataclasses import dataclass
+
+from google.api_core.exceptions import NotFound
+
+from .listing import (
+    GoldskyBlobLister,
+    checkpoint_name_width,
+    first_checkpoint_name_after,
+)
+from .queues import GoldskyCheckpoint, GoldskyQueues
+
+JOB_ID = "0f0e0d0c-0b0a-0908-0706-050403020100"
+GOLDSKY_RE = re.compile(
+    r"goldsky/blocks/(?P<timestamp>\d+)-(?P<job_id>[0-9a-f-]{36})-(?P<worker>\d+)-(?P<checkpoint>\d+).parquet"
+)
+
+
+@dataclass
+class FakeBlob:
+    name: str
+
+
+class FakePage(list):
+    @property
+    def num_items(self):
+        return len(self)
+
+
+class FakeBlobIterator:
+    def __init__(self, pages: t.List[FakePage], prefixes: t.Set[str]):
+        self.pages = pages
+        self.prefixes = prefixes
+
+
+class FakeStoredBlob:
+    def __init__(self, storage: t.Dict[str, str], name: str):
+        self.storage = storage
+        self.name = name
+
+    def download_as_text(self):
+        if self.name not in self.storage:
+            raise NotFound(self.name)
+        return self.storage[self.name]
+
+    def upload_from_string(self, data: str, content_type: str):
+        self.storage[self.name] = data
+
+
+class FakeBucket:
+    def __init__(self, storage: t.Dict[str, str]):
+        self.storage = storage
+
+    def blob(self, name: str):
+        return FakeStoredBlob(self.storage, name)
+
+
+class FakeGCSClient:
+    def __init__(self, names: t.List[str]):
+        self.names = sorted(names)
+        self.storage: t.Dict[str, str] = {}
+        self.listed: t.List[str] = []
+        self.start_offsets: t.List[t.Optional[str]] = []
+
+    def bucket(self, bucket_name: str):
+        return FakeBucket(self.storage)
+
+    def list_blobs(
+        self,
+        bucket_name: str,
+        prefix: str,
+        delimiter: t.Optional[str] = None,
+        start_offset: t.Optional[str] = None,
+        end_offset: t.Optional[str] = None,
+        fields: t.Optional[str] = None,
+    ):
+        if delimiter is None:
+            self.start_offsets.append(start_offset)
+        blobs: t.List[FakeBlob] = []
+        prefixes: t.Set[str] = set()
+        for name in self.names:
+            if not name.startswith(prefix):
+                continue
+            if start_offset and name < start_offset:
+                continue
+            if end_offset and name >= end_offset:
+                continue
+            rest = name[len(prefix) :]
+            if delimiter and delimiter in rest:
+                prefixes.add(prefix + rest[: rest.index(delimiter) + 1])
+                continue
+            self.listed.append(name)
+            blobs.append(FakeBlob(name))
+        pages = [FakePage(blobs[i : i + 3]) for i in range(0, len(blobs), 3)]
+        return FakeBlobIterator(pages, prefixes)
+
+
+def goldsky_file(timestamp: int, worker: int, checkpoint: int, width: int = 0):
+    return f"goldsky/blocks/{timestamp}-{JOB_ID}-{worker}-{str(checkpoint).zfill(width)}.parquet"
+
+
+def new_lister(client: FakeGCSClient):
+    return GoldskyBlobLister(
+        t.cast(t.Any, client),
+        "bucket",
+        "goldsky/blocks",
+        GOLDSKY_RE,
+        "_temp/_listing/blocks.json",
+        concurrency=4,
+    )
+
+
+def test_lister_lists_all_files_concurrently():
+    names = [
+        goldsky_file(timestamp, worker, checkpoint)
+        for timestamp in [1000, 2000]
+        for worker in range(3)
+        for checkpoint in range(12)
+    ]
+    client = FakeGCSClient(names + ["goldsky/blocks/README"])
+
+    lister = new_lister(client)
+    assert sorted(m.group(0) for m in lister.list_matches()) == sorted(names)
+    assert lister.total_files_count == len(names) + 1
+
+    # The checkpoint shards the generations by worker
+    checkpoint_storage = client.storage
+    names.append(goldsky_file(2000, 3, 0))
+    client = FakeGCSClient(names)
+    client.storage = dict(checkpoint_storage)
+    lister = new_lister(client)
+    assert len(lister.shards("goldsky/blocks/2000-", "2000")) == 4
+    assert sorted(m.group(0) for m in lister.list_matches()) == sorted(names)
+    assert lister.checkpoint.generations["2000"]["0"][1] == 11
+
+
+def test_lister_skips_filtered_generations():
+    names = [
+        goldsky_file(timestamp, worker, checkpoint)
+        for timestamp in [1000, 2000]
+        for worker in range(2)
+        for checkpoint in range(5)
+    ]
+    client = FakeGCSClient(names)
+    list(new_lister(client).list_matches())
+
+    client.listed = []
+    lister = new_lister(client)
+    matches = list(lister.list_matches(lambda timestamp, workers: timestamp < 2000))
+    assert {m.group("timestamp") for m in matches} == {"2000"}
+    assert all("/1000-" not in name for name in client.listed)
+
+
+def test_first_checkpoint_name_after():
+    assert first_checkpoint_name_after(5) == "10"
+    assert first_checkpoint_name_after(9) == "10"
+    assert first_checkpoint_name_after(10) == "100"
+    assert first_checkpoint_name_after(123) == "1000"
+    assert first_checkpoint_name_after(1999) == "10000"
+    # Numbers of the same length are ordered like their names
+    assert first_checkpoint_name_after(0) == "1"
+    # Zero padded checkpoints sort like numbers
+    assert first_checkpoint_name_after(5, 4) == "0006"
+    assert first_checkpoint_name_after(1099, 6) == "001100"
+    assert first_checkpoint_name_after(9999, 4) == "10000"
+
+    assert checkpoint_name_width(goldsky_file(1000, 0, 7, 6)) == 6
+    assert checkpoint_name_width(goldsky_file(1000, 0, 7)) == 0
+    assert checkpoint_name_width(goldsky_file(1000, 0, 0)) == 0
+
+
+def test_lister_starts_workers_at_their_pointer():
+    names = [
+        goldsky_file(2000, 0, checkpoint, 6) for checkpoint in range(1050, 1150)
+    ] + [
+        goldsky_file(2000, worker, checkpoint)
+        for worker in [1, 2]
+        for checkpoint in range(50)
+    ]
+    client = FakeGCSClient(names)
+    list(new_lister(client).list_matches())
+
+    worker_status = {
+        # Worker 0 has zero padded checkpoints and has loaded up to 1099
+        "0": GoldskyCheckpoint(job_id=JOB_ID, timestamp=2000, worker_checkpoint=1099),
+        # Worker 1's checkpoints aren't padded. It has loaded up to 12.
+        "1": GoldskyCheckpoint(job_id=JOB_ID, timestamp=2000, worker_checkpoint=12),
+        # Worker 2's pointer is in an earlier generation
+        "2": GoldskyCheckpoint(job_id=JOB_ID, timestamp=1000, worker_checkpoint=7),
+    }
+    client.listed = []
+    client.start_offsets = []
+    queues = GoldskyQueues(max_size=1000, worker_status=worker_status)
+    for match in new_lister(client).list_matches(worker_status=worker_status):
+        queues.append(
+            match.group("worker"),
+            int(match.group("timestamp")),
+            match.group("job_id"),
+            int(match.group("checkpoint")),
+            match.group(0),
+        )
+
+    assert sorted(client.start_offsets, key=str) == [
+        None,
+        f"goldsky/blocks/2000-{JOB_ID}-0-001100",
+        f"goldsky/blocks/2000-{JOB_ID}-1-100",
+        f"goldsky/blocks/2000-{JOB_ID}-2-",
+    ]
+    # The loaded files of worker 0 aren't listed again
+    assert not any(name in client.listed for name in names[:50])
+    # The files of worker 1 that sort before any later checkpoint aren't
+    # listed either
+    assert goldsky_file(2000, 1, 1) not in client.listed
+    assert goldsky_file(2000, 1, 10) not in client.listed
+    # All the files after the pointers are still queued
+    assert queues.queue("0").len() == 50
+    assert queues.queue("1").len() == 37
+    assert queues.queue("2").len() == 50
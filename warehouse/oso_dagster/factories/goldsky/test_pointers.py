@@ -0,0 +1,81 @@
+import threading
+import time
+import typing as t
+
+import pytest
+
+from .errors import PointerUpdateFailed
+from .pointers import GoldskyPointerUpdater
+from .queues import GoldskyCheckpoint
+
+
+class FakeBQClient:
+    def __init__(self):
+        self.queries: t.List[str] = []
+        self.fail = False
+
+    def query_and_wait(self, query: str):
+        if self.fail:
+            raise Exception("failed")
+        # Give the other workers time to record their updates
+        time.sleep(0.05)
+        self.queries.append(query)
+        return []
+
+
+def test_pointer_updates_are_coalesced():
+    client = FakeBQClient()
+    updater = GoldskyPointerUpdater("project.dataset.pointer")
+
+    threads = [
+        threading.Thread(
+            target=updater.update,
+            args=(
+                t.cast(t.Any, client),
+                str(worker),
+                GoldskyCheckpoint("job", 1, worker),
+            ),
+        )
+        for worker in range(8)
+    ]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+
+    assert 1 <= len(client.queries) < 8
+    for worker in range(8):
+        assert any(f"STRUCT('{worker}' AS worker" in q for q in client.queries)
+    assert all(q.strip().startswith("MERGE") for q in client.queries)
+
+
+def test_failed_pointer_updates_are_retried_by_the_next_flush():
+    client = FakeBQClient()
+    updater = GoldskyPointerUpdater("project.dataset.pointer", retries=1)
+
+    client.fail = True
+    with pytest.raises(PointerUpdateFailed):
+        updater.update(t.cast(t.Any, client), "0", GoldskyCheckpoint("job", 1, 10))
+    client.fail = False
+    updater.update(t.cast(t.Any, client), "1", GoldskyCheckpoint("job", 1, 20))
+
+    assert len(client.queries) == 1
+    assert "STRUCT('0' AS worker" in client.queries[0]
+    assert "STRUCT('1' AS worker" in client.queries[0]
+
+
+def test_failed_last_pointer_update_is_written_by_a_final_flush():
+    client = FakeBQClient()
+    updater = GoldskyPointerUpdater("project.dataset.pointer", retries=1)
+
+    client.fail = True
+    with pytest.raises(PointerUpdateFailed):
+        updater.update(t.cast(t.Any, client), "0", GoldskyCheckpoint("job", 1, 10))
+    with pytest.raises(PointerUpdateFailed):
+        updater.flush(t.cast(t.Any, client))
+    client.fail = False
+    updater.flush(t.cast(t.Any, client))
+    updater.flush(t.cast(t.Any, client))
+
+    assert len(client.queries) == 1
+    assert "STRUCT('0' AS worker, 'job' AS job_id, 1 AS timestamp" in client.queries[0]
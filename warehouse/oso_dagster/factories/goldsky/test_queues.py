@@ -0,0 +1,105 @@
+import random
+
+import pytest
+
+from .queues import (
+    GoldskyCheckpoint,
+    GoldskyCheckpointRange,
+    GoldskyQueue,
+    GoldskyQueueItem,
+    GoldskyQueues,
+)
+
+JOB_IDS = ["0f0e0d0c", "a0b1c2d3", "ffeeddcc"]
+
+
+def random_checkpoints(count: int):
+    rng = random.Random(42)
+    return [
+        GoldskyCheckpoint(
+            rng.choice(JOB_IDS), rng.choice([1000, 2000]), rng.randrange(10_000)
+        )
+        for _ in range(count)
+    ]
+
+
+def drain(queue: GoldskyQueue):
+    items = []
+    item = queue.dequeue()
+    while item is not None:
+        items.append(item)
+        item = queue.dequeue()
+    return items
+
+
+def test_queue_dequeues_in_checkpoint_order():
+    checkpoints = random_checkpoints(1000)
+    queue = GoldskyQueue(max_size=10_000)
+    for i, checkpoint in enumerate(checkpoints):
+        queue.enqueue(GoldskyQueueItem(checkpoint, f"file-{i}"))
+    assert queue.len() == 1000
+
+    assert queue.peek() == queue.peek()
+    items = drain(queue)
+    assert [item.checkpoint for item in items] == sorted(checkpoints)
+    assert queue.len() == 0
+
+
+def test_queue_respects_max_size_and_late_enqueues():
+    queue = GoldskyQueue(max_size=3)
+    for checkpoint in [5, 1, 3]:
+        queue.append(1000, "a", checkpoint, f"file-{checkpoint}")
+    first = queue.dequeue()
+    assert first is not None and first.blob_name == "file-1"
+
+    queue.append(1000, "a", 2, "file-2")
+    assert [item.blob_name for item in drain(queue)] == ["file-2", "file-3"]
+    assert queue.len() == 1
+
+
+@pytest.mark.parametrize("filter_on_append", [False, True])
+def test_queues_filter_matches_checkpoint_comparisons(filter_on_append: bool):
+    checkpoints = random_checkpoints(2000)
+    worker_status = {"0": GoldskyCheckpoint("a0b1c2d3", 1000, 5000)}
+    checkpoint_range = GoldskyCheckpointRange(
+        start=GoldskyCheckpoint("0f0e0d0c", 1000, 100),
+        end=GoldskyCheckpoint("b", 2000, 0),
+    )
+    if filter_on_append:
+        queues = GoldskyQueues(
+            max_size=10_000,
+            worker_status=worker_status,
+            checkpoint_range=checkpoint_range,
+        )
+    else:
+        queues = GoldskyQueues(max_size=10_000)
+    for i, checkpoint in enumerate(checkpoints):
+        queues.append(
+            str(i % 2),
+            checkpoint.timestamp,
+            checkpoint.job_id,
+            checkpoint.worker_checkpoint,
+            f"file-{i}",
+        )
+    if not filter_on_append:
+        queues.filter(worker_status=worker_status, checkpoint_range=checkpoint_range)
+
+    for worker in ["0", "1"]:
+        expected = sorted(
+            checkpoint
+            for i, checkpoint in enumerate(checkpoints)
+            if str(i % 2) == worker
+            and checkpoint_range.in_range(checkpoint)
+            and worker_status.get(worker, GoldskyCheckpoint("", 0, 0)) < checkpoint
+        )
+        items = drain(queues.queues[worker])
+        assert [item.checkpoint for item in items] == expected
+
+
+def test_queues_filter_removes_empty_workers():
+    queues = GoldskyQueues(max_size=10)
+    queues.append("0", 1000, "a", 1, "file-0-1")
+    queues.append("1", 1000, "a", 1, "file-1-1")
+    queues.filter(worker_status={"0": GoldskyCheckpoint("a", 1000, 1)})
+    assert list(queues.workers()) == ["1"]
+    assert not queues.is_empty()
@@ -0,0 +1,100 @@
+import io
+import typing as t
+
+import polars
+import pytest
+
+from .errors import SchemaDrift
+from .queues import GoldskyCheckpoint, GoldskyQueueItem
+from .schema import (
+    GoldskySchemaCache,
+    GoldskySchemaSampler,
+    read_parquet_footer,
+    read_parquet_schema,
+)
+
+
+def parquet_bytes(df: polars.DataFrame):
+    buf = io.BytesIO()
+    df.write_parquet(buf)
+    return buf.getvalue()
+
+
+class FakeBlob:
+    def __init__(self, name: str, data: bytes):
+        self.name = name
+        self.data = data
+        self.size: int | None = None
+        self.downloaded = 0
+
+    def reload(self):
+        self.size = len(self.data)
+
+    def download_as_bytes(self, start: int, end: int):
+        chunk = self.data[start : end + 1]
+        self.downloaded += len(chunk)
+        return chunk
+
+
+class FakeBucket:
+    def __init__(self, blobs: t.Dict[str, FakeBlob]):
+        self.blobs = blobs
+
+    def blob(self, name: str):
+        return self.blobs[name]
+
+
+class FakeGCSClient:
+    def __init__(self, blobs: t.Dict[str, FakeBlob]):
+        self.blobs = blobs
+
+    def bucket(self, bucket_name: str):
+        return FakeBucket(self.blobs)
+
+
+def test_read_parquet_schema_only_downloads_the_footer():
+    df = polars.DataFrame(
+        {"id": list(range(500_000)), "name": [str(i) for i in range(500_000)]}
+    )
+    blob = FakeBlob("file.parquet", parquet_bytes(df))
+
+    assert read_parquet_schema(t.cast(t.Any, blob)) == df.schema
+    assert blob.downloaded < len(blob.data) // 10
+
+    # Footers larger than the first read take a second one
+    footer = read_parquet_footer(t.cast(t.Any, blob), read_size=16)
+    assert polars.read_parquet_schema(io.BytesIO(footer)) == df.schema
+
+
+def test_sampler_caches_schemas_by_job_and_detects_drift():
+    df = polars.DataFrame({"id": [1], "name": ["a"]})
+    blobs = {
+        "0-a.parquet": FakeBlob("0-a.parquet", parquet_bytes(df)),
+        "1-a.parquet": FakeBlob("1-a.parquet", parquet_bytes(df)),
+        "0-b.parquet": FakeBlob("0-b.parquet", parquet_bytes(df)),
+        "1-b.parquet": FakeBlob(
+            "1-b.parquet", parquet_bytes(df.with_columns(polars.col("id") * 1.5))
+        ),
+    }
+    sampler = GoldskySchemaSampler(
+        t.cast(t.Any, FakeGCSClient(blobs)), "bucket", cache=GoldskySchemaCache()
+    )
+
+    items = [
+        GoldskyQueueItem(GoldskyCheckpoint("a", 1000, 0), "0-a.parquet"),
+        GoldskyQueueItem(GoldskyCheckpoint("a", 1000, 0), "1-a.parquet"),
+    ]
+    assert sampler.load(items) == {"a": df.schema}
+
+    for blob in blobs.values():
+        blob.downloaded = 0
+    assert sampler.load(items) == {"a": df.schema}
+    assert all(blob.downloaded == 0 for blob in blobs.values())
+
+    with pytest.raises(SchemaDrift):
+        sampler.load(
+            [
+                GoldskyQueueItem(GoldskyCheckpoint("b", 2000, 0), "0-b.parquet"),
+                GoldskyQueueItem(GoldskyCheckpoint("b", 2000, 0), "1-b.parquet"),
+            ]
+        )
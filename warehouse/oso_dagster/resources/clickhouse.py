@@ -1,3 +1,4 @@
+import typing as t
 from contextlib import contextmanager
 
 import clickhouse_connect
@@ -79,6 +80,6 @@ class ClickhouseImporterResource(ConfigurableResource):
     clickhouse: ResourceDependency[ClickhouseResource]
 
     @contextmanager
-    def get(self):
+    def get(self, partition_columns: t.Optional[t.Dict[str, str]] = None):
         with self.clickhouse.get_client() as client:
-            yield ClickhouseImporter(client)
+            yield ClickhouseImporter(client, partition_columns=partition_columns)
@@ -4,19 +4,33 @@ Auxiliary resources for sqlmesh
 
 import logging
 import typing as t
+from dataclasses import dataclass
+from datetime import datetime, timezone
 
 from dagster import (
     AssetExecutionContext,
     AssetKey,
     AssetOut,
     AssetsDefinition,
+    JsonMetadataValue,
     MaterializeResult,
+    MetadataValue,
     multi_asset,
 )
-from dagster_sqlmesh import SQLMeshDagsterTranslator
+from dagster_sqlmesh import (
+    DagsterSQLMeshController,
+    SQLMeshContextConfig,
+    SQLMeshDagsterTranslator,
+)
 from dagster_sqlmesh.controller.base import SQLMeshInstance
-from metrics_tools.compute.types import TableReference
-from metrics_tools.transfer.coordinator import Destination, Source, transfer
+from metrics_tools.compute.types import ExportTimeRange, TableReference
+from metrics_tools.transfer.coordinator import (
+    Destination,
+    Source,
+    TransferBatchFailed,
+    TransferResult,
+    transfer_many,
+)
 from oso_dagster.resources.bq import BigQueryImporterResource
 from oso_dagster.resources.clickhouse import ClickhouseImporterResource
 from oso_dagster.resources.duckdb import DuckDBExporterResource, DuckDBImporterResource
@@ -51,6 +65,124 @@ class PrefixedSQLMeshTranslator(SQLMeshDagsterTranslator):
         return key.with_prefix(self._prefix)
 
 
+@dataclass
+class SQLMeshExportState:
+    """The sqlmesh state of a model at the time it was exported. It is stored
+    in the metadata of the export's materialization."""
+
+    plan_id: str
+    version: str
+    # The intervals of the model as epoch milliseconds [start, end)
+    intervals: t.List[t.Tuple[int, int]]
+
+    def to_metadata(self) -> t.Dict[str, t.Any]:
+        return {
+            "sqlmesh_export_state": MetadataValue.json(
+                {
+                    "plan_id": self.plan_id,
+                    "version": self.version,
+                    "intervals": [list(interval) for interval in self.intervals],
+                }
+            )
+        }
+
+    @classmethod
+    def from_metadata(
+        cls, metadata: t.Mapping[str, t.Any]
+    ) -> t.Optional["SQLMeshExportState"]:
+        value = metadata.get("sqlmesh_export_state")
+        if not isinstance(value, JsonMetadataValue):
+            return None
+        data = t.cast(dict, value.data)
+        return cls(
+            plan_id=data["plan_id"],
+            version=data["version"],
+            intervals=[(int(start), int(end)) for start, end in data["intervals"]],
+        )
+
+
+def subtract_intervals(
+    intervals: t.List[t.Tuple[int, int]], removed: t.List[t.Tuple[int, int]]
+) -> t.List[t.Tuple[int, int]]:
+    """The parts of `intervals` that aren't covered by `removed`"""
+    remaining: t.List[t.Tuple[int, int]] = []
+    for start, end in intervals:
+        for removed_start, removed_end in sorted(removed):
+            if removed_end <= start or removed_start >= end:
+                continue
+            if removed_start > start:
+                remaining.append((start, removed_start))
+            start = max(start, removed_end)
+            if start >= end:
+                break
+        if start < end:
+            remaining.append((start, end))
+    return remaining
+
+
+def epoch_ms_to_datetime(epoch_ms: int) -> datetime:
+    return datetime.fromtimestamp(epoch_ms / 1000, tz=timezone.utc).replace(tzinfo=None)
+
+
+def incremental_export_time_range(
+    time_column: str,
+    previous: t.Optional[SQLMeshExportState],
+    current: SQLMeshExportState,
+) -> t.Optional[ExportTimeRange]:
+    """The days of a model that changed since its previous export or None if
+    the whole model needs to be exported.
+
+    The model is exported fully if it wasn't exported with its current
+    version before, if a plan has been applied since (plans can restate
+    intervals without changing them) or if intervals of the previous export
+    have been removed. Otherwise the range covers the intervals that sqlmesh
+    has processed since the previous export, including backfills of old
+    intervals. If there are none the last interval is exported again."""
+    if previous is None or not current.intervals:
+        return None
+    if previous.version != current.version or previous.plan_id != current.plan_id:
+        return None
+    if subtract_intervals(previous.intervals, current.intervals):
+        return None
+    added = subtract_intervals(current.intervals, previous.intervals)
+    if not added:
+        added = [max(current.intervals)]
+    return ExportTimeRange.from_bounds(
+        time_column,
+        epoch_ms_to_datetime(min(start for start, _ in added)),
+        # Intervals end exclusively
+        epoch_ms_to_datetime(max(end for _, end in added) - 1),
+    )
+
+
+def load_sqlmesh_export_states(
+    config: SQLMeshContextConfig, environment: str, model_names: t.Iterable[str]
+) -> t.Dict[str, SQLMeshExportState]:
+    """Loads the current state of the models from sqlmesh's state"""
+    controller = DagsterSQLMeshController.setup_with_config(config)
+    with controller.instance(environment, "export") as mesh:
+        state_reader = mesh.context.state_reader
+        env = state_reader.get_environment(environment)
+        if env is None:
+            return {}
+        table_infos = {info.name: info for info in env.snapshots}
+        snapshot_ids = {
+            name: table_infos[name].snapshot_id
+            for name in model_names
+            if name in table_infos
+        }
+        snapshots = state_reader.get_snapshots(snapshot_ids.values())
+        return {
+            name: SQLMeshExportState(
+                plan_id=env.plan_id,
+                version=snapshots[snapshot_id].version_get_or_generate(),
+                intervals=list(snapshots[snapshot_id].intervals),
+            )
+            for name, snapshot_id in snapshot_ids.items()
+            if snapshot_id in snapshots
+        }
+
+
 class Trino2ClickhouseSQLMeshExporter(SQLMeshExporter):
     def __init__(
         self,
@@ -60,7 +192,13 @@ class Trino2ClickhouseSQLMeshExporter(SQLMeshExporter):
         destination_schema: str,
         source_catalog: str,
         source_schema: str,
+        incremental: bool = False,
     ):
+        """If `incremental` is set, models that are incremental by time range
+        only export the days that sqlmesh processed since their previous
+        export (see `incremental_export_time_range`). These days replace the
+        same days of the clickhouse table. The whole table is exported if the
+        clickhouse table doesn't exist yet or its schema changed."""
         self._prefix = prefix
 
         self._destination_catalog = destination_catalog
@@ -69,6 +207,15 @@ class Trino2ClickhouseSQLMeshExporter(SQLMeshExporter):
         self._source_catalog = source_catalog
         self._source_schema = source_schema
 
+        self._incremental = incremental
+
+    def incremental_time_column(self, model: Model) -> t.Optional[str]:
+        if not self._incremental:
+            return None
+        if not model.kind.is_incremental_by_time_range or model.time_column is None:
+            return None
+        return model.time_column.column.name
+
     def trino_destination_table(self, table_name: str):
         return f"{self._destination_catalog}.{self._destination_schema}.{table_name}"
 
@@ -95,6 +242,15 @@ class Trino2ClickhouseSQLMeshExporter(SQLMeshExporter):
             key.path[-1]: {key} for _, key in to_export
         }
         deps = [key for _, key in to_export]
+        time_columns: t.Dict[str, str] = {}
+        model_names: t.Dict[str, str] = {}
+        for model, key in to_export:
+            time_column = self.incremental_time_column(model)
+            if time_column:
+                time_columns[key.path[-1]] = time_column
+                model_names[key.path[-1]] = model.fqn
+        sqlmesh_config = mesh.config
+        environment = mesh.environment
 
         @multi_asset(
             outs=clickhouse_outs,
@@ -112,12 +268,54 @@ class Trino2ClickhouseSQLMeshExporter(SQLMeshExporter):
                 "trino-export", log_override=context.log
             ) as exporter:
                 logger.debug(f"exporting to {self._destination_catalog}")
-                with clickhouse_importer.get() as importer:
+                partition_columns = {
+                    self.clickhouse_destination_table(table_name): time_column
+                    for table_name, time_column in time_columns.items()
+                }
+                with clickhouse_importer.get(
+                    partition_columns=partition_columns
+                ) as importer:
                     selected_output_names = (
                         context.op_execution_context.selected_output_names
                     )
-                    for table_name in selected_output_names:
-                        await transfer(
+                    incremental_names = [
+                        name for name in selected_output_names if name in time_columns
+                    ]
+                    states = (
+                        load_sqlmesh_export_states(
+                            sqlmesh_config,
+                            environment,
+                            [model_names[name] for name in incremental_names],
+                        )
+                        if incremental_names
+                        else {}
+                    )
+                    export_states: t.Dict[str, SQLMeshExportState] = {}
+                    time_ranges: t.Dict[str, t.Optional[ExportTimeRange]] = {}
+                    for table_name in incremental_names:
+                        state = states.get(model_names[table_name])
+                        if state is None:
+                            continue
+                        export_states[table_name] = state
+                        latest = context.instance.get_latest_materialization_event(
+                            asset_key=context.asset_key_for_output(table_name)
+                        )
+                        previous = (
+                            SQLMeshExportState.from_metadata(
+                                latest.asset_materialization.metadata
+                            )
+                            if latest and latest.asset_materialization
+                            else None
+                        )
+                        time_ranges[table_name] = incremental_export_time_range(
+                            time_columns[table_name], previous, state
+                        )
+                        context.log.info(
+                            f"Exporting {table_name} "
+                            f"{time_ranges[table_name] or 'fully'}"
+                        )
+                    transfers = [
+                        (
                             Source(
                                 exporter=exporter,
                                 table=TableReference(
@@ -125,6 +323,7 @@ class Trino2ClickhouseSQLMeshExporter(SQLMeshExporter):
                                     schema_name=self._source_schema,
                                     table_name=table_name,
                                 ),
+                                time_range=time_ranges.get(table_name),
                             ),
                             Destination(
                                 importer=importer,
@@ -133,11 +332,26 @@ class Trino2ClickhouseSQLMeshExporter(SQLMeshExporter):
                                     table_name=table_name,
                                 ),
                             ),
-                            log_override=context.log,
                         )
+                        for table_name in selected_output_names
+                    ]
+                    failures: t.List[TransferResult] = []
+                    async for result in transfer_many(
+                        transfers, log_override=context.log
+                    ):
+                        if not result.succeeded:
+                            failures.append(result)
+                            continue
+                        table_name = result.destination.table.table_name
+                        export_state = export_states.get(table_name)
                         yield MaterializeResult(
-                            asset_key=AssetKey(table_name).with_prefix(self._prefix)
+                            asset_key=AssetKey(table_name).with_prefix(self._prefix),
+                            metadata=(
+                                export_state.to_metadata() if export_state else None
+                            ),
                         )
+                    if failures:
+                        raise TransferBatchFailed(failures)
 
         return trino_clickhouse_export
 
@@ -259,8 +473,8 @@ class Trino2BigQuerySQLMeshExporter(SQLMeshExporter):
                     selected_output_names = (
                         context.op_execution_context.selected_output_names
                     )
-                    for table_name in selected_output_names:
-                        await transfer(
+                    transfers = [
+                        (
                             Source(
                                 exporter=exporter,
                                 table=TableReference(
@@ -275,11 +489,23 @@ class Trino2BigQuerySQLMeshExporter(SQLMeshExporter):
                                     schema_name=self._dataset_id, table_name=table_name
                                 ),
                             ),
-                            log_override=context.log,
                         )
+                        for table_name in selected_output_names
+                    ]
+                    failures: t.List[TransferResult] = []
+                    async for result in transfer_many(
+                        transfers, log_override=context.log
+                    ):
+                        if not result.succeeded:
+                            failures.append(result)
+                            continue
                         yield MaterializeResult(
-                            asset_key=AssetKey(table_name).with_prefix(self._prefix)
+                            asset_key=AssetKey(
+                                result.destination.table.table_name
+                            ).with_prefix(self._prefix)
                         )
+                    if failures:
+                        raise TransferBatchFailed(failures)
 
         return trino_bigquery_export
 
@@ -384,8 +610,8 @@ class DuckDB2BigQuerySQLMeshExporter(SQLMeshExporter):
                     selected_output_names = (
                         context.op_execution_context.selected_output_names
                     )
-                    for table_name in selected_output_names:
-                        await transfer(
+                    transfers = [
+                        (
                             Source(
                                 exporter=exporter,
                                 table=TableReference(
@@ -400,11 +626,23 @@ class DuckDB2BigQuerySQLMeshExporter(SQLMeshExporter):
                                     schema_name=self._dataset_id, table_name=table_name
                                 ),
                             ),
-                            log_override=context.log,
                         )
+                        for table_name in selected_output_names
+                    ]
+                    failures: t.List[TransferResult] = []
+                    async for result in transfer_many(
+                        transfers, export_concurrency=1, log_override=context.log
+                    ):
+                        if not result.succeeded:
+                            failures.append(result)
+                            continue
                         yield MaterializeResult(
-                            asset_key=AssetKey(table_name).with_prefix(self._prefix)
+                            asset_key=AssetKey(
+                                result.destination.table.table_name
+                            ).with_prefix(self._prefix)
                         )
+                    if failures:
+                        raise TransferBatchFailed(failures)
 
         return duckdb_bigquery_export
 
@@ -501,8 +739,8 @@ class Trino2DuckDBSQLMeshExporter(SQLMeshExporter):
                     selected_output_names = (
                         context.op_execution_context.selected_output_names
                     )
-                    for table_name in selected_output_names:
-                        await transfer(
+                    transfers = [
+                        (
                             Source(
                                 exporter=exporter,
                                 table=TableReference(
@@ -519,10 +757,22 @@ class Trino2DuckDBSQLMeshExporter(SQLMeshExporter):
                                     table_name=table_name,
                                 ),
                             ),
-                            log_override=context.log,
                         )
+                        for table_name in selected_output_names
+                    ]
+                    failures: t.List[TransferResult] = []
+                    async for result in transfer_many(
+                        transfers, import_concurrency=1, log_override=context.log
+                    ):
+                        if not result.succeeded:
+                            failures.append(result)
+                            continue
                         yield MaterializeResult(
-                            asset_key=AssetKey(table_name).with_prefix(self._prefix)
+                            asset_key=AssetKey(
+                                result.destination.table.table_name
+                            ).with_prefix(self._prefix)
                         )
+                    if failures:
+                        raise TransferBatchFailed(failures)
 
         return trino_duckdb_export
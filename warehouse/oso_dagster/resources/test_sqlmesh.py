@@ -0,0 +1,105 @@
+from datetime import datetime, timezone
+
+from metrics_tools.compute.types import ExportTimeRange
+
+from .sqlmesh import (
+    SQLMeshExportState,
+    incremental_export_time_range,
+    subtract_intervals,
+)
+
+DAY_MS = 24 * 60 * 60 * 1000
+
+
+def day(year: int, month: int, day: int) -> int:
+    return int(datetime(year, month, day, tzinfo=timezone.utc).timestamp() * 1000)
+
+
+def state(intervals, plan_id="plan", version="v1"):
+    return SQLMeshExportState(plan_id=plan_id, version=version, intervals=intervals)
+
+
+def test_subtract_intervals():
+    assert subtract_intervals([(0, 10)], [(2, 4), (6, 8)]) == [
+        (0, 2),
+        (4, 6),
+        (8, 10),
+    ]
+    assert subtract_intervals([(0, 10)], [(0, 10)]) == []
+    assert subtract_intervals([(0, 10), (20, 30)], [(5, 25)]) == [(0, 5), (25, 30)]
+    assert subtract_intervals([(0, 10)], []) == [(0, 10)]
+
+
+def test_incremental_export_time_range_of_new_intervals():
+    previous = state([(day(2024, 1, 1), day(2024, 3, 1))])
+    current = state([(day(2024, 1, 1), day(2024, 3, 3))])
+    assert incremental_export_time_range(
+        "bucket_day", previous, current
+    ) == ExportTimeRange.from_bounds(
+        "bucket_day", datetime(2024, 3, 1), datetime(2024, 3, 2)
+    )
+
+
+def test_incremental_export_time_range_includes_backfills():
+    # An old interval that was missing has been backfilled
+    previous = state(
+        [(day(2023, 1, 1), day(2023, 6, 1)), (day(2023, 6, 2), day(2024, 3, 1))]
+    )
+    current = state([(day(2023, 1, 1), day(2024, 3, 2))])
+    assert incremental_export_time_range(
+        "bucket_day", previous, current
+    ) == ExportTimeRange.from_bounds(
+        "bucket_day", datetime(2023, 6, 1), datetime(2024, 3, 1)
+    )
+
+
+def test_incremental_export_time_range_without_changes():
+    intervals = [(day(2024, 1, 1), day(2024, 3, 1))]
+    # The last interval is exported again
+    assert incremental_export_time_range(
+        "bucket_day", state(intervals), state(intervals)
+    ) == ExportTimeRange.from_bounds(
+        "bucket_day", datetime(2024, 1, 1), datetime(2024, 2, 29)
+    )
+
+
+def test_incremental_export_time_range_exports_fully():
+    previous = state([(day(2024, 1, 1), day(2024, 3, 1))])
+    extended = [(day(2024, 1, 1), day(2024, 3, 2))]
+    # Never exported
+    assert incremental_export_time_range("bucket_day", None, state(extended)) is None
+    # The model changed
+    assert (
+        incremental_export_time_range(
+            "bucket_day", previous, state(extended, version="v2")
+        )
+        is None
+    )
+    # A plan may have restated intervals
+    assert (
+        incremental_export_time_range(
+            "bucket_day", previous, state(extended, plan_id="other")
+        )
+        is None
+    )
+    # Intervals were removed, e.g. by a restatement that hasn't been
+    # backfilled yet
+    assert (
+        incremental_export_time_range(
+            "bucket_day",
+            previous,
+            state(
+                [
+                    (day(2024, 1, 1), day(2024, 1, 10)),
+                    (day(2024, 1, 11), day(2024, 3, 2)),
+                ]
+            ),
+        )
+        is None
+    )
+
+
+def test_sqlmesh_export_state_metadata():
+    exported = state([(0, DAY_MS), (2 * DAY_MS, 3 * DAY_MS)])
+    assert SQLMeshExportState.from_metadata(exported.to_metadata()) == exported
+    assert SQLMeshExportState.from_metadata({}) is None
@@ -11,6 +11,7 @@ def create_table(
     index: Optional[Dict[str, List[str]]] = None,
     order_by: Optional[List[str]] = None,
     if_not_exists: bool = True,
+    partition_by: Optional[str] = None,
 ):
     """
     Creates a Clickhouse table
@@ -32,6 +33,9 @@ def create_table(
         List of column names to order by
     if_not_exists: bool
         Create IF NOT EXISTS
+    partition_by: Optional[str]
+        Partition key expression
+        e.g. "toYYYYMMDD(bucket_day)"
 
     Returns
     -------
@@ -47,6 +51,7 @@ def create_table(
         "(%(columns)s, %(indices)s) "
         "ENGINE = MergeTree() "
         "ORDER BY (%(order_by)s) "
+        "%(partition_by)s"
     )
     params = {
         "table_name": table_name,
@@ -63,6 +68,7 @@ def create_table(
             else ""
         ),
         "order_by": ", ".join(order_by) if order_by else "",
+        "partition_by": f"PARTITION BY {partition_by}" if partition_by else "",
     }
 
     # return command % params
@@ -110,6 +116,56 @@ def rename_table(client, from_name: str, to_name: str):
     return client.command(f"RENAME TABLE {from_name} TO {to_name}")
 
 
+def replace_partition(client, table_name: str, from_table: str, partition_id: str):
+    """
+    Replaces a partition of a Clickhouse table with the same partition of
+    another table. Both tables must have the same structure and partition key
+
+    Parameters
+    ----------
+    client
+        Clickhouse client
+    table_name: str
+        Table whose partition is replaced
+    from_table: str
+        Table to copy the partition from
+    partition_id: str
+        Partition ID
+        e.g. "202401" for a table partitioned by toYYYYMM
+
+    Returns
+    -------
+    Any
+        See https://clickhouse.com/docs/en/integrations/python#client-command-method
+    """
+    return client.command(
+        f"ALTER TABLE {table_name} REPLACE PARTITION ID '{partition_id}' FROM {from_table}"
+    )
+
+
+def drop_partition(client, table_name: str, partition_id: str):
+    """
+    Drops a partition of a Clickhouse table if it exists
+
+    Parameters
+    ----------
+    client
+        Clickhouse client
+    table_name: str
+        Table name
+    partition_id: str
+        Partition ID
+
+    Returns
+    -------
+    Any
+        See https://clickhouse.com/docs/en/integrations/python#client-command-method
+    """
+    return client.command(
+        f"ALTER TABLE {table_name} DROP PARTITION ID '{partition_id}'"
+    )
+
+
 def import_data(client, table_name: str, s3_uri: str, format: str = ""):
     """
     Imports data into a Clickhouse table